@@ -7,10 +7,13 @@ Requirements: 7.1, 7.2, 7.3, 7.4
 """
 
 import os
+import re
 import json
 import gzip
 import logging
+import threading
 import traceback
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, Any, Optional, List
@@ -55,6 +58,135 @@ class StructuredFormatter(logging.Formatter):
         return json.dumps(log_entry, ensure_ascii=False)
 
 
+class _FileStats:
+    """Counters for the already indexed part of a single log file"""
+    
+    def __init__(self, inode: int, max_recent_errors: int):
+        self.inode = inode
+        self.offset = 0
+        self.total_logs = 0
+        self.by_level: Dict[str, int] = {}
+        self.by_component: Dict[str, int] = {}
+        self.recent_errors = deque(maxlen=max_recent_errors)
+
+
+class LogStatsIndex:
+    """
+    Incremental index of structured log files for get_log_stats.
+    
+    Remembers the byte offset of every file and parses only bytes appended
+    since the previous call. A file that was rotated or truncated (new inode
+    or size below the offset) is re-indexed from the start. Lines written by
+    StructuredFormatter start with level and component, so non-error lines
+    are counted by a regex prefilter without a full json.loads.
+    """
+    
+    ERROR_LEVELS = ('ERROR', 'CRITICAL')
+    
+    # Prefix of StructuredFormatter output: {"timestamp": "...", "level": "...", "component": "..."
+    _PREFIX_RE = re.compile(rb'^\{"timestamp": "[^"]*", "level": "([A-Z]+)", "component": "([^"\\]*)"')
+    
+    def __init__(self, max_recent_errors: int = 50, prefilter: bool = True):
+        self.max_recent_errors = max_recent_errors
+        self.prefilter = prefilter
+        self._files: Dict[str, _FileStats] = {}
+        self._lock = threading.Lock()
+    
+    def update(self, log_file: str) -> Optional[_FileStats]:
+        """Index newly appended lines of a file and return its counters"""
+        try:
+            file_stat = os.stat(log_file)
+        except OSError:
+            self._files.pop(log_file, None)
+            return None
+        
+        file_stats = self._files.get(log_file)
+        if (file_stats is None or file_stats.inode != file_stat.st_ino
+                or file_stat.st_size < file_stats.offset):
+            file_stats = _FileStats(file_stat.st_ino, self.max_recent_errors)
+            self._files[log_file] = file_stats
+        
+        if file_stat.st_size == file_stats.offset:
+            return file_stats
+        
+        try:
+            with open(log_file, 'rb') as f:
+                f.seek(file_stats.offset)
+                data = f.read()
+        except Exception as e:
+            print(f'Error processing log file {log_file}: {e}')
+            return file_stats
+        
+        # A partially written last line is left for the next call
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            self._index_line(line, file_stats)
+        file_stats.offset += end
+        
+        return file_stats
+    
+    def _index_line(self, line: bytes, file_stats: _FileStats):
+        """Count a single log line"""
+        if not line.strip():
+            return
+        
+        match = self._PREFIX_RE.match(line) if self.prefilter else None
+        if match and match.group(1).decode('ascii') not in self.ERROR_LEVELS:
+            level = match.group(1).decode('ascii')
+            component = match.group(2).decode('utf-8', errors='replace')
+            entry = None
+        else:
+            try:
+                entry = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                return
+            level = entry.get('level', 'UNKNOWN')
+            component = entry.get('component', 'unknown')
+        
+        file_stats.total_logs += 1
+        file_stats.by_level[level] = file_stats.by_level.get(level, 0) + 1
+        file_stats.by_component[component] = file_stats.by_component.get(component, 0) + 1
+        
+        if level in self.ERROR_LEVELS:
+            file_stats.recent_errors.append({
+                'timestamp': entry.get('timestamp'),
+                'level': level,
+                'component': component,
+                'message': entry.get('message')
+            })
+    
+    def collect(self, log_files: List[str]) -> Dict:
+        """Aggregated statistics for the given files"""
+        stats = {
+            'total_logs': 0,
+            'by_level': {},
+            'by_component': {},
+            'recent_errors': []
+        }
+        
+        with self._lock:
+            for log_file in log_files:
+                file_stats = self.update(log_file)
+                if file_stats is None:
+                    continue
+                
+                stats['total_logs'] += file_stats.total_logs
+                for level, count in file_stats.by_level.items():
+                    stats['by_level'][level] = stats['by_level'].get(level, 0) + count
+                for component, count in file_stats.by_component.items():
+                    stats['by_component'][component] = stats['by_component'].get(component, 0) + count
+                stats['recent_errors'].extend(file_stats.recent_errors)
+            
+            # Forget files that were archived or removed
+            for log_file in [path for path in self._files if not os.path.exists(path)]:
+                del self._files[log_file]
+        
+        stats['recent_errors'].sort(key=lambda error: error['timestamp'] or '')
+        stats['recent_errors'] = stats['recent_errors'][-self.max_recent_errors:]
+        
+        return stats
+
+
 class ComprehensiveErrorLogger:
     """Comprehensive error logger with rotation and alerting"""
     
@@ -71,6 +203,12 @@ class ComprehensiveErrorLogger:
         
         # Setup loggers
         self.loggers = {}
+        
+        # Incremental index for get_log_stats
+        self.stats_index = LogStatsIndex(
+            max_recent_errors=self.config.get('stats_recent_errors', 50),
+            prefilter=self.config.get('stats_prefilter', True)
+        )
     
     def _ensure_log_directories(self):
         """Ensure all required log directories exist"""
@@ -319,59 +457,16 @@ class ComprehensiveErrorLogger:
                 file_path.unlink()
     
     def get_log_stats(self, component: Optional[str] = None, days: int = 7) -> Dict:
-        """Get log statistics"""
-        stats = {
-            'total_logs': 0,
-            'by_level': {},
-            'by_component': {},
-            'recent_errors': []
-        }
+        """Get log statistics (only lines appended since the last call are parsed)"""
+        log_files = []
         
-        # Scan log files for the specified period
+        # Collect log files for the specified period
         for i in range(days):
             date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-            pattern = str(self.log_base_path / 'etl' / f'*-{date}.log')
-            
-            for log_file in glob.glob(pattern):
-                self._process_log_file_stats(log_file, stats)
-        
-        return stats
-    
-    def _process_log_file_stats(self, log_file: str, stats: Dict):
-        """Process log file for statistics"""
-        try:
-            with open(log_file, 'r') as f:
-                for line in f:
-                    try:
-                        entry = json.loads(line)
-                        stats['total_logs'] += 1
-                        
-                        # Count by level
-                        level = entry.get('level', 'UNKNOWN')
-                        stats['by_level'][level] = stats['by_level'].get(level, 0) + 1
-                        
-                        # Count by component
-                        component = entry.get('component', 'unknown')
-                        stats['by_component'][component] = stats['by_component'].get(component, 0) + 1
-                        
-                        # Collect recent errors
-                        if level in ['ERROR', 'CRITICAL']:
-                            stats['recent_errors'].append({
-                                'timestamp': entry.get('timestamp'),
-                                'level': level,
-                                'component': component,
-                                'message': entry.get('message')
-                            })
-                    
-                    except json.JSONDecodeError:
-                        continue
-        
-        except Exception as e:
-            print(f'Error processing log file {log_file}: {e}')
+            pattern = str(self.log_base_path / 'etl' / f'{glob.escape(component) if component else "*"}-{date}.log')
+            log_files.extend(glob.glob(pattern))
         
-        # Keep only last 50 errors
-        if len(stats['recent_errors']) > 50:
-            stats['recent_errors'] = stats['recent_errors'][-50:]
+        return self.stats_index.collect(log_files)
 
 
 # Global logger instance
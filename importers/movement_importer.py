@@ -4,7 +4,11 @@
 
 Функционал:
 - Получение истории движений товаров через API Ozon и Wildberries
-- Запись в таблицу stock_movements с защитой от дубликатов
+- Одновременная выгрузка FBO, FBS и отчета WB (страницы передаются через очередь)
+- Разрешение всех SKU страницы одним обращением к индексу товаров
+- Запись в таблицу stock_movements пачками с защитой от дубликатов
+- Watermark по каждому потоку: повторный запуск не перезапрашивает уже загруженный период
+  (у Ozon последние сутки перечитываются - статусы отправлений еще меняются)
 - Обработка различных типов операций (продажи, возвраты, списания)
 - Детальное логирование всех операций
 
@@ -14,16 +18,21 @@
 
 import os
 import sys
+import queue
 import logging
 import requests
-import time
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 
 # Добавляем путь к корневой директории проекта
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+# Общие утилиты (индекс товаров, rate limiter) лежат в src/utils
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'utils'))
 
 from ozon_importer import connect_to_db
+from product_resolution_index import get_product_index
+from rate_limiter import get_rate_limiter
 import config
 
 # Настройка логирования
@@ -33,6 +42,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+OZON_API_URL = "https://api-seller.ozon.ru"
+
+# Эндпоинты списков отправлений по типу склада
+OZON_POSTING_ENDPOINTS = {
+    'FBO': '/v2/posting/fbo/list',
+    'FBS': '/v3/posting/fbs/list',
+}
+OZON_POSTINGS_PAGE_LIMIT = 1000
+
+WB_REPORT_URL = "https://suppliers-api.wildberries.ru/api/v1/supplier/reportDetailByPeriod"
+WB_REPORT_PAGE_LIMIT = 100000
+
+# Строк в одном INSERT (ограничение max_allowed_packet)
+MOVEMENT_BATCH_SIZE = 1000
+
+# Страниц API в очереди между потоками выгрузки и записью в БД
+PAGE_QUEUE_SIZE = 8
+
+# Потоки выгрузки: имя (часть ключа watermark), источник, тип склада
+MOVEMENT_STREAMS = (
+    ('ozon_fbo', 'Ozon', 'FBO'),
+    ('ozon_fbs', 'Ozon', 'FBS'),
+    ('wb', 'Wildberries', None),
+)
+
+# Ключ system_settings с моментом, до которого движения потока уже загружены
+WATERMARK_SETTING_PREFIX = 'stock_movements_watermark_'
+
+# Запас при сдвиге watermark: отправления, попавшие в API с задержкой, загрузятся в следующий запуск
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# Отправления Ozon выбираются по дате создания, а движение появляется только при
+# смене статуса (awaiting_* -> delivering/cancelled). Поэтому последние часы потока
+# Ozon перечитываются независимо от watermark: иначе смена статуса у уже
+# пройденного отправления терялась бы. Повторы отсекает INSERT IGNORE.
+OZON_STATUS_RESCAN_WINDOW = timedelta(hours=24)
+
 
 class MovementImporter:
     """Класс для импорта движений товаров с маркетплейсов."""
@@ -41,6 +87,7 @@ class MovementImporter:
         """Инициализация импортера."""
         self.connection = None
         self.cursor = None
+        self.product_index = get_product_index()
         
     def connect_to_database(self):
         """Подключение к базе данных."""
@@ -59,7 +106,7 @@ class MovementImporter:
         if self.connection:
             self.connection.close()
         logger.info("Подключение к БД закрыто")
-
+    
     def get_ozon_movements(self, hours_back: int = 24) -> List[Dict[str, Any]]:
         """
         Получение движений товаров с Ozon за указанный период.
@@ -79,13 +126,9 @@ class MovementImporter:
         start_date = end_date - timedelta(hours=hours_back)
         
         try:
-            # Получаем FBO отправления
-            fbo_movements = self._get_ozon_fbo_movements(start_date, end_date)
-            movements_data.extend(fbo_movements)
-            
-            # Получаем FBS отправления
-            fbs_movements = self._get_ozon_fbs_movements(start_date, end_date)
-            movements_data.extend(fbs_movements)
+            for stock_type in OZON_POSTING_ENDPOINTS:
+                for postings in self._iter_ozon_posting_pages(stock_type, start_date, end_date):
+                    movements_data.extend(self._ozon_page_movements(postings, stock_type))
             
         except Exception as e:
             logger.error(f"Ошибка при получении движений Ozon: {e}")
@@ -93,76 +136,27 @@ class MovementImporter:
         
         logger.info(f"✅ Получено {len(movements_data)} движений с Ozon")
         return movements_data
-
-    def _get_ozon_fbo_movements(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
-        """Получение FBO движений с Ozon."""
-        url = "https://api-seller.ozon.ru/v2/posting/fbo/list"
-        headers = {
-            "Client-Id": config.OZON_CLIENT_ID,
-            "Api-Key": config.OZON_API_KEY,
-            "Content-Type": "application/json"
-        }
-        
-        movements = []
-        offset = 0
-        limit = 1000
+    
+    def _iter_ozon_posting_pages(self, stock_type: str, start_date: datetime,
+                                 end_date: datetime) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Постраничная выгрузка отправлений Ozon (FBO или FBS).
         
-        try:
-            while True:
-                payload = {
-                    "dir": "ASC",
-                    "filter": {
-                        "since": start_date.isoformat(),
-                        "to": end_date.isoformat(),
-                        "status": ""
-                    },
-                    "limit": limit,
-                    "offset": offset,
-                    "with": {
-                        "analytics_data": True,
-                        "financial_data": True
-                    }
-                }
-                
-                response = requests.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                
-                data = response.json()
-                postings = data.get('result', [])
-                
-                if not postings:
-                    break
-                
-                logger.info(f"Получено {len(postings)} FBO отправлений (offset: {offset})")
-                
-                for posting in postings:
-                    posting_movements = self._process_ozon_posting(posting, 'FBO')
-                    movements.extend(posting_movements)
-                
-                if len(postings) < limit:
-                    break
-                    
-                offset += limit
-                time.sleep(0.1)
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при запросе FBO движений Ozon: {e}")
-            raise
+        Частоту запросов ограничивает общий rate limiter (бакет 'ozon').
         
-        return movements
-
-    def _get_ozon_fbs_movements(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
-        """Получение FBS движений с Ozon."""
-        url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
+        Yields:
+            List[Dict]: Отправления одной страницы
+        """
+        url = f"{OZON_API_URL}{OZON_POSTING_ENDPOINTS[stock_type]}"
         headers = {
             "Client-Id": config.OZON_CLIENT_ID,
             "Api-Key": config.OZON_API_KEY,
             "Content-Type": "application/json"
         }
+        rate_limiter = get_rate_limiter()
         
-        movements = []
         offset = 0
-        limit = 1000
+        limit = OZON_POSTINGS_PAGE_LIMIT
         
         try:
             while True:
@@ -181,40 +175,58 @@ class MovementImporter:
                     }
                 }
                 
-                response = requests.post(url, json=payload, headers=headers)
+                rate_limiter.acquire('ozon')
+                response = requests.post(url, json=payload, headers=headers, timeout=30)
+                rate_limiter.update_from_response('ozon', response.status_code, response.headers)
                 response.raise_for_status()
                 
-                data = response.json()
-                postings = data.get('result', [])
+                result = response.json().get('result', [])
+                # v3 (FBS) возвращает {"postings": [...], "has_next": ...}, v2 (FBO) - список
+                if isinstance(result, dict):
+                    postings = result.get('postings', [])
+                    has_next = result.get('has_next', len(postings) >= limit)
+                else:
+                    postings = result
+                    has_next = len(postings) >= limit
                 
                 if not postings:
                     break
                 
-                logger.info(f"Получено {len(postings)} FBS отправлений (offset: {offset})")
-                
-                for posting in postings:
-                    posting_movements = self._process_ozon_posting(posting, 'FBS')
-                    movements.extend(posting_movements)
+                logger.info(f"Получено {len(postings)} {stock_type} отправлений (offset: {offset})")
+                yield postings
                 
-                if len(postings) < limit:
+                if not has_next:
                     break
                     
                 offset += limit
-                time.sleep(0.1)
                 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при запросе FBS движений Ozon: {e}")
+            logger.error(f"Ошибка при запросе {stock_type} движений Ozon: {e}")
             raise
+    
+    def _ozon_page_movements(self, postings: List[Dict[str, Any]], stock_type: str) -> List[Dict[str, Any]]:
+        """Движения страницы отправлений Ozon (все offer_id разрешаются одним обращением к индексу)."""
+        offer_ids = {
+            product.get('offer_id')
+            for posting in postings
+            for product in posting.get('products', [])
+        }
+        product_ids = self._resolve_product_ids('sku_ozon', offer_ids)
         
+        movements = []
+        for posting in postings:
+            movements.extend(self._process_ozon_posting(posting, stock_type, product_ids))
         return movements
-
-    def _process_ozon_posting(self, posting: Dict[str, Any], stock_type: str) -> List[Dict[str, Any]]:
+    
+    def _process_ozon_posting(self, posting: Dict[str, Any], stock_type: str,
+                              product_ids: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
         """
         Обработка отправления Ozon и создание движений.
         
         Args:
             posting: Данные отправления
             stock_type: Тип склада (FBO/FBS)
+            product_ids: Уже разрешенные offer_id -> product_id (None - поиск по каждому товару)
             
         Returns:
             List[Dict]: Список движений для данного отправления
@@ -236,8 +248,11 @@ class MovementImporter:
             offer_id = product.get('offer_id', '')
             quantity = product.get('quantity', 0)
             
-            # Получаем product_id из БД
-            product_id = self._get_product_id_by_ozon_sku(offer_id)
+            # Получаем product_id из индекса
+            if product_ids is not None:
+                product_id = product_ids.get(str(offer_id).strip())
+            else:
+                product_id = self._get_product_id_by_ozon_sku(offer_id)
             
             if not product_id:
                 logger.warning(f"Товар с offer_id {offer_id} не найден в БД")
@@ -258,7 +273,7 @@ class MovementImporter:
             movements.append(movement)
         
         return movements
-
+    
     def _map_ozon_status_to_movement_type(self, status: str) -> Optional[str]:
         """
         Маппинг статусов Ozon на типы движений.
@@ -278,7 +293,7 @@ class MovementImporter:
         }
         
         return status_mapping.get(status.lower())
-
+    
     def get_wb_movements(self, hours_back: int = 24) -> List[Dict[str, Any]]:
         """
         Получение движений товаров с Wildberries за указанный период.
@@ -299,8 +314,8 @@ class MovementImporter:
         
         try:
             # Получаем детальный отчет по операциям
-            wb_movements = self._get_wb_detailed_report(start_date, end_date)
-            movements_data.extend(wb_movements)
+            for items in self._iter_wb_report_pages(start_date, end_date):
+                movements_data.extend(self._wb_page_movements(items))
             
         except Exception as e:
             logger.error(f"Ошибка при получении движений WB: {e}")
@@ -308,46 +323,75 @@ class MovementImporter:
         
         logger.info(f"✅ Получено {len(movements_data)} движений с Wildberries")
         return movements_data
-
-    def _get_wb_detailed_report(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
-        """Получение детального отчета по операциям WB."""
-        url = "https://suppliers-api.wildberries.ru/api/v1/supplier/reportDetailByPeriod"
+    
+    def _iter_wb_report_pages(self, start_date: datetime,
+                              end_date: datetime) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Постраничная выгрузка детального отчета по операциям WB.
+        
+        Следующая страница запрашивается от rrd_id последней строки,
+        частоту запросов ограничивает общий rate limiter (бакет 'wb_statistics').
+        
+        Yields:
+            List[Dict]: Строки отчета одной страницы
+        """
         headers = {
             "Authorization": config.WB_API_TOKEN
         }
+        rate_limiter = get_rate_limiter()
         
-        params = {
-            "dateFrom": start_date.strftime('%Y-%m-%d'),
-            "dateTo": end_date.strftime('%Y-%m-%d'),
-            "limit": 100000,
-            "rrdid": 0
-        }
-        
-        movements = []
+        rrdid = 0
         
         try:
-            response = requests.get(url, headers=headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            for item in data:
-                movement = self._process_wb_report_item(item)
-                if movement:
-                    movements.append(movement)
+            while True:
+                params = {
+                    "dateFrom": start_date.strftime('%Y-%m-%d'),
+                    "dateTo": end_date.strftime('%Y-%m-%d'),
+                    "limit": WB_REPORT_PAGE_LIMIT,
+                    "rrdid": rrdid
+                }
+                
+                rate_limiter.acquire('wb_statistics')
+                response = requests.get(WB_REPORT_URL, headers=headers, params=params, timeout=120)
+                rate_limiter.update_from_response('wb_statistics', response.status_code, response.headers)
+                response.raise_for_status()
+                
+                # 204 или пустой список - отчет выгружен полностью
+                items = response.json() if response.status_code != 204 and response.content else []
+                if not items:
+                    break
+                
+                logger.info(f"Получено {len(items)} строк отчета WB (rrdid: {rrdid})")
+                yield items
+                
+                next_rrdid = items[-1].get('rrd_id', items[-1].get('rrdid', 0))
+                if len(items) < WB_REPORT_PAGE_LIMIT or not next_rrdid or next_rrdid == rrdid:
+                    break
+                rrdid = next_rrdid
                     
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка при запросе отчета WB: {e}")
             raise
+    
+    def _wb_page_movements(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Движения страницы отчета WB (все nmId разрешаются одним обращением к индексу)."""
+        product_ids = self._resolve_product_ids('sku_wb', {item.get('nmId') for item in items})
         
+        movements = []
+        for item in items:
+            movement = self._process_wb_report_item(item, product_ids)
+            if movement:
+                movements.append(movement)
         return movements
-
-    def _process_wb_report_item(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    
+    def _process_wb_report_item(self, item: Dict[str, Any],
+                                product_ids: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
         """
         Обработка элемента отчета WB и создание движения.
         
         Args:
             item: Элемент отчета WB
+            product_ids: Уже разрешенные nmId -> product_id (None - поиск по строке)
             
         Returns:
             Dict: Данные движения или None
@@ -364,8 +408,11 @@ class MovementImporter:
         if not movement_type:
             return None
         
-        # Получаем product_id из БД
-        product_id = self._get_product_id_by_wb_sku(str(nm_id))
+        # Получаем product_id из индекса
+        if product_ids is not None:
+            product_id = product_ids.get(str(nm_id).strip())
+        else:
+            product_id = self._get_product_id_by_wb_sku(str(nm_id))
         
         if not product_id:
             logger.warning(f"Товар с nmId {nm_id} не найден в БД")
@@ -386,7 +433,7 @@ class MovementImporter:
         }
         
         return movement
-
+    
     def _map_wb_doc_type_to_movement_type(self, doc_type: str) -> Optional[str]:
         """
         Маппинг типов документов WB на типы движений.
@@ -407,52 +454,54 @@ class MovementImporter:
         }
         
         return doc_type_mapping.get(doc_type)
-
+    
+    def _resolve_product_ids(self, key: str, values) -> Dict[str, int]:
+        """
+        Разрешение всех SKU страницы одним обращением к индексу товаров.
+        
+        Ошибка БД не перехватывается: иначе движения страницы были бы
+        отброшены как "товар не найден", а watermark потока сдвинулся бы.
+        """
+        return self.product_index.resolve_many(key, values, cursor=self.cursor)
+    
     def _get_product_id_by_ozon_sku(self, sku_ozon: str) -> Optional[int]:
         """Получение product_id по SKU Ozon."""
         if not sku_ozon:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_ozon = %s",
-                (sku_ozon,)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_ozon_sku(sku_ozon, cursor=self.cursor)
         except Exception as e:
             logger.error(f"Ошибка при поиске товара по sku_ozon {sku_ozon}: {e}")
             return None
-
+    
     def _get_product_id_by_wb_sku(self, sku_wb: str) -> Optional[int]:
         """Получение product_id по SKU Wildberries."""
         if not sku_wb:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_wb = %s",
-                (sku_wb,)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_wb_sku(sku_wb, cursor=self.cursor)
         except Exception as e:
             logger.error(f"Ошибка при поиске товара по sku_wb {sku_wb}: {e}")
             return None
-
-    def add_movements(self, movements_data: List[Dict[str, Any]], source: str):
+    
+    def add_movements(self, movements_data: List[Dict[str, Any]], source: str) -> int:
         """
         Добавление движений в таблицу stock_movements с защитой от дубликатов.
         
+        Движения пишутся многострочными INSERT IGNORE по MOVEMENT_BATCH_SIZE
+        строк, страница фиксируется одним коммитом.
+        
         Args:
             movements_data: Список данных о движениях
             source: Источник данных ('Ozon' или 'Wildberries')
+            
+        Returns:
+            int: Количество новых движений
         """
-        logger.info(f"🔄 Начинаем добавление движений для источника {source}")
-        
         if not movements_data:
-            logger.warning(f"Нет данных о движениях для {source}")
-            return
+            return 0
         
         try:
             insert_query = """
@@ -463,44 +512,206 @@ class MovementImporter:
                    %(quantity)s, %(warehouse_name)s, %(order_id)s, %(source)s)
             """
             
-            self.cursor.executemany(insert_query, movements_data)
-            inserted_count = self.cursor.rowcount
+            inserted_count = 0
+            for start in range(0, len(movements_data), MOVEMENT_BATCH_SIZE):
+                self.cursor.executemany(insert_query, movements_data[start:start + MOVEMENT_BATCH_SIZE])
+                inserted_count += max(self.cursor.rowcount, 0)
             
             self.connection.commit()
-            logger.info(f"✅ Добавлено {inserted_count} новых движений для {source}")
+            return inserted_count
             
         except Exception as e:
             logger.error(f"Ошибка при добавлении движений {source}: {e}")
             self.connection.rollback()
             raise
-
-    def run_movements_update(self, hours_back: int = 24):
+    
+    def _get_watermark(self, stream_name: str) -> Optional[datetime]:
+        """Момент, до которого движения потока уже загружены (None - поток еще не запускался)."""
+        try:
+            self.cursor.execute(
+                "SELECT setting_value FROM system_settings WHERE setting_key = %s",
+                (f"{WATERMARK_SETTING_PREFIX}{stream_name}",)
+            )
+            result = self.cursor.fetchone()
+            
+            if result and result['setting_value']:
+                return datetime.strptime(result['setting_value'], '%Y-%m-%d %H:%M:%S')
+            return None
+            
+        except Exception as e:
+            logger.error(f"Ошибка при получении watermark движений {stream_name}: {e}")
+            return None
+    
+    def _save_watermark(self, stream_name: str, watermark: datetime):
+        """Сохранение watermark потока в system_settings."""
+        try:
+            self.cursor.execute("""
+                INSERT INTO system_settings (setting_key, setting_value, description)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE setting_value = VALUES(setting_value)
+            """, (
+                f"{WATERMARK_SETTING_PREFIX}{stream_name}",
+                watermark.strftime('%Y-%m-%d %H:%M:%S'),
+                f"Период stock_movements ({stream_name}), уже загруженный из API"
+            ))
+            self.connection.commit()
+            
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении watermark движений {stream_name}: {e}")
+            self.connection.rollback()
+    
+    def _stream_start(self, stream_name: str, hours_back: int, end_date: datetime,
+                      use_watermark: bool, status_rescan: timedelta = timedelta(0)) -> datetime:
+        """
+        Начало периода выгрузки потока: hours_back назад, но не раньше watermark.
+        
+        Последние status_rescan (в пределах hours_back) перечитываются всегда -
+        в них у отправлений еще может смениться статус.
+        """
+        start_date = end_date - timedelta(hours=hours_back)
+        
+        if use_watermark:
+            watermark = self._get_watermark(stream_name)
+            if watermark and watermark > start_date:
+                rescan_start = max(end_date - status_rescan, start_date)
+                if watermark > rescan_start:
+                    logger.info(f"♻️  {stream_name}: период до {watermark} уже загружен, "
+                                f"статусы перечитываются с {rescan_start:%Y-%m-%d %H:%M}")
+                else:
+                    logger.info(f"♻️  {stream_name}: период до {watermark} уже загружен")
+                start_date = min(watermark, rescan_start, end_date)
+        
+        return start_date
+    
+    def _stream_pages(self, stock_type: Optional[str], start_date: datetime,
+                      end_date: datetime) -> Iterator[List[Dict[str, Any]]]:
+        """Страницы API потока: отправления Ozon (FBO/FBS) или строки отчета WB."""
+        if stock_type:
+            return self._iter_ozon_posting_pages(stock_type, start_date, end_date)
+        return self._iter_wb_report_pages(start_date, end_date)
+    
+    def harvest_movements(self, hours_back: int = 24, use_watermark: bool = True) -> Dict[str, Dict[str, int]]:
+        """
+        Одновременная выгрузка FBO, FBS и отчета WB с записью по страницам.
+        
+        Каждый поток API работает в своем треде и передает страницы через
+        ограниченную очередь; разрешение SKU и запись в БД выполняются в
+        текущем треде на единственном подключении. После полной загрузки
+        потока сохраняется его watermark; потоки Ozon при этом перечитывают
+        последние OZON_STATUS_RESCAN_WINDOW ради смены статусов отправлений.
+        
+        Args:
+            hours_back: Количество часов назад для получения данных
+            use_watermark: Не запрашивать период, уже загруженный прошлым запуском
+            
+        Returns:
+            Dict: Статистика по потокам (страницы, движения, новые записи)
+        """
+        end_date = datetime.now()
+        pages: queue.Queue = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+        stop = threading.Event()
+        
+        def put(message) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(message, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce(stream_name: str, stock_type: Optional[str], start_date: datetime):
+            try:
+                for page in self._stream_pages(stock_type, start_date, end_date):
+                    if not put(('page', stream_name, page)):
+                        return
+                put(('done', stream_name, None))
+            except Exception as e:
+                put(('error', stream_name, e))
+        
+        stats = {}
+        producers = []
+        sources = {}
+        for stream_name, source, stock_type in MOVEMENT_STREAMS:
+            status_rescan = OZON_STATUS_RESCAN_WINDOW if source == 'Ozon' else timedelta(0)
+            start_date = self._stream_start(stream_name, hours_back, end_date, use_watermark, status_rescan)
+            logger.info(f"🔄 {stream_name}: {start_date:%Y-%m-%d %H:%M} - {end_date:%Y-%m-%d %H:%M}")
+            
+            stats[stream_name] = {'pages': 0, 'movements': 0, 'inserted': 0}
+            sources[stream_name] = (source, stock_type)
+            producers.append(threading.Thread(
+                target=produce, args=(stream_name, stock_type, start_date),
+                name=f"movements-{stream_name}", daemon=True
+            ))
+        
+        for producer in producers:
+            producer.start()
+        
+        errors = {}
+        try:
+            active = len(producers)
+            while active:
+                kind, stream_name, payload = pages.get()
+                source, stock_type = sources[stream_name]
+                
+                if kind == 'page':
+                    if stream_name in errors:
+                        # Поток уже завершился ошибкой: остальные его страницы не пишем
+                        continue
+                    try:
+                        if stock_type:
+                            movements = self._ozon_page_movements(payload, stock_type)
+                        else:
+                            movements = self._wb_page_movements(payload)
+                    except Exception as e:
+                        # Ошибка разрешения SKU - ошибка потока: watermark не сохраняется
+                        self.connection.rollback()
+                        logger.error(f"❌ Ошибка обработки страницы движений {stream_name}: {e}")
+                        errors[stream_name] = e
+                        continue
+                    
+                    stream_stats = stats[stream_name]
+                    stream_stats['pages'] += 1
+                    stream_stats['movements'] += len(movements)
+                    stream_stats['inserted'] += self.add_movements(movements, source)
+                    continue
+                
+                active -= 1
+                if kind == 'error':
+                    logger.error(f"❌ Ошибка выгрузки движений {stream_name}: {payload}")
+                    errors.setdefault(stream_name, payload)
+                    continue
+                if stream_name in errors:
+                    continue
+                
+                logger.info(f"✅ {stream_name}: {stats[stream_name]['movements']} движений, "
+                            f"новых {stats[stream_name]['inserted']}")
+                if use_watermark:
+                    self._save_watermark(stream_name, end_date - WATERMARK_OVERLAP)
+        finally:
+            stop.set()
+            for producer in producers:
+                producer.join(timeout=5)
+        
+        if errors:
+            raise RuntimeError(f"Не удалось загрузить движения: {', '.join(sorted(errors))}")
+        
+        return stats
+    
+    def run_movements_update(self, hours_back: int = 24, use_watermark: bool = True):
         """
         Основная функция запуска обновления движений.
         
         Args:
             hours_back: Количество часов назад для получения данных
+            use_watermark: Не запрашивать период, уже загруженный прошлым запуском
         """
         logger.info(f"🚀 Запуск обновления движений товаров за последние {hours_back} часов")
         
         try:
             self.connect_to_database()
             
-            # Получаем и добавляем движения Ozon
-            logger.info("=" * 50)
-            logger.info("ОБНОВЛЕНИЕ ДВИЖЕНИЙ OZON")
-            logger.info("=" * 50)
-            
-            ozon_movements = self.get_ozon_movements(hours_back)
-            self.add_movements(ozon_movements, 'Ozon')
-            
-            # Получаем и добавляем движения Wildberries
-            logger.info("=" * 50)
-            logger.info("ОБНОВЛЕНИЕ ДВИЖЕНИЙ WILDBERRIES")
-            logger.info("=" * 50)
-            
-            wb_movements = self.get_wb_movements(hours_back)
-            self.add_movements(wb_movements, 'Wildberries')
+            self.harvest_movements(hours_back, use_watermark)
             
             # Выводим итоговую статистику
             self._print_movements_statistics()
@@ -512,7 +723,7 @@ class MovementImporter:
             raise
         finally:
             self.close_database_connection()
-
+    
     def _print_movements_statistics(self):
         """Вывод статистики по движениям."""
         logger.info("📊 СТАТИСТИКА ДВИЖЕНИЙ:")
@@ -569,11 +780,13 @@ def main():
     parser = argparse.ArgumentParser(description='Импорт движений товаров')
     parser.add_argument('--hours', type=int, default=24, 
                        help='Количество часов назад для получения данных (по умолчанию: 24)')
+    parser.add_argument('--no-watermark', action='store_true',
+                       help='Загрузить весь период --hours, не учитывая уже загруженные движения')
     
     args = parser.parse_args()
     
     importer = MovementImporter()
-    importer.run_movements_update(args.hours)
+    importer.run_movements_update(args.hours, use_watermark=not args.no_watermark)
 
 
 if __name__ == "__main__":
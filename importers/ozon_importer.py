@@ -10,18 +10,27 @@
 """
 
 import os
-import json
+import sys
 import logging
 import mysql.connector
 from mysql.connector import Error
 import requests
-import csv
-import time
-import io
 import pprint
-from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from typing import Dict, List, Optional, Any
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Tuple
+
+# Общий rate limiter лежит в src/utils
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'utils'))
+
+from rate_limiter import get_rate_limiter
+# raw_landing лежит рядом: при импорте как importers.<модуль> - относительный путь
+try:
+    from .raw_landing import get_raw_landing
+except ImportError:
+    from raw_landing import get_raw_landing
+
+if TYPE_CHECKING:
+    from ozon_report_manager import OzonReportManager
 
 # Настройка логирования
 logging.basicConfig(
@@ -31,6 +40,21 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _report_manager_module():
+    """
+    Лениво загружает ozon_report_manager.
+    
+    Модуль тянет aiohttp, который нужен только для работы с отчетами, поэтому
+    импорт откладывается до первого обращения. Путь выбирается по __package__,
+    чтобы отсутствие aiohttp не маскировалось ошибкой поиска модуля.
+    """
+    if __package__:
+        from . import ozon_report_manager
+    else:
+        import ozon_report_manager
+    return ozon_report_manager
+
+
 def load_config() -> Dict[str, str]:
     """
     Загружает конфигурацию из .env файла.
@@ -110,8 +134,12 @@ def make_ozon_request(endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
         'Content-Type': 'application/json'
     }
     
+    rate_limiter = get_rate_limiter()
+    rate_limiter.acquire('ozon')
+    
     try:
         response = requests.post(url, headers=headers, json=data, timeout=30)
+        rate_limiter.update_from_response('ozon', response.status_code, response.headers)
         response.raise_for_status()
         
         logger.info(f"Успешный запрос к {endpoint}")
@@ -127,7 +155,7 @@ def request_report(report_type: str, start_date: str = None, end_date: str = Non
     Универсальная функция для заказа отчетов через API Ozon.
     
     Args:
-        report_type (str): Тип отчета ('products', 'postings', 'transactions')
+        report_type (str): Тип отчета ('products', 'postings', 'transactions', 'stocks')
         start_date (str, optional): Дата начала в формате YYYY-MM-DD
         end_date (str, optional): Дата окончания в формате YYYY-MM-DD
         **kwargs: Дополнительные параметры для конкретных типов отчетов
@@ -137,48 +165,7 @@ def request_report(report_type: str, start_date: str = None, end_date: str = Non
     """
     logger.info(f"Заказываем отчет типа '{report_type}' из API Ozon")
     
-    if report_type == 'products':
-        endpoint = '/v1/report/products/create'
-        request_data = {
-            "language": "DEFAULT",
-            "offer_id": [],
-            "search": "",
-            "sku": [],
-            "visibility": "ALL"
-        }
-    elif report_type == 'postings':
-        endpoint = '/v1/report/postings/create'
-        # Если даты уже в ISO формате, используем их как есть, иначе форматируем
-        if 'T' in start_date:
-            processed_from = start_date
-            processed_to = end_date
-        else:
-            processed_from = f"{start_date}T00:00:00.000Z"
-            processed_to = f"{end_date}T23:59:59.999Z"
-            
-        request_data = {
-            "filter": {
-                "processed_at_from": processed_from,
-                "processed_at_to": processed_to,
-                "delivery_schema": ["fbo"]  # FBO заказы (со склада Ozon)
-            },
-            "language": "DEFAULT"
-        }
-    elif report_type == 'transactions':
-        endpoint = '/v1/report/finance/create'
-        request_data = {
-            "filter": {
-                "date": {
-                    "from": f"{start_date}T00:00:00.000Z",
-                    "to": f"{end_date}T23:59:59.999Z"
-                }
-            }
-        }
-    else:
-        raise ValueError(f"Неподдерживаемый тип отчета: {report_type}")
-    
-    # Добавляем дополнительные параметры если есть
-    request_data.update(kwargs)
+    endpoint, request_data = _report_manager_module().build_report_request(report_type, start_date, end_date, **kwargs)
     
     response = make_ozon_request(endpoint, request_data)
     report_code = response.get('result', {}).get('code')
@@ -201,80 +188,68 @@ def request_products_report() -> str:
     return request_report('products')
 
 
-def get_report_by_code(report_code: str) -> str:
+def get_report_manager() -> 'OzonReportManager':
+    """
+    Создает менеджер отчетов Ozon с параметрами из .env.
+    
+    Returns:
+        OzonReportManager: Менеджер отчетов (кэш файлов и адаптивный опрос)
+    """
+    config = load_config()
+    return _report_manager_module().OzonReportManager(config['OZON_CLIENT_ID'], config['OZON_API_KEY'], config['OZON_API_URL'])
+
+
+def get_report_by_code(report_code: str) -> List[Dict[str, str]]:
     """
-    Проверяет готовность отчета и скачивает его содержимое.
+    Ожидает готовности уже заказанного отчета и скачивает его.
     
     Args:
-        report_code (str): Код отчета, полученный от request_products_report()
+        report_code (str): Код отчета, полученный от request_report()
     
     Returns:
-        str: Содержимое CSV-файла с товарами
+        List[Dict[str, str]]: Строки CSV-отчета
     """
     logger.info(f"Проверяем готовность отчета {report_code}")
+    return get_report_manager().wait_and_download_sync(report_code)
+
+
+def prefetch_reports(reports: List[Tuple[str, Optional[str], Optional[str]]]) -> int:
+    """
+    Параллельно заказывает отчеты и сохраняет их в кэш файлов отчетов.
     
-    max_attempts = 20  # Максимальное количество попыток
-    attempt = 0
+    Отчеты запрашиваются через fetch_reports_sync группами по max_concurrent,
+    поэтому в памяти одновременно находятся строки не более одной группы.
+    Последующие get_products_from_api()/get_postings_from_api() с теми же
+    параметрами берут отчет из кэша. Ошибка предзагрузки не прерывает
+    импорт: отчет будет запрошен повторно при импорте.
     
-    while attempt < max_attempts:
-        attempt += 1
-        
-        # Данные для запроса статуса отчета
-        request_data = {
-            "code": report_code
-        }
-        
+    Args:
+        reports: Список (тип отчета, дата начала, дата окончания)
+    
+    Returns:
+        int: Количество отчетов, сохраненных в кэш
+    """
+    manager = get_report_manager()
+    if manager.cache_ttl <= 0:
+        logger.info("Кэш отчетов Ozon отключен (OZON_REPORT_CACHE_TTL=0), предзагрузка пропущена")
+        return 0
+    
+    report_spec = _report_manager_module().ReportSpec
+    specs = list(dict.fromkeys(report_spec(report_type, start_date, end_date)
+                               for report_type, start_date, end_date in reports))
+    group_size = max(1, manager.max_concurrent)
+    
+    prefetched = 0
+    for start in range(0, len(specs), group_size):
+        group = specs[start:start + group_size]
         try:
-            # Выполняем запрос к API
-            response = make_ozon_request('/v1/report/info', request_data)
-            
-            # Проверяем статус отчета
-            status = response.get('result', {}).get('status')
-            
-            if status == 'success':
-                # Отчет готов, получаем ссылку на файл
-                file_url = response.get('result', {}).get('file')
-                
-                if not file_url:
-                    raise ValueError("Не удалось получить ссылку на файл отчета")
-                
-                logger.info(f"Отчет готов, скачиваем файл: {file_url}")
-                
-                # Скачиваем CSV-файл с правильной кодировкой
-                file_response = requests.get(file_url, timeout=60)
-                file_response.raise_for_status()
-                
-                # Пробуем разные кодировки
-                try:
-                    # Сначала пробуем UTF-8 с BOM
-                    csv_content = file_response.content.decode('utf-8-sig')
-                except UnicodeDecodeError:
-                    try:
-                        # Затем обычный UTF-8
-                        csv_content = file_response.content.decode('utf-8')
-                    except UnicodeDecodeError:
-                        # В крайнем случае CP1251 (Windows-1251)
-                        csv_content = file_response.content.decode('cp1251')
-                
-                logger.info(f"CSV-файл скачан, размер: {len(csv_content)} символов")
-                return csv_content
-                
-            elif status == 'failed':
-                # Отчет завершился с ошибкой
-                error_msg = f"Отчет завершился с ошибкой (статус: failed). Проверьте параметры запроса."
-                logger.error(error_msg)
-                raise ValueError(error_msg)
-            else:
-                logger.info(f"Отчет еще формируется (статус: {status}), ждем 15 секунд... (попытка {attempt}/{max_attempts})")
-                time.sleep(15)
-                
+            manager.fetch_reports_sync(group)
+            prefetched += len(group)
         except Exception as e:
-            logger.error(f"Ошибка при проверке статуса отчета (попытка {attempt}): {e}")
-            if attempt >= max_attempts:
-                raise
-            time.sleep(15)
+            logger.warning(f"Не удалось предзагрузить отчеты Ozon ({len(group)} шт.): {e}")
     
-    raise TimeoutError(f"Отчет не был готов после {max_attempts} попыток")
+    logger.info(f"Предзагружено отчетов Ozon: {prefetched} из {len(specs)}")
+    return prefetched
 
 
 def get_products_from_api() -> List[Dict[str, Any]]:
@@ -287,22 +262,9 @@ def get_products_from_api() -> List[Dict[str, Any]]:
     logger.info("Начинаем загрузку товаров из API Ozon через отчеты")
     
     try:
-        # Этап 1: Заказываем отчет
-        report_code = request_products_report()
-        
-        # Этап 2: Ждем готовности и скачиваем отчет
-        csv_content = get_report_by_code(report_code)
-        
-        # Этап 3: Парсим CSV-содержимое
-        logger.info("Парсим CSV-данные товаров")
-        
-        # Используем StringIO для работы с CSV (с правильным разделителем)
-        csv_file = io.StringIO(csv_content)
-        csv_reader = csv.DictReader(csv_file, delimiter=';')
-        
-        products = []
-        for row in csv_reader:
-            products.append(row)
+        # Заказываем отчет, ждем готовности и разбираем CSV по мере скачивания
+        # (готовый отчет в пределах OZON_REPORT_CACHE_TTL берется из кэша)
+        products = get_report_manager().fetch_report_sync(_report_manager_module().ReportSpec('products'))
         
         logger.info(f"Загрузка товаров завершена. Всего товаров: {len(products)}")
         
@@ -396,19 +358,8 @@ def get_postings_from_api(start_date: str, end_date: str) -> List[Dict[str, Any]
     logger.info(f"Начинаем загрузку заказов с {start_date} по {end_date} через API отчетов")
     
     try:
-        # Заказываем отчет по заказам
-        report_code = request_report('postings', start_date, end_date)
-        
-        # Получаем CSV-файл с отчетом
-        csv_content = get_report_by_code(report_code)
-        
-        # Парсим CSV
-        csv_file = io.StringIO(csv_content)
-        csv_reader = csv.DictReader(csv_file, delimiter=';')
-        
-        postings = []
-        for row in csv_reader:
-            postings.append(row)
+        # Заказываем отчет по заказам, ждем готовности и разбираем CSV по мере скачивания
+        postings = get_report_manager().fetch_report_sync(_report_manager_module().ReportSpec('postings', start_date, end_date))
         
         logger.info(f"Загрузка заказов завершена. Всего заказов: {len(postings)}")
         logger.info("Пример заказа из CSV:")
@@ -429,7 +380,10 @@ def get_postings_from_api(start_date: str, end_date: str) -> List[Dict[str, Any]
 
 def save_raw_events(events: List[Dict[str, Any]], event_type: str) -> None:
     """
-    Сохраняет сырые данные в таблицу raw_events.
+    Сохраняет страницу сырых данных одной пачкой.
+    
+    Куда пишутся данные (таблица raw_events и/или сжатые сегментные файлы),
+    определяет RAW_LANDING_MODE, см. raw_landing.py.
     
     Args:
         events (List[Dict[str, Any]]): Список событий для сохранения
@@ -438,43 +392,22 @@ def save_raw_events(events: List[Dict[str, Any]], event_type: str) -> None:
     if not events:
         return
     
-    connection = connect_to_db()
+    def get_ext_id(event: Dict[str, Any]) -> str:
+        # Определяем ext_id в зависимости от типа события
+        if event_type == 'ozon_posting':
+            # Для заказов из CSV используем русское название поля
+            return str(event.get('Номер заказа', event.get('posting_number', '')))
+        # Для других типов используем стандартные поля
+        return str(event.get('posting_number', event.get('operation_id', '')))
     
     try:
-        cursor = connection.cursor(dictionary=True)
-        for event in events:
-            # Формируем данные для вставки
-            # Определяем ext_id в зависимости от типа события
-            if event_type == 'ozon_posting':
-                # Для заказов из CSV используем русское название поля
-                ext_id = event.get('Номер заказа', event.get('posting_number', ''))
-            else:
-                # Для других типов используем стандартные поля
-                ext_id = event.get('posting_number', event.get('operation_id', ''))
-            
-            raw_data = {
-                'ext_id': ext_id,
-                'event_type': event_type,
-                'payload': json.dumps(event, ensure_ascii=False),
-                'ingested_at': datetime.now()
-            }
-            
-            # SQL запрос с IGNORE для избежания дублей
-            sql = """
-            INSERT IGNORE INTO raw_events (ext_id, event_type, payload, ingested_at)
-            VALUES (%(ext_id)s, %(event_type)s, %(payload)s, %(ingested_at)s)
-            """
-            
-            cursor.execute(sql, raw_data)
-        cursor.close()
-        
-        logger.info(f"Сохранено {len(events)} событий типа {event_type} в raw_events")
+        landing = get_raw_landing()
+        landing.land_page(event_type, [(get_ext_id(event), event) for event in events], connect_to_db)
+        logger.info(f"Сохранено {len(events)} событий типа {event_type} в raw_events ({landing.mode})")
             
     except Exception as e:
         logger.error(f"Ошибка сохранения сырых данных: {e}")
         raise
-    finally:
-        connection.close()
 
 
 def transform_posting_data(csv_row: Dict[str, Any]) -> List[Dict[str, Any]]:
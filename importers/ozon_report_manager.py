@@ -0,0 +1,474 @@
+"""
+Асинхронный менеджер отчетов Ozon.
+
+Включает функции для:
+- Параллельного заказа нескольких отчетов (товары, заказы, остатки, финансы)
+- Ожидания готовности с адаптивным интервалом опроса /v1/report/info
+- Потоковой загрузки CSV: разбор строк начинается до окончания скачивания
+- Кэширования готовых файлов по параметрам отчета (повторный запуск
+  в пределах OZON_REPORT_CACHE_TTL не заказывает отчет заново)
+
+Использование (предварительная загрузка отчетов в кэш):
+    python ozon_report_manager.py --products --stocks --postings 2025-09-01 2025-09-07
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import codecs
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Tuple
+
+import aiohttp
+
+# Общий rate limiter лежит в src/utils
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'utils'))
+
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'mi_core_ozon_reports')
+
+# Сколько секунд готовый файл отчета используется повторно
+DEFAULT_CACHE_TTL = 3600
+
+# Адаптивный опрос статуса: первая пауза, рост и максимум (сек)
+POLL_INITIAL_DELAY = 2.0
+POLL_BACKOFF = 1.6
+POLL_MAX_DELAY = 30.0
+POLL_TIMEOUT = 900.0
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Кодировки файла отчета в порядке проверки
+REPORT_ENCODINGS = ('utf-8-sig', 'cp1251')
+
+
+def build_report_request(report_type: str, start_date: str = None, end_date: str = None,
+                         **kwargs) -> Tuple[str, Dict[str, Any]]:
+    """
+    Эндпоинт и тело запроса на создание отчета.
+    
+    Args:
+        report_type: Тип отчета ('products', 'postings', 'transactions', 'stocks')
+        start_date: Дата начала в формате YYYY-MM-DD (или ISO для postings)
+        end_date: Дата окончания в формате YYYY-MM-DD (или ISO для postings)
+        **kwargs: Дополнительные параметры запроса
+    
+    Returns:
+        (эндпоинт, тело запроса)
+    """
+    if report_type == 'products':
+        endpoint = '/v1/report/products/create'
+        request_data = {
+            "language": "DEFAULT",
+            "offer_id": [],
+            "search": "",
+            "sku": [],
+            "visibility": "ALL"
+        }
+    elif report_type == 'postings':
+        endpoint = '/v1/report/postings/create'
+        # Если даты уже в ISO формате, используем их как есть, иначе форматируем
+        if 'T' in start_date:
+            processed_from = start_date
+            processed_to = end_date
+        else:
+            processed_from = f"{start_date}T00:00:00.000Z"
+            processed_to = f"{end_date}T23:59:59.999Z"
+        
+        request_data = {
+            "filter": {
+                "processed_at_from": processed_from,
+                "processed_at_to": processed_to,
+                "delivery_schema": ["fbo"]  # FBO заказы (со склада Ozon)
+            },
+            "language": "DEFAULT"
+        }
+    elif report_type == 'transactions':
+        endpoint = '/v1/report/finance/create'
+        request_data = {
+            "filter": {
+                "date": {
+                    "from": f"{start_date}T00:00:00.000Z",
+                    "to": f"{end_date}T23:59:59.999Z"
+                }
+            }
+        }
+    elif report_type == 'stocks':
+        endpoint = '/v1/report/warehouse/stock'
+        request_data = {
+            "language": "DEFAULT"
+        }
+    else:
+        raise ValueError(f"Неподдерживаемый тип отчета: {report_type}")
+    
+    # Добавляем дополнительные параметры если есть
+    request_data.update(kwargs)
+    return endpoint, request_data
+
+
+@dataclass(frozen=True)
+class ReportSpec:
+    """Параметры отчета (ключ кэша)."""
+    report_type: str
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    params: Tuple[Tuple[str, Any], ...] = field(default_factory=tuple)
+    
+    @property
+    def cache_key(self) -> str:
+        raw = json.dumps([self.report_type, self.start_date, self.end_date, list(self.params)],
+                         sort_keys=True, default=str)
+        return f"{self.report_type}_{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+    
+    def build_request(self) -> Tuple[str, Dict[str, Any]]:
+        return build_report_request(self.report_type, self.start_date, self.end_date, **dict(self.params))
+
+
+class _RecordFeed:
+    """
+    Источник строк для csv.reader, пополняемый по мере загрузки.
+    
+    Строки отдаются только целыми записями CSV (с четным числом кавычек),
+    поэтому поле с переводом строки внутри кавычек не разрывается.
+    """
+    
+    def __init__(self):
+        self._records = deque()
+        self._partial = ''  # Неполная строка из предыдущего фрагмента
+        self._pending = ''  # Строки незакрытой записи
+        self._quotes = 0
+    
+    def feed(self, text: str):
+        *lines, self._partial = (self._partial + text).split('\n')
+        for line in lines:
+            self._add_line(line + '\n')
+    
+    def _add_line(self, line: str):
+        self._pending += line
+        self._quotes += line.count('"')
+        if self._quotes % 2 == 0:
+            self._records.append(self._pending)
+            self._pending = ''
+            self._quotes = 0
+    
+    def close(self):
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ''
+        if self._pending:
+            self._records.append(self._pending)
+            self._pending = ''
+    
+    def peek(self) -> Optional[str]:
+        return self._records[0] if self._records else None
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self) -> str:
+        if not self._records:
+            raise StopIteration
+        return self._records.popleft()
+
+
+class _StreamingCsvParser:
+    """Инкрементальный разбор CSV-отчета из байтовых фрагментов."""
+    
+    def __init__(self, encoding: str, delimiter: Optional[str] = None):
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._feed = _RecordFeed()
+        self._reader = None
+        self._delimiter = delimiter
+        self.header: Optional[List[str]] = None
+        self.rows: List[Dict[str, str]] = []
+    
+    def feed(self, chunk: bytes, final: bool = False):
+        self._feed.feed(self._decoder.decode(chunk, final))
+        if final:
+            self._feed.close()
+        self._drain()
+    
+    def _drain(self):
+        if self._reader is None:
+            first_record = self._feed.peek()
+            if first_record is None:
+                return
+            delimiter = self._delimiter or (';' if ';' in first_record else ',')
+            self._reader = csv.reader(self._feed, delimiter=delimiter)
+        
+        for values in self._reader:
+            if self.header is None:
+                self.header = values
+                continue
+            if values:
+                self.rows.append(dict(zip(self.header, values)))
+
+
+class OzonReportManager:
+    """Заказ, ожидание и потоковая загрузка отчетов Ozon."""
+    
+    def __init__(self, client_id: str, api_key: str, base_url: str = 'https://api-seller.ozon.ru',
+                 cache_dir: Optional[str] = None, cache_ttl: Optional[float] = None,
+                 max_concurrent: int = 3, poll_timeout: float = POLL_TIMEOUT):
+        """
+        Args:
+            client_id: Client-Id Ozon Seller API
+            api_key: Api-Key Ozon Seller API
+            base_url: Базовый URL API
+            cache_dir: Каталог кэша файлов отчетов (по умолчанию OZON_REPORT_CACHE_DIR)
+            cache_ttl: Время жизни кэша в секундах (по умолчанию OZON_REPORT_CACHE_TTL, 0 - без кэша)
+            max_concurrent: Максимум одновременно обрабатываемых отчетов
+            poll_timeout: Максимальное время ожидания готовности отчета (сек)
+        """
+        self.base_url = base_url
+        self.headers = {
+            'Client-Id': client_id,
+            'Api-Key': api_key,
+            'Content-Type': 'application/json'
+        }
+        self.cache_dir = cache_dir or os.getenv('OZON_REPORT_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.cache_ttl = float(cache_ttl if cache_ttl is not None
+                               else os.getenv('OZON_REPORT_CACHE_TTL', DEFAULT_CACHE_TTL))
+        self.max_concurrent = max_concurrent
+        self.poll_timeout = poll_timeout
+        self.rate_limiter = get_rate_limiter()
+    
+    async def _post(self, session: aiohttp.ClientSession, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST-запрос к API Ozon с учетом общего rate limiter."""
+        await self.rate_limiter.acquire_async('ozon')
+        async with session.post(f"{self.base_url}{endpoint}", headers=self.headers, json=data,
+                                timeout=aiohttp.ClientTimeout(total=30)) as response:
+            self.rate_limiter.update_from_response('ozon', response.status, response.headers)
+            response.raise_for_status()
+            return await response.json()
+    
+    async def create_report(self, session: aiohttp.ClientSession, spec: ReportSpec) -> str:
+        """Заказать отчет и вернуть его код."""
+        endpoint, request_data = spec.build_request()
+        response = await self._post(session, endpoint, request_data)
+        report_code = response.get('result', {}).get('code')
+        
+        if not report_code:
+            raise ValueError(f"Не удалось получить код отчета для типа {spec.report_type}")
+        
+        logger.info(f"Отчет '{spec.report_type}' заказан успешно, код: {report_code}")
+        return report_code
+    
+    async def wait_report(self, session: aiohttp.ClientSession, report_code: str) -> str:
+        """
+        Дождаться готовности отчета.
+        
+        Интервал опроса начинается с POLL_INITIAL_DELAY и растет до
+        POLL_MAX_DELAY: небольшие отчеты забираются через секунды,
+        большие не создают лишних запросов.
+        
+        Returns:
+            Ссылка на файл отчета
+        """
+        started = time.monotonic()
+        delay = POLL_INITIAL_DELAY
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                response = await self._post(session, '/v1/report/info', {"code": report_code})
+                result = response.get('result', {})
+                status = result.get('status')
+                
+                if status == 'success':
+                    if not result.get('file'):
+                        raise ValueError("Не удалось получить ссылку на файл отчета")
+                    logger.info(f"Отчет {report_code} готов через {time.monotonic() - started:.0f} сек")
+                    return result['file']
+                
+                if status == 'failed':
+                    raise ValueError(f"Отчет {report_code} завершился с ошибкой (статус: failed). "
+                                     f"Проверьте параметры запроса.")
+                
+                logger.info(f"Отчет {report_code} еще формируется (статус: {status}), "
+                            f"следующая проверка через {delay:.0f} сек (попытка {attempt})")
+            
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"⚠️ Ошибка при проверке статуса отчета {report_code} (попытка {attempt}): {e}")
+            
+            if time.monotonic() - started + delay > self.poll_timeout:
+                raise TimeoutError(f"Отчет {report_code} не был готов за {self.poll_timeout:.0f} сек")
+            
+            await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+    
+    def _cache_path(self, spec: ReportSpec) -> str:
+        return os.path.join(self.cache_dir, f"{spec.cache_key}.csv")
+    
+    def _cached_file(self, spec: ReportSpec) -> Optional[str]:
+        """Путь к файлу отчета в кэше, если он еще действителен."""
+        if self.cache_ttl <= 0:
+            return None
+        path = self._cache_path(spec)
+        try:
+            if time.time() - os.path.getmtime(path) < self.cache_ttl:
+                return path
+        except OSError:
+            pass
+        return None
+    
+    @staticmethod
+    def _parse_file(path: str) -> List[Dict[str, str]]:
+        """Разбор файла отчета из кэша."""
+        for encoding in REPORT_ENCODINGS:
+            parser = _StreamingCsvParser(encoding)
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        parser.feed(chunk)
+                parser.feed(b'', final=True)
+                return parser.rows
+            except UnicodeDecodeError:
+                continue
+        raise ValueError(f"Не удалось определить кодировку отчета {path}")
+    
+    async def _download(self, session: aiohttp.ClientSession, file_url: str, spec: ReportSpec,
+                        cache: bool = True) -> List[Dict[str, str]]:
+        """
+        Потоковая загрузка файла отчета: фрагменты сразу декодируются,
+        разбираются и пишутся в кэш (при cache=False - во временный файл,
+        который удаляется после разбора).
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(spec)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        parser = _StreamingCsvParser(REPORT_ENCODINGS[0])
+        decode_failed = False
+        size = 0
+        
+        try:
+            async with session.get(file_url, timeout=aiohttp.ClientTimeout(total=600)) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+                        if not decode_failed:
+                            try:
+                                parser.feed(chunk)
+                            except UnicodeDecodeError:
+                                # Не UTF-8: файл будет разобран целиком после загрузки
+                                decode_failed = True
+            
+            if not decode_failed:
+                try:
+                    parser.feed(b'', final=True)
+                except UnicodeDecodeError:
+                    decode_failed = True
+            
+            if cache:
+                os.replace(tmp_path, path)
+            rows = self._parse_file(path if cache else tmp_path) if decode_failed else parser.rows
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        logger.info(f"CSV-файл отчета '{spec.report_type}' скачан: {size} байт, {len(rows)} строк")
+        return rows
+    
+    async def fetch_report(self, session: aiohttp.ClientSession, spec: ReportSpec) -> List[Dict[str, str]]:
+        """Получить строки отчета (из кэша или заказав новый)."""
+        cached = self._cached_file(spec)
+        if cached:
+            rows = self._parse_file(cached)
+            logger.info(f"📦 Отчет '{spec.report_type}' взят из кэша: {len(rows)} строк")
+            return rows
+        
+        report_code = await self.create_report(session, spec)
+        file_url = await self.wait_report(session, report_code)
+        return await self._download(session, file_url, spec)
+    
+    async def fetch_reports(self, specs: List[ReportSpec]) -> Dict[ReportSpec, List[Dict[str, str]]]:
+        """
+        Параллельно получить несколько отчетов.
+        
+        Returns:
+            Строки каждого отчета по его параметрам
+        
+        Raises:
+            Первую ошибку, если какой-либо отчет не получен
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        
+        async with aiohttp.ClientSession() as session:
+            async def bounded_fetch(spec: ReportSpec) -> List[Dict[str, str]]:
+                async with semaphore:
+                    return await self.fetch_report(session, spec)
+            
+            results = await asyncio.gather(*(bounded_fetch(spec) for spec in specs))
+        
+        return dict(zip(specs, results))
+    
+    def fetch_reports_sync(self, specs: List[ReportSpec]) -> Dict[ReportSpec, List[Dict[str, str]]]:
+        """Синхронная обертка над fetch_reports."""
+        return asyncio.run(self.fetch_reports(specs))
+    
+    def fetch_report_sync(self, spec: ReportSpec) -> List[Dict[str, str]]:
+        """Получить один отчет синхронно."""
+        return self.fetch_reports_sync([spec])[spec]
+    
+    def wait_and_download_sync(self, report_code: str) -> List[Dict[str, str]]:
+        """Дождаться уже заказанного отчета и вернуть его строки (без кэша)."""
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                file_url = await self.wait_report(session, report_code)
+                # Параметры отчета неизвестны - по коду его из кэша не найти, файл не сохраняем
+                return await self._download(session, file_url, ReportSpec('code', params=(('code', report_code),)),
+                                            cache=False)
+        
+        return asyncio.run(run())
+
+
+def main():
+    """Предварительная загрузка отчетов в кэш."""
+    from dotenv import load_dotenv
+    
+    parser = argparse.ArgumentParser(description='Параллельная загрузка отчетов Ozon в кэш')
+    parser.add_argument('--products', action='store_true', help='Отчет по товарам')
+    parser.add_argument('--stocks', action='store_true', help='Отчет по остаткам на складах')
+    parser.add_argument('--postings', nargs=2, metavar=('START', 'END'), help='Отчет по заказам за период')
+    parser.add_argument('--transactions', nargs=2, metavar=('START', 'END'), help='Финансовый отчет за период')
+    args = parser.parse_args()
+    
+    load_dotenv()
+    specs = []
+    if args.products:
+        specs.append(ReportSpec('products'))
+    if args.stocks:
+        specs.append(ReportSpec('stocks'))
+    if args.postings:
+        specs.append(ReportSpec('postings', *args.postings))
+    if args.transactions:
+        specs.append(ReportSpec('transactions', *args.transactions))
+    
+    if not specs:
+        parser.error('Укажите хотя бы один отчет')
+    
+    manager = OzonReportManager(os.getenv('OZON_CLIENT_ID'), os.getenv('OZON_API_KEY'),
+                                os.getenv('OZON_API_URL', 'https://api-seller.ozon.ru'))
+    for spec, rows in manager.fetch_reports_sync(specs).items():
+        logger.info(f"✅ {spec.report_type}: {len(rows)} строк")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    raise SystemExit(main())
@@ -7,10 +7,14 @@ It handles two types of reports:
 1. Product-Warehouse report (Товар-склад) - inventory levels by warehouse
 2. Sales report (Отчет о продажах) - sales transactions
 
+Reports are streamed in chunks: the distinct SKUs of a chunk are resolved
+(and missing products created) with one query each, and the chunk is
+written with large execute_values pages and a single commit.
+
 Requirements: 1, 2, 4
 
 Usage:
-    python ozon_warehouse_importer.py --inventory <path_to_inventory_csv>
+    python ozon_warehouse_importer.py --inventory <path_to_inventory_csv> [--chunk-size N]
     python ozon_warehouse_importer.py --sales <path_to_sales_csv> --start-date YYYY-MM-DD --end-date YYYY-MM-DD
     python ozon_warehouse_importer.py --both <inventory_csv> <sales_csv> --start-date YYYY-MM-DD --end-date YYYY-MM-DD
 
@@ -26,7 +30,8 @@ import argparse
 import psycopg2
 from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from typing import List, Dict, Optional, Iterator, Tuple
 from dotenv import load_dotenv
 
 # Setup logging
@@ -40,6 +45,14 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
+def parse_int(value: Optional[str]) -> int:
+    """Parse an integer report value ("1 234", "1,234"); invalid or empty -> 0."""
+    try:
+        return int(value.replace(',', '').replace(' ', '')) if value else 0
+    except ValueError:
+        return 0
+
+
 class OzonWarehouseImporter:
     """Importer for Ozon warehouse data from CSV reports."""
     
@@ -60,10 +73,42 @@ class OzonWarehouseImporter:
         'Самара_РФЦ': 'Поволжье',
     }
     
-    def __init__(self):
-        """Initialize the importer with database connection."""
+    # Inventory count columns: (table column, CSV column)
+    INVENTORY_COUNT_COLUMNS = [
+        ('quantity_present', 'Доступно к продаже'),
+        ('quantity_reserved', 'Зарезервировано'),
+        ('preparing_for_sale', 'Готовим к продаже'),
+        ('in_supply_requests', 'В заявках на поставку'),
+        ('in_transit', 'В поставках в пути'),
+        ('in_inspection', 'Проходят проверку'),
+        ('returning_from_customers', 'Возвращаются от покупателей'),
+        ('expiring_soon', 'Истекает срок годности'),
+        ('defective', 'Брак, доступный к вывозу'),
+        ('excess_from_supply', 'Излишки от поставки'),
+        ('awaiting_upd', 'Ожидают приёмки'),
+        ('preparing_for_removal', 'Готовятся к вывозу'),
+    ]
+    
+    DEFAULT_CHUNK_SIZE = 50000
+    
+    # Rows per INSERT statement generated by execute_values
+    PAGE_SIZE = 5000
+    
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Initialize the importer with database connection.
+        
+        Args:
+            chunk_size: CSV rows processed (resolved and written) per transaction
+        """
         self.conn = None
         self.cursor = None
+        self.chunk_size = chunk_size
+        
+        # sku_ozon -> dim_products.id, filled as chunks are resolved
+        self._product_cache: Dict[str, int] = {}
+        self._cluster_cache: Dict[str, str] = {}
+        
         self._connect_to_database()
     
     def _connect_to_database(self):
@@ -100,16 +145,22 @@ class OzonWarehouseImporter:
         Returns:
             Cluster name or 'Другие' if not found
         """
+        if warehouse_name in self._cluster_cache:
+            return self._cluster_cache[warehouse_name]
+        
         # Try exact match first
-        if warehouse_name in self.WAREHOUSE_CLUSTERS:
-            return self.WAREHOUSE_CLUSTERS[warehouse_name]
+        cluster = self.WAREHOUSE_CLUSTERS.get(warehouse_name)
         
         # Try partial match
-        for wh_key, cluster in self.WAREHOUSE_CLUSTERS.items():
-            if wh_key in warehouse_name or warehouse_name in wh_key:
-                return cluster
+        if cluster is None:
+            cluster = next(
+                (wh_cluster for wh_key, wh_cluster in self.WAREHOUSE_CLUSTERS.items()
+                 if wh_key in warehouse_name or warehouse_name in wh_key),
+                'Другие'
+            )
         
-        return 'Другие'
+        self._cluster_cache[warehouse_name] = cluster
+        return cluster
     
     def _get_or_create_product(self, sku_ozon: str, product_name: str = None) -> Optional[int]:
         """
@@ -122,41 +173,112 @@ class OzonWarehouseImporter:
         Returns:
             product_id or None if failed
         """
-        try:
-            # Try to find existing product
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_ozon = %s",
-                (sku_ozon,)
-            )
-            result = self.cursor.fetchone()
-            
-            if result:
-                return result[0]
+        return self._resolve_products({sku_ozon: product_name or ''}).get(sku_ozon)
+    
+    def _resolve_products(self, product_names: Dict[str, str]) -> Dict[str, int]:
+        """
+        Resolve product ids for a set of SKUs, creating missing products.
+        
+        Uncached SKUs are looked up with one query; those still missing and
+        having a name are inserted with one multi-row INSERT. SKUs without
+        a name that are not in dim_products stay unresolved. Database errors
+        are raised, not turned into unresolved SKUs.
+        
+        Args:
+            product_names: sku_ozon -> product name ('' if unknown)
             
-            # Create new product if not found
-            if product_name:
+        Returns:
+            sku_ozon -> product_id for resolved SKUs
+        """
+        missing = [sku for sku in product_names if sku not in self._product_cache]
+        
+        if missing:
+            try:
                 self.cursor.execute(
-                    """
-                    INSERT INTO dim_products (sku_ozon, product_name, cost_price)
-                    VALUES (%s, %s, NULL)
-                    RETURNING id
-                    """,
-                    (sku_ozon, product_name)
+                    "SELECT sku_ozon, MIN(id) FROM dim_products WHERE sku_ozon = ANY(%s) GROUP BY sku_ozon",
+                    (missing,)
                 )
-                self.conn.commit()
-                product_id = self.cursor.fetchone()[0]
-                logger.info(f"Created new product: {sku_ozon} - {product_name}")
-                return product_id
-            else:
-                logger.warning(f"Product not found and no name provided: {sku_ozon}")
-                return None
+                self._product_cache.update(self.cursor.fetchall())
                 
-        except Exception as e:
-            logger.error(f"Error getting/creating product {sku_ozon}: {e}")
-            self.conn.rollback()
-            return None
+                to_create = [(sku, product_names[sku]) for sku in missing
+                             if sku not in self._product_cache and product_names[sku]]
+                if to_create:
+                    created = execute_values(
+                        self.cursor,
+                        """
+                        INSERT INTO dim_products (sku_ozon, product_name, cost_price)
+                        VALUES %s
+                        ON CONFLICT (sku_ozon) DO NOTHING
+                        RETURNING sku_ozon, id
+                        """,
+                        to_create,
+                        template="(%s, %s, NULL)",
+                        page_size=self.PAGE_SIZE,
+                        fetch=True
+                    )
+                    self.conn.commit()
+                    self._product_cache.update(created)
+                    logger.info(f"Created {len(created)} new products")
+                    
+                    # Created concurrently by another process
+                    if len(created) < len(to_create):
+                        self.cursor.execute(
+                            "SELECT sku_ozon, MIN(id) FROM dim_products WHERE sku_ozon = ANY(%s) GROUP BY sku_ozon",
+                            ([sku for sku, _ in to_create if sku not in self._product_cache],)
+                        )
+                        self._product_cache.update(self.cursor.fetchall())
+                
+                unresolved = sum(1 for sku in missing if sku not in self._product_cache)
+                if unresolved:
+                    logger.warning(f"Products not found and no name provided: {unresolved} SKUs")
+                    
+            except Exception as e:
+                # The caller's import handler rolls back and fails the run
+                logger.error(f"Error resolving {len(missing)} products: {e}")
+                raise
+        
+        return {sku: self._product_cache[sku] for sku in product_names if sku in self._product_cache}
+    
+    @staticmethod
+    def _open_csv(f) -> Tuple[Iterator[List[str]], Dict[str, int]]:
+        """
+        Create a row reader for an opened report file.
+        
+        Returns:
+            (row iterator, column name -> index)
+        """
+        # Try to detect delimiter
+        sample = f.read(1024)
+        f.seek(0)
+        delimiter = ';' if ';' in sample else ','
+        
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, [])
+        columns = {}
+        for index, name in enumerate(header):
+            columns.setdefault(name, index)
+        return reader, columns
+    
+    @staticmethod
+    def _column_getter(columns: Dict[str, int]):
+        """Build a getter returning a stripped cell value ('' if column or cell is missing)."""
+        def get(row: List[str], column: str) -> str:
+            index = columns.get(column)
+            if index is None or index >= len(row):
+                return ''
+            return row[index].strip()
+        return get
+    
+    @staticmethod
+    def _iter_chunks(reader: Iterator[List[str]], chunk_size: int) -> Iterator[List[List[str]]]:
+        """Split a row iterator into lists of at most chunk_size rows."""
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                return
+            yield chunk
     
-    def import_inventory_report(self, csv_file_path: str) -> int:
+    def import_inventory_report(self, csv_file_path: str, chunk_size: Optional[int] = None) -> int:
         """
         Import Ozon Product-Warehouse report (Товар-склад).
         
@@ -176,6 +298,7 @@ class OzonWarehouseImporter:
         
         Args:
             csv_file_path: Path to CSV file
+            chunk_size: Rows per chunk (defaults to the importer setting)
             
         Returns:
             Number of records imported
@@ -186,80 +309,57 @@ class OzonWarehouseImporter:
             logger.error(f"File not found: {csv_file_path}")
             return 0
         
+        chunk_size = chunk_size or self.chunk_size
         imported_count = 0
         skipped_count = 0
         
         try:
-            with open(csv_file_path, 'r', encoding='utf-8-sig') as f:
-                # Try to detect delimiter
-                sample = f.read(1024)
-                f.seek(0)
-                delimiter = ';' if ';' in sample else ','
+            with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as f:
+                reader, columns = self._open_csv(f)
+                get = self._column_getter(columns)
                 
-                reader = csv.DictReader(f, delimiter=delimiter)
-                
-                batch = []
-                batch_size = 100
-                
-                for row in reader:
-                    # Extract data from CSV
-                    sku_ozon = row.get('Артикул', '').strip()
-                    product_name = row.get('Название товара', '').strip()
-                    warehouse_name = row.get('Склад', '').strip()
-                    
-                    if not sku_ozon or not warehouse_name:
-                        skipped_count += 1
-                        continue
-                    
-                    # Get or create product
-                    product_id = self._get_or_create_product(sku_ozon, product_name)
-                    if not product_id:
-                        skipped_count += 1
-                        continue
+                for chunk in self._iter_chunks(reader, chunk_size):
+                    rows = []
+                    product_names = {}
                     
-                    # Get cluster for warehouse
-                    cluster = self._get_cluster_for_warehouse(warehouse_name)
+                    for row in chunk:
+                        sku_ozon = get(row, 'Артикул')
+                        warehouse_name = get(row, 'Склад')
+                        
+                        if not sku_ozon or not warehouse_name:
+                            skipped_count += 1
+                            continue
+                        
+                        product_name = get(row, 'Название товара')
+                        product_names.setdefault(sku_ozon, '')
+                        product_names[sku_ozon] = product_names[sku_ozon] or product_name
+                        rows.append((row, sku_ozon, warehouse_name))
                     
-                    # Parse numeric values
-                    def parse_int(value):
-                        try:
-                            return int(value.replace(',', '').replace(' ', '')) if value else 0
-                        except:
-                            return 0
+                    product_ids = self._resolve_products(product_names)
+                    updated_at = datetime.now()
                     
-                    inventory_data = {
-                        'product_id': product_id,
-                        'warehouse_name': warehouse_name,
-                        'cluster': cluster,
-                        'quantity_present': parse_int(row.get('Доступно к продаже', '0')),
-                        'quantity_reserved': parse_int(row.get('Зарезервировано', '0')),
-                        'preparing_for_sale': parse_int(row.get('Готовим к продаже', '0')),
-                        'in_supply_requests': parse_int(row.get('В заявках на поставку', '0')),
-                        'in_transit': parse_int(row.get('В поставках в пути', '0')),
-                        'in_inspection': parse_int(row.get('Проходят проверку', '0')),
-                        'returning_from_customers': parse_int(row.get('Возвращаются от покупателей', '0')),
-                        'expiring_soon': parse_int(row.get('Истекает срок годности', '0')),
-                        'defective': parse_int(row.get('Брак, доступный к вывозу', '0')),
-                        'excess_from_supply': parse_int(row.get('Излишки от поставки', '0')),
-                        'awaiting_upd': parse_int(row.get('Ожидают приёмки', '0')),
-                        'preparing_for_removal': parse_int(row.get('Готовятся к вывозу', '0')),
-                        'source': 'ozon',
-                        'stock_type': 'FBO',  # Default to FBO for Ozon warehouses
-                        'updated_at': datetime.now()
-                    }
+                    # A repeated product/warehouse pair keeps the last row
+                    records = {}
+                    for row, sku_ozon, warehouse_name in rows:
+                        product_id = product_ids.get(sku_ozon)
+                        if not product_id:
+                            skipped_count += 1
+                            continue
+                        
+                        records[(product_id, warehouse_name)] = (
+                            product_id,
+                            warehouse_name,
+                            self._get_cluster_for_warehouse(warehouse_name),
+                            *(parse_int(get(row, csv_column)) for _, csv_column in self.INVENTORY_COUNT_COLUMNS),
+                            'ozon',
+                            'FBO',  # Default to FBO for Ozon warehouses
+                            updated_at
+                        )
                     
-                    batch.append(inventory_data)
-                    
-                    # Insert batch when it reaches batch_size
-                    if len(batch) >= batch_size:
-                        self._insert_inventory_batch(batch)
-                        imported_count += len(batch)
-                        batch = []
-                
-                # Insert remaining records
-                if batch:
-                    self._insert_inventory_batch(batch)
-                    imported_count += len(batch)
+                    if records:
+                        self._insert_inventory_batch(list(records.values()))
+                        imported_count += len(records)
+                    logger.info(f"Inventory progress: {imported_count} imported, {skipped_count} skipped")
             
             logger.info(f"✅ Imported {imported_count} inventory records")
             logger.info(f"⚠️  Skipped {skipped_count} records")
@@ -271,62 +371,34 @@ class OzonWarehouseImporter:
             self.conn.rollback()
             raise
     
-    def _insert_inventory_batch(self, batch: List[Dict[str, Any]]):
-        """Insert a batch of inventory records using UPSERT."""
+    def _insert_inventory_batch(self, values: List[Tuple]):
+        """
+        Insert a batch of inventory records using UPSERT.
+        
+        Args:
+            values: Tuples of (product_id, warehouse_name, cluster, <INVENTORY_COUNT_COLUMNS>,
+                source, stock_type, updated_at); keys must be unique within the batch
+        """
         try:
-            # Prepare data for execute_values
-            values = [
-                (
-                    item['product_id'],
-                    item['warehouse_name'],
-                    item['cluster'],
-                    item['quantity_present'],
-                    item['quantity_reserved'],
-                    item['preparing_for_sale'],
-                    item['in_supply_requests'],
-                    item['in_transit'],
-                    item['in_inspection'],
-                    item['returning_from_customers'],
-                    item['expiring_soon'],
-                    item['defective'],
-                    item['excess_from_supply'],
-                    item['awaiting_upd'],
-                    item['preparing_for_removal'],
-                    item['source'],
-                    item['stock_type'],
-                    item['updated_at']
-                )
-                for item in batch
-            ]
+            count_columns = ', '.join(column for column, _ in self.INVENTORY_COUNT_COLUMNS)
+            count_updates = ',\n                    '.join(
+                f"{column} = EXCLUDED.{column}" for column, _ in self.INVENTORY_COUNT_COLUMNS
+            )
             
-            query = """
+            query = f"""
                 INSERT INTO inventory (
                     product_id, warehouse_name, cluster,
-                    quantity_present, quantity_reserved,
-                    preparing_for_sale, in_supply_requests, in_transit,
-                    in_inspection, returning_from_customers, expiring_soon,
-                    defective, excess_from_supply, awaiting_upd, preparing_for_removal,
+                    {count_columns},
                     source, stock_type, updated_at
                 ) VALUES %s
                 ON CONFLICT (product_id, warehouse_name, source)
                 DO UPDATE SET
                     cluster = EXCLUDED.cluster,
-                    quantity_present = EXCLUDED.quantity_present,
-                    quantity_reserved = EXCLUDED.quantity_reserved,
-                    preparing_for_sale = EXCLUDED.preparing_for_sale,
-                    in_supply_requests = EXCLUDED.in_supply_requests,
-                    in_transit = EXCLUDED.in_transit,
-                    in_inspection = EXCLUDED.in_inspection,
-                    returning_from_customers = EXCLUDED.returning_from_customers,
-                    expiring_soon = EXCLUDED.expiring_soon,
-                    defective = EXCLUDED.defective,
-                    excess_from_supply = EXCLUDED.excess_from_supply,
-                    awaiting_upd = EXCLUDED.awaiting_upd,
-                    preparing_for_removal = EXCLUDED.preparing_for_removal,
+                    {count_updates},
                     updated_at = EXCLUDED.updated_at
             """
             
-            execute_values(self.cursor, query, values)
+            execute_values(self.cursor, query, values, page_size=self.PAGE_SIZE)
             self.conn.commit()
             
         except Exception as e:
@@ -334,7 +406,8 @@ class OzonWarehouseImporter:
             self.conn.rollback()
             raise
     
-    def import_sales_report(self, csv_file_path: str, start_date: str, end_date: str) -> int:
+    def import_sales_report(self, csv_file_path: str, start_date: str, end_date: str,
+                            chunk_size: Optional[int] = None) -> int:
         """
         Import Ozon Sales report (Отчет о продажах).
         
@@ -351,6 +424,7 @@ class OzonWarehouseImporter:
             csv_file_path: Path to CSV file
             start_date: Start date for the report period (YYYY-MM-DD)
             end_date: End date for the report period (YYYY-MM-DD)
+            chunk_size: Rows per chunk (defaults to the importer setting)
             
         Returns:
             Number of records imported
@@ -362,91 +436,77 @@ class OzonWarehouseImporter:
             logger.error(f"File not found: {csv_file_path}")
             return 0
         
+        chunk_size = chunk_size or self.chunk_size
         imported_count = 0
         skipped_count = 0
+        order_dates = {}
         
         try:
-            with open(csv_file_path, 'r', encoding='utf-8-sig') as f:
-                # Try to detect delimiter
-                sample = f.read(1024)
-                f.seek(0)
-                delimiter = ';' if ';' in sample else ','
+            with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as f:
+                reader, columns = self._open_csv(f)
+                get = self._column_getter(columns)
                 
-                reader = csv.DictReader(f, delimiter=delimiter)
-                
-                batch = []
-                batch_size = 100
-                
-                for row in reader:
-                    # Extract data from CSV
-                    order_id = row.get('Номер заказа', '').strip()
-                    sku_ozon = row.get('Артикул', '').strip()
-                    product_name = row.get('Название товара', '').strip()
-                    warehouse_name = row.get('Склад отгрузки', '').strip()
-                    order_date_str = row.get('Принят в обработку', '').strip()
-                    
-                    if not order_id or not sku_ozon:
-                        skipped_count += 1
-                        continue
-                    
-                    # Get or create product
-                    product_id = self._get_or_create_product(sku_ozon, product_name)
-                    if not product_id:
-                        skipped_count += 1
-                        continue
-                    
-                    # Parse date (format: "2025-09-02 00:00:39" or "2025-09-02")
-                    try:
-                        order_date = datetime.strptime(order_date_str[:10], '%Y-%m-%d').date()
-                    except:
-                        logger.warning(f"Invalid date format: {order_date_str}")
-                        skipped_count += 1
-                        continue
+                for chunk in self._iter_chunks(reader, chunk_size):
+                    rows = []
+                    product_names = {}
                     
-                    # Parse numeric values
-                    def parse_int(value):
-                        try:
-                            return int(value.replace(',', '').replace(' ', '')) if value else 0
-                        except:
-                            return 0
+                    for row in chunk:
+                        # Extract data from CSV
+                        order_id = get(row, 'Номер заказа')
+                        sku_ozon = get(row, 'Артикул')
+                        
+                        if not order_id or not sku_ozon:
+                            skipped_count += 1
+                            continue
+                        
+                        # Parse date (format: "2025-09-02 00:00:39" or "2025-09-02")
+                        order_date_str = get(row, 'Принят в обработку')[:10]
+                        if order_date_str not in order_dates:
+                            try:
+                                order_dates[order_date_str] = datetime.strptime(order_date_str, '%Y-%m-%d').date()
+                            except ValueError:
+                                logger.warning(f"Invalid date format: {order_date_str}")
+                                order_dates[order_date_str] = None
+                        order_date = order_dates[order_date_str]
+                        
+                        quantity = parse_int(get(row, 'Количество'))
+                        
+                        if order_date is None or quantity <= 0:
+                            skipped_count += 1
+                            continue
+                        
+                        product_name = get(row, 'Название товара')
+                        product_names.setdefault(sku_ozon, '')
+                        product_names[sku_ozon] = product_names[sku_ozon] or product_name
+                        rows.append((order_id, sku_ozon, order_date, quantity, get(row, 'Склад отгрузки')))
                     
-                    def parse_float(value):
-                        try:
-                            return float(value.replace(',', '.').replace(' ', '')) if value else 0.0
-                        except:
-                            return 0.0
+                    product_ids = self._resolve_products(product_names)
                     
-                    quantity = parse_int(row.get('Количество', '0'))
-                    price = parse_float(row.get('Ваша цена', '0'))
+                    # A repeated movement keeps the last row
+                    records = {}
+                    for order_id, sku_ozon, order_date, quantity, warehouse_name in rows:
+                        product_id = product_ids.get(sku_ozon)
+                        if not product_id:
+                            skipped_count += 1
+                            continue
+                        
+                        # Create movement record (negative quantity for sales)
+                        movement_id = f"ozon_sale_{order_id}_{sku_ozon}"
+                        records[(movement_id, product_id)] = (
+                            movement_id,
+                            product_id,
+                            order_date,
+                            'sale',
+                            -quantity,  # Negative for sales
+                            warehouse_name if warehouse_name else 'Unknown',
+                            order_id,
+                            'ozon'
+                        )
                     
-                    if quantity <= 0:
-                        skipped_count += 1
-                        continue
-                    
-                    # Create movement record (negative quantity for sales)
-                    movement_data = {
-                        'movement_id': f"ozon_sale_{order_id}_{sku_ozon}",
-                        'product_id': product_id,
-                        'movement_date': order_date,
-                        'movement_type': 'sale',
-                        'quantity': -quantity,  # Negative for sales
-                        'warehouse_name': warehouse_name if warehouse_name else 'Unknown',
-                        'order_id': order_id,
-                        'source': 'ozon'
-                    }
-                    
-                    batch.append(movement_data)
-                    
-                    # Insert batch when it reaches batch_size
-                    if len(batch) >= batch_size:
-                        self._insert_movements_batch(batch)
-                        imported_count += len(batch)
-                        batch = []
-                
-                # Insert remaining records
-                if batch:
-                    self._insert_movements_batch(batch)
-                    imported_count += len(batch)
+                    if records:
+                        self._insert_movements_batch(list(records.values()))
+                        imported_count += len(records)
+                    logger.info(f"Sales progress: {imported_count} imported, {skipped_count} skipped")
             
             logger.info(f"✅ Imported {imported_count} sales records")
             logger.info(f"⚠️  Skipped {skipped_count} records")
@@ -458,24 +518,15 @@ class OzonWarehouseImporter:
             self.conn.rollback()
             raise
     
-    def _insert_movements_batch(self, batch: List[Dict[str, Any]]):
-        """Insert a batch of stock movement records using UPSERT."""
+    def _insert_movements_batch(self, values: List[Tuple]):
+        """
+        Insert a batch of stock movement records using UPSERT.
+        
+        Args:
+            values: Tuples of (movement_id, product_id, movement_date, movement_type,
+                quantity, warehouse_name, order_id, source); keys must be unique within the batch
+        """
         try:
-            # Prepare data for execute_values
-            values = [
-                (
-                    item['movement_id'],
-                    item['product_id'],
-                    item['movement_date'],
-                    item['movement_type'],
-                    item['quantity'],
-                    item['warehouse_name'],
-                    item['order_id'],
-                    item['source']
-                )
-                for item in batch
-            ]
-            
             query = """
                 INSERT INTO stock_movements (
                     movement_id, product_id, movement_date, movement_type,
@@ -490,7 +541,7 @@ class OzonWarehouseImporter:
                     order_id = EXCLUDED.order_id
             """
             
-            execute_values(self.cursor, query, values)
+            execute_values(self.cursor, query, values, page_size=self.PAGE_SIZE)
             self.conn.commit()
             
         except Exception as e:
@@ -577,6 +628,12 @@ def main():
         metavar=('INVENTORY_CSV', 'SALES_CSV'),
         help='Import both inventory and sales reports'
     )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=OzonWarehouseImporter.DEFAULT_CHUNK_SIZE,
+        help='CSV rows resolved and written per transaction'
+    )
     
     args = parser.parse_args()
     
@@ -591,7 +648,7 @@ def main():
         parser.error('--both requires --start-date and --end-date')
     
     # Create importer
-    importer = OzonWarehouseImporter()
+    importer = OzonWarehouseImporter(chunk_size=args.chunk_size)
     
     try:
         # Import inventory
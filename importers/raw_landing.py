@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Зона приземления сырых событий API (raw_events).
+
+Каждая страница ответа API сохраняется одной пачкой:
+- db: многострочный INSERT IGNORE в таблицу raw_events (компактный JSON)
+- files: сжатые сегменты JSONL по датам с индексом ext_id
+- both: оба варианта
+
+Структура файлов:
+    <RAW_LANDING_DIR>/<event_type>/<YYYY-MM-DD>/segment-00001.jsonl.gz
+    <RAW_LANDING_DIR>/<event_type>/<YYYY-MM-DD>/index.tsv
+
+Каждая страница дописывается в сегмент отдельным сжатым фреймом
+(gzip member или zstd frame), индекс хранит ext_id, сегмент, смещение
+и длину фрейма. Повтор дня - последовательное чтение сегментов без
+запросов к БД.
+
+Использование:
+    python raw_landing.py replay --event-type wb_sale --date 2025-09-02
+    python raw_landing.py get --event-type wb_sale --date 2025-09-02 --ext-id <srid>
+"""
+
+import os
+import sys
+import gzip
+import json
+import fcntl
+import logging
+import argparse
+import threading
+from datetime import datetime, date
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+LANDING_MODES = ('db', 'files', 'both')
+
+DEFAULT_LANDING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'storage', 'raw_events')
+
+# Размер сегмента, после которого начинается следующий файл
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+# Строк в одном INSERT (ограничение max_allowed_packet)
+DB_BATCH_SIZE = 1000
+
+SEGMENT_EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+RawRecord = Tuple[str, Dict[str, Any]]
+
+
+def _dumps(value: Any) -> str:
+    """Компактная сериализация payload."""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class RawEventLanding:
+    """Пакетная запись сырых событий в raw_events и/или сегментные файлы."""
+    
+    def __init__(self, mode: Optional[str] = None, base_dir: Optional[str] = None,
+                 compression: Optional[str] = None,
+                 segment_max_bytes: int = DEFAULT_SEGMENT_MAX_BYTES):
+        """
+        Инициализация зоны приземления.
+        
+        Args:
+            mode: 'db', 'files' или 'both' (по умолчанию RAW_LANDING_MODE или 'db')
+            base_dir: Каталог сегментов (по умолчанию RAW_LANDING_DIR)
+            compression: 'gzip' или 'zstd' (по умолчанию RAW_LANDING_COMPRESSION или 'gzip')
+            segment_max_bytes: Максимальный размер файла сегмента
+        """
+        self.mode = (mode or os.getenv('RAW_LANDING_MODE', 'db')).lower()
+        if self.mode not in LANDING_MODES:
+            raise ValueError(f"Неизвестный режим RAW_LANDING_MODE: {self.mode}")
+        
+        self.base_dir = base_dir or os.getenv('RAW_LANDING_DIR', DEFAULT_LANDING_DIR)
+        self.compression = (compression or os.getenv('RAW_LANDING_COMPRESSION', 'gzip')).lower()
+        if self.compression not in SEGMENT_EXTENSIONS:
+            raise ValueError(f"Неизвестный тип сжатия: {self.compression}")
+        if self.compression == 'zstd' and zstandard is None:
+            logger.warning("⚠️ Пакет zstandard не установлен, сегменты сжимаются gzip")
+            self.compression = 'gzip'
+        
+        self.segment_max_bytes = segment_max_bytes
+        
+        # ext_id, уже записанные в индекс дня: (event_type, день) -> (размер индекса, множество)
+        self._known_ids: Dict[Tuple[str, str], Tuple[int, Set[str]]] = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def writes_db(self) -> bool:
+        return self.mode in ('db', 'both')
+    
+    @property
+    def writes_files(self) -> bool:
+        return self.mode in ('files', 'both')
+    
+    def land_page(self, event_type: str, records: List[RawRecord],
+                  connection_factory: Optional[Callable[[], Any]] = None) -> int:
+        """
+        Сохранить страницу событий одной пачкой.
+        
+        Args:
+            event_type: Тип события (например, 'wb_sale')
+            records: Список (ext_id, событие)
+            connection_factory: Функция, возвращающая подключение к MySQL (для режима db)
+        
+        Returns:
+            Количество событий в странице
+        """
+        if not records:
+            return 0
+        
+        ingested_at = datetime.now().replace(microsecond=0)
+        
+        if self.writes_db:
+            if connection_factory is None:
+                raise ValueError("Для записи в raw_events нужен connection_factory")
+            connection = connection_factory()
+            try:
+                self._land_db(connection, event_type, records, ingested_at)
+            finally:
+                connection.close()
+        
+        if self.writes_files:
+            self._land_files(event_type, records, ingested_at)
+        
+        return len(records)
+    
+    @staticmethod
+    def _land_db(connection, event_type: str, records: List[RawRecord], ingested_at: datetime) -> None:
+        """Запись страницы в raw_events пачками по DB_BATCH_SIZE строк."""
+        sql = """
+            INSERT IGNORE INTO raw_events (ext_id, event_type, payload, ingested_at)
+            VALUES (%s, %s, %s, %s)
+        """
+        cursor = connection.cursor()
+        try:
+            for start in range(0, len(records), DB_BATCH_SIZE):
+                cursor.executemany(sql, [
+                    (ext_id, event_type, _dumps(event), ingested_at)
+                    for ext_id, event in records[start:start + DB_BATCH_SIZE]
+                ])
+            connection.commit()
+        finally:
+            cursor.close()
+    
+    def _day_dir(self, event_type: str, day: str) -> str:
+        return os.path.join(self.base_dir, event_type, day)
+    
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return gzip.compress(data, compresslevel=6)
+    
+    @staticmethod
+    def _decompress(data: bytes, path: str) -> bytes:
+        if path.endswith(SEGMENT_EXTENSIONS['zstd']):
+            if zstandard is None:
+                raise RuntimeError(f"Для чтения {path} нужен пакет zstandard")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return gzip.decompress(data)
+    
+    @staticmethod
+    def _read_index(index_path: str) -> Iterator[Tuple[str, str, int, int]]:
+        """Строки индекса дня: (ext_id, сегмент, смещение, длина)."""
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 4:
+                    yield parts[0], parts[1], int(parts[2]), int(parts[3])
+    
+    def _land_files(self, event_type: str, records: List[RawRecord], ingested_at: datetime) -> None:
+        """Дописать страницу сжатым фреймом в текущий сегмент дня."""
+        day = ingested_at.strftime('%Y-%m-%d')
+        day_dir = self._day_dir(event_type, day)
+        os.makedirs(day_dir, exist_ok=True)
+        index_path = os.path.join(day_dir, 'index.tsv')
+        
+        with self._lock, open(index_path, 'a+', encoding='utf-8') as index_file:
+            # Блокировка индекса дня разделяет запись между процессами
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                # Индекс перечитывается, только если его дописал другой процесс
+                index_size = index_file.seek(0, os.SEEK_END)
+                cached_size, known = self._known_ids.get((event_type, day), (-1, set()))
+                if cached_size != index_size:
+                    known = {ext_id for ext_id, _, _, _ in self._read_index(index_path)}
+                
+                # Как INSERT IGNORE: повторный ext_id за день не пишется (пустые ext_id пишутся всегда)
+                page = []
+                page_ids = set()
+                for ext_id, event in records:
+                    if ext_id and (ext_id in known or ext_id in page_ids):
+                        continue
+                    if ext_id:
+                        page_ids.add(ext_id)
+                    page.append((ext_id, event))
+                
+                if not page:
+                    return
+                
+                lines = ''.join(
+                    _dumps({'ext_id': ext_id, 'ingested_at': ingested_at, 'event': event}) + '\n'
+                    for ext_id, event in page
+                )
+                frame = self._compress(lines.encode('utf-8'))
+                
+                segment = self._current_segment(day_dir)
+                segment_path = os.path.join(day_dir, segment)
+                with open(segment_path, 'ab') as segment_file:
+                    offset = segment_file.tell()
+                    segment_file.write(frame)
+                
+                index_file.write(''.join(
+                    f"{ext_id}\t{segment}\t{offset}\t{len(frame)}\n" for ext_id, _ in page if ext_id
+                ))
+                index_file.flush()
+                known.update(page_ids)
+                self._known_ids[(event_type, day)] = (index_file.tell(), known)
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+    
+    def _current_segment(self, day_dir: str) -> str:
+        """Имя сегмента для записи (новый, если текущий достиг segment_max_bytes)."""
+        extension = SEGMENT_EXTENSIONS[self.compression]
+        segments = self._list_segments(day_dir)
+        same_format = [name for name in segments if name.endswith(extension)]
+        
+        if same_format and segments[-1] == same_format[-1]:
+            last = same_format[-1]
+            if os.path.getsize(os.path.join(day_dir, last)) < self.segment_max_bytes:
+                return last
+        
+        return f"segment-{len(segments) + 1:05d}{extension}"
+    
+    @staticmethod
+    def _list_segments(day_dir: str) -> List[str]:
+        if not os.path.isdir(day_dir):
+            return []
+        return sorted(name for name in os.listdir(day_dir)
+                      if name.startswith('segment-') and name.endswith(tuple(SEGMENT_EXTENSIONS.values())))
+    
+    def iter_day(self, event_type: str, day: str) -> Iterator[RawRecord]:
+        """
+        Последовательное чтение всех событий дня в порядке записи.
+        
+        Args:
+            event_type: Тип события
+            day: Дата приземления (YYYY-MM-DD)
+        
+        Yields:
+            (ext_id, событие)
+        """
+        day_dir = self._day_dir(event_type, day)
+        for segment in self._list_segments(day_dir):
+            path = os.path.join(day_dir, segment)
+            if segment.endswith(SEGMENT_EXTENSIONS['zstd']):
+                if zstandard is None:
+                    raise RuntimeError(f"Для чтения {path} нужен пакет zstandard")
+                raw = open(path, 'rb')
+                stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            else:
+                raw = None
+                stream = gzip.open(path, 'rb')
+            
+            try:
+                for line in _iter_lines(stream):
+                    record = json.loads(line)
+                    yield record['ext_id'], record['event']
+            finally:
+                stream.close()
+                if raw is not None:
+                    raw.close()
+    
+    def read_event(self, event_type: str, day: str, ext_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Чтение одного события по индексу ext_id (распаковывается только его фрейм).
+        
+        Returns:
+            Событие или None, если ext_id нет в индексе дня
+        """
+        day_dir = self._day_dir(event_type, day)
+        for indexed_id, segment, offset, length in self._read_index(os.path.join(day_dir, 'index.tsv')):
+            if indexed_id != ext_id:
+                continue
+            
+            path = os.path.join(day_dir, segment)
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                frame = f.read(length)
+            
+            for line in self._decompress(frame, path).decode('utf-8').splitlines():
+                record = json.loads(line)
+                if record['ext_id'] == ext_id:
+                    return record['event']
+        return None
+
+
+def _iter_lines(stream) -> Iterator[bytes]:
+    """Построчное чтение бинарного потока."""
+    buffer = b''
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line:
+                yield line
+    if buffer:
+        yield buffer
+
+
+_landing: Optional[RawEventLanding] = None
+_landing_lock = threading.Lock()
+
+
+def get_raw_landing() -> RawEventLanding:
+    """Общий экземпляр зоны приземления (настройки из переменных окружения)."""
+    global _landing
+    with _landing_lock:
+        if _landing is None:
+            _landing = RawEventLanding()
+            logger.info(f"Сырые события: режим {_landing.mode}"
+                        + (f", каталог {_landing.base_dir} ({_landing.compression})" if _landing.writes_files else ''))
+        return _landing
+
+
+def main():
+    """Повтор дня или чтение одного события из сегментов."""
+    parser = argparse.ArgumentParser(description='Чтение сырых событий из сегментных файлов')
+    parser.add_argument('command', choices=['replay', 'get'])
+    parser.add_argument('--event-type', required=True, help='Тип события (например, wb_sale)')
+    parser.add_argument('--date', default=date.today().isoformat(), help='Дата приземления (YYYY-MM-DD)')
+    parser.add_argument('--ext-id', help='ext_id события (для get)')
+    parser.add_argument('--dir', help='Каталог сегментов (по умолчанию RAW_LANDING_DIR)')
+    args = parser.parse_args()
+    
+    landing = RawEventLanding(mode='files', base_dir=args.dir)
+    
+    if args.command == 'get':
+        if not args.ext_id:
+            parser.error('для get нужен --ext-id')
+        event = landing.read_event(args.event_type, args.date, args.ext_id)
+        if event is None:
+            logger.error(f"❌ Событие {args.ext_id} не найдено")
+            return 1
+        print(_dumps(event))
+        return 0
+    
+    for ext_id, event in landing.iter_day(args.event_type, args.date):
+        sys.stdout.write(_dumps({'ext_id': ext_id, 'event': event}) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -22,8 +22,11 @@ from typing import List, Dict, Any, Optional
 
 # Добавляем путь к корневой директории проекта
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+# Общие утилиты (индекс товаров, rate limiter) лежат в src/utils
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'utils'))
 
 from ozon_importer import connect_to_db
+from product_resolution_index import get_product_index
 import config
 
 # Настройка логирования
@@ -41,6 +44,7 @@ class StockImporter:
         """Инициализация импортера."""
         self.connection = None
         self.cursor = None
+        self.product_index = get_product_index()
         
     def connect_to_database(self):
         """Подключение к базе данных."""
@@ -269,12 +273,7 @@ class StockImporter:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_ozon = %s",
-                (sku_ozon,)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_ozon_sku(sku_ozon, cursor=self.cursor)
         except Exception as e:
             logger.error(f"Ошибка при поиске товара по sku_ozon {sku_ozon}: {e}")
             return None
@@ -293,12 +292,7 @@ class StockImporter:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_wb = %s",
-                (str(sku_wb),)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_wb_sku(sku_wb, cursor=self.cursor)
         except Exception as e:
             logger.error(f"Ошибка при поиске товара по sku_wb {sku_wb}: {e}")
             return None
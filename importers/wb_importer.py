@@ -7,18 +7,36 @@
 - Получения продаж и возвратов из API Wildberries
 - Получения финансовых деталей из API Wildberries
 - Трансформации и загрузки данных в таблицы fact_orders и fact_transactions
+- Потоковой загрузки продаж и финансовых деталей: ответ API разбирается
+  по мере получения, каждая порция сразу загружается в БД, а позиция
+  (dateFrom/rrdid) сохраняется в чекпоинт после каждой страницы
 """
 
 import os
+import sys
 import json
+import codecs
 import logging
+import tempfile
+import threading
 import mysql.connector
 from mysql.connector import Error
 import requests
 import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Iterator
+
+# Общий rate limiter лежит в src/utils
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'utils'))
+
+from rate_limiter import get_rate_limiter
+from product_resolution_index import get_product_index, LOOKUP_BATCH_SIZE
+# raw_landing лежит рядом: при импорте как importers.<модуль> - относительный путь
+try:
+    from .raw_landing import get_raw_landing
+except ImportError:
+    from raw_landing import get_raw_landing
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,6 +45,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Максимум записей в одном ответе /api/v1/supplier/sales
+WB_SALES_PAGE_LIMIT = 80000
+
+# Записей в порции, которая преобразуется и загружается в БД за раз
+STREAM_CHUNK_SIZE = 5000
+
+# Размер фрагмента при чтении тела ответа
+STREAM_READ_SIZE = 64 * 1024
+
+DEFAULT_STREAM_CHECKPOINT_FILE = 'wb_import_checkpoint.json'
+
 
 def load_config() -> Dict[str, str]:
     """
@@ -152,34 +181,33 @@ def get_source_id_by_code(source_code: str) -> Optional[int]:
         connection.close()
 
 
-def make_wb_request(endpoint: str, params: Dict[str, Any] = None, method: str = 'GET', data: Dict[str, Any] = None) -> Dict[str, Any]:
+def _prepare_wb_request(endpoint: str, method: str) -> tuple:
     """
-    Выполняет запрос к API Wildberries с автоматическим выбором правильного базового URL.
-    
-    Args:
-        endpoint (str): Конечная точка API (например, '/api/v1/supplier/sales')
-        params (Dict[str, Any], optional): Параметры запроса для GET
-        method (str): HTTP метод ('GET' или 'POST')
-        data (Dict[str, Any], optional): Данные для POST запроса
+    Определяет URL, заголовки и bucket rate limiter для эндпоинта и ожидает токен.
     
     Returns:
-        Dict[str, Any]: Ответ от API в формате JSON
+        tuple: (url, headers, rate_bucket)
     """
     config = load_config()
     
     # Определяем правильный базовый URL в зависимости от типа API
+    # Statistics API ограничен 1 запросом в минуту, остальные API - общим лимитом WB
     if endpoint.startswith('/content/'):
         base_url = 'https://content-api.wildberries.ru'
+        rate_bucket = 'wb'
         logger.info(f"Используем Content API: {base_url}")
     elif endpoint.startswith('/marketplace/'):
         base_url = 'https://marketplace-api.wildberries.ru'
+        rate_bucket = 'wb'
         logger.info(f"Используем Marketplace API: {base_url}")
     elif endpoint.startswith('/analytics/'):
         base_url = 'https://analytics-api.wildberries.ru'
+        rate_bucket = 'wb'
         logger.info(f"Используем Analytics API: {base_url}")
     else:
         # Statistics API (по умолчанию)
         base_url = config['WB_API_URL']
+        rate_bucket = 'wb_statistics'
         logger.info(f"Используем Statistics API: {base_url}")
     
     url = f"{base_url}{endpoint}"
@@ -190,12 +218,36 @@ def make_wb_request(endpoint: str, params: Dict[str, Any] = None, method: str =
     
     logger.info(f"Выполняем {method} запрос к {url}")
     
+    wait_time = get_rate_limiter().acquire(rate_bucket)
+    if wait_time > 0:
+        logger.info(f"Ожидание {wait_time:.1f} сек согласно ограничениям API...")
+    
+    return url, headers, rate_bucket
+
+
+def make_wb_request(endpoint: str, params: Dict[str, Any] = None, method: str = 'GET', data: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Выполняет запрос к API Wildberries с автоматическим выбором правильного базового URL.
+    
+    Args:
+        endpoint (str): Конечная точка API (например, '/api/v1/supplier/sales')
+        params (Dict[str, Any], optional): Параметры запроса для GET
+        method (str): HTTP метод ('GET' или 'POST')
+        data (Dict[str, Any], optional): Данные для POST запроса
+    
+    Returns:
+        Dict[str, Any]: Ответ от API в формате JSON
+    """
+    url, headers, rate_bucket = _prepare_wb_request(endpoint, method)
+    rate_limiter = get_rate_limiter()
+    
     try:
         if method.upper() == 'POST':
             response = requests.post(url, headers=headers, json=data or {}, timeout=30)
         else:
             response = requests.get(url, headers=headers, params=params or {}, timeout=30)
-            
+        
+        rate_limiter.update_from_response(rate_bucket, response.status_code, response.headers)
         response.raise_for_status()
         
         logger.info(f"Успешный {method} запрос к {endpoint}")
@@ -208,85 +260,269 @@ def make_wb_request(endpoint: str, params: Dict[str, Any] = None, method: str =
         raise
 
 
-def get_sales_from_api(start_date: str, end_date: str) -> List[Dict[str, Any]]:
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
     """
-    Получает данные о продажах и возвратах из API Wildberries с пагинацией.
+    Инкрементальный разбор JSON-массива: элементы отдаются по мере
+    получения фрагментов, весь ответ в памяти не хранится.
+    
+    Пустое тело и null считаются пустым массивом: так API отвечает,
+    когда данных больше нет.
+    
+    Args:
+        chunks (Iterable[bytes]): Фрагменты тела ответа
+    
+    Yields:
+        Any: Элементы массива
+    
+    Raises:
+        ValueError: Ответ не является JSON-массивом или оборван
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    started = False
+    
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        pos = 0
+        
+        while True:
+            # Пропускаем пробелы и разделители
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            
+            if not started:
+                if buffer[pos] != '[':
+                    if 'null'.startswith(buffer[pos:].rstrip()):
+                        # null (или его начало) - решаем после конца ответа
+                        break
+                    raise ValueError(f"Ответ API не является JSON-массивом: {buffer[pos:pos + 200]}")
+                started = True
+                pos += 1
+                continue
+            
+            if buffer[pos] == ']':
+                return
+            
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Элемент получен не полностью - ждем следующий фрагмент
+                break
+            if not isinstance(item, (dict, list)) and (end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+                # Число на границе фрагмента может быть неполным ("100" из "1005")
+                break
+            
+            yield item
+            pos = end
+        
+        buffer = buffer[pos:]
+    
+    buffer += text_decoder.decode(b'', final=True)
+    if not started and buffer.strip() in ('', 'null'):
+        return
+    raise ValueError("Ответ API оборван: JSON-массив не завершен")
+
+
+def stream_wb_request(endpoint: str, params: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Выполняет GET-запрос к API Wildberries и отдает элементы ответа-массива
+    по мере чтения тела ответа.
+    
+    Args:
+        endpoint (str): Конечная точка API
+        params (Dict[str, Any], optional): Параметры запроса
+    
+    Yields:
+        Dict[str, Any]: Элементы ответа
+    """
+    url, headers, rate_bucket = _prepare_wb_request(endpoint, 'GET')
+    rate_limiter = get_rate_limiter()
+    
+    with requests.get(url, headers=headers, params=params or {}, timeout=30, stream=True) as response:
+        rate_limiter.update_from_response(rate_bucket, response.status_code, response.headers)
+        response.raise_for_status()
+        
+        if response.status_code == 204:
+            # Данных больше нет (конец постраничной выгрузки)
+            logger.info(f"Пустой ответ {endpoint} (204)")
+            return
+        
+        logger.info(f"Успешный GET запрос к {endpoint}, читаем ответ потоком")
+        yield from iter_json_array(response.iter_content(chunk_size=STREAM_READ_SIZE))
+
+
+class WbStreamCheckpoint:
+    """
+    Позиция потоковой загрузки (dateFrom/rrdid) по ключам запусков.
+    
+    Сохраняется после каждой полностью загруженной страницы, поэтому
+    прерванная загрузка продолжается со следующей страницы.
+    """
+    
+    # Блокировки по пути файла: экземпляры импорта продаж и финансов,
+    # работающие в параллельных шардах, пишут в один файл
+    _path_locks: Dict[str, threading.Lock] = {}
+    _path_locks_guard = threading.Lock()
+    
+    def __init__(self, path: Optional[str] = DEFAULT_STREAM_CHECKPOINT_FILE):
+        self.path = path
+        lock_key = os.path.abspath(path) if path else ''
+        with self._path_locks_guard:
+            self._lock = self._path_locks.setdefault(lock_key, threading.Lock())
+    
+    def _read(self) -> Dict[str, Any]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать чекпоинт {self.path}: {e}")
+            return {}
+    
+    def _write(self, state: Dict[str, Any]) -> None:
+        # Уникальное имя: временный файл другого процесса не будет перезаписан
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.path)}.",
+                                        suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """Сохраненная позиция запуска или None."""
+        with self._lock:
+            return self._read().get(key)
+    
+    def save(self, key: str, position: Dict[str, Any]) -> None:
+        """Сохранить позицию после загруженной страницы."""
+        if not self.path:
+            return
+        with self._lock:
+            state = self._read()
+            state[key] = dict(position, updated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self._write(state)
+    
+    def clear(self, key: str) -> None:
+        """Удалить позицию завершенного запуска."""
+        if not self.path:
+            return
+        with self._lock:
+            state = self._read()
+            if state.pop(key, None) is not None:
+                if state:
+                    self._write(state)
+                else:
+                    os.remove(self.path)
+
+
+def iter_sales_chunks(start_date: str, end_date: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                      checkpoint: Optional[WbStreamCheckpoint] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Потоково получает продажи и возвраты из API Wildberries порциями.
+    
+    Сырые данные каждой порции сохраняются в raw_events до передачи
+    вызывающему коду. Позиция dateFrom сохраняется в чекпоинт, когда все
+    порции страницы обработаны (генератор продолжается только после
+    обработки последней порции).
     
     Args:
         start_date (str): Начальная дата в формате 'YYYY-MM-DD'
         end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+        chunk_size (int): Размер порции
+        checkpoint (WbStreamCheckpoint, optional): Чекпоинт для продолжения загрузки
     
-    Returns:
-        List[Dict[str, Any]]: Список продаж и возвратов
+    Yields:
+        List[Dict[str, Any]]: Порция продаж и возвратов
     """
     logger.info(f"Начинаем загрузку продаж WB с {start_date} по {end_date}")
     
-    all_sales = []
-    current_date = start_date
+    checkpoint_key = f"wb_sales:{start_date}..{end_date}"
+    position = checkpoint.load(checkpoint_key) if checkpoint else None
     
     # Конвертируем даты в RFC3339 формат
-    date_from = f"{start_date}T00:00:00Z"
+    date_from = position['date_from'] if position else f"{start_date}T00:00:00Z"
+    if position:
+        logger.info(f"♻️  Продолжаем загрузку продаж с {date_from} (чекпоинт)")
     
+    total = 0
     while True:
-        params = {
-            'dateFrom': date_from
-        }
-        
         logger.info(f"Запрашиваем продажи с {date_from}")
         
-        try:
-            # Делаем запрос к API
-            response = make_wb_request('/api/v1/supplier/sales', params)
-            
-            # Проверяем, что ответ содержит данные
-            if not isinstance(response, list):
-                logger.warning(f"Неожиданный формат ответа API: {type(response)}")
-                break
-            
-            sales_batch = response
-            
-            if not sales_batch:
-                logger.info("Получен пустой ответ, завершаем загрузку")
-                break
-            
-            all_sales.extend(sales_batch)
-            logger.info(f"Загружено {len(sales_batch)} записей, всего: {len(all_sales)}")
-            
-            # Сохраняем сырые данные
-            save_raw_events(sales_batch, 'wb_sale')
-            
-            # Если получили максимальное количество записей (80000), 
-            # нужно продолжить с последней даты
-            if len(sales_batch) >= 80000:
-                # Находим последнюю дату в полученных данных
-                last_sale = sales_batch[-1]
-                last_date = last_sale.get('date', '')
-                
-                if last_date:
-                    date_from = last_date
-                    logger.info(f"Продолжаем с даты: {date_from}")
-                else:
-                    logger.warning("Не удалось определить последнюю дату, прерываем загрузку")
-                    break
-            else:
-                # Если записей меньше максимума, это последняя порция
-                break
-            
-            # Ограничение API: 1 запрос в минуту
-            logger.info("Ожидание 61 секунда согласно ограничениям API...")
-            time.sleep(61)
+        page_count = 0
+        last_date = None
+        chunk = []
+        
+        for sale in stream_wb_request('/api/v1/supplier/sales', {'dateFrom': date_from}):
+            chunk.append(sale)
+            page_count += 1
+            last_date = sale.get('date') or last_date
             
-        except Exception as e:
-            logger.error(f"Ошибка при получении продаж: {e}")
+            if len(chunk) >= chunk_size:
+                save_raw_events(chunk, 'wb_sale')
+                yield chunk
+                chunk = []
+        
+        if chunk:
+            save_raw_events(chunk, 'wb_sale')
+            yield chunk
+        
+        total += page_count
+        logger.info(f"Загружено {page_count} записей, всего: {total}")
+        
+        # Если получили максимальное количество записей (80000),
+        # нужно продолжить с последней даты
+        if page_count < WB_SALES_PAGE_LIMIT:
+            break
+        if not last_date:
+            logger.warning("Не удалось определить последнюю дату, прерываем загрузку")
             break
+        
+        date_from = last_date
+        if checkpoint:
+            checkpoint.save(checkpoint_key, {'date_from': date_from})
+        logger.info(f"Продолжаем с даты: {date_from}")
+    
+    if checkpoint:
+        checkpoint.clear(checkpoint_key)
+    logger.info(f"Загрузка продаж завершена. Всего записей: {total}")
+
+
+def get_sales_from_api(start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    Получает данные о продажах и возвратах из API Wildberries с пагинацией.
+    
+    Args:
+        start_date (str): Начальная дата в формате 'YYYY-MM-DD'
+        end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+    
+    Returns:
+        List[Dict[str, Any]]: Список продаж и возвратов
+    """
+    all_sales = []
+    
+    try:
+        for chunk in iter_sales_chunks(start_date, end_date):
+            all_sales.extend(chunk)
+    except Exception as e:
+        logger.error(f"Ошибка при получении продаж: {e}")
     
-    logger.info(f"Загрузка продаж завершена. Всего записей: {len(all_sales)}")
     return all_sales
 
 
 def save_raw_events(events: List[Dict[str, Any]], event_type: str) -> None:
     """
-    Сохраняет сырые данные в таблицу raw_events.
+    Сохраняет страницу сырых данных одной пачкой.
+    
+    Куда пишутся данные (таблица raw_events и/или сжатые сегментные файлы),
+    определяет RAW_LANDING_MODE, см. raw_landing.py.
     
     Args:
         events (List[Dict[str, Any]]): Список событий для сохранения
@@ -295,45 +531,73 @@ def save_raw_events(events: List[Dict[str, Any]], event_type: str) -> None:
     if not events:
         return
     
-    connection = connect_to_db()
+    def get_ext_id(event: Dict[str, Any]) -> str:
+        # Определяем ext_id в зависимости от типа события
+        if event_type == 'wb_sale':
+            return str(event.get('srid', event.get('saleID', '')))
+        if event_type == 'wb_finance_detail':
+            return str(event.get('realizationreport_id', event.get('rrd_id', '')))
+        return str(event.get('id', ''))
     
     try:
-        cursor = connection.cursor(dictionary=True)
-        for event in events:
-            # Определяем ext_id в зависимости от типа события
-            if event_type == 'wb_sale':
-                ext_id = event.get('srid', event.get('saleID', ''))
-            elif event_type == 'wb_finance_detail':
-                ext_id = event.get('realizationreport_id', event.get('rrd_id', ''))
-            else:
-                ext_id = event.get('id', '')
-            
-            raw_data = {
-                'ext_id': str(ext_id),
-                'event_type': event_type,
-                'payload': json.dumps(event, ensure_ascii=False),
-                'ingested_at': datetime.now()
-            }
-            
-            # SQL запрос с IGNORE для избежания дублей
-            sql = """
-            INSERT IGNORE INTO raw_events (ext_id, event_type, payload, ingested_at)
-            VALUES (%(ext_id)s, %(event_type)s, %(payload)s, %(ingested_at)s)
-            """
-            
-            cursor.execute(sql, raw_data)
-        cursor.close()
-        
-        logger.info(f"Сохранено {len(events)} событий типа {event_type} в raw_events")
+        landing = get_raw_landing()
+        landing.land_page(event_type, [(get_ext_id(event), event) for event in events], connect_to_db)
+        logger.info(f"Сохранено {len(events)} событий типа {event_type} в raw_events ({landing.mode})")
             
     except Exception as e:
         logger.error(f"Ошибка сохранения сырых данных: {e}")
         raise
+
+
+def resolve_sale_products(sales: List[Dict[str, Any]], connection) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Разрешает товары порции продаж на одном подключении.
+    
+    Артикулы поставщика ищутся по sku_ozon, штрихкоды - по barcode через общий
+    индекс товаров (промахи проверяются пакетными запросами), себестоимость
+    найденных товаров читается запросами WHERE id IN (...).
+    
+    Args:
+        sales (List[Dict[str, Any]]): Порция продаж из API
+        connection: Подключение к базе данных
+    
+    Returns:
+        Dict: {'sku_ozon': {артикул: товар}, 'barcode': {штрихкод: товар}},
+            где товар - {'id': ..., 'cost_price': ...}
+    """
+    cursor = connection.cursor(dictionary=True)
+    
+    try:
+        index = get_product_index()
+        product_ids = {
+            'sku_ozon': index.resolve_many('sku_ozon', (sale.get('supplierArticle') for sale in sales), cursor=cursor),
+            'barcode': index.resolve_many('barcode', (sale.get('barcode') for sale in sales), cursor=cursor),
+        }
+        
+        ids = sorted({product_id for resolved in product_ids.values() for product_id in resolved.values()})
+        cost_prices = {}
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            batch = ids[start:start + LOOKUP_BATCH_SIZE]
+            cursor.execute(
+                f"SELECT id, cost_price FROM dim_products WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                tuple(batch)
+            )
+            for row in cursor.fetchall():
+                cost_prices[row['id']] = row['cost_price']
+        
+        return {
+            key: {
+                value: {'id': product_id, 'cost_price': cost_prices.get(product_id)}
+                for value, product_id in resolved.items()
+            }
+            for key, resolved in product_ids.items()
+        }
     finally:
-        connection.close()
+        cursor.close()
 
 
-def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: int) -> List[Dict[str, Any]]:
+def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: int,
+                        products: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
     """
     Преобразует данные продажи/возврата из API WB в формат для таблицы fact_orders.
     
@@ -341,16 +605,16 @@ def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: in
         sale_item (Dict[str, Any]): Данные продажи из API
         client_id (int): ID клиента
         source_id (int): ID источника
+        products (Dict, optional): Товары порции из resolve_sale_products()
+            (None - товар ищется отдельным запросом)
     
     Returns:
         List[Dict[str, Any]]: Список записей для fact_orders (обычно одна запись)
     """
-    connection = connect_to_db()
+    connection = connect_to_db() if products is None else None
     orders_list = []
     
     try:
-        cursor = connection.cursor(dictionary=True)
-        
         # Извлекаем информацию из API ответа
         supplier_article = sale_item.get('supplierArticle', '')
         barcode = sale_item.get('barcode', '')
@@ -366,13 +630,21 @@ def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: in
         
         # Получаем product_id и cost_price из dim_products
         # Ищем по артикулу поставщика или штрихкоду
-        sql = """
-        SELECT id, cost_price FROM dim_products 
-        WHERE sku_ozon = %s OR barcode = %s
-        LIMIT 1
-        """
-        cursor.execute(sql, (supplier_article, barcode))
-        product_info = cursor.fetchone()
+        if products is not None:
+            product_info = (
+                products['sku_ozon'].get(str(supplier_article).strip()) or
+                products['barcode'].get(str(barcode).strip())
+            )
+        else:
+            cursor = connection.cursor(dictionary=True)
+            sql = """
+            SELECT id, cost_price FROM dim_products 
+            WHERE sku_ozon = %s OR barcode = %s
+            LIMIT 1
+            """
+            cursor.execute(sql, (supplier_article, barcode))
+            product_info = cursor.fetchone()
+            cursor.close()
         
         if not product_info:
             logger.warning(f"Товар с артикулом {supplier_article} или штрихкодом {barcode} не найден в dim_products")
@@ -410,7 +682,6 @@ def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: in
         }
         
         orders_list.append(order_record)
-        cursor.close()
         
         logger.debug(f"Преобразована продажа {sale_id}, тип: {transaction_type}")
         
@@ -418,7 +689,8 @@ def transform_sale_data(sale_item: Dict[str, Any], client_id: int, source_id: in
         logger.error(f"Ошибка преобразования данных продажи: {e}")
         raise
     finally:
-        connection.close()
+        if connection:
+            connection.close()
     
     return orders_list
 
@@ -461,22 +733,32 @@ def load_orders_to_db(orders_list: List[Dict[str, Any]]) -> None:
         connection.close()
 
 
-def get_financial_details_api(start_date: str, end_date: str) -> List[Dict[str, Any]]:
+def iter_financial_details_chunks(start_date: str, end_date: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                                  checkpoint: Optional[WbStreamCheckpoint] = None) -> Iterator[List[Dict[str, Any]]]:
     """
-    Получает финансовые детали из API Wildberries с пагинацией.
+    Потоково получает финансовые детали из API Wildberries порциями.
+    
+    Позиция rrdid сохраняется в чекпоинт после обработки каждой страницы.
     
     Args:
         start_date (str): Начальная дата в формате 'YYYY-MM-DD'
         end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+        chunk_size (int): Размер порции
+        checkpoint (WbStreamCheckpoint, optional): Чекпоинт для продолжения загрузки
     
-    Returns:
-        List[Dict[str, Any]]: Список финансовых деталей
+    Yields:
+        List[Dict[str, Any]]: Порция финансовых деталей
     """
     logger.info(f"Начинаем загрузку финансовых деталей WB с {start_date} по {end_date}")
     
-    all_details = []
-    rrd_id = 0  # Начинаем с 0 для первого запроса
+    checkpoint_key = f"wb_finance:{start_date}..{end_date}"
+    position = checkpoint.load(checkpoint_key) if checkpoint else None
+    
+    rrd_id = position['rrd_id'] if position else 0  # Начинаем с 0 для первого запроса
+    if position:
+        logger.info(f"♻️  Продолжаем загрузку финансовых деталей с rrdid {rrd_id} (чекпоинт)")
     
+    total = 0
     while True:
         params = {
             'dateFrom': start_date,
@@ -486,47 +768,65 @@ def get_financial_details_api(start_date: str, end_date: str) -> List[Dict[str,
         
         logger.info(f"Запрашиваем финансовые детали с rrdid: {rrd_id}")
         
-        try:
-            # Делаем запрос к API
-            response = make_wb_request('/api/v5/supplier/reportDetailByPeriod', params)
-            
-            # Проверяем, что ответ содержит данные
-            if not isinstance(response, list):
-                logger.warning(f"Неожиданный формат ответа API: {type(response)}")
-                break
-            
-            details_batch = response
-            
-            if not details_batch:
-                logger.info("Получен пустой ответ, завершаем загрузку")
-                break
-            
-            all_details.extend(details_batch)
-            logger.info(f"Загружено {len(details_batch)} записей, всего: {len(all_details)}")
-            
-            # Сохраняем сырые данные
-            save_raw_events(details_batch, 'wb_finance_detail')
-            
-            # Получаем ID последней записи для следующего запроса
-            last_detail = details_batch[-1]
-            last_rrd_id = last_detail.get('rrd_id', 0)
-            
-            if last_rrd_id <= rrd_id:
-                # Если ID не увеличился, прерываем цикл
-                logger.info("ID последней записи не изменился, завершаем загрузку")
-                break
-            
-            rrd_id = last_rrd_id
-            
-            # Ограничение API: 1 запрос в минуту
-            logger.info("Ожидание 61 секунда согласно ограничениям API...")
-            time.sleep(61)
+        page_count = 0
+        last_rrd_id = 0
+        chunk = []
+        
+        for detail in stream_wb_request('/api/v5/supplier/reportDetailByPeriod', params):
+            chunk.append(detail)
+            page_count += 1
+            last_rrd_id = detail.get('rrd_id', 0) or last_rrd_id
             
-        except Exception as e:
-            logger.error(f"Ошибка при получении финансовых деталей: {e}")
+            if len(chunk) >= chunk_size:
+                save_raw_events(chunk, 'wb_finance_detail')
+                yield chunk
+                chunk = []
+        
+        if chunk:
+            save_raw_events(chunk, 'wb_finance_detail')
+            yield chunk
+        
+        if not page_count:
+            logger.info("Получен пустой ответ, завершаем загрузку")
             break
+        
+        total += page_count
+        logger.info(f"Загружено {page_count} записей, всего: {total}")
+        
+        if last_rrd_id <= rrd_id:
+            # Если ID не увеличился, прерываем цикл
+            logger.info("ID последней записи не изменился, завершаем загрузку")
+            break
+        
+        # Получаем ID последней записи для следующего запроса
+        rrd_id = last_rrd_id
+        if checkpoint:
+            checkpoint.save(checkpoint_key, {'rrd_id': rrd_id})
+    
+    if checkpoint:
+        checkpoint.clear(checkpoint_key)
+    logger.info(f"Загрузка финансовых деталей завершена. Всего записей: {total}")
+
+
+def get_financial_details_api(start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    Получает финансовые детали из API Wildberries с пагинацией.
+    
+    Args:
+        start_date (str): Начальная дата в формате 'YYYY-MM-DD'
+        end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+    
+    Returns:
+        List[Dict[str, Any]]: Список финансовых деталей
+    """
+    all_details = []
+    
+    try:
+        for chunk in iter_financial_details_chunks(start_date, end_date):
+            all_details.extend(chunk)
+    except Exception as e:
+        logger.error(f"Ошибка при получении финансовых деталей: {e}")
     
-    logger.info(f"Загрузка финансовых деталей завершена. Всего записей: {len(all_details)}")
     return all_details
 
 
@@ -659,13 +959,20 @@ def load_transactions_to_db(transactions_list: List[Dict[str, Any]]) -> None:
         connection.close()
 
 
-def import_sales(start_date: str, end_date: str) -> None:
+def import_sales(start_date: str, end_date: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                 checkpoint_file: Optional[str] = DEFAULT_STREAM_CHECKPOINT_FILE) -> None:
     """
     Полный цикл импорта продаж: получение из API, преобразование и загрузка в БД.
     
+    Ответ API обрабатывается потоком: каждая порция сразу преобразуется и
+    загружается, поэтому память не зависит от длины периода. Прерванный
+    импорт продолжается со страницы из чекпоинта.
+    
     Args:
         start_date (str): Начальная дата в формате 'YYYY-MM-DD'
         end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+        chunk_size (int): Размер порции загрузки
+        checkpoint_file (str, optional): Файл чекпоинта (None - без чекпоинта)
     """
     logger.info(f"=== Начинаем импорт продаж WB с {start_date} по {end_date} ===")
     
@@ -677,17 +984,21 @@ def import_sales(start_date: str, end_date: str) -> None:
         if not client_id or not source_id:
             raise ValueError("Не удалось получить client_id или source_id")
         
-        # Получаем продажи из API (сырые данные уже сохраняются в raw_events)
-        sales = get_sales_from_api(start_date, end_date)
-        
-        # Преобразуем каждую продажу и собираем все записи
-        all_orders = []
-        for sale in sales:
-            orders = transform_sale_data(sale, client_id, source_id)
-            all_orders.extend(orders)
-        
-        # Загружаем в базу данных
-        load_orders_to_db(all_orders)
+        # Получаем продажи из API порциями (сырые данные уже сохраняются в raw_events)
+        checkpoint = WbStreamCheckpoint(checkpoint_file)
+        for sales in iter_sales_chunks(start_date, end_date, chunk_size, checkpoint):
+            # Товары всей порции разрешаются на одном подключении, затем порция
+            # преобразуется и сразу загружается в базу данных
+            connection = connect_to_db()
+            try:
+                products = resolve_sale_products(sales, connection)
+            finally:
+                connection.close()
+            
+            orders = []
+            for sale in sales:
+                orders.extend(transform_sale_data(sale, client_id, source_id, products))
+            load_orders_to_db(orders)
         
         logger.info("=== Импорт продаж WB завершен успешно ===")
         
@@ -696,13 +1007,19 @@ def import_sales(start_date: str, end_date: str) -> None:
         raise
 
 
-def import_financial_details(start_date: str, end_date: str) -> None:
+def import_financial_details(start_date: str, end_date: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                             checkpoint_file: Optional[str] = DEFAULT_STREAM_CHECKPOINT_FILE) -> None:
     """
     Полный цикл импорта финансовых деталей: получение из API, преобразование и загрузка в БД.
     
+    Ответ API обрабатывается потоком порциями, позиция rrdid сохраняется
+    в чекпоинт после каждой страницы.
+    
     Args:
         start_date (str): Начальная дата в формате 'YYYY-MM-DD'
         end_date (str): Конечная дата в формате 'YYYY-MM-DD'
+        chunk_size (int): Размер порции загрузки
+        checkpoint_file (str, optional): Файл чекпоинта (None - без чекпоинта)
     """
     logger.info(f"=== Начинаем импорт финансовых деталей WB с {start_date} по {end_date} ===")
     
@@ -714,17 +1031,14 @@ def import_financial_details(start_date: str, end_date: str) -> None:
         if not client_id or not source_id:
             raise ValueError("Не удалось получить client_id или source_id")
         
-        # Получаем финансовые детали из API (сырые данные уже сохраняются в raw_events)
-        financial_details = get_financial_details_api(start_date, end_date)
-        
-        # Преобразуем каждую запись и собираем все транзакции
-        all_transactions = []
-        for detail in financial_details:
-            transactions = transform_finance_data(detail, client_id, source_id)
-            all_transactions.extend(transactions)
-        
-        # Загружаем в базу данных
-        load_transactions_to_db(all_transactions)
+        # Получаем финансовые детали из API порциями (сырые данные уже сохраняются в raw_events)
+        checkpoint = WbStreamCheckpoint(checkpoint_file)
+        for details in iter_financial_details_chunks(start_date, end_date, chunk_size, checkpoint):
+            # Преобразуем порцию и сразу загружаем в базу данных
+            transactions = []
+            for detail in details:
+                transactions.extend(transform_finance_data(detail, client_id, source_id))
+            load_transactions_to_db(transactions)
         
         logger.info("=== Импорт финансовых деталей WB завершен успешно ===")
         
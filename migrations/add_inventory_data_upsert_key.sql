@@ -0,0 +1,22 @@
+-- Migration: Add unique key for inventory_data bulk upserts (PostgreSQL)
+-- Description: InventoryBulkWriter (src/ETL/inventory_bulk_writer.py) merges staged rows with
+--              INSERT ... ON CONFLICT (product_id, sku, warehouse_name, stock_type, source),
+--              which requires a unique index on exactly these columns.
+--              Existing duplicates are removed first, keeping the most recently synced row.
+-- Date: 2026-10-16
+
+BEGIN;
+
+DELETE FROM inventory_data a
+USING inventory_data b
+WHERE a.product_id = b.product_id
+  AND a.sku IS NOT DISTINCT FROM b.sku
+  AND a.warehouse_name IS NOT DISTINCT FROM b.warehouse_name
+  AND a.stock_type IS NOT DISTINCT FROM b.stock_type
+  AND a.source IS NOT DISTINCT FROM b.source
+  AND (COALESCE(a.last_sync_at, '-infinity'), a.ctid) < (COALESCE(b.last_sync_at, '-infinity'), b.ctid);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_inventory_data_upsert_key
+ON inventory_data (product_id, sku, warehouse_name, stock_type, source);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Migration: Add indexes for cost-change driven margin recalculation
+-- Description: Speeds up recalculate_historical_margins.py --cost-changed
+--              (products changed since the watermark -> order dates of those products)
+-- Date: 2026-10-16
+
+ALTER TABLE dim_products
+ADD INDEX idx_dim_products_updated_at (updated_at);
+
+ALTER TABLE fact_orders
+ADD INDEX idx_fo_product_order_date (product_id, order_date);
@@ -0,0 +1,12 @@
+-- Migration: Add indexes for incremental metrics_daily aggregation
+-- Description: Speeds up dirty-date detection in run_aggregation.py
+--              (late-arriving fact_orders / fact_transactions rows since the last run)
+-- Date: 2026-10-16
+
+ALTER TABLE fact_orders
+ADD INDEX idx_fo_updated_at_order_date (updated_at, order_date),
+ADD INDEX idx_fo_order_date_client (order_date, client_id);
+
+ALTER TABLE fact_transactions
+ADD INDEX idx_ft_created_at_transaction_date (created_at, transaction_date),
+ADD INDEX idx_ft_client_transaction_date (client_id, transaction_date);
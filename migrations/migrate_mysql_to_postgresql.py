@@ -5,20 +5,28 @@ For mi_core_etl project
 
 This script migrates data from MySQL to PostgreSQL with integrity checks
 and validation at each step.
+
+Rows are streamed from MySQL and loaded with PostgreSQL COPY. Tables whose
+foreign-key dependencies are already migrated run in parallel, large tables
+resume from a checkpoint file, and data is verified with chunked, parallel
+hash comparison.
 """
 
 import os
+import io
 import sys
+import copy
 import json
 import logging
 import hashlib
-from datetime import datetime
-from typing import Dict, List, Tuple, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, date, time, timezone
+from typing import Dict, List, Set, Tuple, Any, Optional, Callable
 from dataclasses import dataclass
 
 import mysql.connector
 import psycopg2
-import psycopg2.extras
 from mysql.connector import Error as MySQLError
 from psycopg2 import Error as PostgreSQLError
 
@@ -33,6 +41,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Escaping for the PostgreSQL COPY text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_NULL = '\\N'
+
+def format_copy_value(value: Any) -> str:
+    """Format a Python value as a field of the COPY text format"""
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (bytes, bytearray)):
+        return '\\\\x' + bytes(value).hex()
+    if isinstance(value, datetime):
+        # MySQL returns naive values, TIMESTAMPTZ columns aware ones: compare both as naive UTC
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        text = value.isoformat(sep=' ')
+    elif isinstance(value, (date, time)):
+        text = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value, ensure_ascii=False)
+    else:
+        text = str(value)
+    return text.translate(COPY_ESCAPES)
+
 @dataclass
 class DatabaseConfig:
     """Database configuration"""
@@ -61,16 +94,71 @@ class MigrationStats:
             len(self.errors) == 0
         )
 
+class MigrationCheckpoint:
+    """Per-table migration progress persisted to a JSON file"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state: Dict[str, Dict[str, Any]] = {}
+        
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._state = json.load(f)
+                logger.info(f"Loaded migration checkpoint from {path} ({len(self._state)} tables)")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable checkpoint file {path}: {e}")
+    
+    def get(self, table_name: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._state.get(table_name, {}))
+    
+    def update(self, table_name: str, **fields):
+        with self._lock:
+            self._state.setdefault(table_name, {}).update(fields)
+            self._save()
+    
+    def reset(self, table_name: str):
+        with self._lock:
+            if self._state.pop(table_name, None) is not None:
+                self._save()
+    
+    def clear(self):
+        with self._lock:
+            self._state = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+    
+    def _save(self):
+        # Write to a temporary file first so an interrupted run never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
+
 class DatabaseMigrator:
     """Main migration class"""
     
-    def __init__(self, mysql_config: DatabaseConfig, postgresql_config: DatabaseConfig):
+    def __init__(self, mysql_config: DatabaseConfig, postgresql_config: DatabaseConfig,
+                 max_workers: int = 4, copy_batch_size: int = 50000,
+                 checksum_chunk_size: int = 100000, checksum_workers: int = 4,
+                 checkpoint_file: str = 'migration_checkpoint.json'):
         self.mysql_config = mysql_config
         self.postgresql_config = postgresql_config
         self.mysql_conn = None
         self.postgresql_conn = None
         self.migration_stats: Dict[str, MigrationStats] = {}
         
+        # Parallelism and batching
+        self.max_workers = max(1, max_workers)
+        self.copy_batch_size = copy_batch_size
+        self.checksum_chunk_size = checksum_chunk_size
+        self.checksum_workers = max(1, checksum_workers)
+        
+        # Progress of large tables, so an interrupted migration can resume
+        self.checkpoints = MigrationCheckpoint(checkpoint_file)
+        
         # Table migration order (respecting foreign key dependencies)
         self.table_order = [
             'clients',
@@ -127,31 +215,42 @@ class DatabaseMigrator:
             }
         }
 
+    def _open_mysql_connection(self):
+        """Open a new MySQL connection"""
+        return mysql.connector.connect(
+            host=self.mysql_config.host,
+            port=self.mysql_config.port,
+            database=self.mysql_config.database,
+            user=self.mysql_config.user,
+            password=self.mysql_config.password,
+            charset='utf8mb4',
+            use_unicode=True
+        )
+
+    def _open_postgresql_connection(self):
+        """Open a new PostgreSQL connection"""
+        conn = psycopg2.connect(
+            host=self.postgresql_config.host,
+            port=self.postgresql_config.port,
+            database=self.postgresql_config.database,
+            user=self.postgresql_config.user,
+            password=self.postgresql_config.password,
+            # Naive MySQL datetimes are loaded and read back as UTC
+            options='-c TimeZone=UTC'
+        )
+        conn.set_client_encoding('UTF8')
+        return conn
+
     def connect_databases(self) -> bool:
         """Establish connections to both databases"""
         try:
             # Connect to MySQL
             logger.info("Connecting to MySQL database...")
-            self.mysql_conn = mysql.connector.connect(
-                host=self.mysql_config.host,
-                port=self.mysql_config.port,
-                database=self.mysql_config.database,
-                user=self.mysql_config.user,
-                password=self.mysql_config.password,
-                charset='utf8mb4',
-                use_unicode=True
-            )
+            self.mysql_conn = self._open_mysql_connection()
             
             # Connect to PostgreSQL
             logger.info("Connecting to PostgreSQL database...")
-            self.postgresql_conn = psycopg2.connect(
-                host=self.postgresql_config.host,
-                port=self.postgresql_config.port,
-                database=self.postgresql_config.database,
-                user=self.postgresql_config.user,
-                password=self.postgresql_config.password
-            )
-            self.postgresql_conn.set_client_encoding('UTF8')
+            self.postgresql_conn = self._open_postgresql_connection()
             
             logger.info("Database connections established successfully")
             return True
@@ -216,27 +315,167 @@ class DatabaseMigrator:
             logger.error(f"Error getting count for {table_name} in {database}: {e}")
             return 0
 
-    def calculate_table_checksum(self, table_name: str, database: str) -> str:
-        """Calculate checksum for table data"""
+    def _get_table_columns(self, table_name: str) -> List[str]:
+        """Columns present in both databases, in PostgreSQL ordinal order"""
+        mysql_cursor = self.mysql_conn.cursor()
+        mysql_cursor.execute(f"SELECT * FROM {table_name} LIMIT 0")
+        mysql_columns = set(mysql_cursor.column_names)
+        mysql_cursor.fetchall()
+        mysql_cursor.close()
+        
+        postgresql_cursor = self.postgresql_conn.cursor()
+        postgresql_cursor.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = %s AND table_schema = 'public'
+            ORDER BY ordinal_position
+        """, (table_name,))
+        pg_columns = [row[0] for row in postgresql_cursor.fetchall()]
+        postgresql_cursor.close()
+        
+        return [column for column in pg_columns if column in mysql_columns]
+
+    def _get_json_columns(self, table_name: str) -> Set[str]:
+        """JSON columns of a PostgreSQL table (compared by value, not by text)"""
+        cursor = self.postgresql_conn.cursor()
+        cursor.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = %s AND table_schema = 'public' AND data_type IN ('json', 'jsonb')
+        """, (table_name,))
+        json_columns = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return json_columns
+
+    def _get_row_converters(self, table_name: str, columns: List[str]) -> List[Tuple[int, Callable]]:
+        """Column converters for a table as (column index, converter) pairs"""
+        mappings = self.column_mappings.get(table_name, {})
+        return [(index, mappings[column]) for index, column in enumerate(columns) if column in mappings]
+
+    def _get_key_range(self, table_name: str) -> Optional[Tuple[int, int]]:
+        """Combined id range of a table in both databases"""
+        bounds = []
+        for conn in (self.mysql_conn, self.postgresql_conn):
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table_name}")
+            row = cursor.fetchone()
+            cursor.close()
+            if row and row[0] is not None:
+                bounds.append(row)
+        
+        if not bounds:
+            return None
+        return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+    def _checksum_ranges(self, database: str, table_name: str, columns: List[str],
+                         ranges: List[Optional[Tuple[int, int]]],
+                         json_columns: Set[str]) -> Dict[Optional[Tuple[int, int]], str]:
+        """Hash id ranges of a table using a dedicated connection"""
+        conn = self._open_mysql_connection() if database == 'mysql' else self._open_postgresql_connection()
+        converters = self._get_row_converters(table_name, columns) if database == 'mysql' else []
+        json_indexes = [index for index, column in enumerate(columns) if column in json_columns]
+        column_list = ', '.join(columns)
+        results = {}
+        
         try:
-            if database == 'mysql':
-                cursor = self.mysql_conn.cursor()
-                cursor.execute(f"SELECT * FROM {table_name} ORDER BY id")
-                rows = cursor.fetchall()
-                cursor.close()
-            else:  # postgresql
-                cursor = self.postgresql_conn.cursor()
-                cursor.execute(f"SELECT * FROM {table_name} ORDER BY id")
-                rows = cursor.fetchall()
+            for key_range in ranges:
+                cursor = conn.cursor()
+                if key_range is None:
+                    cursor.execute(f"SELECT {column_list} FROM {table_name}")
+                else:
+                    cursor.execute(
+                        f"SELECT {column_list} FROM {table_name} WHERE id BETWEEN %s AND %s",
+                        key_range
+                    )
+                
+                # Order-independent digest: sum of per-row hashes, so no ORDER BY is needed
+                digest = 0
+                row_count = 0
+                while True:
+                    rows = cursor.fetchmany(self.copy_batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        row = list(row)
+                        for index, converter in converters:
+                            if row[index] is not None:
+                                row[index] = converter(row[index])
+                        for index in json_indexes:
+                            value = row[index]
+                            if isinstance(value, (bytes, bytearray)):
+                                value = value.decode('utf-8')
+                            if isinstance(value, str):
+                                value = json.loads(value)
+                            if value is not None:
+                                row[index] = json.dumps(value, sort_keys=True, ensure_ascii=False)
+                        # Booleans are TINYINT in MySQL
+                        row_text = '\t'.join(
+                            format_copy_value(int(value) if isinstance(value, bool) else value)
+                            for value in row
+                        )
+                        digest = (digest + int(hashlib.md5(row_text.encode('utf-8')).hexdigest(), 16)) % (1 << 128)
+                        row_count += 1
                 cursor.close()
+                
+                results[key_range] = f"{digest:032x}:{row_count}"
+        finally:
+            conn.close()
+        
+        return results
+
+    def compare_table_checksums(self, table_name: str, columns: List[str]) -> Tuple[str, str, List[str]]:
+        """
+        Compare table data in both databases chunk by chunk.
+        
+        The id range is split into chunks of checksum_chunk_size ids; chunks are
+        hashed in parallel on both sides with dedicated connections.
+        
+        Returns:
+            Source checksum, target checksum and the list of mismatching id ranges
+        """
+        try:
+            ranges: List[Optional[Tuple[int, int]]]
+            if 'id' in columns:
+                key_range = self._get_key_range(table_name)
+                if key_range is None:
+                    return "", "", []
+                low, high = key_range
+                ranges = [
+                    (start, min(start + self.checksum_chunk_size - 1, high))
+                    for start in range(low, high + 1, self.checksum_chunk_size)
+                ]
+            else:
+                ranges = [None]
+            
+            json_columns = self._get_json_columns(table_name)
+            
+            # Distribute chunks between workers; each worker keeps one connection per database
+            workers = min(self.checksum_workers, len(ranges))
+            chunk_groups = [ranges[i::workers] for i in range(workers)]
+            
+            digests = {'mysql': {}, 'postgresql': {}}
+            with ThreadPoolExecutor(max_workers=workers * 2) as executor:
+                futures = {
+                    executor.submit(self._checksum_ranges, database, table_name, columns, group, json_columns): database
+                    for database in digests
+                    for group in chunk_groups
+                }
+                for future in futures:
+                    digests[futures[future]].update(future.result())
             
-            # Create checksum from all data
-            data_str = json.dumps(rows, default=str, sort_keys=True)
-            return hashlib.md5(data_str.encode()).hexdigest()
+            mismatches = [
+                f"{key_range[0]}-{key_range[1]}" if key_range else "all rows"
+                for key_range in ranges
+                if digests['mysql'][key_range] != digests['postgresql'][key_range]
+            ]
+            
+            source_checksum = hashlib.md5('|'.join(digests['mysql'][r] for r in ranges).encode()).hexdigest()
+            target_checksum = hashlib.md5('|'.join(digests['postgresql'][r] for r in ranges).encode()).hexdigest()
+            return source_checksum, target_checksum, mismatches
             
         except Exception as e:
-            logger.error(f"Error calculating checksum for {table_name} in {database}: {e}")
-            return ""
+            logger.error(f"Error comparing checksums for {table_name}: {e}")
+            return "", "error", []
 
     def _convert_enum_status(self, value: str) -> str:
         """Convert MySQL enum status to PostgreSQL"""
@@ -270,6 +509,100 @@ class DatabaseMigrator:
         """Convert fastener type enum"""
         return value  # Direct mapping
 
+    def _copy_table_data(self, table_name: str, columns: List[str],
+                         last_id: Optional[Any], migrated_count: int,
+                         errors: List[str]) -> int:
+        """
+        Stream rows from MySQL into PostgreSQL COPY.
+        
+        Rows are read with an unbuffered cursor, so the result set is streamed
+        from the server instead of being loaded into memory. Every batch is
+        written to an in-memory buffer in COPY text format and committed; for
+        tables with an id column the last copied id is checkpointed.
+        """
+        column_list = ', '.join(columns)
+        key_index = columns.index('id') if 'id' in columns else None
+        converters = self._get_row_converters(table_name, columns)
+        
+        query = f"SELECT {column_list} FROM {table_name}"
+        params: Tuple = ()
+        if key_index is not None:
+            if last_id is not None:
+                query += " WHERE id > %s"
+                params = (last_id,)
+            query += " ORDER BY id"
+        
+        mysql_cursor = self.mysql_conn.cursor(buffered=False)
+        postgresql_cursor = self.postgresql_conn.cursor()
+        mysql_cursor.execute(query, params)
+        
+        batch_count = 0
+        try:
+            while True:
+                rows = mysql_cursor.fetchmany(self.copy_batch_size)
+                if not rows:
+                    break
+                
+                batch_count += 1
+                
+                buffer = io.StringIO()
+                for row in rows:
+                    if converters:
+                        row = list(row)
+                        for index, converter in converters:
+                            if row[index] is not None:
+                                row[index] = converter(row[index])
+                    buffer.write('\t'.join(map(format_copy_value, row)))
+                    buffer.write('\n')
+                buffer.seek(0)
+                
+                try:
+                    postgresql_cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN", buffer)
+                    self.postgresql_conn.commit()
+                except PostgreSQLError as e:
+                    error_msg = f"Error copying batch {batch_count} into {table_name}: {e}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+                    self.postgresql_conn.rollback()
+                    # Stop here: the checkpoint still points at the last committed batch
+                    break
+                
+                migrated_count += len(rows)
+                if key_index is not None:
+                    self.checkpoints.update(
+                        table_name,
+                        status='in_progress',
+                        last_id=rows[-1][key_index],
+                        migrated_count=migrated_count
+                    )
+                logger.info(f"Copied batch {batch_count} for {table_name} ({migrated_count} rows total)")
+        finally:
+            # Drain the unbuffered result set so the connection can be reused
+            if mysql_cursor.with_rows:
+                mysql_cursor.fetchall()
+            mysql_cursor.close()
+            postgresql_cursor.close()
+        
+        return migrated_count
+
+    def _reset_sequence(self, table_name: str):
+        """Move the id sequence past the copied ids"""
+        cursor = self.postgresql_conn.cursor()
+        try:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table_name,))
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute(
+                    f"SELECT setval(%s, COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table_name}",
+                    (sequence,)
+                )
+            self.postgresql_conn.commit()
+        except PostgreSQLError as e:
+            logger.warning(f"Could not reset id sequence for {table_name}: {e}")
+            self.postgresql_conn.rollback()
+        finally:
+            cursor.close()
+
     def migrate_table(self, table_name: str) -> MigrationStats:
         """Migrate a single table from MySQL to PostgreSQL"""
         logger.info(f"Starting migration for table: {table_name}")
@@ -321,85 +654,39 @@ class DatabaseMigrator:
                     checksum_target=""
                 )
             
-            # Clear target table
-            postgresql_cursor = self.postgresql_conn.cursor()
-            postgresql_cursor.execute(f"TRUNCATE TABLE {table_name} RESTART IDENTITY CASCADE")
-            self.postgresql_conn.commit()
-            
-            # Get source data
-            mysql_cursor = self.mysql_conn.cursor(dictionary=True)
-            mysql_cursor.execute(f"SELECT * FROM {table_name}")
-            
-            # Get column names from PostgreSQL table
-            postgresql_cursor.execute(f"""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = '{table_name}' AND table_schema = 'public'
-                ORDER BY ordinal_position
-            """)
-            pg_columns = [row[0] for row in postgresql_cursor.fetchall()]
+            columns = self._get_table_columns(table_name)
+            checkpoint = self.checkpoints.get(table_name) if 'id' in columns else {}
             
-            # Migrate data in batches
-            batch_size = 1000
-            batch_count = 0
+            postgresql_cursor = self.postgresql_conn.cursor()
             
-            while True:
-                rows = mysql_cursor.fetchmany(batch_size)
-                if not rows:
-                    break
-                
-                batch_count += 1
-                logger.info(f"Processing batch {batch_count} for {table_name} ({len(rows)} rows)")
-                
-                # Prepare data for PostgreSQL
-                processed_rows = []
-                for row in rows:
-                    processed_row = {}
-                    
-                    # Apply column mappings and conversions
-                    for col_name, value in row.items():
-                        if col_name in pg_columns:
-                            # Apply custom conversions if defined
-                            if (table_name in self.column_mappings and 
-                                col_name in self.column_mappings[table_name]):
-                                converter = self.column_mappings[table_name][col_name]
-                                value = converter(value) if value is not None else None
-                            
-                            processed_row[col_name] = value
-                    
-                    processed_rows.append(processed_row)
+            if checkpoint.get('status') == 'completed':
+                logger.info(f"Table {table_name} already copied according to checkpoint")
+                migrated_count = checkpoint.get('migrated_count', 0)
+            else:
+                last_id = checkpoint.get('last_id')
+                if last_id is not None:
+                    # Resume: drop rows committed after the last checkpoint
+                    migrated_count = checkpoint.get('migrated_count', 0)
+                    logger.info(f"Resuming {table_name} after id {last_id} ({migrated_count} rows already copied)")
+                    postgresql_cursor.execute(f"DELETE FROM {table_name} WHERE id > %s", (last_id,))
+                else:
+                    # Clear target table
+                    postgresql_cursor.execute(f"TRUNCATE TABLE {table_name} RESTART IDENTITY CASCADE")
+                self.postgresql_conn.commit()
                 
-                # Insert batch into PostgreSQL
-                if processed_rows:
-                    try:
-                        # Build insert query
-                        columns = list(processed_rows[0].keys())
-                        placeholders = ', '.join(['%s'] * len(columns))
-                        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-                        
-                        # Prepare values
-                        values = []
-                        for row in processed_rows:
-                            values.append([row[col] for col in columns])
-                        
-                        # Execute batch insert
-                        psycopg2.extras.execute_batch(postgresql_cursor, query, values, page_size=100)
-                        self.postgresql_conn.commit()
-                        migrated_count += len(processed_rows)
-                        
-                    except PostgreSQLError as e:
-                        error_msg = f"Error inserting batch {batch_count} into {table_name}: {e}"
-                        logger.error(error_msg)
-                        errors.append(error_msg)
-                        self.postgresql_conn.rollback()
+                migrated_count = self._copy_table_data(table_name, columns, last_id, migrated_count, errors)
+                if not errors:
+                    self._reset_sequence(table_name)
+                    if 'id' in columns:
+                        self.checkpoints.update(table_name, status='completed', migrated_count=migrated_count)
             
-            mysql_cursor.close()
             postgresql_cursor.close()
             
             # Get final counts and checksums
             target_count = self.get_table_count(table_name, 'postgresql')
-            source_checksum = self.calculate_table_checksum(table_name, 'mysql')
-            target_checksum = self.calculate_table_checksum(table_name, 'postgresql')
+            source_checksum, target_checksum, mismatched_ranges = self.compare_table_checksums(table_name, columns)
+            for key_range in mismatched_ranges:
+                errors.append(f"Checksum mismatch in {table_name} for id range {key_range}")
             
             stats = MigrationStats(
                 table_name=table_name,
@@ -434,14 +721,115 @@ class DatabaseMigrator:
                 checksum_target=""
             )
 
+    def get_table_dependencies(self) -> Dict[str, Set[str]]:
+        """
+        Foreign-key dependencies between migrated tables.
+        
+        Falls back to the sequential table_order if constraints cannot be read.
+        """
+        tables = set(self.table_order)
+        dependencies = {table: set() for table in self.table_order}
+        
+        try:
+            cursor = self.postgresql_conn.cursor()
+            cursor.execute("""
+                SELECT DISTINCT tc.table_name, ccu.table_name
+                FROM information_schema.table_constraints tc
+                JOIN information_schema.constraint_column_usage ccu
+                    ON tc.constraint_name = ccu.constraint_name
+                    AND tc.table_schema = ccu.table_schema
+                WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = 'public'
+            """)
+            for table_name, referenced_table in cursor.fetchall():
+                if table_name in tables and referenced_table in tables and table_name != referenced_table:
+                    dependencies[table_name].add(referenced_table)
+            cursor.close()
+        except PostgreSQLError as e:
+            logger.warning(f"Could not read foreign keys, migrating tables sequentially: {e}")
+            self.postgresql_conn.rollback()
+            for previous, table_name in zip(self.table_order, self.table_order[1:]):
+                dependencies[table_name].add(previous)
+        
+        return dependencies
+
+    def _invalidate_dependent_checkpoints(self, dependencies: Dict[str, Set[str]]):
+        """
+        Restart tables that reference a table being reloaded from scratch.
+        
+        TRUNCATE ... CASCADE on the referenced table also empties them, so their
+        checkpoints are no longer valid.
+        """
+        fresh = {table for table in self.table_order if not self.checkpoints.get(table)}
+        changed = True
+        while changed:
+            changed = False
+            for table_name, table_dependencies in dependencies.items():
+                if table_name not in fresh and table_dependencies & fresh:
+                    logger.info(f"Restarting {table_name}: a referenced table is reloaded from scratch")
+                    self.checkpoints.reset(table_name)
+                    fresh.add(table_name)
+                    changed = True
+
+    def _migrate_table_in_worker(self, table_name: str) -> MigrationStats:
+        """Migrate a table with dedicated connections (runs in a worker thread)"""
+        worker = copy.copy(self)
+        worker.mysql_conn = self._open_mysql_connection()
+        worker.postgresql_conn = self._open_postgresql_connection()
+        try:
+            return worker.migrate_table(table_name)
+        finally:
+            worker.mysql_conn.close()
+            worker.postgresql_conn.close()
+
     def migrate_all_tables(self) -> Dict[str, MigrationStats]:
-        """Migrate all tables in the correct order"""
-        logger.info("Starting full database migration...")
+        """Migrate all tables, running independent tables in parallel"""
+        logger.info(f"Starting full database migration ({self.max_workers} workers)...")
+        
+        dependencies = self.get_table_dependencies()
+        self._invalidate_dependent_checkpoints(dependencies)
         
-        for table_name in self.table_order:
-            stats = self.migrate_table(table_name)
-            self.migration_stats[table_name] = stats
+        if self.max_workers == 1:
+            for table_name in self.table_order:
+                stats = self.migrate_table(table_name)
+                self.migration_stats[table_name] = stats
+            return self.migration_stats
         
+        pending = list(self.table_order)
+        finished: Set[str] = set()
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Start every table whose referenced tables are already migrated
+                for table_name in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if dependencies[table_name] <= finished:
+                        pending.remove(table_name)
+                        running[executor.submit(self._migrate_table_in_worker, table_name)] = table_name
+                
+                if not running:
+                    # Circular references: fall back to the configured order
+                    table_name = pending.pop(0)
+                    logger.warning(f"Unresolved dependencies for {table_name}, migrating it anyway")
+                    running[executor.submit(self._migrate_table_in_worker, table_name)] = table_name
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    table_name = running.pop(future)
+                    try:
+                        stats = future.result()
+                    except Exception as e:
+                        error_msg = f"Unexpected error migrating {table_name}: {e}"
+                        logger.error(error_msg)
+                        stats = MigrationStats(table_name, 0, 0, 0, [error_msg], "", "")
+                    self.migration_stats[table_name] = stats
+                    finished.add(table_name)
+        
+        # Keep the report in migration order
+        self.migration_stats = {
+            table_name: self.migration_stats[table_name] for table_name in self.table_order
+        }
         return self.migration_stats
 
     def generate_migration_report(self) -> str:
@@ -532,7 +920,13 @@ def main():
         mysql_config, postgresql_config = load_config_from_env()
         
         # Create migrator
-        migrator = DatabaseMigrator(mysql_config, postgresql_config)
+        migrator = DatabaseMigrator(
+            mysql_config,
+            postgresql_config,
+            max_workers=int(os.getenv('MIGRATION_WORKERS', '4')),
+            copy_batch_size=int(os.getenv('MIGRATION_BATCH_SIZE', '50000')),
+            checkpoint_file=os.getenv('MIGRATION_CHECKPOINT_FILE', 'migration_checkpoint.json')
+        )
         
         # Connect to databases
         if not migrator.connect_databases():
@@ -559,6 +953,10 @@ def main():
         # Close connections
         migrator.close_connections()
         
+        # A successful run starts from scratch next time
+        if is_valid:
+            migrator.checkpoints.clear()
+        
         logger.info(f"Migration completed. Report saved to: {report_filename}")
         return is_valid
         
@@ -0,0 +1,4 @@
+-- Rollback: Remove unique key for inventory_data bulk upserts (PostgreSQL)
+-- Date: 2026-10-16
+
+DROP INDEX IF EXISTS uq_inventory_data_upsert_key;
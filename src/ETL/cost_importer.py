@@ -4,7 +4,9 @@
 Функционал:
 - Поиск файла cost_price.xlsx в папке uploads/
 - Чтение данных из Excel (колонки: barcode, cost_price)
-- Обновление таблицы dim_products по штрихкоду
+- Обновление таблицы dim_products по штрихкоду (сопоставление в pandas,
+  запись пакетными запросами)
+- Сводка изменений цен
 - Архивация обработанных файлов с датой
 - Полное логирование процесса
 
@@ -42,6 +44,12 @@ ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
 COST_FILE_NAME = "cost_price.xlsx"
 EXPECTED_COLUMNS = ['баркод', 'артикул', 'СС без НДС']
 
+# Строк в одном пакетном INSERT
+BULK_BATCH_SIZE = 5000
+
+# Сколько самых крупных изменений цены показывать в логе
+PRICE_DIFF_TOP = 10
+
 
 def ensure_directories():
     """Создает необходимые директории если их нет."""
@@ -168,11 +176,145 @@ def read_cost_file(file_path: str) -> Optional[pd.DataFrame]:
         return None
 
 
+def _clean_key(series: pd.Series) -> pd.Series:
+    """Нормализует идентификатор: строка без пробелов по краям, пустые значения -> NA."""
+    cleaned = series.astype('string').str.strip()
+    return cleaned.mask(cleaned.isin(['', 'nan', 'None']))
+
+
+def load_product_keys(cursor) -> pd.DataFrame:
+    """
+    Читает ключи и себестоимость всех товаров dim_products одним запросом.
+    
+    Returns:
+        pd.DataFrame: id, barcode, sku_ozon, sku_wb, cost_price
+    """
+    cursor.execute("SELECT id, barcode, sku_ozon, sku_wb, cost_price FROM dim_products ORDER BY id")
+    products = pd.DataFrame(cursor.fetchall(), columns=['id', 'barcode', 'sku_ozon', 'sku_wb', 'cost_price'])
+    products['cost_price'] = pd.to_numeric(products['cost_price'], errors='coerce')
+    return products
+
+
+def match_cost_rows(df: pd.DataFrame, products: pd.DataFrame) -> pd.DataFrame:
+    """
+    Сопоставляет строки файла с товарами: сначала по штрихкоду, затем по артикулу
+    (sku_ozon или sku_wb). Сравнение без учета регистра, как в MySQL.
+    
+    Повторы штрихкода в файле схлопываются: цена берется из последней строки,
+    артикул - из первой (как при построчной обработке, где первая строка
+    создает товар, а следующие его обновляют).
+    
+    Returns:
+        pd.DataFrame: barcode, article, cost_price, rows, last_row, product_id, matched_by
+            (last_row: позиция последней строки штрихкода в файле;
+            matched_by: 'barcode', 'article' или None для новых товаров)
+    """
+    price_col = 'СС без НДС'
+    rows = pd.DataFrame({
+        'barcode': _clean_key(df['баркод']) if 'баркод' in df.columns else pd.NA,
+        'article': _clean_key(df['артикул']) if 'артикул' in df.columns else pd.NA,
+        'cost_price': df[price_col].astype(float).round(2)
+    })
+    rows['position'] = range(len(rows))
+    rows = rows.dropna(subset=['barcode'])
+    rows['barcode_key'] = rows['barcode'].str.lower()
+    
+    grouped = rows.groupby('barcode_key', sort=False).agg(
+        barcode=('barcode', 'first'),
+        article=('article', 'first'),
+        cost_price=('cost_price', 'last'),
+        rows=('cost_price', 'size'),
+        last_row=('position', 'last')
+    ).reset_index()
+    
+    # Индексы ключей: при нескольких товарах с одним ключом берется меньший id
+    by_barcode = (products.assign(key=_clean_key(products['barcode']).str.lower())
+                  .dropna(subset=['key']).drop_duplicates('key')[['key', 'id']])
+    by_article = (pd.concat([
+        products.assign(key=_clean_key(products['sku_ozon']).str.lower())[['key', 'id']],
+        products.assign(key=_clean_key(products['sku_wb']).str.lower())[['key', 'id']]
+    ]).dropna(subset=['key']).sort_values('id', kind='stable').drop_duplicates('key'))
+    
+    matched = grouped.merge(by_barcode.rename(columns={'key': 'barcode_key', 'id': 'barcode_id'}),
+                            on='barcode_key', how='left')
+    matched['article_key'] = matched['article'].str.lower()
+    matched = matched.merge(by_article.rename(columns={'key': 'article_key', 'id': 'article_id'}),
+                            on='article_key', how='left')
+    
+    matched['product_id'] = matched['barcode_id'].fillna(matched['article_id'])
+    matched['matched_by'] = None
+    matched.loc[matched['article_id'].notna(), 'matched_by'] = 'article'
+    matched.loc[matched['barcode_id'].notna(), 'matched_by'] = 'barcode'
+    
+    return matched[['barcode', 'article', 'cost_price', 'rows', 'last_row', 'product_id', 'matched_by']]
+
+
+def collapse_new_products(new_products: pd.DataFrame) -> pd.DataFrame:
+    """
+    Схлопывает новые товары с общим артикулом в один (sku_ozon уникален).
+    
+    При построчной обработке первая строка создавала товар, а следующие
+    находили его по артикулу и переписывали штрихкод и цену. Поэтому
+    артикул берется из первой группы, штрихкод и цена - из группы
+    с последней строкой в файле. Товары без артикула не схлопываются.
+    
+    Args:
+        new_products: Несопоставленные строки match_cost_rows
+        
+    Returns:
+        pd.DataFrame: barcode, article, cost_price - по строке на создаваемый товар
+    """
+    article_key = new_products['article'].str.lower()
+    without_article = new_products[article_key.isna()]
+    with_article = new_products[article_key.notna()].assign(article_key=article_key)
+    
+    groups = with_article.groupby('article_key', sort=False)
+    latest = with_article.loc[groups['last_row'].idxmax()]
+    latest = latest.assign(article=latest['article_key'].map(groups['article'].first()))
+    
+    return pd.concat([without_article, latest])[['barcode', 'article', 'cost_price']]
+
+
+def log_price_changes(changes: pd.DataFrame, top: int = PRICE_DIFF_TOP):
+    """
+    Выводит компактную сводку изменений себестоимости.
+    
+    Args:
+        changes: product_id, barcode, old_price, cost_price
+        top: Сколько самых крупных изменений показать
+    """
+    if changes.empty:
+        logger.info("💰 Себестоимость существующих товаров не изменилась")
+        return
+    
+    delta = changes['cost_price'] - changes['old_price']
+    known = changes['old_price'].notna() & (changes['old_price'] > 0)
+    logger.info(
+        f"💰 Изменена себестоимость {len(changes)} товаров: "
+        f"📈 выросла {int((delta > 0).sum())}, 📉 снизилась {int((delta < 0).sum())}, "
+        f"🆕 задана впервые {int(changes['old_price'].isna().sum())}"
+    )
+    
+    if known.any():
+        percent = delta[known] / changes.loc[known, 'old_price'] * 100
+        logger.info(f"   Среднее изменение: {percent.mean():+.1f}%, медиана: {percent.median():+.1f}%")
+        
+        largest = changes[known].assign(percent=percent).reindex(percent.abs().sort_values(ascending=False).index)
+        for item in largest.head(top).itertuples():
+            logger.info(f"   {item.barcode} (ID: {int(item.product_id)}): "
+                        f"{item.old_price:.2f} → {item.cost_price:.2f} ({item.percent:+.1f}%)")
+
+
 def update_product_costs(df: pd.DataFrame) -> Tuple[int, int, int]:
     """
     Обновляет/создает товары в справочнике dim_products с UPSERT логикой.
     Основной ключ - штрихкод (barcode). Если товар найден - обновляет, если нет - создает.
     
+    Ключи dim_products читаются один раз, сопоставление выполняется в pandas,
+    обновления применяются одним UPDATE ... JOIN по временной таблице,
+    новые товары - пакетным INSERT. Товары, у которых цена и штрихкод
+    не изменились, не переписываются (updated_at не сдвигается).
+    
     Args:
         df: DataFrame с данными (артикул, баркод, СС без НДС)
         
@@ -181,106 +323,91 @@ def update_product_costs(df: pd.DataFrame) -> Tuple[int, int, int]:
     """
     connection = None
     cursor = None
-    updated_count = 0
-    created_count = 0
-    error_count = 0
-    
-    # Определяем доступные колонки
-    has_barcode = 'баркод' in df.columns
-    has_article = 'артикул' in df.columns
-    price_col = 'СС без НДС'
     
     try:
         # Подключаемся к базе данных
         connection = connect_to_db()
-        cursor = connection.cursor(dictionary=True)
+        cursor = connection.cursor()
         
         logger.info(f"🔄 Начинаем UPSERT обработку для {len(df)} товаров")
         
-        # Обрабатываем каждую строку
-        for index, row in df.iterrows():
-            cost_price = row[price_col]
-            barcode = str(row['баркод']).strip() if has_barcode and pd.notna(row['баркод']) else None
-            article = str(row['артикул']).strip() if has_article and pd.notna(row['артикул']) else None
-            
-            # Штрихкод - основной ключ, без него не обрабатываем
-            if not barcode:
-                logger.warning(f"⚠️ Пропускаем строку без штрихкода: артикул={article}")
-                error_count += 1
-                continue
+        products = load_product_keys(cursor)
+        matched = match_cost_rows(df, products)
+        
+        # Штрихкод - основной ключ, строки без него не обрабатываем
+        error_count = len(df) - int(matched['rows'].sum())
+        if error_count:
+            logger.warning(f"⚠️ Пропущено строк без штрихкода: {error_count}")
+        
+        existing = matched[matched['product_id'].notna()].copy()
+        new_products = collapse_new_products(matched[matched['product_id'].isna()])
+        
+        # Несколько строк файла могут указывать на один товар (разные штрихкоды, один артикул):
+        # применяется последняя, как при построчной обработке
+        existing['product_id'] = existing['product_id'].astype(int)
+        existing = existing.drop_duplicates('product_id', keep='last')
+        existing = existing.merge(
+            products[['id', 'barcode', 'cost_price']].rename(
+                columns={'id': 'product_id', 'barcode': 'old_barcode', 'cost_price': 'old_price'}),
+            on='product_id', how='left'
+        )
+        existing['new_barcode'] = existing['barcode'].where(existing['matched_by'] == 'article')
+        
+        price_changed = existing['old_price'].isna() | (existing['old_price'].round(2) != existing['cost_price'])
+        barcode_changed = existing['new_barcode'].notna() & (existing['new_barcode'] != existing['old_barcode'])
+        to_update = existing[price_changed | barcode_changed]
+        
+        if not to_update.empty:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_cost_updates")
+            cursor.execute("""
+                CREATE TEMPORARY TABLE tmp_cost_updates (
+                    product_id INT PRIMARY KEY,
+                    cost_price DECIMAL(10,2) NOT NULL,
+                    barcode VARCHAR(255) NULL
+                )
+            """)
+            update_rows = [
+                (int(item.product_id), float(item.cost_price),
+                 None if pd.isna(item.new_barcode) else str(item.new_barcode))
+                for item in to_update.itertuples(index=False)
+            ]
+            for start in range(0, len(update_rows), BULK_BATCH_SIZE):
+                cursor.executemany(
+                    "INSERT INTO tmp_cost_updates (product_id, cost_price, barcode) VALUES (%s, %s, %s)",
+                    update_rows[start:start + BULK_BATCH_SIZE]
+                )
             
-            try:
-                # Шаг 1: Ищем товар по штрихкоду
-                cursor.execute("SELECT id FROM dim_products WHERE barcode = %s", (barcode,))
-                existing_product = cursor.fetchone()
-                # Очищаем оставшиеся результаты
-                cursor.fetchall()
-                
-                if existing_product:
-                    # Товар найден - обновляем
-                    product_id = existing_product['id']
-                    update_sql = """
-                        UPDATE dim_products 
-                        SET cost_price = %s, 
-                            updated_at = CURRENT_TIMESTAMP 
-                        WHERE id = %s
-                    """
-                    cursor.execute(update_sql, (cost_price, product_id))
-                    updated_count += 1
-                    logger.info(f"✅ Обновлен товар {barcode} (ID: {product_id}): цена={cost_price}, артикул={article}")
-                    
-                else:
-                    # Товар не найден по штрихкоду - ищем по артикулу в sku_ozon или sku_wb
-                    if article:
-                        cursor.execute("""
-                            SELECT id FROM dim_products 
-                            WHERE sku_ozon = %s OR sku_wb = %s
-                        """, (article, article))
-                        existing_by_sku = cursor.fetchone()
-                        # Очищаем оставшиеся результаты
-                        cursor.fetchall()
-                        
-                        if existing_by_sku:
-                            # Товар найден по артикулу - обновляем и добавляем штрихкод
-                            product_id = existing_by_sku['id']
-                            update_sql = """
-                                UPDATE dim_products 
-                                SET cost_price = %s, 
-                                    barcode = %s,
-                                    updated_at = CURRENT_TIMESTAMP 
-                                WHERE id = %s
-                            """
-                            cursor.execute(update_sql, (cost_price, barcode, product_id))
-                            updated_count += 1
-                            logger.info(f"✅ Обновлен товар по артикулу {article} (ID: {product_id}): цена={cost_price}, добавлен штрихкод={barcode}")
-                        else:
-                            # Товар не найден ни по штрихкоду, ни по артикулу - создаем новый
-                            insert_sql = """
-                                INSERT INTO dim_products (barcode, sku_ozon, cost_price, created_at, updated_at)
-                                VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-                            cursor.execute(insert_sql, (barcode, article, cost_price))
-                            new_product_id = cursor.lastrowid
-                            created_count += 1
-                            logger.info(f"🆕 Создан новый товар {barcode} (ID: {new_product_id}): цена={cost_price}, артикул={article}")
-                    else:
-                        # Нет артикула - создаем только с штрихкодом
-                        insert_sql = """
-                            INSERT INTO dim_products (barcode, cost_price, created_at, updated_at)
-                            VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        """
-                        cursor.execute(insert_sql, (barcode, cost_price))
-                        new_product_id = cursor.lastrowid
-                        created_count += 1
-                        logger.info(f"🆕 Создан новый товар {barcode} (ID: {new_product_id}): цена={cost_price}")
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка обработки товара {barcode}: {e}")
-                error_count += 1
+            cursor.execute("""
+                UPDATE dim_products dp
+                JOIN tmp_cost_updates t ON t.product_id = dp.id
+                SET dp.cost_price = t.cost_price,
+                    dp.barcode = COALESCE(t.barcode, dp.barcode),
+                    dp.updated_at = CURRENT_TIMESTAMP
+            """)
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_cost_updates")
+        
+        # Новые товары - пакетный INSERT (без артикула sku_ozon остается NULL).
+        # Штрихкоды с общим артикулом уже схлопнуты в один товар и считаются обновлениями
+        insert_rows = [
+            (str(item.barcode), None if pd.isna(item.article) else str(item.article), float(item.cost_price))
+            for item in new_products.itertuples(index=False)
+        ]
+        for start in range(0, len(insert_rows), BULK_BATCH_SIZE):
+            cursor.executemany("""
+                INSERT INTO dim_products (barcode, sku_ozon, cost_price, created_at, updated_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            """, insert_rows[start:start + BULK_BATCH_SIZE])
         
         # Фиксируем изменения
         connection.commit()
         
+        created_count = len(insert_rows)
+        updated_count = int(matched['rows'].sum()) - created_count
+        matched_by_article = int((existing['matched_by'] == 'article').sum())
+        
+        log_price_changes(existing.loc[price_changed, ['product_id', 'barcode', 'old_price', 'cost_price']])
+        logger.info(f"🔗 Сопоставлено по штрихкоду: {len(existing) - matched_by_article}, "
+                    f"по артикулу: {matched_by_article}, без изменений: {len(existing) - len(to_update)}")
         logger.info(f"✅ UPSERT завершен. Обновлено: {updated_count}, создано: {created_count}, ошибок: {error_count}")
         return updated_count, created_count, error_count
         
@@ -2,6 +2,10 @@
 """
 Импорт данных из мастер таблицы dim_products в локальную таблицу product_master
 Поддерживает импорт из CSV файла, экспортированного из dim_products
+
+Записи нормализуются векторно (pandas), загружаются во временную таблицу
+пакетами и сливаются в product_master одним INSERT ... SELECT. Количество
+новых записей считается одним anti-join по staging-таблице.
 """
 
 import csv
@@ -11,6 +15,7 @@ import os
 import sys
 import time
 import logging
+import pandas as pd
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
@@ -28,6 +33,44 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Маппинг полей (поддерживаем разные варианты названий)
+FIELD_MAPPING = {
+    'master_id': ['id', 'master_id', 'product_id'],
+    'sku_ozon': ['sku_ozon', 'ozon_sku', 'sku'],
+    'sku_wb': ['sku_wb', 'wb_sku', 'wildberries_sku'],
+    'barcode': ['barcode', 'bar_code', 'ean'],
+    'product_name': ['product_name', 'name', 'title', 'product_title'],
+    'name': ['name', 'alternative_name', 'short_name'],
+    'brand': ['brand', 'brand_name', 'manufacturer'],
+    'category': ['category', 'category_name', 'product_category'],
+    'cost_price': ['cost_price', 'price', 'cost'],
+    'created_at': ['created_at', 'created', 'date_created'],
+    'updated_at': ['updated_at', 'updated', 'date_updated', 'last_modified']
+}
+
+# Максимальная длина строковых полей product_master
+MAX_LENGTHS = {
+    'sku_ozon': 255,
+    'sku_wb': 50,
+    'barcode': 255,
+    'product_name': 500,
+    'name': 500,
+    'brand': 255,
+    'category': 255
+}
+
+# Колонки staging-таблицы в порядке загрузки
+STAGING_COLUMNS = [
+    'master_id', 'sku_ozon', 'sku_wb', 'barcode', 'product_name', 'name',
+    'brand', 'category', 'cost_price', 'created_at', 'updated_at'
+]
+
+# Граница DECIMAL(10,2) для cost_price
+MAX_COST_PRICE = 10 ** 8
+
+# Строк в одном INSERT при загрузке staging-таблицы
+STAGING_BATCH_SIZE = 5000
+
 class MasterTableImporter:
     """Импортер данных мастер таблицы"""
     
@@ -213,17 +256,73 @@ class MasterTableImporter:
         return self._process_records(sample_records)
     
     def _process_records(self, records: List[Dict]) -> Dict[str, int]:
-        """Обрабатывает записи и вставляет их в БД"""
+        """Обрабатывает записи: staging-таблица и слияние в product_master одним запросом"""
+        if not records:
+            return {'inserted': 0, 'updated': 0, 'failed': 0}
+        
         cursor = self.connection.cursor()
-        inserted = updated = failed = 0
         
         try:
-            # Подготавливаем запрос для UPSERT
-            upsert_query = """
-                INSERT INTO product_master (
-                    master_id, sku_ozon, sku_wb, barcode, product_name, name, 
-                    brand, category, cost_price, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            normalized = self._normalize_records(records)
+            
+            # Невалидные записи отбрасываются до staging, чтобы одна плохая строка не срывала весь пакет
+            valid_mask = self._validate_records(normalized)
+            failed = int((~valid_mask).sum())
+            
+            valid = normalized[valid_mask]
+            if valid.empty:
+                self.stats['failed_records'] += failed
+                return {'inserted': 0, 'updated': 0, 'failed': failed}
+            
+            now = time.strftime('%Y-%m-%d %H:%M:%S')
+            rows = [
+                (seq, *values[:-2], values[-2] or now, values[-1] or now)
+                for seq, values in enumerate(valid[STAGING_COLUMNS].itertuples(index=False, name=None))
+            ]
+            
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_product_master_import")
+            cursor.execute("""
+                CREATE TEMPORARY TABLE tmp_product_master_import (
+                    seq INT NOT NULL,
+                    master_id INT,
+                    sku_ozon VARCHAR(255) NOT NULL,
+                    sku_wb VARCHAR(50),
+                    barcode VARCHAR(255),
+                    product_name VARCHAR(500),
+                    name VARCHAR(500),
+                    brand VARCHAR(255),
+                    category VARCHAR(255),
+                    cost_price DECIMAL(10,2),
+                    created_at VARCHAR(32),
+                    updated_at VARCHAR(32),
+                    INDEX idx_sku_ozon (sku_ozon)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """)
+            
+            insert_query = f"""
+                INSERT INTO tmp_product_master_import (seq, {', '.join(STAGING_COLUMNS)})
+                VALUES ({', '.join(['%s'] * (len(STAGING_COLUMNS) + 1))})
+            """
+            for start in range(0, len(rows), STAGING_BATCH_SIZE):
+                cursor.executemany(insert_query, rows[start:start + STAGING_BATCH_SIZE])
+                logger.info(f"Загружено в staging: {min(start + STAGING_BATCH_SIZE, len(rows))}/{len(rows)}")
+            
+            # Новые SKU - одним anti-join (повторы SKU в файле считаются обновлениями, как при построчном UPSERT)
+            cursor.execute("""
+                SELECT COUNT(DISTINCT t.sku_ozon)
+                FROM tmp_product_master_import t
+                LEFT JOIN product_master p ON p.sku_ozon = t.sku_ozon
+                WHERE p.id IS NULL
+            """)
+            inserted = cursor.fetchone()[0]
+            updated = len(rows) - inserted
+            
+            # Слияние в порядке записей файла: при повторе SKU побеждает последняя запись
+            cursor.execute(f"""
+                INSERT INTO product_master ({', '.join(STAGING_COLUMNS)})
+                SELECT {', '.join(STAGING_COLUMNS)}
+                FROM tmp_product_master_import
+                ORDER BY seq
                 ON DUPLICATE KEY UPDATE
                 sku_wb = VALUES(sku_wb),
                 barcode = VALUES(barcode),
@@ -234,63 +333,15 @@ class MasterTableImporter:
                 cost_price = VALUES(cost_price),
                 updated_at = VALUES(updated_at),
                 synced_at = CURRENT_TIMESTAMP
-            """
-            
-            for record in records:
-                try:
-                    # Нормализуем данные записи
-                    normalized_record = self._normalize_record(record)
-                    
-                    if not normalized_record.get('sku_ozon'):
-                        logger.warning(f"Пропускаем запись без sku_ozon: {record}")
-                        failed += 1
-                        continue
-                    
-                    # Проверяем, существует ли запись
-                    check_cursor = self.connection.cursor()
-                    check_cursor.execute(
-                        "SELECT id FROM product_master WHERE sku_ozon = %s",
-                        (normalized_record['sku_ozon'],)
-                    )
-                    exists = check_cursor.fetchone()
-                    check_cursor.close()
-                    
-                    # Выполняем UPSERT
-                    cursor.execute(upsert_query, (
-                        normalized_record.get('master_id'),
-                        normalized_record.get('sku_ozon'),
-                        normalized_record.get('sku_wb'),
-                        normalized_record.get('barcode'),
-                        normalized_record.get('product_name'),
-                        normalized_record.get('name'),
-                        normalized_record.get('brand'),
-                        normalized_record.get('category'),
-                        normalized_record.get('cost_price'),
-                        normalized_record.get('created_at', time.strftime('%Y-%m-%d %H:%M:%S')),
-                        normalized_record.get('updated_at', time.strftime('%Y-%m-%d %H:%M:%S'))
-                    ))
-                    
-                    if exists:
-                        updated += 1
-                    else:
-                        inserted += 1
-                    
-                    self.stats['processed_records'] += 1
-                    
-                    # Показываем прогресс каждые 100 записей
-                    if self.stats['processed_records'] % 100 == 0:
-                        progress = (self.stats['processed_records'] / self.stats['total_records']) * 100
-                        logger.info(f"Прогресс: {progress:.1f}% ({self.stats['processed_records']}/{self.stats['total_records']})")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка обработки записи {record.get('sku_ozon', 'unknown')}: {e}")
-                    failed += 1
-                    self.stats['failed_records'] += 1
+            """)
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_product_master_import")
             
             self.connection.commit()
             
+            self.stats['processed_records'] += len(rows)
             self.stats['inserted_records'] = inserted
             self.stats['updated_records'] = updated
+            self.stats['failed_records'] += failed
             
             logger.info(f"Импорт завершен: вставлено {inserted}, обновлено {updated}, ошибок {failed}")
             
@@ -303,58 +354,93 @@ class MasterTableImporter:
         finally:
             cursor.close()
     
-    def _normalize_record(self, record: Dict) -> Dict:
-        """Нормализует запись для вставки в БД"""
-        normalized = {}
+    def _normalize_records(self, records: List[Dict]) -> pd.DataFrame:
+        """
+        Нормализует записи для вставки в БД (векторно, по колонкам).
+        
+        Для каждого поля берется первое непустое из вариантов названий,
+        cost_price приводится к числу (запятая как разделитель допускается),
+        даты остаются строками, строки обрезаются до длины колонки.
+        """
+        frame = pd.DataFrame(records, dtype=object)
+        normalized = pd.DataFrame(index=frame.index)
+        
+        for target_field, source_fields in FIELD_MAPPING.items():
+            present = [field for field in source_fields if field in frame.columns]
+            if not present:
+                normalized[target_field] = None
+                continue
+            
+            # Первое непустое поле из вариантов названий
+            column = frame[present].bfill(axis=1).iloc[:, 0]
+            
+            if target_field == 'cost_price':
+                column = pd.to_numeric(
+                    column.astype(str).str.replace(',', '.', regex=False), errors='coerce'
+                )
+            elif target_field in ['created_at', 'updated_at']:
+                column = column.where(column.isna(), column.astype(str))
+            else:
+                # Обрезаем строки до максимальной длины (нестроковые значения не трогаем)
+                is_str = column.map(lambda value: isinstance(value, str)).astype(bool)
+                if is_str.any():
+                    column = column.mask(is_str, column[is_str].str.slice(0, MAX_LENGTHS.get(target_field, 1000)))
+            
+            normalized[target_field] = column
         
-        # Маппинг полей (поддерживаем разные варианты названий)
-        field_mapping = {
-            'master_id': ['id', 'master_id', 'product_id'],
-            'sku_ozon': ['sku_ozon', 'ozon_sku', 'sku'],
-            'sku_wb': ['sku_wb', 'wb_sku', 'wildberries_sku'],
-            'barcode': ['barcode', 'bar_code', 'ean'],
-            'product_name': ['product_name', 'name', 'title', 'product_title'],
-            'name': ['name', 'alternative_name', 'short_name'],
-            'brand': ['brand', 'brand_name', 'manufacturer'],
-            'category': ['category', 'category_name', 'product_category'],
-            'cost_price': ['cost_price', 'price', 'cost'],
-            'created_at': ['created_at', 'created', 'date_created'],
-            'updated_at': ['updated_at', 'updated', 'date_updated', 'last_modified']
+        normalized = normalized.astype(object)
+        return normalized.where(normalized.notna(), None)
+    
+    def _validate_records(self, normalized: pd.DataFrame) -> pd.Series:
+        """
+        Проверяет нормализованные записи и возвращает маску годных строк.
+        
+        master_id и даты приводятся на месте к типам staging-таблицы.
+        
+        Отбраковываются записи без sku_ozon, с нецелым master_id, с нераспознанной
+        датой и с cost_price, не помещающимся в DECIMAL(10,2). Каждая причина
+        логируется с количеством и примерами SKU.
+        """
+        def is_blank(column: pd.Series) -> pd.Series:
+            return column.isna() | (column.astype(str).str.strip() == '')
+        
+        master_id = pd.to_numeric(normalized['master_id'], errors='coerce')
+        cost_price = pd.to_numeric(normalized['cost_price'], errors='coerce')
+        
+        checks = {
+            'без sku_ozon': is_blank(normalized['sku_ozon']),
+            'с некорректным master_id': ~is_blank(normalized['master_id']) & (
+                master_id.isna() | (master_id % 1 != 0)
+            ),
+            'с cost_price вне DECIMAL(10,2)': cost_price.abs() >= MAX_COST_PRICE,
         }
+        parsed_dates = {
+            field: pd.to_datetime(normalized[field], errors='coerce', format='mixed')
+            for field in ['created_at', 'updated_at']
+        }
+        for field, parsed in parsed_dates.items():
+            checks[f'с некорректным {field}'] = ~is_blank(normalized[field]) & parsed.isna()
         
-        for target_field, source_fields in field_mapping.items():
-            for source_field in source_fields:
-                if source_field in record and record[source_field] is not None:
-                    value = record[source_field]
-                    
-                    # Специальная обработка для некоторых полей
-                    if target_field == 'cost_price' and value:
-                        try:
-                            normalized[target_field] = float(str(value).replace(',', '.'))
-                        except (ValueError, TypeError):
-                            normalized[target_field] = None
-                    elif target_field in ['created_at', 'updated_at'] and value:
-                        # Оставляем как есть, MySQL сам разберется с форматом
-                        normalized[target_field] = str(value)
-                    else:
-                        # Обрезаем строки до максимальной длины
-                        if isinstance(value, str):
-                            max_lengths = {
-                                'sku_ozon': 255,
-                                'sku_wb': 50,
-                                'barcode': 255,
-                                'product_name': 500,
-                                'name': 500,
-                                'brand': 255,
-                                'category': 255
-                            }
-                            max_len = max_lengths.get(target_field, 1000)
-                            normalized[target_field] = value[:max_len] if len(value) > max_len else value
-                        else:
-                            normalized[target_field] = value
-                    break
+        rejected = pd.Series(False, index=normalized.index)
+        for reason, mask in checks.items():
+            count = int(mask.sum())
+            if count:
+                examples = normalized.loc[mask, 'sku_ozon'].head(5).tolist()
+                logger.warning(f"⚠️ Пропущено записей {reason}: {count} (например: {examples})")
+            rejected |= mask
+        
+        # Приводим годные значения к типам staging-таблицы
+        normalized['master_id'] = pd.Series(
+            [None if pd.isna(value) or value % 1 else int(value) for value in master_id],
+            index=normalized.index, dtype=object
+        )
+        for field, parsed in parsed_dates.items():
+            normalized[field] = pd.Series(
+                [None if pd.isna(value) else value.strftime('%Y-%m-%d %H:%M:%S') for value in parsed],
+                index=normalized.index, dtype=object
+            )
         
-        return normalized
+        return ~rejected
     
     def get_import_statistics(self) -> Dict:
         """Получает статистику импорта"""
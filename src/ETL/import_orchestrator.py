@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Оркестратор импорта данных из API маркетплейсов по шардам дат.
+
+Период [start_date, end_date] делится на шарды (дни или недели),
+независимые потоки (заказы Ozon, транзакции Ozon, финансы WB, ...)
+выполняются одновременно. У каждого маркетплейса свой пул воркеров,
+частоту запросов внутри пула ограничивает общий rate limiter, поэтому
+длинная загрузка использует весь доступный лимит API, а не проходит
+потоки по очереди.
+
+Завершенные шарды сохраняются в чекпоинт: повторный запуск с теми же
+параметрами пропускает их. После успешного запуска чекпоинт удаляется.
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_FILE = 'import_checkpoint.json'
+
+# Воркеров на маркетплейс (частоту запросов ограничивает rate limiter)
+DEFAULT_CONCURRENCY = {
+    'ozon': 4,
+    'wb': 2,
+}
+
+Shard = Tuple[str, str]
+
+# Текст ошибки задачи, пропущенной из-за ошибки недатированного потока
+SKIPPED_ERROR = 'пропущен: импорт товаров завершился с ошибкой'
+
+
+@dataclass(frozen=True)
+class ImportStream:
+    """Независимый поток импорта."""
+    name: str
+    marketplace: str
+    func: Callable[..., None]
+    dated: bool = True  # Принимает (start_date, end_date)
+    shardable: bool = True  # Период можно делить на шарды
+    title: str = ''
+
+
+Task = Tuple[ImportStream, Optional[Shard]]
+
+
+def split_into_shards(start_date: str, end_date: str, shard_days: int) -> List[Shard]:
+    """
+    Разбить период на шарды по shard_days дней.
+    
+    Returns:
+        Список (начало, конец) в формате YYYY-MM-DD
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    if end < start:
+        raise ValueError(f"Конечная дата {end_date} раньше начальной {start_date}")
+    
+    shards = []
+    while start <= end:
+        shard_end = min(start + timedelta(days=max(1, shard_days) - 1), end)
+        shards.append((start.isoformat(), shard_end.isoformat()))
+        start = shard_end + timedelta(days=1)
+    return shards
+
+
+class ImportCheckpoint:
+    """Чекпоинт запуска: ключ параметров и завершенные шарды."""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.run_key = None
+        self.completed = set()
+        self._lock = threading.Lock()
+    
+    def start(self, task_keys: List[str]) -> set:
+        """
+        Начать или продолжить запуск.
+        
+        Returns:
+            Ключи уже завершенных задач
+        """
+        self.run_key = hashlib.sha1(','.join(sorted(task_keys)).encode('utf-8')).hexdigest()
+        self.completed = set()
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get('run_key') == self.run_key:
+                    self.completed = set(state.get('completed', [])) & set(task_keys)
+                    logger.info(f"♻️  Продолжаем прерванный импорт: уже готово {len(self.completed)} шардов")
+                else:
+                    logger.info("ℹ️  Чекпоинт относится к другому запуску, начинаем заново")
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️  Не удалось прочитать чекпоинт {self.path}: {e}")
+        
+        return set(self.completed)
+    
+    def mark_done(self, task_key: str):
+        """Отметить шард как завершенный и сохранить чекпоинт."""
+        with self._lock:
+            self.completed.add(task_key)
+            
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'run_key': self.run_key,
+                    'completed': sorted(self.completed),
+                    'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }, f)
+            os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        """Удалить чекпоинт после успешного завершения."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ImportOrchestrator:
+    """Параллельный импорт потоков маркетплейсов по шардам дат."""
+    
+    def __init__(self, streams: List[ImportStream], concurrency: Optional[Dict[str, int]] = None,
+                 checkpoint_file: Optional[str] = DEFAULT_CHECKPOINT_FILE,
+                 prefetch: Optional[Callable[[List[Task]], None]] = None):
+        """
+        Args:
+            streams: Потоки импорта
+            concurrency: Воркеров на маркетплейс (по умолчанию DEFAULT_CONCURRENCY)
+            checkpoint_file: Файл чекпоинта (None - без чекпоинтов)
+            prefetch: Вызывается с невыполненными задачами перед запуском
+                (например, параллельный заказ отчетов в кэш); ошибки не прерывают импорт
+        """
+        self.streams = streams
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.checkpoint = ImportCheckpoint(checkpoint_file) if checkpoint_file else None
+        self.prefetch = prefetch
+    
+    @staticmethod
+    def _task_key(stream: ImportStream, shard: Optional[Shard]) -> str:
+        return f"{stream.name}:{shard[0]}..{shard[1]}" if shard else stream.name
+    
+    def _plan(self, start_date: str, end_date: str, shard_days: int) -> List[Task]:
+        """
+        Задачи запуска: недатированные потоки - одна задача, остальные - по шардам.
+        
+        Шарды разных потоков чередуются, чтобы потоки одного маркетплейса
+        продвигались одновременно.
+        """
+        shards = split_into_shards(start_date, end_date, shard_days)
+        per_stream = []
+        for stream in self.streams:
+            if not stream.dated:
+                per_stream.append([(stream, None)])
+            elif stream.shardable:
+                per_stream.append([(stream, shard) for shard in shards])
+            else:
+                per_stream.append([(stream, (start_date, end_date))])
+        
+        return [task for group in zip_longest(*per_stream) for task in group if task is not None]
+    
+    def _run_task(self, stream: ImportStream, shard: Optional[Shard]) -> None:
+        period = f" {shard[0]} - {shard[1]}" if shard else ''
+        logger.info(f"▶️  {stream.title or stream.name}{period}")
+        if shard:
+            stream.func(*shard)
+        else:
+            stream.func()
+        logger.info(f"✅ {stream.title or stream.name}{period} завершен")
+    
+    def _run_phase(self, tasks: List[Task]) -> Dict[str, str]:
+        """
+        Выполнить задачи в пулах маркетплейсов.
+        
+        Returns:
+            Ошибки: ключ задачи -> текст ошибки
+        """
+        errors = {}
+        executors = {
+            marketplace: ThreadPoolExecutor(max_workers=max(1, self.concurrency.get(marketplace, 1)),
+                                            thread_name_prefix=f"import-{marketplace}")
+            for marketplace in {stream.marketplace for stream, _ in tasks}
+        }
+        
+        try:
+            futures = {
+                executors[stream.marketplace].submit(self._run_task, stream, shard): self._task_key(stream, shard)
+                for stream, shard in tasks
+            }
+            for future in as_completed(futures):
+                task_key = futures[future]
+                try:
+                    future.result()
+                    if self.checkpoint:
+                        self.checkpoint.mark_done(task_key)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка импорта {task_key}: {e}")
+                    errors[task_key] = str(e)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+        
+        return errors
+    
+    def run(self, start_date: str, end_date: str, shard_days: int = 7) -> Dict[str, str]:
+        """
+        Импорт за период.
+        
+        Недатированные потоки (товары) выполняются первыми: заказы и
+        транзакции сопоставляются с уже загруженными товарами. Если они
+        завершились с ошибкой, датированные задачи не запускаются и
+        возвращаются как пропущенные (в чекпоинт не попадают).
+        
+        Args:
+            start_date: Начальная дата (YYYY-MM-DD)
+            end_date: Конечная дата (YYYY-MM-DD)
+            shard_days: Размер шарда в днях (1 - по дням, 7 - по неделям)
+        
+        Returns:
+            Ошибки: ключ задачи -> текст ошибки (пустой словарь при успехе)
+        """
+        tasks = self._plan(start_date, end_date, shard_days)
+        
+        done = set()
+        if self.checkpoint:
+            done = self.checkpoint.start([self._task_key(stream, shard) for stream, shard in tasks])
+        pending = [(stream, shard) for stream, shard in tasks if self._task_key(stream, shard) not in done]
+        
+        logger.info(f"📋 План импорта: {len(tasks)} задач, к выполнению {len(pending)} "
+                    f"(шард {shard_days} дн., воркеры {self.concurrency})")
+        
+        if self.prefetch and pending:
+            try:
+                self.prefetch(pending)
+            except Exception as e:
+                logger.warning(f"⚠️  Предзагрузка не выполнена: {e}")
+        
+        errors = self._run_phase([(stream, shard) for stream, shard in pending if not stream.dated])
+        dated = [(stream, shard) for stream, shard in pending if stream.dated]
+        if errors:
+            logger.error(f"❌ Импорт товаров завершился с ошибкой, пропускаем {len(dated)} датированных задач")
+            errors.update({self._task_key(stream, shard): SKIPPED_ERROR for stream, shard in dated})
+        else:
+            errors.update(self._run_phase(dated))
+        
+        if errors:
+            logger.error(f"❌ Импорт завершен с ошибками: {len(errors)} из {len(pending)} задач")
+        else:
+            logger.info(f"🎉 Импорт завершен: {len(pending)} задач")
+            if self.checkpoint:
+                self.checkpoint.clear()
+        
+        return errors
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Пакетная запись остатков в таблицу inventory_data.
+
+Общий слой записи для сервисов синхронизации (v4, enhanced, with_names
+и базового InventorySyncService):
+- PostgreSQL: COPY во временную таблицу и один INSERT ... ON CONFLICT
+- MySQL: многострочный INSERT ... ON DUPLICATE KEY UPDATE
+- Режим вставки без UPSERT для сервисов, удаляющих снимок перед записью
+- Точный подсчет вставленных/обновленных/ошибочных записей
+- При ошибке батча - деление пополам для поиска проблемных строк
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import io
+import csv
+import logging
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Tuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+# Колонки inventory_data, заполняемые из InventoryRecord
+INVENTORY_COLUMNS = (
+    'product_id', 'sku', 'source', 'warehouse_name', 'stock_type',
+    'current_stock', 'reserved_stock', 'available_stock',
+    'quantity_present', 'quantity_reserved', 'snapshot_date'
+)
+
+# Колонки, обновляемые при конфликте
+INVENTORY_UPDATE_COLUMNS = (
+    'current_stock', 'reserved_stock', 'available_stock',
+    'quantity_present', 'quantity_reserved', 'snapshot_date'
+)
+
+# Ключ конфликта по умолчанию: зерно InventoryRecord (товар × SKU × склад × тип склада × источник).
+# SKU входит в ключ, т.к. аналитические записи Ozon приходят с product_id = 0.
+# В PostgreSQL ключ создается миграцией migrations/add_inventory_data_upsert_key.sql
+DEFAULT_CONFLICT_COLUMNS = ('product_id', 'sku', 'warehouse_name', 'stock_type', 'source')
+
+
+@dataclass
+class BulkWriteResult:
+    """Результат пакетной записи."""
+    updated: int = 0
+    inserted: int = 0
+    failed: int = 0
+    failed_records: List[Any] = field(default_factory=list)
+
+    def as_tuple(self) -> Tuple[int, int, int]:
+        """Результат в формате (обновлено, вставлено, ошибок)."""
+        return self.updated, self.inserted, self.failed
+
+
+class InventoryBulkWriter:
+    """
+    Пакетный UPSERT записей об остатках.
+
+    В режиме UPSERT записи сначала дедуплицируются по ключу конфликта,
+    затем пишутся батчами по batch_size строк одним оператором на батч.
+    insert_records пишет те же батчи обычным INSERT. Если батч
+    падает, он делится пополам до тех пор, пока не будут найдены
+    конкретные ошибочные строки; остальные строки сохраняются.
+    """
+
+    def __init__(self, connection, sync_logger=None, batch_size: int = 5000,
+                 table: str = 'inventory_data',
+                 conflict_columns: Sequence[str] = DEFAULT_CONFLICT_COLUMNS):
+        """
+        Инициализация писателя.
+
+        Args:
+            connection: Соединение с БД (psycopg2 или mysql.connector)
+            sync_logger: SyncLogger для записи ошибок (опционально)
+            batch_size: Количество строк в одном операторе
+            table: Целевая таблица
+            conflict_columns: Колонки уникального ключа для ON CONFLICT
+        """
+        self.connection = connection
+        self.sync_logger = sync_logger
+        self.batch_size = max(1, batch_size)
+        self.table = table
+        self.conflict_columns = tuple(conflict_columns)
+        self.dialect = self.detect_dialect(connection)
+        self.stage_table = f"{table}_stage"
+        self._savepoint_seq = 0
+
+    @staticmethod
+    def detect_dialect(connection) -> str:
+        """Определение типа СУБД по классу соединения."""
+        module = type(connection).__module__ or ''
+        if module.startswith('psycopg'):
+            return 'postgresql'
+        return 'mysql'
+
+    def upsert_records(self, records: List[Any]) -> BulkWriteResult:
+        """
+        Пакетная запись записей об остатках.
+
+        Транзакцией управляет вызывающий код: метод не выполняет commit.
+
+        Args:
+            records: Список InventoryRecord (или объектов с теми же атрибутами)
+
+        Returns:
+            BulkWriteResult: Счетчики и список записей, которые не удалось сохранить
+        """
+        result = BulkWriteResult()
+        if not records:
+            return result
+
+        rows, duplicates = self._prepare_rows(records, result)
+        # Повторы ключа внутри выгрузки при построчной записи были бы обновлениями
+        result.updated += duplicates
+
+        self._write_rows(rows, result, upsert=True)
+        return result
+
+    def insert_records(self, records: List[Any]) -> BulkWriteResult:
+        """
+        Пакетная вставка записей без UPSERT.
+
+        Для сервисов, которые удаляют снимок источника перед записью:
+        строки не дедуплицируются и не обновляют существующие, нарушение
+        уникального ключа учитывается как ошибка записи.
+        Транзакцией управляет вызывающий код: метод не выполняет commit.
+
+        Args:
+            records: Список InventoryRecord (или объектов с теми же атрибутами)
+
+        Returns:
+            BulkWriteResult: Счетчики и список записей, которые не удалось сохранить
+        """
+        result = BulkWriteResult()
+        if not records:
+            return result
+
+        rows, _ = self._prepare_rows(records, result, deduplicate=False)
+        self._write_rows(rows, result, upsert=False)
+        return result
+
+    def _write_rows(self, rows: List[Tuple[Any, tuple]], result: BulkWriteResult,
+                    upsert: bool) -> None:
+        """Запись подготовленных строк батчами по batch_size."""
+        cursor = self.connection.cursor()
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                self._write_with_bisect(cursor, rows[start:start + self.batch_size], result, upsert)
+        finally:
+            cursor.close()
+
+        logger.info(f"✅ Пакетная запись {self.table}: обновлено {result.updated}, "
+                    f"вставлено {result.inserted}, ошибок {result.failed}")
+
+    def _prepare_rows(self, records: List[Any], result: BulkWriteResult,
+                      deduplicate: bool = True) -> Tuple[List[Tuple[Any, tuple]], int]:
+        """Преобразование записей в кортежи и дедупликация по ключу (побеждает последняя)."""
+        key_idx = [INVENTORY_COLUMNS.index(col) for col in self.conflict_columns]
+        unique: Dict[tuple, Tuple[Any, tuple]] = {}
+        rows: List[Tuple[Any, tuple]] = []
+        duplicates = 0
+
+        for record in records:
+            try:
+                values = tuple(getattr(record, col) for col in INVENTORY_COLUMNS)
+            except AttributeError as e:
+                self._log_error(f"Ошибка подготовки записи: {e}")
+                result.failed += 1
+                result.failed_records.append(record)
+                continue
+
+            if not deduplicate:
+                rows.append((record, values))
+                continue
+
+            key = tuple(values[i] for i in key_idx)
+            if key in unique:
+                duplicates += 1
+            unique[key] = (record, values)
+
+        return (list(unique.values()) if deduplicate else rows), duplicates
+
+    def _write_with_bisect(self, cursor, rows: List[Tuple[Any, tuple]],
+                           result: BulkWriteResult, upsert: bool = True) -> None:
+        """Запись батча; при ошибке - рекурсивное деление пополам."""
+        stack = [rows]
+        while stack:
+            chunk = stack.pop()
+            try:
+                inserted, updated = self._write_chunk_atomic(cursor, chunk, upsert)
+                result.inserted += inserted
+                result.updated += updated
+            except Exception as e:
+                if len(chunk) == 1:
+                    record = chunk[0][0]
+                    self._log_error(f"Ошибка сохранения записи для товара "
+                                    f"{getattr(record, 'sku', '?')}: {e}")
+                    result.failed += 1
+                    result.failed_records.append(record)
+                    continue
+
+                middle = len(chunk) // 2
+                logger.warning(f"⚠️ Ошибка записи батча из {len(chunk)} строк, "
+                               f"делим пополам: {e}")
+                # Правую половину кладем первой, чтобы сохранить порядок записи
+                stack.append(chunk[middle:])
+                stack.append(chunk[:middle])
+
+    def _write_chunk_atomic(self, cursor, chunk: List[Tuple[Any, tuple]],
+                            upsert: bool = True) -> Tuple[int, int]:
+        """Запись батча внутри savepoint (если соединение не в autocommit)."""
+        values = [row for _, row in chunk]
+
+        # Временная таблица создается вне savepoint: откат батча не должен ее удалять
+        if self.dialect == 'postgresql':
+            self._ensure_stage_table(cursor)
+
+        if getattr(self.connection, 'autocommit', False):
+            # В autocommit каждый оператор атомарен сам по себе
+            return self._write_chunk(cursor, values, upsert)
+
+        self._savepoint_seq += 1
+        savepoint = f"inventory_bulk_{self._savepoint_seq}"
+        cursor.execute(f"SAVEPOINT {savepoint}")
+        try:
+            counts = self._write_chunk(cursor, values, upsert)
+        except Exception:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            raise
+        cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+        return counts
+
+    def _write_chunk(self, cursor, values: List[tuple], upsert: bool = True) -> Tuple[int, int]:
+        """Запись батча одним оператором. Возвращает (вставлено, обновлено)."""
+        if self.dialect == 'postgresql':
+            return self._write_chunk_postgresql(cursor, values, upsert)
+        return self._write_chunk_mysql(cursor, values, upsert)
+
+    def _ensure_stage_table(self, cursor) -> None:
+        """
+        Создание временной таблицы для COPY.
+
+        Выполняется перед каждым батчем (IF NOT EXISTS): откат транзакции
+        вызывающим кодом удаляет таблицу, созданную в этой транзакции.
+        """
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {self.stage_table} AS
+            SELECT {', '.join(INVENTORY_COLUMNS)} FROM {self.table} WITH NO DATA
+        """)
+
+    def _write_chunk_postgresql(self, cursor, values: List[tuple], upsert: bool = True) -> Tuple[int, int]:
+        """COPY во временную таблицу и слияние одним INSERT ... ON CONFLICT."""
+        columns = ', '.join(INVENTORY_COLUMNS)
+
+        cursor.execute(f"TRUNCATE {self.stage_table}")
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in values:
+            writer.writerow(['\\N' if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {self.stage_table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+        if not upsert:
+            cursor.execute(f"""
+                INSERT INTO {self.table} ({columns}, last_sync_at)
+                SELECT {columns}, NOW() FROM {self.stage_table}
+            """)
+            return max(cursor.rowcount, 0), 0
+
+        update_set = ',\n                '.join(
+            f"{col} = EXCLUDED.{col}" for col in INVENTORY_UPDATE_COLUMNS
+        )
+        cursor.execute(f"""
+            INSERT INTO {self.table} ({columns}, last_sync_at)
+            SELECT {columns}, NOW() FROM {self.stage_table}
+            ON CONFLICT ({', '.join(self.conflict_columns)}) DO UPDATE SET
+                {update_set},
+                last_sync_at = NOW()
+            RETURNING (xmax = 0) AS inserted
+        """)
+        flags = cursor.fetchall()
+        inserted = sum(1 for row in flags if row[0])
+        return inserted, len(flags) - inserted
+
+    def _write_chunk_mysql(self, cursor, values: List[tuple], upsert: bool = True) -> Tuple[int, int]:
+        """Многострочный INSERT ... ON DUPLICATE KEY UPDATE."""
+        columns = ', '.join(INVENTORY_COLUMNS)
+        placeholders = '(' + ', '.join(['%s'] * len(INVENTORY_COLUMNS)) + ', NOW())'
+        params = [value for row in values for value in row]
+
+        if not upsert:
+            cursor.execute(f"""
+                INSERT INTO {self.table} ({columns}, last_sync_at)
+                VALUES {', '.join([placeholders] * len(values))}
+            """, params)
+            return len(values), 0
+
+        update_set = ',\n                '.join(
+            f"{col} = VALUES({col})" for col in INVENTORY_UPDATE_COLUMNS
+        )
+        query = f"""
+            INSERT INTO {self.table} ({columns}, last_sync_at)
+            VALUES {', '.join([placeholders] * len(values))}
+            ON DUPLICATE KEY UPDATE
+                {update_set},
+                last_sync_at = NOW()
+        """
+        cursor.execute(query, params)
+
+        # MySQL считает 1 за вставку и 2 за обновление строки; last_sync_at = NOW()
+        # гарантирует, что существующая строка всегда изменяется
+        affected = max(cursor.rowcount, 0)
+        updated = min(max(affected - len(values), 0), len(values))
+        return len(values) - updated, updated
+
+    def _log_error(self, message: str) -> None:
+        """Логирование ошибки через SyncLogger или стандартный логгер."""
+        if self.sync_logger:
+            self.sync_logger.log_error(message)
+        else:
+            logger.error(f"❌ {message}")
@@ -3,7 +3,8 @@
 REST API для управления синхронизацией остатков товаров.
 
 Предоставляет endpoints для:
-- Запуска принудительной синхронизации
+- Запуска принудительной синхронизации (задачи с ID, источники параллельно)
+- Прогресса задач в реальном времени (Server-Sent Events) и их отмены
 - Получения статуса последней синхронизации
 - Получения отчетов о синхронизации
 
@@ -13,10 +14,12 @@ REST API для управления синхронизацией остатко
 
 import os
 import sys
+import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 from flask_cors import CORS
 import threading
 import json
@@ -45,10 +48,263 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для веб-интерфейса
 
-# Глобальные переменные для отслеживания состояния
-sync_in_progress = False
-last_sync_results = {}
-sync_thread = None
+VALID_SOURCES = ['Ozon', 'Wildberries']
+
+# Интервал keep-alive комментариев в SSE потоке (сек)
+SSE_HEARTBEAT_SECONDS = 15
+
+
+class SyncJobRegistry:
+    """
+    Реестр задач синхронизации.
+    
+    Каждая задача получает ID, источники выполняются параллельно
+    (каждый в своем потоке со своим подключением к БД). Одновременно
+    блокируется только источник, а не вся синхронизация: Ozon и
+    Wildberries можно запускать независимыми задачами. Прогресс
+    сохраняется как последовательность событий для SSE.
+    """
+    
+    def __init__(self, max_workers: int = 4, max_history: int = 50):
+        """
+        Инициализация реестра.
+        
+        Args:
+            max_workers: Максимум одновременно синхронизируемых источников
+            max_history: Сколько завершенных задач хранить
+        """
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inventory-sync')
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._active_sources: Dict[str, str] = {}
+        self._condition = threading.Condition()
+    
+    def start_job(self, sources: List[str]) -> Dict[str, Any]:
+        """
+        Создать задачу и запустить синхронизацию источников.
+        
+        Raises:
+            RuntimeError: Если какой-то из источников уже синхронизируется
+        """
+        with self._condition:
+            busy = {source: self._active_sources[source] for source in sources if source in self._active_sources}
+            if busy:
+                raise RuntimeError(
+                    "Синхронизация уже выполняется: " +
+                    ", ".join(f"{source} (задача {job_id})" for source, job_id in busy.items())
+                )
+            
+            job_id = uuid.uuid4().hex
+            job = {
+                'job_id': job_id,
+                'sources': list(sources),
+                'status': 'running',
+                'created_at': datetime.now().isoformat(),
+                'finished_at': None,
+                'progress': {
+                    source: {
+                        'status': 'queued',
+                        'stage': None,
+                        'pages_fetched': 0,
+                        'records_processed': 0,
+                        'records_written': 0,
+                        'records_failed': 0,
+                        'started_at': None,
+                        'finished_at': None
+                    } for source in sources
+                },
+                'results': {},
+                'events': [],
+                'cancel_event': threading.Event()
+            }
+            self._jobs[job_id] = job
+            for source in sources:
+                self._active_sources[source] = job_id
+            self._trim()
+            self._add_event(job, 'started', {'sources': job['sources']})
+        
+        for source in sources:
+            self._executor.submit(self._run_source, job, source)
+        
+        logger.info(f"🚀 Задача синхронизации {job_id} запущена для источников: {sources}")
+        return self.get_job(job_id)
+    
+    def _run_source(self, job: Dict[str, Any], source: str):
+        """Синхронизация одного источника в потоке пула."""
+        progress = job['progress'][source]
+        with self._condition:
+            progress['status'] = 'running'
+            progress['started_at'] = datetime.now().isoformat()
+            self._add_event(job, 'progress', {'source': source, **progress})
+        
+        sync_service = RobustInventorySyncService()
+        sync_service.cancel_event = job['cancel_event']
+        sync_service.progress_callback = lambda src, values: self._on_progress(job, src, values)
+        
+        try:
+            if job['cancel_event'].is_set():
+                raise RuntimeError("Синхронизация отменена до запуска")
+            
+            sync_service.connect_to_database()
+            if source == 'Ozon':
+                result = sync_service.sync_ozon_inventory_with_recovery()
+            else:
+                result = sync_service.sync_wb_inventory_with_recovery()
+            
+            source_result = {
+                "status": result.status.value,
+                "records_processed": result.records_processed,
+                "records_updated": result.records_updated,
+                "records_inserted": result.records_inserted,
+                "records_failed": result.records_failed,
+                "duration_seconds": result.duration_seconds,
+                "error_message": result.error_message,
+                "completed_at": result.completed_at.isoformat() if result.completed_at else None
+            }
+            logger.info(f"✅ Синхронизация {source} завершена: {result.status.value}")
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка синхронизации {source}: {e}")
+            source_result = {
+                "status": 'cancelled' if job['cancel_event'].is_set() else 'failed',
+                "error_message": str(e),
+                "completed_at": datetime.now().isoformat()
+            }
+        finally:
+            try:
+                sync_service.close_database_connection()
+            except Exception:
+                pass
+        
+        with self._condition:
+            job['results'][source] = source_result
+            progress['status'] = source_result['status']
+            progress['finished_at'] = source_result['completed_at']
+            self._add_event(job, 'progress', {'source': source, **progress})
+            
+            self._active_sources.pop(source, None)
+            if len(job['results']) == len(job['sources']):
+                statuses = {result['status'] for result in job['results'].values()}
+                if 'cancelled' in statuses:
+                    job['status'] = 'cancelled'
+                elif statuses <= {'success', 'fallback'}:
+                    job['status'] = 'completed'
+                elif statuses == {'failed'}:
+                    job['status'] = 'failed'
+                else:
+                    job['status'] = 'partial'
+                job['finished_at'] = datetime.now().isoformat()
+                self._add_event(job, 'finished', {'status': job['status'], 'results': job['results']})
+                logger.info(f"🏁 Задача синхронизации {job['job_id']} завершена: {job['status']}")
+    
+    def _on_progress(self, job: Dict[str, Any], source: str, values: Dict[str, Any]):
+        """Обновление прогресса источника (вызывается сервисом синхронизации)."""
+        with self._condition:
+            progress = job['progress'][source]
+            progress.update({key: value for key, value in values.items() if key in progress})
+            self._add_event(job, 'progress', {'source': source, **progress})
+    
+    def _add_event(self, job: Dict[str, Any], event_type: str, data: Dict[str, Any]):
+        """Добавить событие задачи и разбудить SSE подписчиков (под self._condition)."""
+        job['events'].append({
+            'id': len(job['events']) + 1,
+            'event': event_type,
+            'data': dict(data, job_id=job['job_id'], timestamp=datetime.now().isoformat())
+        })
+        self._condition.notify_all()
+    
+    def _trim(self):
+        """Удаление самых старых завершенных задач сверх max_history."""
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished_at']]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+    
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'job_id': job['job_id'],
+            'sources': job['sources'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'finished_at': job['finished_at'],
+            'cancel_requested': job['cancel_event'].is_set(),
+            'progress': {source: dict(progress) for source, progress in job['progress'].items()},
+            'results': dict(job['results']),
+            'status_url': f"/api/sync/jobs/{job['job_id']}",
+            'events_url': f"/api/sync/jobs/{job['job_id']}/events"
+        }
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи (None, если задача неизвестна)."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+    
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние задачи, новые первыми."""
+        with self._condition:
+            return [self._public(job) for job in list(self._jobs.values())[-limit:][::-1]]
+    
+    def cancel_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Запросить отмену задачи (источники останавливаются на ближайшей странице)."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            if not job['finished_at'] and not job['cancel_event'].is_set():
+                job['cancel_event'].set()
+                self._add_event(job, 'cancel_requested', {})
+                logger.info(f"⏹️ Запрошена отмена задачи синхронизации {job_id}")
+            return self._public(job)
+    
+    def is_running(self) -> bool:
+        """Выполняется ли хотя бы одна синхронизация."""
+        with self._condition:
+            return bool(self._active_sources)
+    
+    def get_active_sources(self) -> Dict[str, str]:
+        """Источники, синхронизируемые сейчас, и ID их задач."""
+        with self._condition:
+            return dict(self._active_sources)
+    
+    def get_last_results(self) -> Dict[str, Any]:
+        """Результаты последней завершенной задачи."""
+        with self._condition:
+            for job in reversed(list(self._jobs.values())):
+                if job['finished_at']:
+                    return dict(job['results'])
+            return {}
+    
+    def iter_events(self, job_id: str, last_event_id: int = 0):
+        """
+        Генератор событий задачи для SSE.
+        
+        Отдает события после last_event_id, ждет новых и завершается
+        после события 'finished'. Во время ожидания отдает None
+        (keep-alive) раз в SSE_HEARTBEAT_SECONDS.
+        """
+        position = last_event_id
+        while True:
+            with self._condition:
+                job = self._jobs.get(job_id)
+                if not job:
+                    return
+                if len(job['events']) <= position:
+                    self._condition.wait(timeout=SSE_HEARTBEAT_SECONDS)
+                events = job['events'][position:]
+            
+            if not events:
+                yield None
+                continue
+            
+            for event in events:
+                position = event['id']
+                yield event
+                if event['event'] == 'finished':
+                    return
+
+
+sync_registry = SyncJobRegistry(max_workers=int(os.getenv('SYNC_API_WORKERS', '4')))
 
 
 class InventorySyncAPI:
@@ -119,7 +375,7 @@ class InventorySyncAPI:
             stats = self.cursor.fetchone()
             
             return {
-                "sync_in_progress": sync_in_progress,
+                "sync_in_progress": sync_registry.is_running(),
                 "last_sync_records": [dict(record) for record in sync_records],
                 "inventory_stats": dict(stats) if stats else {},
                 "timestamp": datetime.now().isoformat()
@@ -200,70 +456,6 @@ class InventorySyncAPI:
 api_instance = InventorySyncAPI()
 
 
-def run_sync_in_background(sources: List[str] = None):
-    """Запуск синхронизации в фоновом режиме."""
-    global sync_in_progress, last_sync_results
-    
-    try:
-        sync_in_progress = True
-        logger.info("🔄 Запуск фоновой синхронизации")
-        
-        # Создаем новый экземпляр сервиса для фонового выполнения
-        sync_service = RobustInventorySyncService()
-        sync_service.connect_to_database()
-        
-        results = {}
-        
-        # Определяем источники для синхронизации
-        if not sources:
-            sources = ['Ozon', 'Wildberries']
-        
-        # Выполняем синхронизацию для каждого источника
-        for source in sources:
-            try:
-                if source.lower() == 'ozon':
-                    result = sync_service.sync_ozon_inventory()
-                elif source.lower() == 'wildberries':
-                    result = sync_service.sync_wb_inventory()
-                else:
-                    continue
-                
-                results[source] = {
-                    "status": result.status.value,
-                    "records_processed": result.records_processed,
-                    "records_updated": result.records_updated,
-                    "records_inserted": result.records_inserted,
-                    "records_failed": result.records_failed,
-                    "duration_seconds": result.duration_seconds,
-                    "error_message": result.error_message,
-                    "completed_at": result.completed_at.isoformat() if result.completed_at else None
-                }
-                
-                logger.info(f"✅ Синхронизация {source} завершена: {result.status.value}")
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка синхронизации {source}: {e}")
-                results[source] = {
-                    "status": "failed",
-                    "error_message": str(e),
-                    "completed_at": datetime.now().isoformat()
-                }
-        
-        sync_service.close_database_connection()
-        last_sync_results = results
-        
-        logger.info("✅ Фоновая синхронизация завершена")
-        
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка фоновой синхронизации: {e}")
-        last_sync_results = {
-            "error": str(e),
-            "completed_at": datetime.now().isoformat()
-        }
-    finally:
-        sync_in_progress = False
-
-
 # API Endpoints
 
 @app.route('/api/sync/status')
@@ -272,14 +464,17 @@ def get_sync_status():
     try:
         status_data = api_instance.get_sync_status()
         
-        # Добавляем информацию о текущем процессе синхронизации
-        if sync_in_progress:
+        # Добавляем информацию о текущих задачах синхронизации
+        active_sources = sync_registry.get_active_sources()
+        if active_sources:
             status_data["current_sync"] = {
                 "in_progress": True,
+                "active_sources": active_sources,
                 "message": "Синхронизация выполняется в фоновом режиме"
             }
         
         # Добавляем результаты последней принудительной синхронизации
+        last_sync_results = sync_registry.get_last_results()
         if last_sync_results:
             status_data["last_forced_sync"] = last_sync_results
         
@@ -324,24 +519,14 @@ def get_sync_reports():
 
 @app.route('/api/sync/trigger', methods=['POST'])
 def trigger_sync():
-    """Запустить принудительную синхронизацию."""
-    global sync_thread
-    
+    """Запустить принудительную синхронизацию (задача с ID, источники параллельно)."""
     try:
-        # Проверяем, не выполняется ли уже синхронизация
-        if sync_in_progress:
-            return jsonify({
-                "success": False,
-                "error": "Синхронизация уже выполняется"
-            }), 409
-        
         # Получаем параметры из запроса
         data = request.get_json() or {}
-        sources = data.get('sources', ['Ozon', 'Wildberries'])
+        sources = data.get('sources', VALID_SOURCES)
         
         # Валидируем источники
-        valid_sources = ['Ozon', 'Wildberries']
-        sources = [s for s in sources if s in valid_sources]
+        sources = [s for s in VALID_SOURCES if s in sources]
         
         if not sources:
             return jsonify({
@@ -349,22 +534,24 @@ def trigger_sync():
                 "error": "Не указаны валидные источники для синхронизации"
             }), 400
         
-        # Запускаем синхронизацию в отдельном потоке
-        sync_thread = threading.Thread(
-            target=run_sync_in_background,
-            args=(sources,),
-            daemon=True
-        )
-        sync_thread.start()
-        
-        logger.info(f"🚀 Запущена принудительная синхронизация для источников: {sources}")
+        try:
+            job = sync_registry.start_job(sources)
+        except RuntimeError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e),
+                "active_sources": sync_registry.get_active_sources()
+            }), 409
         
         return jsonify({
             "success": True,
             "message": "Синхронизация запущена в фоновом режиме",
             "sources": sources,
-            "started_at": datetime.now().isoformat()
-        })
+            "job_id": job['job_id'],
+            "status_url": job['status_url'],
+            "events_url": job['events_url'],
+            "started_at": job['created_at']
+        }), 202
         
     except Exception as e:
         logger.error(f"❌ Ошибка API trigger_sync: {e}")
@@ -374,6 +561,63 @@ def trigger_sync():
         }), 500
 
 
+@app.route('/api/sync/jobs')
+def list_sync_jobs():
+    """Получить список последних задач синхронизации."""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({
+        "success": True,
+        "data": {"jobs": sync_registry.list_jobs(limit)}
+    })
+
+
+@app.route('/api/sync/jobs/<job_id>')
+def get_sync_job(job_id):
+    """Получить статус и прогресс задачи синхронизации."""
+    job = sync_registry.get_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Задача не найдена"}), 404
+    return jsonify({"success": True, "data": job})
+
+
+@app.route('/api/sync/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_sync_job(job_id):
+    """Отменить задачу синхронизации."""
+    job = sync_registry.cancel_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Задача не найдена"}), 404
+    return jsonify({"success": True, "data": job})
+
+
+@app.route('/api/sync/jobs/<job_id>/events')
+def stream_sync_job_events(job_id):
+    """Поток прогресса задачи синхронизации (Server-Sent Events)."""
+    if not sync_registry.get_job(job_id):
+        return jsonify({"success": False, "error": "Задача не найдена"}), 404
+    
+    # Переподключение EventSource продолжает с последнего полученного события
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0))
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_event_id = 0
+    
+    def generate():
+        for event in sync_registry.iter_events(job_id, last_event_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield (f"id: {event['id']}\n"
+                   f"event: {event['event']}\n"
+                   f"data: {json.dumps(event['data'], ensure_ascii=False, default=str)}\n\n")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/sync/health')
 def sync_health_check():
     """Проверка состояния системы синхронизации."""
@@ -384,7 +628,7 @@ def sync_health_check():
         # Проверяем актуальность данных
         health_data = {
             "database_connected": db_connected,
-            "sync_in_progress": sync_in_progress,
+            "sync_in_progress": sync_registry.is_running(),
             "api_status": "healthy",
             "timestamp": datetime.now().isoformat()
         }
@@ -972,16 +1216,7 @@ DASHBOARD_TEMPLATE = """
                 if (data.success) {
                     showAlert('Синхронизация запущена успешно для источников: ' + sources.join(', '), 'success');
                     syncInProgress = true;
-                    
-                    // Увеличиваем частоту обновления во время синхронизации
-                    clearInterval(refreshInterval);
-                    refreshInterval = setInterval(loadStatus, 5000);
-                    
-                    // Через 2 минуты возвращаем обычную частоту
-                    setTimeout(() => {
-                        clearInterval(refreshInterval);
-                        refreshInterval = setInterval(loadStatus, 30000);
-                    }, 120000);
+                    followSyncJob(data.events_url);
                     
                 } else {
                     showAlert('Ошибка запуска синхронизации: ' + data.error, 'error');
@@ -996,6 +1231,35 @@ DASHBOARD_TEMPLATE = """
             }
         }
         
+        // Отображение прогресса задачи синхронизации через Server-Sent Events
+        function followSyncJob(eventsUrl) {
+            const syncStatus = document.getElementById('sync-status');
+            const events = new EventSource(eventsUrl);
+            const progressBySource = {};
+            
+            events.addEventListener('progress', (e) => {
+                const progress = JSON.parse(e.data);
+                progressBySource[progress.source] = progress.source + ': ' +
+                    progress.pages_fetched + ' стр., ' + progress.records_processed + ' записей' +
+                    (progress.records_written ? ', записано ' + progress.records_written : '');
+                syncStatus.textContent = Object.values(progressBySource).join(' | ');
+            });
+            
+            events.addEventListener('finished', (e) => {
+                const result = JSON.parse(e.data);
+                events.close();
+                showAlert('Синхронизация завершена: ' + result.status, result.status === 'completed' ? 'success' : 'error');
+                loadStatus();
+                loadRecentLogs();
+            });
+            
+            events.onerror = () => {
+                // Поток закрыт сервером или соединение прервано - возвращаемся к опросу статуса
+                events.close();
+                loadStatus();
+            };
+        }
+        
         // Функция загрузки последних логов
         async function loadRecentLogs() {
             try {
@@ -1488,6 +1752,9 @@ if __name__ == '__main__':
     print("   GET  /api/sync/status   - Статус синхронизации")
     print("   GET  /api/sync/reports  - Отчеты о синхронизации")
     print("   POST /api/sync/trigger  - Запуск принудительной синхронизации")
+    print("   GET  /api/sync/jobs/<id> - Статус задачи синхронизации")
+    print("   GET  /api/sync/jobs/<id>/events - Прогресс задачи (SSE)")
+    print("   POST /api/sync/jobs/<id>/cancel - Отмена задачи")
     print("   GET  /api/sync/health   - Проверка состояния системы")
     print("   GET  /api/sync/logs     - Логи синхронизации")
     print()
@@ -26,6 +26,9 @@ try:
     from importers.ozon_importer import connect_to_db
     import config
     from inventory_data_validator import InventoryDataValidator, ValidationResult
+    from inventory_bulk_writer import InventoryBulkWriter
+    from product_resolution_index import get_product_index
+    from rate_limiter import get_rate_limiter
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     sys.exit(1)
@@ -111,6 +114,8 @@ class InventorySyncService:
         self.connection = None
         self.cursor = None
         self.validator = InventoryDataValidator()
+        self.product_index = get_product_index()
+        self.rate_limiter = get_rate_limiter()
         
     def connect_to_database(self):
         """Подключение к базе данных."""
@@ -144,12 +149,7 @@ class InventorySyncService:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_ozon = %s",
-                (sku_ozon,)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_ozon_sku(sku_ozon, cursor=self.cursor)
         except Exception as e:
             logger.error(f"❌ Ошибка при поиске товара по sku_ozon {sku_ozon}: {e}")
             return None
@@ -168,12 +168,7 @@ class InventorySyncService:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE sku_wb = %s",
-                (str(sku_wb),)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_wb_sku(sku_wb, cursor=self.cursor)
         except Exception as e:
             logger.error(f"❌ Ошибка при поиске товара по sku_wb {sku_wb}: {e}")
             return None
@@ -192,12 +187,7 @@ class InventorySyncService:
             return None
             
         try:
-            self.cursor.execute(
-                "SELECT id FROM dim_products WHERE barcode = %s",
-                (barcode,)
-            )
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_barcode(barcode, cursor=self.cursor)
         except Exception as e:
             logger.error(f"❌ Ошибка при поиске товара по barcode {barcode}: {e}")
             return None
@@ -234,51 +224,9 @@ class InventorySyncService:
             deleted_count = self.cursor.rowcount
             logger.info(f"🗑️ Удалено {deleted_count} старых записей для {source} за {today}")
             
-            # Подготавливаем запрос для вставки новых данных
-            insert_query = """
-                INSERT INTO inventory_data 
-                (product_id, sku, source, warehouse_name, stock_type, 
-                 snapshot_date, current_stock, reserved_stock, available_stock,
-                 quantity_present, quantity_reserved, last_sync_at)
-                VALUES (%(product_id)s, %(sku)s, %(source)s, %(warehouse_name)s, %(stock_type)s,
-                       %(snapshot_date)s, %(current_stock)s, %(reserved_stock)s, %(available_stock)s,
-                       %(quantity_present)s, %(quantity_reserved)s, NOW())
-            """
-            
-            # Вставляем новые данные пакетами
-            batch_size = 100
-            for i in range(0, len(inventory_records), batch_size):
-                batch = inventory_records[i:i + batch_size]
-                batch_data = []
-                
-                for record in batch:
-                    try:
-                        record_data = {
-                            'product_id': record.product_id,
-                            'sku': record.sku,
-                            'source': record.source,
-                            'warehouse_name': record.warehouse_name,
-                            'stock_type': record.stock_type,
-                            'snapshot_date': record.snapshot_date,
-                            'current_stock': record.current_stock,
-                            'reserved_stock': record.reserved_stock,
-                            'available_stock': record.available_stock,
-                            'quantity_present': record.quantity_present,
-                            'quantity_reserved': record.quantity_reserved
-                        }
-                        batch_data.append(record_data)
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка подготовки записи: {e}")
-                        failed_count += 1
-                
-                if batch_data:
-                    try:
-                        self.cursor.executemany(insert_query, batch_data)
-                        inserted_count += len(batch_data)
-                        logger.info(f"✅ Вставлено {len(batch_data)} записей (батч {i//batch_size + 1})")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка вставки батча: {e}")
-                        failed_count += len(batch_data)
+            # Вставляем новые данные пакетно (COPY/многострочный INSERT)
+            writer = InventoryBulkWriter(self.connection)
+            updated_count, inserted_count, failed_count = writer.insert_records(inventory_records).as_tuple()
             
             self.connection.commit()
             logger.info(f"✅ Обновление inventory_data завершено: вставлено {inserted_count}, ошибок {failed_count}")
@@ -584,7 +532,9 @@ class InventorySyncService:
                 }
                 
                 try:
+                    self.rate_limiter.acquire('ozon')
                     response = requests.post(url, json=payload, headers=headers, timeout=30)
+                    self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
                     response.raise_for_status()
                     api_requests += 1
                     
@@ -648,7 +598,6 @@ class InventorySyncService:
                         break
                     
                     offset += limit
-                    time.sleep(config.OZON_REQUEST_DELAY)  # Задержка между запросами
                     
                 except requests.exceptions.RequestException as e:
                     logger.error(f"Ошибка запроса к Ozon API: {e}")
@@ -737,7 +686,9 @@ class InventorySyncService:
             }
             
             try:
+                self.rate_limiter.acquire('wb')
                 response = requests.get(url, headers=headers, params=params, timeout=30)
+                self.rate_limiter.update_from_response('wb', response.status_code, response.headers)
                 response.raise_for_status()
                 api_requests += 1
                 
@@ -797,8 +748,6 @@ class InventorySyncService:
                         logger.error(f"Ошибка обработки товара WB {item.get('nmId', 'unknown')}: {e}")
                         records_failed += 1
                 
-                time.sleep(config.WB_REQUEST_DELAY)  # Задержка после запроса
-                
             except requests.exceptions.RequestException as e:
                 logger.error(f"Ошибка запроса к WB API: {e}")
                 records_failed = records_processed
@@ -977,7 +926,9 @@ class InventorySyncService:
                 "Authorization": config.WB_API_TOKEN
             }
             
+            self.rate_limiter.acquire('wb')
             response = requests.get(url, headers=headers, timeout=30)
+            self.rate_limiter.update_from_response('wb', response.status_code, response.headers)
             response.raise_for_status()
             
             warehouses = response.json()
@@ -1008,7 +959,9 @@ class InventorySyncService:
                 "Authorization": config.WB_API_TOKEN
             }
             
+            self.rate_limiter.acquire('wb')
             response = requests.get(url, headers=headers, timeout=30)
+            self.rate_limiter.update_from_response('wb', response.status_code, response.headers)
             response.raise_for_status()
             
             data = response.json()
@@ -1101,8 +1054,6 @@ class InventorySyncService:
                     all_inventory_records.extend(warehouse_stocks)
                     records_processed += len(warehouse_stocks)
                     
-                    time.sleep(config.WB_REQUEST_DELAY)  # Задержка между запросами
-                    
                 except Exception as e:
                     logger.error(f"Ошибка получения остатков склада {warehouse_name}: {e}")
                     records_failed += 1
@@ -27,6 +27,9 @@ try:
     from importers.ozon_importer import connect_to_db
     import config
     from inventory_data_validator import InventoryDataValidator, ValidationResult
+    from inventory_bulk_writer import InventoryBulkWriter
+    from product_resolution_index import get_product_index
+    from rate_limiter import get_rate_limiter
     from sync_logger import SyncLogger, SyncType, SyncStatus as LogSyncStatus, ProcessingStats
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
@@ -122,6 +125,8 @@ class EnhancedInventorySyncService:
         self.cursor = None
         self.validator = InventoryDataValidator()
         self.sync_logger: Optional[SyncLogger] = None
+        self.product_index = get_product_index()
+        self.rate_limiter = get_rate_limiter()
         
     def connect_to_database(self):
         """Подключение к базе данных."""
@@ -207,9 +212,11 @@ class EnhancedInventorySyncService:
                 }
                 
                 try:
+                    self.rate_limiter.acquire('ozon')
                     request_start = time.time()
                     response = requests.post(url, json=payload, headers=headers, timeout=30)
                     request_time = time.time() - request_start
+                    self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
                     
                     # Логируем API запрос
                     if self.sync_logger:
@@ -311,7 +318,6 @@ class EnhancedInventorySyncService:
                         break
                     
                     offset += limit
-                    time.sleep(config.OZON_REQUEST_DELAY)  # Задержка между запросами
                     
                 except requests.exceptions.RequestException as e:
                     error_msg = f"Ошибка запроса к Ozon API: {e}"
@@ -497,9 +503,11 @@ class EnhancedInventorySyncService:
             memory_before = self.get_memory_usage()
             
             try:
+                self.rate_limiter.acquire('wb')
                 request_start = time.time()
                 response = requests.get(url, headers=headers, params=params, timeout=30)
                 request_time = time.time() - request_start
+                self.rate_limiter.update_from_response('wb', response.status_code, response.headers)
                 
                 # Логируем API запрос
                 if self.sync_logger:
@@ -597,8 +605,6 @@ class EnhancedInventorySyncService:
                         memory_usage_mb=memory_after - memory_before
                     )
                 
-                time.sleep(config.WB_REQUEST_DELAY)  # Задержка после запроса
-                
             except requests.exceptions.RequestException as e:
                 error_msg = f"Ошибка запроса к WB API: {e}"
                 if self.sync_logger:
@@ -800,9 +806,7 @@ class EnhancedInventorySyncService:
         if not sku_ozon:
             return None
         try:
-            self.cursor.execute("SELECT id FROM dim_products WHERE sku_ozon = %s", (sku_ozon,))
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_ozon_sku(sku_ozon, cursor=self.cursor)
         except Exception as e:
             if self.sync_logger:
                 self.sync_logger.log_error(f"Ошибка при поиске товара по sku_ozon {sku_ozon}: {e}")
@@ -813,9 +817,7 @@ class EnhancedInventorySyncService:
         if not sku_wb:
             return None
         try:
-            self.cursor.execute("SELECT id FROM dim_products WHERE sku_wb = %s", (str(sku_wb),))
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_wb_sku(sku_wb, cursor=self.cursor)
         except Exception as e:
             if self.sync_logger:
                 self.sync_logger.log_error(f"Ошибка при поиске товара по sku_wb {sku_wb}: {e}")
@@ -826,9 +828,7 @@ class EnhancedInventorySyncService:
         if not barcode:
             return None
         try:
-            self.cursor.execute("SELECT id FROM dim_products WHERE barcode = %s", (barcode,))
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            return self.product_index.get_product_id_by_barcode(barcode, cursor=self.cursor)
         except Exception as e:
             if self.sync_logger:
                 self.sync_logger.log_error(f"Ошибка при поиске товара по barcode {barcode}: {e}")
@@ -858,54 +858,9 @@ class EnhancedInventorySyncService:
             if self.sync_logger:
                 self.sync_logger.log_info(f"Удалено {deleted_count} старых записей для {source} за {today}")
             
-            # Подготавливаем запрос для вставки новых данных
-            insert_query = """
-                INSERT INTO inventory_data 
-                (product_id, sku, source, warehouse_name, stock_type, 
-                 snapshot_date, current_stock, reserved_stock, available_stock,
-                 quantity_present, quantity_reserved, last_sync_at)
-                VALUES (%(product_id)s, %(sku)s, %(source)s, %(warehouse_name)s, %(stock_type)s,
-                       %(snapshot_date)s, %(current_stock)s, %(reserved_stock)s, %(available_stock)s,
-                       %(quantity_present)s, %(quantity_reserved)s, NOW())
-            """
-            
-            # Вставляем новые данные пакетами
-            batch_size = 100
-            for i in range(0, len(inventory_records), batch_size):
-                batch = inventory_records[i:i + batch_size]
-                batch_data = []
-                
-                for record in batch:
-                    try:
-                        record_data = {
-                            'product_id': record.product_id,
-                            'sku': record.sku,
-                            'source': record.source,
-                            'warehouse_name': record.warehouse_name,
-                            'stock_type': record.stock_type,
-                            'snapshot_date': record.snapshot_date,
-                            'current_stock': record.current_stock,
-                            'reserved_stock': record.reserved_stock,
-                            'available_stock': record.available_stock,
-                            'quantity_present': record.quantity_present,
-                            'quantity_reserved': record.quantity_reserved
-                        }
-                        batch_data.append(record_data)
-                    except Exception as e:
-                        if self.sync_logger:
-                            self.sync_logger.log_error(f"Ошибка подготовки записи: {e}")
-                        failed_count += 1
-                
-                if batch_data:
-                    try:
-                        self.cursor.executemany(insert_query, batch_data)
-                        inserted_count += len(batch_data)
-                        if self.sync_logger:
-                            self.sync_logger.log_info(f"Вставлено {len(batch_data)} записей (батч {i//batch_size + 1})")
-                    except Exception as e:
-                        if self.sync_logger:
-                            self.sync_logger.log_error(f"Ошибка вставки батча: {e}")
-                        failed_count += len(batch_data)
+            # Вставляем новые данные пакетно (COPY/многострочный INSERT)
+            writer = InventoryBulkWriter(self.connection, sync_logger=self.sync_logger)
+            updated_count, inserted_count, failed_count = writer.insert_records(inventory_records).as_tuple()
             
             self.connection.commit()
             
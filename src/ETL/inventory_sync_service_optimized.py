@@ -23,7 +23,6 @@ from typing import List, Dict, Any, Optional, Tuple, Set
 from dataclasses import dataclass
 from enum import Enum
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
 from collections import defaultdict
 
 # Добавляем путь к корневой директории проекта
@@ -33,6 +32,8 @@ try:
     from importers.ozon_importer import connect_to_db
     import config
     from inventory_data_validator import InventoryDataValidator, ValidationResult
+    from product_resolution_index import ProductResolutionIndex, get_product_index
+    from rate_limiter import get_rate_limiter
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     sys.exit(1)
@@ -102,67 +103,8 @@ class SyncResult:
         return 0
 
 
-class ProductCache:
-    """Кэш для быстрого поиска товаров по SKU."""
-    
-    def __init__(self):
-        self._ozon_cache: Dict[str, int] = {}
-        self._wb_cache: Dict[str, int] = {}
-        self._barcode_cache: Dict[str, int] = {}
-        self._lock = threading.Lock()
-        self._loaded = False
-    
-    def load_cache(self, cursor) -> None:
-        """Загрузка кэша из базы данных."""
-        with self._lock:
-            if self._loaded:
-                return
-            
-            logger.info("🔄 Загружаем кэш товаров...")
-            
-            # Загружаем все товары одним запросом
-            cursor.execute("""
-                SELECT id, sku_ozon, sku_wb, barcode 
-                FROM dim_products 
-                WHERE sku_ozon IS NOT NULL OR sku_wb IS NOT NULL OR barcode IS NOT NULL
-            """)
-            
-            products = cursor.fetchall()
-            
-            for product in products:
-                product_id = product['id']
-                
-                if product['sku_ozon']:
-                    self._ozon_cache[product['sku_ozon']] = product_id
-                
-                if product['sku_wb']:
-                    self._wb_cache[str(product['sku_wb'])] = product_id
-                
-                if product['barcode']:
-                    self._barcode_cache[product['barcode']] = product_id
-            
-            self._loaded = True
-            logger.info(f"✅ Кэш загружен: Ozon={len(self._ozon_cache)}, WB={len(self._wb_cache)}, Barcode={len(self._barcode_cache)}")
-    
-    def get_product_id_by_ozon_sku(self, sku: str) -> Optional[int]:
-        """Получение product_id по SKU Ozon из кэша."""
-        return self._ozon_cache.get(sku)
-    
-    def get_product_id_by_wb_sku(self, sku: str) -> Optional[int]:
-        """Получение product_id по SKU Wildberries из кэша."""
-        return self._wb_cache.get(str(sku))
-    
-    def get_product_id_by_barcode(self, barcode: str) -> Optional[int]:
-        """Получение product_id по штрихкоду из кэша."""
-        return self._barcode_cache.get(barcode)
-    
-    def clear_cache(self) -> None:
-        """Очистка кэша."""
-        with self._lock:
-            self._ozon_cache.clear()
-            self._wb_cache.clear()
-            self._barcode_cache.clear()
-            self._loaded = False
+# Кэш товаров вынесен в общий индекс разрешения SKU (product_resolution_index)
+ProductCache = ProductResolutionIndex
 
 
 class OptimizedInventorySyncService:
@@ -179,7 +121,8 @@ class OptimizedInventorySyncService:
         self.connection = None
         self.cursor = None
         self.validator = InventoryDataValidator()
-        self.product_cache = ProductCache()
+        self.product_cache = get_product_index()
+        self.rate_limiter = get_rate_limiter()
         self.batch_size = batch_size
         self.max_workers = max_workers
         
@@ -464,7 +407,9 @@ class OptimizedInventorySyncService:
                 }
                 
                 try:
+                    await self.rate_limiter.acquire_async('ozon')
                     async with session.post(url, json=payload, headers=headers, timeout=30) as response:
+                        self.rate_limiter.update_from_response('ozon', response.status, response.headers)
                         response.raise_for_status()
                         data = await response.json()
                         items = data.get('result', {}).get('items', [])
@@ -479,7 +424,6 @@ class OptimizedInventorySyncService:
                             break
                         
                         offset += limit
-                        await asyncio.sleep(config.OZON_REQUEST_DELAY)
                         
                 except Exception as e:
                     logger.error(f"Ошибка запроса к Ozon API: {e}")
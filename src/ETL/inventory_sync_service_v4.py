@@ -18,8 +18,9 @@ import logging
 import requests
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Set
 from dataclasses import dataclass
 from enum import Enum
 
@@ -30,6 +31,9 @@ try:
     import config
     from inventory_data_validator import InventoryDataValidator, ValidationResult
     from sync_logger import SyncLogger, SyncType, SyncStatus as LogSyncStatus, ProcessingStats
+    from inventory_bulk_writer import InventoryBulkWriter
+    from product_resolution_index import get_product_index
+    from rate_limiter import get_rate_limiter
     import mysql.connector
     from dotenv import load_dotenv
 except ImportError as e:
@@ -63,6 +67,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Колонки ozon_warehouse_stock_details, обновляемые при конфликте, по источнику данных
+_MAIN_DETAIL_COLUMNS = ("product_id", "warehouse_name", "stock_type", "sku",
+                        "main_present", "main_reserved")
+_ANALYTICS_DETAIL_COLUMNS = ("analytics_free_to_sell", "analytics_promised",
+                             "analytics_reserved", "has_analytics_data")
+WAREHOUSE_DETAIL_UPDATE_COLUMNS = {
+    "all": _MAIN_DETAIL_COLUMNS + _ANALYTICS_DETAIL_COLUMNS,
+    "main": _MAIN_DETAIL_COLUMNS,
+    "analytics": _ANALYTICS_DETAIL_COLUMNS,
+}
+
 
 class SyncStatus(Enum):
     """Статусы синхронизации."""
@@ -257,10 +272,18 @@ class InventorySyncServiceV4:
         self.sync_logger: Optional[SyncLogger] = None
         self.warehouse_cache: Dict[int, OzonWarehouse] = {}
         self.warehouse_cache_updated: Optional[datetime] = None
+        self.product_index = get_product_index()
         self.api_retry_count = 0
         self.max_retries = 3
         self.base_delay = 1.0
         
+        # Конвейерная загрузка страниц v4 API
+        self.prefetch_pages = True
+        self.fetch_concurrency = 2
+        
+        # Общий для всех процессов rate limiter Ozon
+        self.rate_limiter = get_rate_limiter()
+        
     def connect_to_database(self):
         """Подключение к базе данных."""
         try:
@@ -384,6 +407,7 @@ class InventorySyncServiceV4:
                 if self.sync_logger:
                     self.sync_logger.log_info(f"API запрос (попытка {attempt}/{self.max_retries}): {url}")
                 
+                self.rate_limiter.acquire('ozon')
                 request_start = time.time()
                 
                 if method.upper() == "POST":
@@ -392,6 +416,7 @@ class InventorySyncServiceV4:
                     response = requests.get(url, headers=headers, timeout=30)
                 
                 request_time = time.time() - request_start
+                self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
                 
                 # Логируем запрос
                 if self.sync_logger:
@@ -683,6 +708,90 @@ class InventorySyncServiceV4:
                 self.sync_logger.log_error(error_msg)
             raise
 
+    def _fetch_stock_page(self, cursor: Optional[str], offer_ids: Optional[List[str]],
+                          visibility: str, limit: int) -> Dict[str, Any]:
+        """Загрузка одной страницы v4 API (лимит запросов соблюдается в make_api_request_with_retry)."""
+        return self.get_ozon_stocks_v4(cursor=cursor, offer_ids=offer_ids,
+                                       visibility=visibility, limit=limit)
+
+    def iter_ozon_stock_pages(self, offer_ids: List[str] = None, visibility: str = "ALL",
+                              limit: int = 1000, prefetch: bool = None,
+                              max_concurrency: int = None) -> Iterator[Dict[str, Any]]:
+        """
+        Итератор по страницам v4 API с предзагрузкой следующей страницы.
+        
+        Пока вызывающий код обрабатывает текущую страницу, следующая страница
+        того же курсора уже запрашивается в фоновом потоке. Список offer_ids
+        делится на шарды по 100 (лимит фильтра API), и до max_concurrency
+        шардов пагинируются одновременно. Паузы между запросами соблюдаются
+        для всех потоков вместе.
+        
+        Args:
+            offer_ids: Список offer_id для фильтрации (опционально)
+            visibility: Фильтр по видимости товаров
+            limit: Количество товаров на странице
+            prefetch: Включить предзагрузку (по умолчанию self.prefetch_pages)
+            max_concurrency: Число одновременных курсоров (по умолчанию self.fetch_concurrency)
+            
+        Yields:
+            Dict: Ответ get_ozon_stocks_v4 для каждой непустой страницы
+        """
+        if prefetch is None:
+            prefetch = self.prefetch_pages
+        if max_concurrency is None:
+            max_concurrency = self.fetch_concurrency
+        
+        if offer_ids:
+            shards = [offer_ids[i:i + 100] for i in range(0, len(offer_ids), 100)]
+        else:
+            shards = [None]
+        
+        if not prefetch:
+            # Последовательный режим: запрос, обработка, следующий запрос
+            for shard in shards:
+                cursor = None
+                while True:
+                    page = self._fetch_stock_page(cursor, shard, visibility, limit)
+                    if not page.get("items"):
+                        break
+                    yield page
+                    cursor = page.get("last_id")
+                    if not page.get("has_next", False) or not cursor:
+                        break
+            return
+        
+        pending_shards = list(shards)
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency),
+                                      thread_name_prefix="ozon-v4-fetch")
+        try:
+            while pending_shards or in_flight:
+                # Запускаем новые шарды в пределах лимита параллельности
+                while pending_shards and len(in_flight) < max(1, max_concurrency):
+                    shard = pending_shards.pop(0)
+                    future = executor.submit(self._fetch_stock_page, None, shard, visibility, limit)
+                    in_flight[future] = shard
+                
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = in_flight.pop(future)
+                    page = future.result()
+                    if not page.get("items"):
+                        continue
+                    
+                    # Запрашиваем следующую страницу до отдачи текущей на обработку
+                    cursor = page.get("last_id")
+                    if page.get("has_next", False) and cursor:
+                        next_future = executor.submit(self._fetch_stock_page, cursor, shard,
+                                                      visibility, limit)
+                        in_flight[next_future] = shard
+                    
+                    yield page
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
+
     def get_ozon_warehouses(self) -> List[OzonWarehouse]:
         """
         Получение списка складов Ozon через API.
@@ -1028,27 +1137,13 @@ class InventorySyncServiceV4:
             Полный список аналитических данных об остатках
         """
         all_analytics_stocks = []
-        offset = 0
-        limit = 1000
         
         try:
             if self.sync_logger:
                 self.sync_logger.log_info("Начинаем получение всех аналитических данных с пагинацией")
             
-            while True:
-                result = self.get_ozon_analytics_stocks(date_from, date_to, limit, offset)
-                analytics_stocks = result["analytics_stocks"]
-                has_next = result["has_next"]
-                
+            for analytics_stocks in self.iter_ozon_analytics_stock_pages(date_from, date_to):
                 all_analytics_stocks.extend(analytics_stocks)
-                
-                if not has_next:
-                    break
-                
-                offset = result["next_offset"]
-                
-                # Небольшая задержка между запросами для соблюдения rate limits
-                time.sleep(0.5)
             
             if self.sync_logger:
                 self.sync_logger.log_info(f"Получено всего {len(all_analytics_stocks)} записей аналитических данных")
@@ -1061,6 +1156,33 @@ class InventorySyncServiceV4:
                 self.sync_logger.log_error(error_msg)
             raise
 
+    def iter_ozon_analytics_stock_pages(self, date_from: str = None, 
+                                        date_to: str = None) -> Iterator[List[OzonAnalyticsStock]]:
+        """
+        Постраничный итератор по аналитическим данным об остатках.
+        
+        Args:
+            date_from: Дата начала периода (YYYY-MM-DD)
+            date_to: Дата окончания периода (YYYY-MM-DD)
+            
+        Yields:
+            List[OzonAnalyticsStock]: Аналитические данные одной страницы
+        """
+        offset = 0
+        limit = 1000
+        
+        while True:
+            result = self.get_ozon_analytics_stocks(date_from, date_to, limit, offset)
+            yield result["analytics_stocks"]
+            
+            if not result["has_next"]:
+                break
+            
+            offset = result["next_offset"]
+            
+            # Небольшая задержка между запросами для соблюдения rate limits
+            time.sleep(0.5)
+
     def create_stock_mapping(self, main_stocks: List[OzonStockRecord], 
                            analytics_stocks: List[OzonAnalyticsStock]) -> Dict[str, Dict]:
         """
@@ -1141,7 +1263,9 @@ class InventorySyncServiceV4:
     def sync_ozon_inventory_combined(self, offer_ids: List[str] = None, 
                                    visibility: str = "ALL", 
                                    include_analytics: bool = True,
-                                   fallback_on_error: bool = True) -> SyncResult:
+                                   fallback_on_error: bool = True,
+                                   streaming: bool = False,
+                                   flush_size: int = 5000) -> SyncResult:
         """
         Оптимизированная синхронизация остатков с комбинированным использованием API.
         
@@ -1156,10 +1280,17 @@ class InventorySyncServiceV4:
             visibility: Фильтр по видимости товаров
             include_analytics: Включать ли аналитические данные
             fallback_on_error: Использовать ли fallback при ошибках
+            streaming: Потоковый режим с постоянным потреблением памяти
+                       (см. sync_ozon_inventory_streaming)
+            flush_size: Размер батча записи в потоковом режиме
             
         Returns:
             SyncResult: Результат синхронизации
         """
+        if streaming:
+            return self.sync_ozon_inventory_streaming(offer_ids, visibility, include_analytics,
+                                                      fallback_on_error, flush_size)
+        
         started_at = datetime.now()
         
         # Начинаем сессию логирования
@@ -1181,27 +1312,16 @@ class InventorySyncServiceV4:
             
             main_stocks = []
             try:
-                cursor = None
-                while True:
-                    result = self.get_ozon_stocks_v4(cursor, offer_ids, visibility)
+                # Следующая страница загружается, пока обрабатывается текущая
+                for result in self.iter_ozon_stock_pages(offer_ids, visibility):
                     api_requests += 1
                     
                     items = result.get("items", [])
-                    if not items:
-                        break
                     
                     # Обрабатываем полученные данные
                     batch_stocks = self.process_ozon_v4_stocks(items)
                     main_stocks.extend(batch_stocks)
                     records_processed += len(items)
-                    
-                    # Проверяем наличие следующей страницы
-                    if not result.get("has_next", False):
-                        break
-                    
-                    cursor = result.get("last_id")
-                    if not cursor:
-                        break
                 
                 main_api_success = True
                 if self.sync_logger:
@@ -1401,6 +1521,344 @@ class InventorySyncServiceV4:
                 api_requests_count=api_requests
             )
 
+    def sync_ozon_inventory_streaming(self, offer_ids: List[str] = None,
+                                      visibility: str = "ALL",
+                                      include_analytics: bool = True,
+                                      fallback_on_error: bool = True,
+                                      flush_size: int = 5000) -> SyncResult:
+        """
+        Потоковая синхронизация остатков Ozon.
+        
+        Страницы API проходят через цепочку генераторов (обработка → конвертация →
+        батчи) и записываются в БД по мере накопления flush_size записей, поэтому
+        в памяти одновременно находятся только страницы в полете и один буфер.
+        Аналитические данные читаются после основного прохода тоже постранично:
+        детализация по складам объединяется с основными данными в БД (каждый
+        проход обновляет только свои колонки), а product_id для записей
+        Ozon_Analytics берется из детализации основного прохода или индекса
+        товаров. Сравнение основного и аналитического API требует полного набора
+        данных и в этом режиме не выполняется.
+        
+        Args:
+            offer_ids: Список offer_id для фильтрации (опционально)
+            visibility: Фильтр по видимости товаров
+            include_analytics: Записывать ли аналитические данные
+            fallback_on_error: Переключаться ли на v3 API при ошибке v4
+            flush_size: Количество записей в одном батче записи
+            
+        Returns:
+            SyncResult: Результат синхронизации
+        """
+        started_at = datetime.now()
+        flush_size = max(1, flush_size)
+        
+        if self.sync_logger:
+            self.sync_logger.start_sync_session(SyncType.INVENTORY, "Ozon_Combined")
+            self.sync_logger.log_info(f"Начинаем потоковую синхронизацию остатков с Ozon (батч {flush_size})")
+        
+        counters = {
+            'records_processed': 0,
+            'records_inserted': 0,
+            'records_updated': 0,
+            'records_failed': 0,
+            'api_requests': 0
+        }
+        analytics_api_success = False
+        writer = InventoryBulkWriter(self.connection, sync_logger=self.sync_logger,
+                                     batch_size=flush_size)
+        
+        try:
+            # Счетчики до основного прохода: при fallback проход v3 считается с них заново
+            baseline = dict(counters)
+            
+            try:
+                pages = self.iter_ozon_stock_pages(offer_ids, visibility)
+                for stocks, records in self._iter_inventory_batches(pages, counters, flush_size):
+                    self._flush_inventory_batch(stocks, records, writer, counters)
+            
+            except Exception as e:
+                if self.sync_logger:
+                    self.sync_logger.log_error(f"Ошибка основного API v4: {e}")
+                if not fallback_on_error:
+                    raise
+                
+                # Повторный проход через v3 API: записи идемпотентны (UPSERT), поэтому
+                # уже записанные страницы v4 перезаписываются и в счетчиках не дублируются
+                v4_requests = counters['api_requests'] - baseline['api_requests']
+                counters.update(baseline)
+                
+                if self.sync_logger:
+                    self.sync_logger.log_info("Используем fallback к v3 API")
+                pages = self._iter_v3_pages_as_v4(visibility)
+                for stocks, records in self._iter_inventory_batches(pages, counters, flush_size):
+                    self._flush_inventory_batch(stocks, records, writer, counters)
+                
+                v3_requests = counters['api_requests'] - baseline['api_requests']
+                counters['api_requests'] += v4_requests
+                if self.sync_logger:
+                    self.sync_logger.log_info(
+                        f"Запросов к основному API: v4 - {v4_requests} (прерван), v3 - {v3_requests}"
+                    )
+            
+            if include_analytics:
+                analytics_api_success = self._sync_analytics_pages(writer, counters, flush_size)
+            
+            records_written = counters['records_inserted'] + counters['records_updated']
+            if records_written > 0:
+                if analytics_api_success or not include_analytics:
+                    status, log_status = SyncStatus.SUCCESS, LogSyncStatus.SUCCESS
+                else:
+                    status, log_status = SyncStatus.PARTIAL, LogSyncStatus.PARTIAL
+            else:
+                status, log_status = SyncStatus.FAILED, LogSyncStatus.FAILED
+            
+            if self.sync_logger:
+                self.sync_logger.update_sync_counters(
+                    records_processed=counters['records_processed'],
+                    records_updated=counters['records_updated'],
+                    records_inserted=counters['records_inserted'],
+                    records_failed=counters['records_failed']
+                )
+                self.sync_logger.end_sync_session(status=log_status)
+                self.sync_logger.log_info(f"Потоковая синхронизация завершена: {status.value}")
+            
+            return SyncResult(
+                source="Ozon_Combined",
+                status=status,
+                records_processed=counters['records_processed'],
+                records_updated=counters['records_updated'],
+                records_inserted=counters['records_inserted'],
+                records_failed=counters['records_failed'],
+                started_at=started_at,
+                completed_at=datetime.now(),
+                api_requests_count=counters['api_requests']
+            )
+            
+        except Exception as e:
+            error_msg = f"Критическая ошибка потоковой синхронизации: {e}"
+            if self.sync_logger:
+                self.sync_logger.log_error(error_msg)
+                self.sync_logger.end_sync_session(status=LogSyncStatus.FAILED, error_message=error_msg)
+            
+            return SyncResult(
+                source="Ozon_Combined",
+                status=SyncStatus.FAILED,
+                records_processed=counters['records_processed'],
+                records_updated=counters['records_updated'],
+                records_inserted=counters['records_inserted'],
+                records_failed=counters['records_failed'],
+                started_at=started_at,
+                completed_at=datetime.now(),
+                error_message=error_msg,
+                api_requests_count=counters['api_requests']
+            )
+
+    def _iter_v3_pages_as_v4(self, visibility: str) -> Iterator[Dict[str, Any]]:
+        """Постраничный обход v3 API с конвертацией товаров в формат v4."""
+        cursor = None
+        while True:
+            result = self.get_ozon_stocks_v3(cursor, 1000, visibility)
+            items = result.get("items", [])
+            if not items:
+                break
+            
+            yield {"items": self._convert_v3_to_v4_format(items)}
+            
+            cursor = result.get("last_id")
+            if not result.get("has_next", False) or not cursor:
+                break
+
+    def _iter_inventory_batches(self, pages: Iterator[Dict[str, Any]], counters: Dict[str, int],
+                                flush_size: int) -> Iterator[Tuple[List[OzonStockRecord], List[InventoryRecord]]]:
+        """
+        Генератор батчей: страницы → OzonStockRecord → InventoryRecord.
+        
+        Буфер отдается, как только в нем набирается flush_size записей,
+        поэтому его размер ограничен flush_size плюс одна страница.
+        """
+        buffer_stocks: List[OzonStockRecord] = []
+        buffer_records: List[InventoryRecord] = []
+        
+        for page in pages:
+            counters['api_requests'] += 1
+            items = page.get("items", [])
+            counters['records_processed'] += len(items)
+            
+            stocks = self.process_ozon_v4_stocks(items)
+            buffer_stocks.extend(stocks)
+            buffer_records.extend(self.convert_to_inventory_records(stocks))
+            
+            if len(buffer_records) >= flush_size:
+                yield buffer_stocks, buffer_records
+                buffer_stocks, buffer_records = [], []
+        
+        if buffer_records:
+            yield buffer_stocks, buffer_records
+
+    def _flush_inventory_batch(self, stocks: List[OzonStockRecord], records: List[InventoryRecord],
+                               writer: InventoryBulkWriter, counters: Dict[str, int]) -> None:
+        """Валидация и запись одного батча, сохранение основных колонок детализации по складам."""
+        validation_result = self.validate_inventory_data(records, 'Ozon')
+        valid_records = self.filter_valid_records(records, validation_result)
+        counters['records_failed'] += len(records) - len(valid_records)
+        
+        if valid_records:
+            try:
+                result = writer.upsert_records(valid_records)
+                self.connection.commit()
+                counters['records_inserted'] += result.inserted
+                counters['records_updated'] += result.updated
+                counters['records_failed'] += result.failed
+            except Exception as e:
+                self.connection.rollback()
+                counters['records_failed'] += len(valid_records)
+                if self.sync_logger:
+                    self.sync_logger.log_error(f"Ошибка записи батча из {len(valid_records)} записей: {e}")
+        
+        try:
+            # Аналитические колонки не трогаем: их обновляет проход аналитики
+            self.save_warehouse_stock_details(self.create_stock_mapping(stocks, []), scope='main')
+        except Exception as e:
+            if self.sync_logger:
+                self.sync_logger.log_warning(f"Ошибка сохранения детализации по складам: {e}")
+
+    def _sync_analytics_pages(self, writer: InventoryBulkWriter, counters: Dict[str, int],
+                              flush_size: int) -> bool:
+        """
+        Постраничная запись аналитики после основного прохода потоковой синхронизации.
+        
+        Каждая страница сразу сохраняется в аналитические колонки детализации и
+        как записи Ozon_Analytics, поэтому в памяти находится одна страница.
+        Перед первой страницей аналитические колонки сегодняшнего снимка
+        сбрасываются, чтобы не оставались данные предыдущего запуска.
+        
+        Returns:
+            bool: True если все страницы аналитического API получены
+        """
+        snapshot_reset = False
+        pages_written = 0
+        records_total = 0
+        records_resolved = 0
+        
+        try:
+            for analytics_page in self.iter_ozon_analytics_stock_pages():
+                counters['api_requests'] += 1
+                if not analytics_page:
+                    continue
+                
+                if not snapshot_reset:
+                    self._reset_warehouse_analytics(date.today())
+                    snapshot_reset = True
+                
+                try:
+                    self.save_warehouse_stock_details(self.create_stock_mapping([], analytics_page),
+                                                      scope='analytics')
+                except Exception as e:
+                    if self.sync_logger:
+                        self.sync_logger.log_warning(f"Ошибка сохранения детализации по складам: {e}")
+                
+                records = self.convert_analytics_to_inventory_records(analytics_page)
+                product_ids = self._resolve_analytics_product_ids({record.sku for record in records})
+                
+                resolved_records = []
+                for record in records:
+                    product_id = product_ids.get(record.sku)
+                    if not product_id:
+                        counters['records_failed'] += 1
+                        if self.sync_logger:
+                            self.sync_logger.log_warning(f"Аналитическая запись пропущена: товар {record.sku} не найден")
+                        continue
+                    record.product_id = product_id
+                    resolved_records.append(record)
+                
+                for start in range(0, len(resolved_records), flush_size):
+                    batch = resolved_records[start:start + flush_size]
+                    try:
+                        result = writer.upsert_records(batch)
+                        self.connection.commit()
+                        counters['records_inserted'] += result.inserted
+                        counters['records_updated'] += result.updated
+                        counters['records_failed'] += result.failed
+                    except Exception as e:
+                        self.connection.rollback()
+                        counters['records_failed'] += len(batch)
+                        if self.sync_logger:
+                            self.sync_logger.log_error(f"Ошибка записи {len(batch)} аналитических записей: {e}")
+                
+                pages_written += 1
+                records_total += len(records)
+                records_resolved += len(resolved_records)
+        
+        except Exception as e:
+            # Аналитические данные не критичны: уже записанные страницы остаются
+            if self.sync_logger:
+                self.sync_logger.log_error(f"Ошибка аналитического API: {e}")
+            return False
+        
+        finally:
+            if self.sync_logger:
+                self.sync_logger.log_info(f"Аналитические данные: {pages_written} страниц, записано "
+                                          f"{records_resolved} из {records_total} записей Ozon_Analytics")
+        
+        return True
+
+    def _reset_warehouse_analytics(self, snapshot_date: date) -> None:
+        """Сброс аналитических колонок детализации по складам за дату снимка."""
+        try:
+            self.cursor.execute("""
+                UPDATE ozon_warehouse_stock_details
+                SET analytics_free_to_sell = 0, analytics_promised = 0,
+                    analytics_reserved = 0, has_analytics_data = FALSE
+                WHERE snapshot_date = %s AND has_analytics_data = TRUE
+            """, (snapshot_date,))
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            if self.sync_logger:
+                self.sync_logger.log_warning(f"Не удалось сбросить аналитику детализации за {snapshot_date}: {e}")
+
+    def _resolve_analytics_product_ids(self, offer_ids: Set[str]) -> Dict[str, int]:
+        """
+        product_id для offer_id одной страницы аналитики.
+        
+        Сначала берется product_id основного API из сегодняшней детализации
+        по складам (один запрос на страницу), для остальных offer_id -
+        индекс товаров (sku_ozon, затем sku_internal).
+        """
+        offer_ids = {offer_id for offer_id in offer_ids if offer_id}
+        if not offer_ids:
+            return {}
+        
+        product_ids: Dict[str, int] = {}
+        try:
+            placeholders = ', '.join(['%s'] * len(offer_ids))
+            self.cursor.execute(f"""
+                SELECT offer_id, MAX(product_id) AS product_id
+                FROM ozon_warehouse_stock_details
+                WHERE snapshot_date = %s AND product_id <> 0 AND offer_id IN ({placeholders})
+                GROUP BY offer_id
+            """, (date.today(), *offer_ids))
+            for row in self.cursor.fetchall():
+                if isinstance(row, dict):
+                    product_ids[row['offer_id']] = row['product_id']
+                else:
+                    product_ids[row[0]] = row[1]
+        except Exception as e:
+            if self.sync_logger:
+                self.sync_logger.log_warning(f"Ошибка чтения product_id из детализации по складам: {e}")
+        
+        for key in ('sku_ozon', 'sku_internal'):
+            missing = offer_ids - product_ids.keys()
+            if not missing:
+                break
+            try:
+                product_ids.update(self.product_index.resolve_many(key, missing, cursor=self.cursor))
+            except Exception as e:
+                if self.sync_logger:
+                    self.sync_logger.log_error(f"Ошибка поиска товаров по {key}: {e}")
+        
+        return product_ids
+
     def _convert_v3_to_v4_format(self, v3_items: List[Dict]) -> List[Dict]:
         """
         Конвертация данных из v3 API в формат v4 API для совместимости.
@@ -1666,13 +2124,22 @@ class InventorySyncServiceV4:
         
         return unified_structure
 
-    def save_warehouse_stock_details(self, stock_mapping: Dict[str, Dict]) -> None:
+    def save_warehouse_stock_details(self, stock_mapping: Dict[str, Dict], scope: str = "all") -> None:
         """
         Сохранение детализации по конкретным складам в БД.
         
         Args:
             stock_mapping: Маппинг с объединенными данными по товарам и складам
+            scope: Какие колонки обновлять у существующей записи: "all",
+                "main" (только данные основного API) или "analytics"
+                (только данные аналитического API)
         """
+        if scope not in WAREHOUSE_DETAIL_UPDATE_COLUMNS:
+            raise ValueError(f"Неизвестная область обновления детализации: {scope}")
+        update_clause = ",\n                        ".join(
+            f"{column} = VALUES({column})" for column in WAREHOUSE_DETAIL_UPDATE_COLUMNS[scope]
+        )
+        
         try:
             if self.sync_logger:
                 self.sync_logger.log_info(f"Сохраняем детализацию по {len(stock_mapping)} складам в БД")
@@ -1711,23 +2178,14 @@ class InventorySyncServiceV4:
             
             for key, stock_data in stock_mapping.items():
                 try:
-                    upsert_query = """
+                    upsert_query = f"""
                     INSERT INTO ozon_warehouse_stock_details 
                     (offer_id, product_id, warehouse_id, warehouse_name, stock_type, sku,
                      main_present, main_reserved, analytics_free_to_sell, analytics_promised,
                      analytics_reserved, has_analytics_data, snapshot_date)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     ON DUPLICATE KEY UPDATE
-                        product_id = VALUES(product_id),
-                        warehouse_name = VALUES(warehouse_name),
-                        stock_type = VALUES(stock_type),
-                        sku = VALUES(sku),
-                        main_present = VALUES(main_present),
-                        main_reserved = VALUES(main_reserved),
-                        analytics_free_to_sell = VALUES(analytics_free_to_sell),
-                        analytics_promised = VALUES(analytics_promised),
-                        analytics_reserved = VALUES(analytics_reserved),
-                        has_analytics_data = VALUES(has_analytics_data),
+                        {update_clause},
                         updated_at = CURRENT_TIMESTAMP
                     """
                     
@@ -2164,29 +2622,12 @@ class InventorySyncServiceV4:
                     self.sync_logger.log_warning(f"Ошибка обновления складов: {e}")
                 # Продолжаем выполнение без складов
             
-            cursor = None
-            page = 1
-            
-            # Пагинация через cursor
-            while True:
-                if self.sync_logger:
-                    self.sync_logger.log_info(f"Обрабатываем страницу {page}, cursor: {cursor}")
-                
-                # Получаем данные с API
-                api_response = self.get_ozon_stocks_v4(
-                    cursor=cursor,
-                    visibility=visibility,
-                    limit=1000
-                )
-                
+            # Пагинация через cursor с предзагрузкой следующей страницы
+            for page, api_response in enumerate(
+                    self.iter_ozon_stock_pages(offer_ids, visibility, limit=1000), start=1):
                 api_requests += 1
                 items = api_response["items"]
                 
-                if not items:
-                    if self.sync_logger:
-                        self.sync_logger.log_info("Больше нет товаров для обработки")
-                    break
-                
                 # Обрабатываем полученные данные
                 batch_start = time.time()
                 stock_records = self.process_ozon_v4_stocks(items)
@@ -2202,18 +2643,9 @@ class InventorySyncServiceV4:
                         len(stock_records),
                         batch_time
                     )
-                
-                # Проверяем, есть ли еще страницы
-                if not api_response["has_next"]:
-                    if self.sync_logger:
-                        self.sync_logger.log_info("Достигнута последняя страница")
-                    break
-                
-                cursor = api_response["last_id"]
-                page += 1
-                
-                # Задержка между запросами
-                time.sleep(config.OZON_REQUEST_DELAY)
+            
+            if self.sync_logger:
+                self.sync_logger.log_info("Достигнута последняя страница")
             
             # Конвертируем в универсальный формат
             if self.sync_logger:
@@ -2412,14 +2844,8 @@ class InventorySyncServiceV4:
             product_id или None если не найден
         """
         try:
-            query = """
-            SELECT id FROM dim_products 
-            WHERE sku_ozon = %s OR sku_internal = %s
-            LIMIT 1
-            """
-            self.cursor.execute(query, (offer_id, offer_id))
-            result = self.cursor.fetchone()
-            return result['id'] if result else None
+            # Индекс в памяти; в БД уходят только промахи
+            return self.product_index.get_product_id_by_offer_id(offer_id, cursor=self.cursor)
         except Exception as e:
             if self.sync_logger:
                 self.sync_logger.log_error(f"Ошибка поиска товара по offer_id {offer_id}: {e}")
@@ -2447,68 +2873,26 @@ class InventorySyncServiceV4:
         """
         Обновление данных об остатках в БД.
         
+        Записи пишутся пакетно через InventoryBulkWriter: ошибочные строки
+        отсекаются делением батча, остальные сохраняются.
+        
         Returns:
             Tuple[updated_count, inserted_count, failed_count]
         """
-        updated_count = 0
-        inserted_count = 0
-        failed_count = 0
+        if not records:
+            return 0, 0, 0
         
         try:
-            for record in records:
-                try:
-                    # UPSERT запрос для обновления/вставки данных
-                    query = """
-                    INSERT INTO inventory_data 
-                    (product_id, sku, source, warehouse_name, stock_type, 
-                     current_stock, reserved_stock, available_stock, 
-                     quantity_present, quantity_reserved, snapshot_date, last_sync_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                    ON DUPLICATE KEY UPDATE
-                        current_stock = VALUES(current_stock),
-                        reserved_stock = VALUES(reserved_stock),
-                        available_stock = VALUES(available_stock),
-                        quantity_present = VALUES(quantity_present),
-                        quantity_reserved = VALUES(quantity_reserved),
-                        snapshot_date = VALUES(snapshot_date),
-                        last_sync_at = NOW()
-                    """
-                    
-                    self.cursor.execute(query, (
-                        record.product_id,
-                        record.sku,
-                        record.source,
-                        record.warehouse_name,
-                        record.stock_type,
-                        record.current_stock,
-                        record.reserved_stock,
-                        record.available_stock,
-                        record.quantity_present,
-                        record.quantity_reserved,
-                        record.snapshot_date
-                    ))
-                    
-                    if self.cursor.rowcount > 0:
-                        if self.cursor.lastrowid:
-                            inserted_count += 1
-                        else:
-                            updated_count += 1
-                    
-                except Exception as e:
-                    if self.sync_logger:
-                        self.sync_logger.log_error(f"Ошибка сохранения записи для товара {record.sku}: {e}")
-                    failed_count += 1
-            
+            writer = InventoryBulkWriter(self.connection, sync_logger=self.sync_logger)
+            result = writer.upsert_records(records)
             self.connection.commit()
+            return result.as_tuple()
             
         except Exception as e:
             self.connection.rollback()
             if self.sync_logger:
                 self.sync_logger.log_error(f"Ошибка транзакции при сохранении данных: {e}")
-            failed_count = len(records)
-        
-        return updated_count, inserted_count, failed_count
-
+            return 0, 0, len(records)
 
 def main():
     """Основная функция для тестирования."""
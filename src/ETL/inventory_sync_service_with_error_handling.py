@@ -13,9 +13,9 @@ import os
 import sys
 import logging
 import requests
-import time
+import threading
 from datetime import datetime, date
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from dataclasses import dataclass
 from enum import Enum
 
@@ -49,6 +49,12 @@ class SyncStatus(Enum):
     PARTIAL = "partial"
     FAILED = "failed"
     FALLBACK = "fallback"
+    CANCELLED = "cancelled"
+
+
+class SyncCancelledError(Exception):
+    """Синхронизация отменена по запросу (cancel_event)."""
+    pass
 
 
 @dataclass
@@ -137,6 +143,10 @@ class RobustInventorySyncService:
         self.recovery_manager: Optional[DataRecoveryManager] = None
         self.fallback_manager: Optional[FallbackManager] = None
         
+        # Отчет о прогрессе (source, счетчики) и флаг отмены - задаются вызывающим кодом
+        self.progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None
+        self.cancel_event: Optional[threading.Event] = None
+        
     def connect_to_database(self):
         """Подключение к базе данных."""
         try:
@@ -212,6 +222,52 @@ class RobustInventorySyncService:
             logger.error(f"❌ Ошибка при поиске товара по barcode {barcode}: {e}")
             return None
 
+    def report_progress(self, source: str, check_cancel: bool = True, **progress):
+        """
+        Сообщить о прогрессе синхронизации и проверить запрос на отмену.
+        
+        Ошибка обработчика прогресса не прерывает синхронизацию.
+        
+        Args:
+            source: Источник данных
+            check_cancel: Проверять запрос на отмену (False - после записи в БД)
+            **progress: Поля прогресса для обработчика
+        
+        Raises:
+            SyncCancelledError: Если установлен cancel_event и check_cancel
+        """
+        if check_cancel and self.cancel_event is not None and self.cancel_event.is_set():
+            raise SyncCancelledError(f"Синхронизация {source} отменена")
+        
+        if self.progress_callback:
+            try:
+                self.progress_callback(source, progress)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка обработчика прогресса: {e}")
+    
+    def _cancelled_result(self, source: str, error: SyncCancelledError, started_at: datetime,
+                          records_processed: int, records_inserted: int, records_failed: int,
+                          api_requests: int, recovery_actions: List[str]) -> SyncResult:
+        """Результат отмененной синхронизации."""
+        logger.warning(f"⏹️ {error}")
+        if self.sync_logger:
+            self.sync_logger.log_warning(str(error))
+            self.sync_logger.end_sync_session(status=LogSyncStatus.FAILED, error_message=str(error))
+        
+        return SyncResult(
+            source=source,
+            status=SyncStatus.CANCELLED,
+            records_processed=records_processed,
+            records_updated=0,
+            records_inserted=records_inserted,
+            records_failed=records_failed,
+            started_at=started_at,
+            completed_at=datetime.now(),
+            error_message=str(error),
+            api_requests_count=api_requests,
+            recovery_actions=recovery_actions
+        )
+    
     def make_api_request(self, method: str, url: str, source: str, **kwargs) -> Tuple[Optional[requests.Response], Optional[ErrorContext]]:
         """
         Выполнение API запроса с обработкой ошибок.
@@ -276,11 +332,12 @@ class RobustInventorySyncService:
             
             offset = 0
             limit = 1000
+            last_id = ""
             
             while True:
                 payload = {
                     "filter": {},
-                    "last_id": "",
+                    "last_id": last_id,
                     "limit": limit
                 }
                 
@@ -396,12 +453,22 @@ class RobustInventorySyncService:
                             self.sync_logger.log_error(error_msg)
                         records_failed += 1
                 
+                self.report_progress(
+                    source, stage='fetching', pages_fetched=api_requests,
+                    records_processed=records_processed, records_failed=records_failed
+                )
+                
                 # Если получили меньше лимита, значит это последняя страница
-                if len(items) < limit:
+                last_id = data.get('result', {}).get('last_id', '')
+                if len(items) < limit or not last_id:
                     break
                 
                 offset += limit
-                time.sleep(config.OZON_REQUEST_DELAY)
+            
+            self.report_progress(
+                source, stage='writing', pages_fetched=api_requests,
+                records_processed=records_processed, records_failed=records_failed
+            )
             
             # Валидация и сохранение данных
             if inventory_records:
@@ -413,6 +480,13 @@ class RobustInventorySyncService:
                     records_inserted = inserted
                     records_failed += failed + (len(inventory_records) - len(valid_records))
                     
+                    # Данные уже записаны: отмена на этом этапе не проверяется
+                    self.report_progress(source, check_cancel=False, stage='written',
+                                         pages_fetched=api_requests,
+                                         records_processed=records_processed,
+                                         records_written=records_inserted,
+                                         records_failed=records_failed)
+                    
                     success_msg = (f"Синхронизация Ozon завершена: обработано {records_processed}, "
                                  f"валидных {len(valid_records)}, вставлено {records_inserted}, ошибок {records_failed}")
                     if self.sync_logger:
@@ -457,6 +531,12 @@ class RobustInventorySyncService:
                 recovery_actions=recovery_actions
             )
             
+        except SyncCancelledError as e:
+            return self._cancelled_result(
+                source, e, started_at, records_processed, records_inserted,
+                records_failed, api_requests, recovery_actions
+            )
+            
         except Exception as e:
             error_msg = f"Критическая ошибка синхронизации Ozon: {e}"
             if self.sync_logger:
@@ -582,6 +662,7 @@ class RobustInventorySyncService:
                 data = []
             
             logger.info(f"Получено {len(data)} записей остатков с Wildberries")
+            self.report_progress(source, stage='fetching', pages_fetched=api_requests, records_processed=0)
             
             # Обрабатываем каждую запись
             for item in data:
@@ -634,6 +715,11 @@ class RobustInventorySyncService:
                         self.sync_logger.log_error(error_msg)
                     records_failed += 1
             
+            self.report_progress(
+                source, stage='writing', pages_fetched=api_requests,
+                records_processed=records_processed, records_failed=records_failed
+            )
+            
             # Валидация и сохранение данных
             if inventory_records:
                 validation_result = self.validate_inventory_data(inventory_records, source)
@@ -644,6 +730,13 @@ class RobustInventorySyncService:
                     records_inserted = inserted
                     records_failed += failed + (len(inventory_records) - len(valid_records))
                     
+                    # Данные уже записаны: отмена на этом этапе не проверяется
+                    self.report_progress(source, check_cancel=False, stage='written',
+                                         pages_fetched=api_requests,
+                                         records_processed=records_processed,
+                                         records_written=records_inserted,
+                                         records_failed=records_failed)
+                    
                     success_msg = (f"Синхронизация Wildberries завершена: обработано {records_processed}, "
                                  f"валидных {len(valid_records)}, вставлено {records_inserted}, ошибок {records_failed}")
                     if self.sync_logger:
@@ -688,6 +781,12 @@ class RobustInventorySyncService:
                 recovery_actions=recovery_actions
             )
             
+        except SyncCancelledError as e:
+            return self._cancelled_result(
+                source, e, started_at, records_processed, records_inserted,
+                records_failed, api_requests, recovery_actions
+            )
+            
         except Exception as e:
             error_msg = f"Критическая ошибка синхронизации Wildberries: {e}"
             if self.sync_logger:
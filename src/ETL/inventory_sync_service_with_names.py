@@ -16,7 +16,6 @@ import os
 import sys
 import logging
 import requests
-import time
 import json
 from datetime import datetime, date
 from typing import List, Dict, Any, Optional, Tuple
@@ -31,6 +30,8 @@ try:
     from inventory_data_validator import InventoryDataValidator, ValidationResult
     from sync_logger import SyncLogger, SyncType, SyncStatus as LogSyncStatus, ProcessingStats
     from product_name_resolver import ProductNameResolver
+    from inventory_bulk_writer import InventoryBulkWriter
+    from rate_limiter import get_rate_limiter
     import mysql.connector
     from dotenv import load_dotenv
 except ImportError as e:
@@ -120,9 +121,8 @@ class InventorySyncServiceWithNames:
         self.ozon_base_url = "https://api-seller.ozon.ru"
         self.wb_base_url = "https://statistics-api.wildberries.ru"
         
-        # Настройки для rate limiting
-        self.request_delay = 0.5
-        self.last_request_time = 0
+        # Общий для всех процессов rate limiter
+        self.rate_limiter = get_rate_limiter()
         
         # Статистика
         self.stats = {
@@ -134,13 +134,9 @@ class InventorySyncServiceWithNames:
             'names_failed': 0
         }
     
-    def _rate_limit(self):
-        """Контроль частоты запросов."""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.request_delay:
-            time.sleep(self.request_delay - time_since_last)
-        self.last_request_time = time.time()
+    def _rate_limit(self, marketplace: str = 'ozon'):
+        """Контроль частоты запросов через общий rate limiter."""
+        self.rate_limiter.acquire(marketplace)
     
     def sync_ozon_inventory_with_names(self) -> Dict[str, Any]:
         """
@@ -252,6 +248,7 @@ class InventorySyncServiceWithNames:
             }
             
             response = requests.post(url, headers=headers, json=payload)
+            self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
             response.raise_for_status()
             
             data = response.json()
@@ -303,6 +300,7 @@ class InventorySyncServiceWithNames:
             }
             
             response = requests.post(url, headers=headers, json=payload)
+            self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
             response.raise_for_status()
             
             data = response.json()
@@ -449,40 +447,16 @@ class InventorySyncServiceWithNames:
                 (source, f"{source}_Analytics")
             )
             
-            # Подготавливаем запрос для вставки
-            insert_query = """
-                INSERT INTO inventory_data (
-                    product_id, sku, source, warehouse_name, stock_type,
-                    current_stock, reserved_stock, available_stock,
-                    quantity_present, quantity_reserved, snapshot_date, last_sync_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-            """
+            # Вставляем записи пакетно (COPY/многострочный INSERT)
+            writer = InventoryBulkWriter(self.connection)
+            result = writer.insert_records(records)
+            inserted, updated, failed = result.inserted, result.updated, result.failed
             
-            # Вставляем записи
+            # Сохраняем названия товаров для успешно записанных строк
+            failed_ids = {id(record) for record in result.failed_records}
             for record in records:
-                try:
-                    cursor.execute(insert_query, (
-                        record.product_id,
-                        record.sku,
-                        record.source,
-                        record.warehouse_name,
-                        record.stock_type,
-                        record.current_stock,
-                        record.reserved_stock,
-                        record.available_stock,
-                        record.quantity_present,
-                        record.quantity_reserved,
-                        record.snapshot_date
-                    ))
-                    inserted += 1
-                    
-                    # Сохраняем название товара если есть
-                    if record.product_name and record.sku:
-                        self._save_product_name(record.product_id, record.sku, record.product_name, record.source)
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка вставки записи {record.sku}: {e}")
-                    failed += 1
+                if id(record) not in failed_ids and record.product_name and record.sku:
+                    self._save_product_name(record.product_id, record.sku, record.product_name, record.source)
             
             self.connection.commit()
             
@@ -6,6 +6,7 @@
 - Параллельная обработка данных с разных маркетплейсов
 - Координация синхронизации между источниками
 - Балансировка нагрузки и управление ресурсами
+- Событийный планировщик задач (приоритеты, лимиты по маркетплейсам, retry с backoff)
 - Мониторинг производительности в реальном времени
 
 Автор: ETL System
@@ -13,6 +14,8 @@
 """
 
 import asyncio
+import heapq
+import itertools
 import threading
 import time
 from datetime import datetime, timedelta
@@ -22,7 +25,6 @@ from enum import Enum
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import logging
 import json
-import queue
 from collections import defaultdict, deque
 import psutil
 import sys
@@ -64,10 +66,12 @@ class SyncTask:
     marketplace: str
     task_type: str
     priority: SyncPriority
+    task_id: str = ""
+    handler: Optional[Callable[[], Any]] = None  # Произвольная работа вместо синхронизации маркетплейса
     created_at: datetime = field(default_factory=datetime.now)
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
-    result: Optional[SyncResult] = None
+    result: Optional[Any] = None
     error: Optional[str] = None
     retry_count: int = 0
     max_retries: int = 3
@@ -87,7 +91,7 @@ class SyncTask:
     @property
     def is_failed(self) -> bool:
         """Проверка неудачного выполнения."""
-        return self.error is not None or (self.result and self.result.status == SyncStatus.FAILED)
+        return self.error is not None or getattr(self.result, 'status', None) == SyncStatus.FAILED
 
 
 @dataclass
@@ -135,19 +139,24 @@ class ParallelSyncManager:
         self.max_concurrent_marketplaces = max_concurrent_marketplaces
         self.resource_monitoring = resource_monitoring
         
-        # Очереди задач по приоритетам
-        self._task_queues = {
-            SyncPriority.CRITICAL: queue.PriorityQueue(),
-            SyncPriority.HIGH: queue.PriorityQueue(),
-            SyncPriority.NORMAL: queue.PriorityQueue(),
-            SyncPriority.LOW: queue.PriorityQueue()
-        }
+        # Очередь готовых задач: (-приоритет, порядковый номер, ID задачи)
+        self._ready_heap: List[Tuple[int, int, str]] = []
+        # Отложенные повторы: (время запуска, порядковый номер, ID задачи)
+        self._delayed_heap: List[Tuple[float, int, str]] = []
+        self._task_seq = itertools.count(1)
         
         # Активные задачи и результаты
         self._active_tasks: Dict[str, SyncTask] = {}
         self._completed_tasks: List[SyncTask] = []
         self._task_lock = threading.Lock()
         
+        # Пробуждение планировщика при добавлении задач из других потоков
+        self._scheduler_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._scheduler_wakeup: Optional[asyncio.Event] = None
+        
+        # Фоновый запуск (wait_for_completion=False): ссылка держит задачу от сборщика мусора
+        self._background_task: Optional[asyncio.Task] = None
+        
         # Пулы исполнителей
         self._thread_executor = ThreadPoolExecutor(max_workers=max_workers)
         self._process_executor = ProcessPoolExecutor(max_workers=max(1, max_workers // 2))
@@ -168,17 +177,26 @@ class ParallelSyncManager:
         self._marketplace_configs = {
             'Ozon': {
                 'max_concurrent_requests': 10,
+                'max_concurrent_tasks': 1,
                 'batch_size': 1000,
                 'retry_delay': 5,
                 'timeout': 30
             },
             'Wildberries': {
                 'max_concurrent_requests': 5,
+                'max_concurrent_tasks': 1,
                 'batch_size': 1000,
                 'retry_delay': 10,
                 'timeout': 60
             }
         }
+        
+        # Параметры для задач без конфигурации маркетплейса
+        self._default_task_config = {
+            'max_concurrent_tasks': 1,
+            'retry_delay': 5
+        }
+        self._max_retry_delay = 300
     
     def start_monitoring(self) -> None:
         """Запуск мониторинга ресурсов."""
@@ -232,51 +250,106 @@ class ParallelSyncManager:
         self,
         marketplace: str,
         task_type: str = "inventory_sync",
-        priority: SyncPriority = SyncPriority.NORMAL
+        priority: SyncPriority = SyncPriority.NORMAL,
+        handler: Optional[Callable[[], Any]] = None,
+        max_retries: int = 3
     ) -> str:
         """
         Добавление задачи синхронизации в очередь.
         
         Args:
-            marketplace: Название маркетплейса
+            marketplace: Название маркетплейса (определяет лимит параллельности)
             task_type: Тип задачи
             priority: Приоритет выполнения
+            handler: Функция без аргументов для произвольных задач
+                (по умолчанию - полная синхронизация маркетплейса)
+            max_retries: Максимальное количество повторов
             
         Returns:
             ID задачи
         """
+        seq = next(self._task_seq)
+        task_id = f"{marketplace}_{task_type}_{int(time.time())}_{seq}"
+        
         task = SyncTask(
             marketplace=marketplace,
             task_type=task_type,
-            priority=priority
+            priority=priority,
+            task_id=task_id,
+            handler=handler,
+            max_retries=max_retries
         )
         
-        task_id = f"{marketplace}_{task_type}_{int(time.time())}"
-        
-        # Добавляем в очередь с приоритетом
-        priority_queue = self._task_queues[priority]
-        priority_queue.put((priority.value, task_id, task))
-        
         with self._task_lock:
             self._active_tasks[task_id] = task
+            heapq.heappush(self._ready_heap, (-priority.value, seq, task_id))
+        
+        self._wake_scheduler()
         
         logger.info(f"📝 Добавлена задача {task_id} с приоритетом {priority.name}")
         return task_id
     
-    def _get_next_task(self) -> Optional[Tuple[str, SyncTask]]:
-        """Получение следующей задачи из очереди по приоритету."""
-        # Проверяем очереди в порядке приоритета
-        for priority in [SyncPriority.CRITICAL, SyncPriority.HIGH, SyncPriority.NORMAL, SyncPriority.LOW]:
-            priority_queue = self._task_queues[priority]
-            
-            try:
-                _, task_id, task = priority_queue.get_nowait()
-                return task_id, task
-            except queue.Empty:
-                continue
+    def _wake_scheduler(self) -> None:
+        """Пробуждение работающего планировщика (безопасно из любого потока)."""
+        loop, wakeup = self._scheduler_loop, self._scheduler_wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+    
+    def _get_task_config(self, marketplace: str) -> Dict[str, Any]:
+        """Конфигурация маркетплейса с параметрами по умолчанию."""
+        return {**self._default_task_config, **self._marketplace_configs.get(marketplace, {})}
+    
+    def _promote_delayed_tasks(self) -> Optional[float]:
+        """
+        Перенос отложенных повторов, время которых наступило, в очередь готовых.
         
+        Returns:
+            Секунды до следующего отложенного повтора или None
+        """
+        now = time.monotonic()
+        with self._task_lock:
+            while self._delayed_heap and self._delayed_heap[0][0] <= now:
+                _, seq, task_id = heapq.heappop(self._delayed_heap)
+                task = self._active_tasks[task_id]
+                heapq.heappush(self._ready_heap, (-task.priority.value, seq, task_id))
+            
+            if self._delayed_heap:
+                return max(0.0, self._delayed_heap[0][0] - now)
         return None
     
+    def _get_next_task(self, running_by_marketplace: Dict[str, int]) -> Optional[Tuple[str, SyncTask]]:
+        """
+        Получение самой приоритетной задачи, для которой есть свободный слот.
+        
+        Задачи маркетплейсов, исчерпавших лимит параллельности, остаются
+        в очереди на своих местах и не блокируют задачи других маркетплейсов.
+        """
+        skipped = []
+        next_task = None
+        
+        with self._task_lock:
+            while self._ready_heap:
+                entry = heapq.heappop(self._ready_heap)
+                task = self._active_tasks[entry[2]]
+                
+                running = running_by_marketplace.get(task.marketplace, 0)
+                marketplace_limit = self._get_task_config(task.marketplace)['max_concurrent_tasks']
+                new_marketplace = running == 0
+                active_marketplaces = sum(1 for count in running_by_marketplace.values() if count > 0)
+                
+                if running >= marketplace_limit or (
+                        new_marketplace and active_marketplaces >= self.max_concurrent_marketplaces):
+                    skipped.append(entry)
+                    continue
+                
+                next_task = (entry[2], task)
+                break
+            
+            for entry in skipped:
+                heapq.heappush(self._ready_heap, entry)
+        
+        return next_task
+    
     def _check_resource_availability(self) -> bool:
         """Проверка доступности ресурсов для новых задач."""
         if not self._resource_history:
@@ -311,19 +384,23 @@ class ParallelSyncManager:
         task.started_at = datetime.now()
         
         try:
-            # Создаем оптимизированный сервис синхронизации
-            sync_service = OptimizedInventorySyncService(
-                batch_size=self._marketplace_configs[task.marketplace]['batch_size'],
-                max_workers=self.max_workers
-            )
-            
-            # Выполняем синхронизацию в зависимости от маркетплейса
-            if task.marketplace == 'Ozon':
-                result = sync_service.sync_ozon_inventory_optimized()
-            elif task.marketplace == 'Wildberries':
-                result = sync_service.sync_wb_inventory()  # Будет реализован аналогично
+            if task.handler is not None:
+                # Произвольная задача (например, синхронизация диапазона дат или отчет)
+                result = task.handler()
             else:
-                raise ValueError(f"Неподдерживаемый маркетплейс: {task.marketplace}")
+                # Создаем оптимизированный сервис синхронизации
+                sync_service = OptimizedInventorySyncService(
+                    batch_size=self._marketplace_configs[task.marketplace]['batch_size'],
+                    max_workers=self.max_workers
+                )
+                
+                # Выполняем синхронизацию в зависимости от маркетплейса
+                if task.marketplace == 'Ozon':
+                    result = sync_service.sync_ozon_inventory_optimized()
+                elif task.marketplace == 'Wildberries':
+                    result = sync_service.sync_wb_inventory()  # Будет реализован аналогично
+                else:
+                    raise ValueError(f"Неподдерживаемый маркетплейс: {task.marketplace}")
             
             task.result = result
             task.completed_at = datetime.now()
@@ -373,131 +450,179 @@ class ParallelSyncManager:
         
         return False
     
-    async def run_parallel_sync(
-        self,
-        marketplaces: List[str],
-        wait_for_completion: bool = True
-    ) -> Dict[str, SyncResult]:
+    def _get_retry_delay(self, task: SyncTask) -> float:
+        """Экспоненциальная задержка перед повтором задачи."""
+        base_delay = self._get_task_config(task.marketplace)['retry_delay']
+        return min(base_delay * (2 ** (task.retry_count - 1)), self._max_retry_delay)
+    
+    def _schedule_retry(self, task_id: str, task: SyncTask) -> None:
+        """Сброс состояния задачи и постановка повтора с задержкой."""
+        task.retry_count += 1
+        delay = self._get_retry_delay(task)
+        
+        task.started_at = None
+        task.completed_at = None
+        task.result = None
+        task.error = None
+        
+        with self._task_lock:
+            heapq.heappush(self._delayed_heap, (time.monotonic() + delay, next(self._task_seq), task_id))
+        
+        logger.info(f"🔄 Повторная попытка {task.retry_count}/{task.max_retries} "
+                    f"для {task_id} через {delay:.0f} сек")
+    
+    def _finish_task(self, task_id: str, task: SyncTask) -> None:
+        """Перенос задачи в список завершенных."""
+        with self._task_lock:
+            self._completed_tasks.append(task)
+            self._active_tasks.pop(task_id, None)
+    
+    async def run_tasks(self) -> List[SyncTask]:
         """
-        Запуск параллельной синхронизации для указанных маркетплейсов.
+        Выполнение всех задач из очереди событийным планировщиком.
+        
+        Задачи запускаются в пуле потоков по приоритету с учетом лимитов
+        по маркетплейсам. Планировщик просыпается только по событиям:
+        завершение задачи, наступление времени повтора или добавление
+        новой задачи, поэтому короткие задачи не ждут фиксированного тика.
         
-        Args:
-            marketplaces: Список маркетплейсов для синхронизации
-            wait_for_completion: Ожидать завершения всех задач
-            
         Returns:
-            Словарь результатов синхронизации
+            Завершенные за этот запуск задачи
         """
-        logger.info(f"🚀 Запуск параллельной синхронизации: {', '.join(marketplaces)}")
+        loop = asyncio.get_running_loop()
+        self._scheduler_loop = loop
+        self._scheduler_wakeup = asyncio.Event()
         
-        # Запускаем мониторинг ресурсов
-        self.start_monitoring()
+        running: Dict[asyncio.Future, Tuple[str, SyncTask]] = {}
+        running_by_marketplace: Dict[str, int] = defaultdict(int)
+        finished: List[SyncTask] = []
         
         try:
-            # Добавляем задачи в очередь
-            task_ids = []
-            for marketplace in marketplaces:
-                task_id = self.add_sync_task(marketplace, priority=SyncPriority.HIGH)
-                task_ids.append(task_id)
-            
-            # Запускаем обработку задач
-            futures = []
-            active_marketplaces = set()
-            
-            while task_ids or futures:
-                # Проверяем доступность ресурсов
-                if not self._check_resource_availability():
-                    await asyncio.sleep(5)
-                    continue
+            while True:
+                next_retry_in = self._promote_delayed_tasks()
                 
-                # Запускаем новые задачи если есть свободные слоты
-                while (len(active_marketplaces) < self.max_concurrent_marketplaces and 
-                       len(futures) < self.max_workers):
-                    
-                    next_task = self._get_next_task()
+                # Запускаем задачи, пока есть свободные слоты и ресурсы
+                resources_ok = self._check_resource_availability()
+                while resources_ok and len(running) < self.max_workers:
+                    next_task = self._get_next_task(running_by_marketplace)
                     if not next_task:
                         break
                     
                     task_id, task = next_task
-                    
-                    # Проверяем, не обрабатывается ли уже этот маркетплейс
-                    if task.marketplace in active_marketplaces:
-                        # Возвращаем задачу в очередь
-                        priority_queue = self._task_queues[task.priority]
-                        priority_queue.put((task.priority.value, task_id, task))
-                        break
-                    
-                    # Запускаем задачу
-                    future = self._thread_executor.submit(self._execute_sync_task, task_id, task)
-                    futures.append((future, task_id, task))
-                    active_marketplaces.add(task.marketplace)
+                    future = loop.run_in_executor(self._thread_executor, self._execute_sync_task, task_id, task)
+                    running[future] = (task_id, task)
+                    running_by_marketplace[task.marketplace] += 1
                     
                     logger.info(f"🔄 Запущена задача {task_id} для {task.marketplace}")
                 
-                # Проверяем завершенные задачи
-                completed_futures = []
-                for future, task_id, task in futures:
-                    if future.done():
-                        completed_futures.append((future, task_id, task))
+                with self._task_lock:
+                    has_pending = bool(self._ready_heap)
+                
+                if not running and not has_pending and next_retry_in is None:
+                    break
+                
+                # Ждем первого события: завершения задачи, повтора или новой задачи
+                timeout = next_retry_in
+                if has_pending and not resources_ok:
+                    timeout = 5 if timeout is None else min(timeout, 5)
                 
-                # Обрабатываем завершенные задачи
-                for future, task_id, task in completed_futures:
-                    futures.remove((future, task_id, task))
-                    active_marketplaces.discard(task.marketplace)
+                self._scheduler_wakeup.clear()
+                wakeup = asyncio.ensure_future(self._scheduler_wakeup.wait())
+                done, _ = await asyncio.wait(
+                    list(running) + [wakeup],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not wakeup.done():
+                    wakeup.cancel()
+                
+                for future in done:
+                    if future is wakeup:
+                        continue
+                    
+                    task_id, task = running.pop(future)
+                    running_by_marketplace[task.marketplace] -= 1
                     
                     try:
-                        result = future.result()
-                        
-                        # Проверяем необходимость повтора
-                        if self._should_retry_task(task):
-                            task.retry_count += 1
-                            retry_task_id = self.add_sync_task(
-                                task.marketplace,
-                                task.task_type,
-                                SyncPriority.HIGH
-                            )
-                            task_ids.append(retry_task_id)
-                            logger.info(f"🔄 Повторная попытка {task.retry_count} для {task_id}")
-                        else:
-                            # Задача завершена окончательно
-                            with self._task_lock:
-                                self._completed_tasks.append(task)
-                                if task_id in self._active_tasks:
-                                    del self._active_tasks[task_id]
-                            
-                            if task_id in task_ids:
-                                task_ids.remove(task_id)
-                        
+                        future.result()
                     except Exception as e:
                         logger.error(f"❌ Ошибка получения результата задачи {task_id}: {e}")
-                
-                # Небольшая пауза между итерациями
-                await asyncio.sleep(1)
-            
-            # Ожидаем завершения всех задач если требуется
-            if wait_for_completion:
-                while futures:
-                    await asyncio.sleep(1)
-                    # Повторяем логику обработки завершенных задач
-                    completed_futures = [(f, tid, t) for f, tid, t in futures if f.done()]
-                    for future, task_id, task in completed_futures:
-                        futures.remove((future, task_id, task))
-                        try:
-                            future.result()
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка задачи {task_id}: {e}")
+                        task.error = task.error or str(e)
+                    
+                    if self._should_retry_task(task):
+                        self._schedule_retry(task_id, task)
+                    else:
+                        self._finish_task(task_id, task)
+                        finished.append(task)
+        finally:
+            self._scheduler_wakeup = None
+            self._scheduler_loop = None
+        
+        return finished
+    
+    async def run_parallel_sync(
+        self,
+        marketplaces: List[str],
+        wait_for_completion: bool = True
+    ) -> Dict[str, SyncResult]:
+        """
+        Запуск параллельной синхронизации для указанных маркетплейсов.
+        
+        Args:
+            marketplaces: Список маркетплейсов для синхронизации
+            wait_for_completion: Ожидать завершения всех задач; иначе планировщик
+                запускается в фоне и метод сразу возвращает пустой словарь
             
-            # Собираем результаты
-            results = {}
-            for task in self._completed_tasks:
-                if task.result:
-                    results[task.marketplace] = task.result
+        Returns:
+            Словарь результатов синхронизации
+        """
+        logger.info(f"🚀 Запуск параллельной синхронизации: {', '.join(marketplaces)}")
+        
+        for marketplace in marketplaces:
+            self.add_sync_task(marketplace, priority=SyncPriority.HIGH)
+        
+        if not wait_for_completion:
+            if self._background_task is None or self._background_task.done():
+                self._background_task = asyncio.ensure_future(self._run_monitored())
+                self._background_task.add_done_callback(self._on_background_done)
+            # Иначе задачи подхватит уже работающий планировщик
+            return {}
+        
+        finished = await self._run_monitored()
+        
+        # Собираем результаты
+        results = {}
+        for task in finished:
+            if task.result:
+                results[task.marketplace] = task.result
+        
+        logger.info(f"✅ Параллельная синхронизация завершена: {len(results)} результатов")
+        return results
+    
+    def _on_background_done(self, task: asyncio.Task) -> None:
+        """Забрать результат фонового запуска и записать его ошибку в лог."""
+        if task is self._background_task:
+            self._background_task = None
+        if task.cancelled():
+            logger.warning("⚠️ Фоновая синхронизация отменена")
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"❌ Ошибка фоновой синхронизации: {error}", exc_info=error)
+        else:
+            logger.info(f"✅ Фоновая синхронизация завершена: {len(task.result())} задач")
+    
+    async def _run_monitored(self) -> List[SyncTask]:
+        """Выполнение очереди задач с мониторингом ресурсов."""
+        # Запускаем мониторинг ресурсов
+        self.start_monitoring()
+        
+        try:
+            finished = await self.run_tasks()
             
             # Обновляем метрики производительности
             self._update_performance_metrics()
-            
-            logger.info(f"✅ Параллельная синхронизация завершена: {len(results)} результатов")
-            return results
+            return finished
             
         finally:
             self.stop_monitoring()
@@ -558,12 +683,19 @@ class ParallelSyncManager:
                 if self._performance_metrics.resource_usage else None
             ),
             'active_tasks': len(self._active_tasks),
-            'queue_sizes': {
-                priority.name: queue.qsize() for priority, queue in self._task_queues.items()
-            },
+            'queue_sizes': self._get_queue_sizes(),
             'api_optimizer_stats': self._api_optimizer.get_performance_stats()
         }
     
+    def _get_queue_sizes(self) -> Dict[str, int]:
+        """Количество ожидающих задач по приоритетам и отложенных повторов."""
+        with self._task_lock:
+            sizes = {priority.name: 0 for priority in SyncPriority}
+            for _, _, task_id in self._ready_heap:
+                sizes[self._active_tasks[task_id].priority.name] += 1
+            sizes['DELAYED_RETRIES'] = len(self._delayed_heap)
+        return sizes
+    
     def cleanup(self) -> None:
         """Очистка ресурсов менеджера."""
         logger.info("🧹 Очистка ресурсов менеджера...")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Модель чтения рекомендаций по пополнению для API и дашбордов.
+
+Возможности:
+- Кэш страниц в памяти процесса по версии анализа и фильтрам
+- Сброс кэша при сохранении нового анализа (save_recommendations_to_db)
+- Keyset-пагинация по (urgency_score, days_until_stockout, id)
+- Фильтры по приоритету и источнику выполняются в SQL
+- Ответы с ETag/If-None-Match и gzip для больших ответов
+"""
+
+import gzip
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты, которые API отдает по умолчанию (как get_critical_recommendations)
+DEFAULT_PRIORITIES = ('CRITICAL', 'HIGH')
+ALL_PRIORITIES = ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW')
+
+MAX_PAGE_SIZE = 1000
+
+# Ответы больше этого размера сжимаются, если клиент поддерживает gzip
+GZIP_MIN_BYTES = 1024
+
+# Заменяет NULL в days_until_stockout при сортировке (NULL идет первым, как в MySQL)
+NULL_DAYS_SORT_VALUE = -1
+
+# Поколение данных в текущем процессе: увеличивается при каждом сохранении анализа
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def notify_recommendations_changed() -> None:
+    """Сообщить всем моделям чтения процесса, что рекомендации перезаписаны."""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def parse_priorities(value: Optional[str]) -> Tuple[str, ...]:
+    """
+    Разбор фильтра приоритета из query-параметра.
+
+    Args:
+        value: 'CRITICAL', 'CRITICAL,HIGH', 'ALL' или None (по умолчанию CRITICAL и HIGH)
+
+    Returns:
+        Кортеж приоритетов
+    """
+    if not value:
+        return DEFAULT_PRIORITIES
+    if value.upper() == 'ALL':
+        return ALL_PRIORITIES
+
+    priorities = tuple(sorted({p.strip().upper() for p in value.split(',') if p.strip()}))
+    unknown = [p for p in priorities if p not in ALL_PRIORITIES]
+    if unknown:
+        raise ValueError(f"Неизвестный приоритет: {', '.join(unknown)}")
+    return priorities
+
+
+def encode_cursor(row: Mapping[str, Any]) -> str:
+    """Курсор следующей страницы по последней строке текущей."""
+    days = row['days_until_stockout']
+    key = [str(row['urgency_score']), NULL_DAYS_SORT_VALUE if days is None else days, row['id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Decimal, int, int]:
+    """Разбор курсора (ValueError при некорректном значении)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        urgency, days, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return Decimal(urgency), int(days), int(row_id)
+    except Exception:
+        raise ValueError("Некорректный курсор пагинации")
+
+
+def _json_value(value: Any) -> Any:
+    """Преобразование значений БД в JSON-совместимые."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+class RecommendationsReadModel:
+    """
+    Кэшируемое чтение последнего анализа рекомендаций.
+
+    Версия данных - (MAX(analysis_date), MAX(id)) таблицы и поколение
+    процесса. Версия проверяется не чаще version_ttl секунд, поэтому
+    частые опросы дашбордов не нагружают БД; новый анализ, сохраненный
+    в этом процессе, сбрасывает кэш сразу, в другом процессе - не позже
+    чем через version_ttl.
+    """
+
+    COLUMNS = (
+        'id', 'product_id', 'sku', 'product_name', 'source',
+        'current_stock', 'reserved_stock', 'available_stock',
+        'daily_sales_rate_7d', 'daily_sales_rate_14d', 'daily_sales_rate_30d',
+        'days_until_stockout', 'recommended_order_quantity', 'recommended_order_value',
+        'priority_level', 'urgency_score', 'last_sale_date', 'sales_trend',
+        'inventory_turnover_days', 'min_stock_level', 'reorder_point', 'lead_time_days',
+        'analysis_date'
+    )
+
+    def __init__(self, connection, max_entries: int = 256, version_ttl: float = 5.0):
+        """
+        Инициализация модели чтения.
+
+        Args:
+            connection: Подключение к базе данных (MySQL)
+            max_entries: Максимальное количество страниц в кэше
+            version_ttl: Как часто (сек) проверять версию данных в БД
+        """
+        self.connection = connection
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+
+        self._lock = threading.RLock()
+        self._pages: 'OrderedDict[tuple, Dict[str, Any]]' = OrderedDict()
+        self._version: Optional[tuple] = None
+        self._version_checked_at = 0.0
+
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def invalidate(self) -> None:
+        """Сбросить кэш страниц."""
+        with self._lock:
+            self._pages.clear()
+            self._version = None
+            self._version_checked_at = 0.0
+            self.stats['invalidations'] += 1
+
+    def _get_version(self) -> tuple:
+        """Текущая версия данных (с учетом version_ttl)."""
+        now = time.monotonic()
+        if self._version is not None and self._version[2] == _generation \
+                and now - self._version_checked_at < self.version_ttl:
+            return self._version
+
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("SELECT MAX(analysis_date), MAX(id) FROM replenishment_recommendations")
+            analysis_date, max_id = cursor.fetchone() or (None, None)
+        finally:
+            cursor.close()
+
+        version = (analysis_date, max_id, _generation)
+        if version != self._version:
+            if self._version is not None:
+                logger.info(f"🔄 Новый анализ рекомендаций ({analysis_date}), кэш сброшен")
+            self._pages.clear()
+            self._version = version
+        self._version_checked_at = now
+        return version
+
+    def get_page(self, priorities: Sequence[str] = DEFAULT_PRIORITIES,
+                 source: Optional[str] = None, limit: int = 50,
+                 cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Страница рекомендаций последнего анализа.
+
+        Args:
+            priorities: Приоритеты для фильтра
+            source: Источник данных (опционально)
+            limit: Размер страницы (не более MAX_PAGE_SIZE)
+            cursor: Курсор из next_cursor предыдущей страницы
+
+        Returns:
+            Словарь с recommendations, next_cursor, analysis_date и etag
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        after = decode_cursor(cursor) if cursor else None
+
+        with self._lock:
+            version = self._get_version()
+            key = (tuple(sorted(priorities)), source, limit, cursor)
+
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.stats['hits'] += 1
+                return page
+
+            self.stats['misses'] += 1
+            rows = self._fetch_rows(version[0], priorities, source, limit, after)
+
+            recommendations = [
+                {column: _json_value(row[column]) for column in self.COLUMNS if column != 'id'}
+                for row in rows
+            ]
+            page = {
+                'recommendations': recommendations,
+                'count': len(recommendations),
+                'next_cursor': encode_cursor(rows[-1]) if len(rows) == limit else None,
+                'analysis_date': _json_value(version[0])
+            }
+            page['etag'] = '"{}"'.format(hashlib.sha1(
+                json.dumps(page, ensure_ascii=False, sort_keys=True).encode('utf-8')
+            ).hexdigest())
+
+            self._pages[key] = page
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+            return page
+
+    def _fetch_rows(self, analysis_date: Optional[date], priorities: Sequence[str],
+                    source: Optional[str], limit: int,
+                    after: Optional[Tuple[Decimal, int, int]]) -> List[Dict[str, Any]]:
+        """Выборка страницы из БД с фильтрами и keyset-условием в SQL."""
+        if analysis_date is None or not priorities:
+            return []
+
+        sql = f"""
+            SELECT {', '.join(self.COLUMNS)},
+                COALESCE(days_until_stockout, {NULL_DAYS_SORT_VALUE}) as days_sort
+            FROM replenishment_recommendations
+            WHERE analysis_date = %s
+                AND priority_level IN ({', '.join(['%s'] * len(priorities))})
+        """
+        params: List[Any] = [analysis_date, *priorities]
+
+        if source:
+            sql += " AND source = %s"
+            params.append(source)
+
+        if after:
+            urgency, days, row_id = after
+            sql += f"""
+                AND (urgency_score < %s
+                    OR (urgency_score = %s AND COALESCE(days_until_stockout, {NULL_DAYS_SORT_VALUE}) > %s)
+                    OR (urgency_score = %s AND COALESCE(days_until_stockout, {NULL_DAYS_SORT_VALUE}) = %s AND id > %s))
+            """
+            params.extend([urgency, urgency, days, urgency, days, row_id])
+
+        sql += " ORDER BY urgency_score DESC, days_sort ASC, id ASC LIMIT %s"
+        params.append(limit)
+
+        cursor = self.connection.cursor(dictionary=True)
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша."""
+        with self._lock:
+            return dict(self.stats, cached_pages=len(self._pages))
+
+
+def build_http_response(payload: Dict[str, Any], etag: Optional[str],
+                        request_headers: Mapping[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Формирование HTTP-ответа с учетом If-None-Match и Accept-Encoding.
+
+    Args:
+        payload: Тело ответа (JSON)
+        etag: ETag содержимого
+        request_headers: Заголовки запроса
+
+    Returns:
+        (статус, заголовки, тело)
+    """
+    headers = {'Content-Type': 'application/json; charset=utf-8', 'Vary': 'Accept-Encoding'}
+    if etag:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        if_none_match = request_headers.get('If-None-Match') or ''
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return 304, headers, b''
+
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    accept_encoding = request_headers.get('Accept-Encoding') or ''
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in accept_encoding.lower():
+        body = gzip.compress(body, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+
+    headers['Content-Length'] = str(len(body))
+    return 200, headers, body
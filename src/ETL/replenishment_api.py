@@ -10,7 +10,7 @@ import logging
 import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string
 from flask_cors import CORS
 
 # Добавляем путь к модулям
@@ -20,6 +20,7 @@ from replenishment_recommender import ReplenishmentRecommender, PriorityLevel
 from alert_manager import AlertManager
 from reporting_engine import ReportingEngine
 from replenishment_orchestrator import ReplenishmentOrchestrator
+from recommendations_read_model import RecommendationsReadModel, parse_priorities, build_http_response
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -34,14 +35,16 @@ recommender = None
 alert_manager = None
 reporting_engine = None
 orchestrator = None
+recommendations_model = None
 
 
 def init_components():
     """Инициализация компонентов системы."""
-    global recommender, alert_manager, reporting_engine, orchestrator
+    global recommender, alert_manager, reporting_engine, orchestrator, recommendations_model
     
     try:
         recommender = ReplenishmentRecommender()
+        recommendations_model = RecommendationsReadModel(recommender.connection)
         alert_manager = AlertManager()
         reporting_engine = ReportingEngine()
         orchestrator = ReplenishmentOrchestrator()
@@ -298,50 +301,35 @@ def index():
 
 @app.route('/api/recommendations')
 def get_recommendations():
-    """Получить рекомендации по пополнению."""
+    """
+    Получить рекомендации по пополнению.
+    
+    Параметры: limit, priority (CRITICAL, HIGH, ... через запятую или ALL),
+    source, cursor (next_cursor предыдущей страницы).
+    """
     try:
         limit = request.args.get('limit', 50, type=int)
-        priority_filter = request.args.get('priority', None)
         source = request.args.get('source', None)
+        cursor = request.args.get('cursor', None)
         
-        if not recommender:
+        if not recommendations_model:
             return jsonify({'error': 'Система не инициализирована'}), 500
         
-        # Получаем рекомендации из БД
-        if priority_filter:
-            recommendations = recommender.get_critical_recommendations(limit)
-            # Фильтруем по приоритету если нужно
-            if priority_filter != 'ALL':
-                recommendations = [r for r in recommendations if r.priority_level.value == priority_filter]
-        else:
-            recommendations = recommender.get_critical_recommendations(limit)
-        
-        # Преобразуем в JSON-совместимый формат
-        recommendations_data = []
-        for rec in recommendations:
-            rec_data = {
-                'product_id': rec.product_id,
-                'sku': rec.sku,
-                'product_name': rec.product_name,
-                'source': rec.source,
-                'current_stock': rec.current_stock,
-                'available_stock': rec.available_stock,
-                'recommended_order_quantity': rec.recommended_order_quantity,
-                'recommended_order_value': rec.recommended_order_value,
-                'priority_level': rec.priority_level.value,
-                'urgency_score': rec.urgency_score,
-                'days_until_stockout': rec.days_until_stockout,
-                'daily_sales_rate_7d': rec.daily_sales_rate_7d,
-                'sales_trend': rec.sales_trend.value,
-                'analysis_date': rec.analysis_date.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            recommendations_data.append(rec_data)
+        try:
+            priorities = parse_priorities(request.args.get('priority', None))
+            page = recommendations_model.get_page(priorities, source=source, limit=limit, cursor=cursor)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        payload = {
+            'recommendations': page['recommendations'],
+            'total_count': page['count'],
+            'next_cursor': page['next_cursor'],
+            'analysis_date': page['analysis_date']
+        }
         
-        return jsonify({
-            'recommendations': recommendations_data,
-            'total_count': len(recommendations_data),
-            'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        status, headers, body = build_http_response(payload, page['etag'], request.headers)
+        return Response(body, status=status, headers=headers)
         
     except Exception as e:
         logger.error(f"Ошибка получения рекомендаций: {e}")
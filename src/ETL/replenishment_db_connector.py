@@ -7,7 +7,10 @@
 import sys
 import os
 import logging
+import threading
+from contextlib import contextmanager
 import mysql.connector
+import mysql.connector.pooling
 from mysql.connector import Error
 
 # Добавляем путь к конфигурации
@@ -53,6 +56,80 @@ def connect_to_replenishment_db():
         logger.error(f"❌ Ошибка подключения к базе данных: {e}")
         raise
 
+class ReplenishmentConnectionPool:
+    """
+    Пул подключений к базе данных системы пополнения для многопоточных серверов.
+    
+    В отличие от MySQLConnectionPool, при исчерпании пула ожидает
+    освобождения подключения (до timeout), а не выбрасывает ошибку.
+    """
+    
+    def __init__(self, pool_size: int = 8, pool_name: str = 'replenishment_pool'):
+        self.pool_size = pool_size
+        self._pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name=pool_name,
+            pool_size=pool_size,
+            pool_reset_session=True,
+            **DB_CONFIG
+        )
+        self._slots = threading.BoundedSemaphore(pool_size)
+        logger.info(f"✅ Пул подключений {pool_name} создан ({pool_size} подключений)")
+    
+    def get_connection(self, timeout: float = 30.0):
+        """
+        Взять подключение из пула. Вызов close() возвращает его в пул.
+        
+        Raises:
+            mysql.connector.Error: Если свободное подключение не появилось за timeout
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise Error(f"Нет свободных подключений в пуле за {timeout} сек")
+        
+        try:
+            connection = self._pool.get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        
+        # Освобождаем слот вместе с возвратом подключения в пул (повторный close игнорируется)
+        original_close = connection.close
+        released = threading.Event()
+        
+        def close():
+            if released.is_set():
+                return
+            released.set()
+            try:
+                original_close()
+            finally:
+                self._slots.release()
+        
+        connection.close = close
+        return connection
+    
+    @contextmanager
+    def connection(self, timeout: float = 30.0):
+        """Контекстный менеджер: подключение из пула на время блока."""
+        connection = self.get_connection(timeout)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_replenishment_pool(pool_size: int = 8) -> ReplenishmentConnectionPool:
+    """Общий для процесса пул подключений (создается при первом вызове)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ReplenishmentConnectionPool(pool_size=pool_size)
+    return _pool
+
 def test_connection():
     """Тестирует подключение к базе данных."""
     try:
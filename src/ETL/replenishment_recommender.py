@@ -18,6 +18,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
 from replenishment_db_connector import connect_to_replenishment_db as connect_to_db
 from inventory_analyzer import InventoryAnalyzer, InventoryItem, ProductSettings
 from sales_velocity_calculator import SalesVelocityCalculator, SalesMetrics, SalesTrend
+from recommendations_read_model import notify_recommendations_changed
 
 # Настройка логирования
 logging.basicConfig(
@@ -109,7 +110,7 @@ class ReplenishmentRecommender:
         
         try:
             # Получаем все товары в запасах
-            inventory_items = self.inventory_analyzer.get_current_stock(source=source)
+            inventory_items = self.inventory_analyzer.get_current_stock(source=source, lazy=True)
             
             if not inventory_items:
                 logger.warning("Нет товаров в запасах для анализа")
@@ -118,6 +119,14 @@ class ReplenishmentRecommender:
             recommendations = []
             analysis_date = datetime.now()
             
+            # Метрики продаж всех товаров считаются одним пакетом;
+            # дальше в цикле - только поиск по рассчитанной таблице
+            self.sales_calculator.refresh_metrics()
+            
+            # Настройки товаров загружаются заново в начале каждого анализа
+            self.inventory_analyzer.invalidate_product_settings()
+            settings_map = self.inventory_analyzer.get_product_settings_map(source)
+            
             logger.info(f"Анализируем {len(inventory_items)} товаров...")
             
             for i, item in enumerate(inventory_items, 1):
@@ -126,7 +135,7 @@ class ReplenishmentRecommender:
                 
                 try:
                     # Получаем настройки товара
-                    settings = self.inventory_analyzer.get_product_settings(item.product_id)
+                    settings = settings_map.get(item.product_id, ProductSettings())
                     
                     # Пропускаем неактивные товары
                     if not settings.is_active:
@@ -478,6 +487,9 @@ class ReplenishmentRecommender:
             self.connection.commit()
             cursor.close()
             
+            # Сбрасываем кэш API рекомендаций
+            notify_recommendations_changed()
+            
             logger.info(f"✅ Сохранено {len(recommendations)} рекомендаций в базу данных")
             return True
             
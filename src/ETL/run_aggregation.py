@@ -3,13 +3,21 @@
 
 Автоматически рассчитывает итоговые дневные метрики и загружает их в таблицу metrics_daily.
 Поддерживает как обработку конкретной даты, так и автоматическое определение дат для обработки.
+
+Режимы работы:
+- Агрегация диапазона дат одним сгруппированным запросом (aggregate_metrics_range)
+- Параллельная обработка диапазонов в отдельных соединениях (aggregate_dates_parallel)
+- Инкрементальный пересчет: только даты, по которым пришли новые или измененные
+  строки fact_orders / fact_transactions (get_dirty_dates)
 """
 
 import os
 import sys
+import argparse
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Callable, List, Optional, Tuple
 
 # Добавляем путь к модулю importers
 sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
@@ -40,182 +48,221 @@ def calculate_margin_percentage(profit_sum: float, revenue_sum: float) -> Option
     return (profit_sum / revenue_sum) * 100
 
 
-def aggregate_daily_metrics(connection, date_to_process: str) -> bool:
+# Агрегация метрик за диапазон дат одним запросом: факты группируются
+# по (client_id, дата), расходы из fact_transactions - по (client_id, дата)
+# и присоединяются по обоим полям
+AGGREGATION_SQL = """
+    INSERT INTO metrics_daily (
+        client_id, metric_date, orders_cnt, revenue_sum, returns_sum, 
+        cogs_sum, commission_sum, shipping_sum, other_expenses_sum, 
+        profit_sum, margin_percent
+    )
+    SELECT
+        fo.client_id,
+        fo.order_date AS metric_date,
+        
+        -- Базовые метрики продаж
+        COUNT(CASE WHEN fo.transaction_type = 'продажа' THEN fo.id END) AS orders_cnt,
+        SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) AS revenue_sum,
+        SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) AS returns_sum,
+        
+        -- Себестоимость проданных товаров (COGS)
+        SUM(CASE 
+            WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
+            THEN COALESCE(dp.cost_price * fo.qty, 0) 
+            ELSE 0 
+        END) AS cogs_sum,
+        
+        -- Комиссии маркетплейса и эквайринг
+        COALESCE(commission_data.commission_sum, 0) AS commission_sum,
+        
+        -- Расходы на логистику и доставку
+        COALESCE(logistics_data.shipping_sum, 0) AS shipping_sum,
+        
+        -- Прочие расходы
+        COALESCE(other_data.other_expenses_sum, 0) AS other_expenses_sum,
+        
+        -- Расчет чистой прибыли
+        (
+            SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) - -- Выручка
+            SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) - -- Возвраты
+            SUM(CASE 
+                WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
+                THEN COALESCE(dp.cost_price * fo.qty, 0) 
+                ELSE 0 
+            END) - -- Себестоимость
+            COALESCE(commission_data.commission_sum, 0) - -- Комиссии
+            COALESCE(logistics_data.shipping_sum, 0) - -- Логистика
+            COALESCE(other_data.other_expenses_sum, 0) -- Прочие расходы
+        ) AS profit_sum,
+        
+        -- Расчет процента маржинальности
+        CASE 
+            WHEN SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) > 0 
+            THEN (
+                (
+                    SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) - -- Выручка
+                    SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) - -- Возвраты
+                    SUM(CASE 
+                        WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
+                        THEN COALESCE(dp.cost_price * fo.qty, 0) 
+                        ELSE 0 
+                    END) - -- Себестоимость
+                    COALESCE(commission_data.commission_sum, 0) - -- Комиссии
+                    COALESCE(logistics_data.shipping_sum, 0) - -- Логистика
+                    COALESCE(other_data.other_expenses_sum, 0) -- Прочие расходы
+                ) / SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END)
+            ) * 100
+            ELSE NULL 
+        END AS margin_percent
+
+    FROM fact_orders fo
+
+    -- JOIN с таблицей товаров для получения себестоимости
+    LEFT JOIN dim_products dp ON fo.product_id = dp.id
+
+    -- Подзапрос для агрегации комиссий и эквайринга
+    LEFT JOIN (
+        SELECT 
+            ft.client_id,
+            ft.transaction_date,
+            SUM(ABS(ft.amount)) AS commission_sum
+        FROM fact_transactions ft
+        WHERE ft.transaction_date BETWEEN %(date_from)s AND %(date_to)s
+            AND (
+                ft.transaction_type LIKE '%%комиссия%%' OR
+                ft.transaction_type LIKE '%%эквайринг%%' OR
+                ft.transaction_type LIKE '%%commission%%' OR
+                ft.transaction_type LIKE '%%fee%%' OR
+                ft.transaction_type LIKE '%%OperationMarketplaceServiceItemFulfillment%%'
+            )
+        GROUP BY ft.client_id, ft.transaction_date
+    ) commission_data ON fo.client_id = commission_data.client_id
+        AND fo.order_date = commission_data.transaction_date
+
+    -- Подзапрос для агрегации логистических расходов
+    LEFT JOIN (
+        SELECT 
+            ft.client_id,
+            ft.transaction_date,
+            SUM(ABS(ft.amount)) AS shipping_sum
+        FROM fact_transactions ft
+        WHERE ft.transaction_date BETWEEN %(date_from)s AND %(date_to)s
+            AND (
+                ft.transaction_type LIKE '%%логистика%%' OR
+                ft.transaction_type LIKE '%%доставка%%' OR
+                ft.transaction_type LIKE '%%delivery%%' OR
+                ft.transaction_type LIKE '%%shipping%%' OR
+                ft.transaction_type LIKE '%%OperationMarketplaceServiceItemDeliveryToCustomer%%'
+            )
+        GROUP BY ft.client_id, ft.transaction_date
+    ) logistics_data ON fo.client_id = logistics_data.client_id
+        AND fo.order_date = logistics_data.transaction_date
+
+    -- Подзапрос для прочих расходов
+    LEFT JOIN (
+        SELECT 
+            ft.client_id,
+            ft.transaction_date,
+            SUM(ABS(ft.amount)) AS other_expenses_sum
+        FROM fact_transactions ft
+        WHERE ft.transaction_date BETWEEN %(date_from)s AND %(date_to)s
+            AND ft.transaction_type NOT LIKE '%%комиссия%%'
+            AND ft.transaction_type NOT LIKE '%%эквайринг%%'
+            AND ft.transaction_type NOT LIKE '%%commission%%'
+            AND ft.transaction_type NOT LIKE '%%fee%%'
+            AND ft.transaction_type NOT LIKE '%%логистика%%'
+            AND ft.transaction_type NOT LIKE '%%доставка%%'
+            AND ft.transaction_type NOT LIKE '%%delivery%%'
+            AND ft.transaction_type NOT LIKE '%%shipping%%'
+            AND ft.transaction_type NOT LIKE '%%возврат%%'
+            AND ft.transaction_type NOT LIKE '%%return%%'
+            AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemFulfillment%%'
+            AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemDeliveryToCustomer%%'
+            AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemReturn%%'
+            AND ft.amount < 0 -- Только расходные операции
+        GROUP BY ft.client_id, ft.transaction_date
+    ) other_data ON fo.client_id = other_data.client_id
+        AND fo.order_date = other_data.transaction_date
+
+    WHERE fo.order_date BETWEEN %(date_from)s AND %(date_to)s
+    GROUP BY fo.client_id, fo.order_date
+    
+    ON DUPLICATE KEY UPDATE
+        orders_cnt = VALUES(orders_cnt),
+        revenue_sum = VALUES(revenue_sum),
+        returns_sum = VALUES(returns_sum),
+        cogs_sum = VALUES(cogs_sum),
+        commission_sum = VALUES(commission_sum),
+        shipping_sum = VALUES(shipping_sum),
+        other_expenses_sum = VALUES(other_expenses_sum),
+        profit_sum = VALUES(profit_sum),
+        margin_percent = VALUES(margin_percent);
+"""
+
+# Ключ system_settings с моментом, до которого изменения фактов уже агрегированы
+WATERMARK_SETTING_KEY = 'metrics_daily_watermark'
+
+# Запас при сдвиге watermark: строки, закоммиченные во время агрегации, попадут в следующий запуск
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+
+def aggregate_metrics_range(connection, date_from: str, date_to: str) -> Optional[int]:
     """
-    Выполняет агрегацию метрик за указанную дату с полным расчетом маржинальности.
+    Выполняет агрегацию метрик за диапазон дат одним запросом.
     
     Args:
         connection: Подключение к базе данных
-        date_to_process (str): Дата для обработки в формате 'YYYY-MM-DD'
+        date_from (str): Начальная дата в формате 'YYYY-MM-DD'
+        date_to (str): Конечная дата в формате 'YYYY-MM-DD' (включительно)
         
     Returns:
-        bool: True если агрегация прошла успешно, False в случае ошибки
+        Optional[int]: Количество затронутых записей или None в случае ошибки
     """
-    logger.info(f"Начинаем агрегацию метрик за дату: {date_to_process}")
-    
     cursor = None
     
     try:
         cursor = connection.cursor()
-        
-        # Улучшенный SQL запрос для агрегации метрик с полным расчетом маржинальности
-        sql_query = """
-        INSERT INTO metrics_daily (
-            client_id, metric_date, orders_cnt, revenue_sum, returns_sum, 
-            cogs_sum, commission_sum, shipping_sum, other_expenses_sum, 
-            profit_sum, margin_percent
-        )
-        SELECT
-            fo.client_id,
-            %(date_param)s AS metric_date,
-            
-            -- Базовые метрики продаж
-            COUNT(CASE WHEN fo.transaction_type = 'продажа' THEN fo.id END) AS orders_cnt,
-            SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) AS revenue_sum,
-            SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) AS returns_sum,
-            
-            -- Себестоимость проданных товаров (COGS)
-            SUM(CASE 
-                WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
-                THEN COALESCE(dp.cost_price * fo.qty, 0) 
-                ELSE 0 
-            END) AS cogs_sum,
-            
-            -- Комиссии маркетплейса и эквайринг
-            COALESCE(commission_data.commission_sum, 0) AS commission_sum,
-            
-            -- Расходы на логистику и доставку
-            COALESCE(logistics_data.shipping_sum, 0) AS shipping_sum,
-            
-            -- Прочие расходы
-            COALESCE(other_data.other_expenses_sum, 0) AS other_expenses_sum,
-            
-            -- Расчет чистой прибыли
-            (
-                SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) - -- Выручка
-                SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) - -- Возвраты
-                SUM(CASE 
-                    WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
-                    THEN COALESCE(dp.cost_price * fo.qty, 0) 
-                    ELSE 0 
-                END) - -- Себестоимость
-                COALESCE(commission_data.commission_sum, 0) - -- Комиссии
-                COALESCE(logistics_data.shipping_sum, 0) - -- Логистика
-                COALESCE(other_data.other_expenses_sum, 0) -- Прочие расходы
-            ) AS profit_sum,
-            
-            -- Расчет процента маржинальности
-            CASE 
-                WHEN SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) > 0 
-                THEN (
-                    (
-                        SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END) - -- Выручка
-                        SUM(CASE WHEN fo.transaction_type = 'возврат' THEN (fo.qty * fo.price) ELSE 0 END) - -- Возвраты
-                        SUM(CASE 
-                            WHEN fo.transaction_type = 'продажа' AND dp.cost_price IS NOT NULL 
-                            THEN COALESCE(dp.cost_price * fo.qty, 0) 
-                            ELSE 0 
-                        END) - -- Себестоимость
-                        COALESCE(commission_data.commission_sum, 0) - -- Комиссии
-                        COALESCE(logistics_data.shipping_sum, 0) - -- Логистика
-                        COALESCE(other_data.other_expenses_sum, 0) -- Прочие расходы
-                    ) / SUM(CASE WHEN fo.transaction_type = 'продажа' THEN (fo.qty * fo.price) ELSE 0 END)
-                ) * 100
-                ELSE NULL 
-            END AS margin_percent
-
-        FROM fact_orders fo
-
-        -- JOIN с таблицей товаров для получения себестоимости
-        LEFT JOIN dim_products dp ON fo.product_id = dp.id
-
-        -- Подзапрос для агрегации комиссий и эквайринга
-        LEFT JOIN (
-            SELECT 
-                ft.client_id,
-                SUM(ABS(ft.amount)) AS commission_sum
-            FROM fact_transactions ft
-            WHERE ft.transaction_date = %(date_param)s
-                AND (
-                    ft.transaction_type LIKE '%%комиссия%%' OR
-                    ft.transaction_type LIKE '%%эквайринг%%' OR
-                    ft.transaction_type LIKE '%%commission%%' OR
-                    ft.transaction_type LIKE '%%fee%%' OR
-                    ft.transaction_type LIKE '%%OperationMarketplaceServiceItemFulfillment%%'
-                )
-            GROUP BY ft.client_id
-        ) commission_data ON fo.client_id = commission_data.client_id
-
-        -- Подзапрос для агрегации логистических расходов
-        LEFT JOIN (
-            SELECT 
-                ft.client_id,
-                SUM(ABS(ft.amount)) AS shipping_sum
-            FROM fact_transactions ft
-            WHERE ft.transaction_date = %(date_param)s
-                AND (
-                    ft.transaction_type LIKE '%%логистика%%' OR
-                    ft.transaction_type LIKE '%%доставка%%' OR
-                    ft.transaction_type LIKE '%%delivery%%' OR
-                    ft.transaction_type LIKE '%%shipping%%' OR
-                    ft.transaction_type LIKE '%%OperationMarketplaceServiceItemDeliveryToCustomer%%'
-                )
-            GROUP BY ft.client_id
-        ) logistics_data ON fo.client_id = logistics_data.client_id
-
-        -- Подзапрос для прочих расходов
-        LEFT JOIN (
-            SELECT 
-                ft.client_id,
-                SUM(ABS(ft.amount)) AS other_expenses_sum
-            FROM fact_transactions ft
-            WHERE ft.transaction_date = %(date_param)s
-                AND ft.transaction_type NOT LIKE '%%комиссия%%'
-                AND ft.transaction_type NOT LIKE '%%эквайринг%%'
-                AND ft.transaction_type NOT LIKE '%%commission%%'
-                AND ft.transaction_type NOT LIKE '%%fee%%'
-                AND ft.transaction_type NOT LIKE '%%логистика%%'
-                AND ft.transaction_type NOT LIKE '%%доставка%%'
-                AND ft.transaction_type NOT LIKE '%%delivery%%'
-                AND ft.transaction_type NOT LIKE '%%shipping%%'
-                AND ft.transaction_type NOT LIKE '%%возврат%%'
-                AND ft.transaction_type NOT LIKE '%%return%%'
-                AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemFulfillment%%'
-                AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemDeliveryToCustomer%%'
-                AND ft.transaction_type NOT LIKE '%%OperationMarketplaceServiceItemReturn%%'
-                AND ft.amount < 0 -- Только расходные операции
-            GROUP BY ft.client_id
-        ) other_data ON fo.client_id = other_data.client_id
-
-        WHERE fo.order_date = %(date_param)s
-        GROUP BY fo.client_id
-        
-        ON DUPLICATE KEY UPDATE
-            orders_cnt = VALUES(orders_cnt),
-            revenue_sum = VALUES(revenue_sum),
-            returns_sum = VALUES(returns_sum),
-            cogs_sum = VALUES(cogs_sum),
-            commission_sum = VALUES(commission_sum),
-            shipping_sum = VALUES(shipping_sum),
-            other_expenses_sum = VALUES(other_expenses_sum),
-            profit_sum = VALUES(profit_sum),
-            margin_percent = VALUES(margin_percent);
-        """
-        
-        # Параметры для запроса
-        params = {'date_param': date_to_process}
-        
-        # Выполняем запрос
-        cursor.execute(sql_query, params)
+        cursor.execute(AGGREGATION_SQL, {'date_from': date_from, 'date_to': date_to})
         affected_rows = cursor.rowcount
         
         # Фиксируем изменения
         connection.commit()
+        return affected_rows
+        
+    except Exception as e:
+        logger.error(f"Ошибка при агрегации метрик за период {date_from} - {date_to}: {e}")
+        connection.rollback()
+        return None
         
-        logger.info(f"Агрегация завершена успешно. Обработано записей: {affected_rows}")
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def aggregate_daily_metrics(connection, date_to_process: str) -> bool:
+    """
+    Выполняет агрегацию метрик за указанную дату с полным расчетом маржинальности.
+    
+    Args:
+        connection: Подключение к базе данных
+        date_to_process (str): Дата для обработки в формате 'YYYY-MM-DD'
         
-        # Логируем детали для отладки
-        if affected_rows > 0:
+    Returns:
+        bool: True если агрегация прошла успешно, False в случае ошибки
+    """
+    logger.info(f"Начинаем агрегацию метрик за дату: {date_to_process}")
+    
+    affected_rows = aggregate_metrics_range(connection, date_to_process, date_to_process)
+    if affected_rows is None:
+        return False
+    
+    logger.info(f"Агрегация завершена успешно. Обработано записей: {affected_rows}")
+    
+    # Логируем детали для отладки
+    if affected_rows > 0:
+        cursor = connection.cursor()
+        try:
             cursor.execute("""
                 SELECT 
                     client_id, 
@@ -232,19 +279,113 @@ def aggregate_daily_metrics(connection, date_to_process: str) -> bool:
             results = cursor.fetchall()
             for result in results:
                 logger.info(f"Клиент {result[0]}: Выручка={result[1]:.2f}, Прибыль={result[2]:.2f}, Маржа={result[3]:.2f}%")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать итоговые метрики за {date_to_process}: {e}")
+        finally:
+            cursor.close()
+    
+    return True
+
+
+def split_into_chunks(dates: List[str], chunk_days: int) -> List[Tuple[str, str, List[str]]]:
+    """
+    Разбивает список дат на непрерывные диапазоны не длиннее chunk_days.
+    
+    Разрыв в датах начинает новый диапазон, чтобы запрос не пересчитывал
+    дни, которые не требуют обработки.
+    
+    Args:
+        dates: Даты в формате 'YYYY-MM-DD'
+        chunk_days: Максимальная длина диапазона в днях
         
-        return True
-        
+    Returns:
+        List[Tuple[str, str, List[str]]]: (начало, конец, даты диапазона)
+    """
+    chunks = []
+    current = []
+    previous = None
+    
+    for date_str in sorted(set(dates)):
+        day = datetime.strptime(date_str, '%Y-%m-%d')
+        if current and (day - previous != timedelta(days=1) or len(current) >= chunk_days):
+            chunks.append((current[0], current[-1], current))
+            current = []
+        current.append(date_str)
+        previous = day
+    
+    if current:
+        chunks.append((current[0], current[-1], current))
+    
+    return chunks
+
+
+def _aggregate_chunk(date_from: str, date_to: str) -> Optional[int]:
+    """
+    Агрегация одного диапазона в отдельном соединении (выполняется в потоке пула).
+    """
+    connection = None
+    
+    try:
+        connection = connect_to_db()
+        return aggregate_metrics_range(connection, date_from, date_to)
     except Exception as e:
-        logger.error(f"Ошибка при агрегации метрик за дату {date_to_process}: {e}")
-        logger.error(f"Детали ошибки: {str(e)}")
-        connection.rollback()
-        return False
-        
+        logger.error(f"Не удалось подключиться к БД для периода {date_from} - {date_to}: {e}")
+        return None
     finally:
-        # Закрываем только cursor, connection остается открытым
-        if cursor:
-            cursor.close()
+        if connection:
+            connection.close()
+
+
+def aggregate_dates_parallel(dates: List[str], workers: int = 4, chunk_days: int = 31,
+                             on_chunk_done: Optional[Callable[[List[str], bool], None]] = None
+                             ) -> Tuple[List[str], List[str]]:
+    """
+    Агрегирует даты диапазонами в пуле потоков.
+    
+    Каждый диапазон обрабатывается одним сгруппированным запросом в
+    собственном соединении и фиксируется отдельной транзакцией, поэтому
+    ошибка в одном диапазоне не откатывает остальные.
+    
+    Args:
+        dates: Даты для обработки в формате 'YYYY-MM-DD'
+        workers: Количество параллельных соединений
+        chunk_days: Максимальная длина диапазона в днях
+        on_chunk_done: Вызывается в основном потоке после каждого диапазона
+            с его датами и признаком успеха (например, для чекпоинта)
+        
+    Returns:
+        Tuple[List[str], List[str]]: (успешно обработанные даты, даты с ошибкой)
+    """
+    chunks = split_into_chunks(dates, max(1, chunk_days))
+    succeeded, failed = [], []
+    
+    if not chunks:
+        return succeeded, failed
+    
+    workers = max(1, min(workers, len(chunks)))
+    logger.info(f"Агрегация {len(dates)} дат: {len(chunks)} диапазонов, потоков: {workers}")
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_aggregate_chunk, date_from, date_to): (date_from, date_to, chunk_dates)
+            for date_from, date_to, chunk_dates in chunks
+        }
+        
+        for future in as_completed(futures):
+            date_from, date_to, chunk_dates = futures[future]
+            affected_rows = future.result()
+            
+            if affected_rows is None:
+                failed.extend(chunk_dates)
+                logger.error(f"Не удалось обработать период: {date_from} - {date_to}")
+            else:
+                succeeded.extend(chunk_dates)
+                logger.info(f"Период {date_from} - {date_to} обработан. Записей: {affected_rows}")
+            
+            if on_chunk_done:
+                on_chunk_done(chunk_dates, affected_rows is not None)
+    
+    return sorted(succeeded), sorted(failed)
 
 
 def get_last_aggregated_date(cursor) -> Optional[str]:
@@ -342,10 +483,130 @@ def get_dates_to_process(cursor) -> List[str]:
     return dates_to_process
 
 
-def main():
+def get_aggregation_watermark(cursor, setting_key: str = WATERMARK_SETTING_KEY) -> Optional[datetime]:
+    """
+    Получает момент, до которого изменения фактов уже учтены в metrics_daily.
+    
+    Args:
+        cursor: Курсор базы данных
+        setting_key: Ключ watermark в system_settings
+    
+    Returns:
+        Optional[datetime]: Watermark или None если агрегация еще не запускалась в инкрементальном режиме
+    """
+    try:
+        cursor.execute(
+            "SELECT setting_value FROM system_settings WHERE setting_key = %s",
+            (setting_key,)
+        )
+        result = cursor.fetchone()
+        
+        if result and result[0]:
+            return datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
+        return None
+        
+    except Exception as e:
+        logger.error(f"Ошибка при получении watermark агрегации: {e}")
+        return None
+
+
+def save_aggregation_watermark(connection, watermark: datetime,
+                               setting_key: str = WATERMARK_SETTING_KEY,
+                               description: str = 'Последнее изменение fact_orders/fact_transactions, учтенное в metrics_daily') -> None:
+    """
+    Сохраняет watermark агрегации в system_settings.
+    
+    Args:
+        connection: Подключение к базе данных
+        watermark: Момент, до которого изменения фактов учтены
+        setting_key: Ключ watermark в system_settings
+        description: Описание настройки
+    """
+    cursor = connection.cursor()
+    
+    try:
+        cursor.execute("""
+            INSERT INTO system_settings (setting_key, setting_value, description)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE setting_value = VALUES(setting_value)
+        """, (
+            setting_key,
+            watermark.strftime('%Y-%m-%d %H:%M:%S'),
+            description
+        ))
+        connection.commit()
+        
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении watermark агрегации: {e}")
+        connection.rollback()
+        
+    finally:
+        cursor.close()
+
+
+def get_dirty_dates(cursor, since: datetime) -> List[str]:
+    """
+    Определяет даты, по которым после watermark появились новые или измененные факты.
+    
+    Учитываются опоздавшие строки fact_orders (по updated_at) и
+    fact_transactions (по created_at) за любые прошлые даты.
+    
+    Args:
+        cursor: Курсор базы данных
+        since: Watermark предыдущего запуска
+    
+    Returns:
+        List[str]: Список дат в формате 'YYYY-MM-DD'
+    """
+    cursor.execute("""
+        SELECT DISTINCT order_date FROM fact_orders WHERE updated_at > %s
+        UNION
+        SELECT DISTINCT transaction_date FROM fact_transactions WHERE created_at > %s
+    """, (since, since))
+    
+    return sorted(row[0].strftime('%Y-%m-%d') for row in cursor.fetchall() if row[0])
+
+
+def get_date_range(date_from: str, date_to: str) -> List[str]:
+    """
+    Возвращает все даты диапазона (включительно) в формате 'YYYY-MM-DD'.
+    """
+    current_date = datetime.strptime(date_from, '%Y-%m-%d')
+    end_date = datetime.strptime(date_to, '%Y-%m-%d')
+    
+    dates = []
+    while current_date <= end_date:
+        dates.append(current_date.strftime('%Y-%m-%d'))
+        current_date += timedelta(days=1)
+    
+    return dates
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Разбор аргументов командной строки.
+    """
+    parser = argparse.ArgumentParser(description='Агрегация ежедневных метрик в metrics_daily')
+    parser.add_argument('--date-from', help='Начальная дата полного пересчета (YYYY-MM-DD)')
+    parser.add_argument('--date-to', help='Конечная дата полного пересчета (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Количество параллельных соединений (по умолчанию 4)')
+    parser.add_argument('--chunk-days', type=int, default=31,
+                        help='Максимальная длина диапазона для одного запроса (по умолчанию 31)')
+    parser.add_argument('--sequential', action='store_true',
+                        help='Обрабатывать даты по одной в одном соединении (прежний режим)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """
     Основная функция скрипта.
+    
+    Без аргументов обрабатывает даты после последней агрегации и даты,
+    затронутые опоздавшими фактами с момента предыдущего запуска.
+    С --date-from/--date-to пересчитывает указанный диапазон полностью.
     """
+    args = parse_args(argv)
     logger.info("Запуск скрипта агрегации ежедневных метрик")
     
     connection = None
@@ -356,27 +617,62 @@ def main():
         connection = connect_to_db()
         cursor = connection.cursor()
         
-        # Определяем даты для обработки
-        dates_to_process = get_dates_to_process(cursor)
+        run_started_at = None
+        
+        if args.date_from or args.date_to:
+            # Явный диапазон: полный пересчет (backfill), watermark не меняем
+            date_from = args.date_from or args.date_to
+            date_to = args.date_to or args.date_from
+            dates_to_process = get_date_range(date_from, date_to)
+        else:
+            # Фиксируем время старта до чтения фактов: все, что изменится позже,
+            # попадет в следующий запуск
+            cursor.execute("SELECT NOW()")
+            run_started_at = cursor.fetchone()[0]
+            
+            # Определяем даты для обработки
+            dates_to_process = get_dates_to_process(cursor)
+            
+            watermark = get_aggregation_watermark(cursor)
+            if watermark:
+                dirty_dates = get_dirty_dates(cursor, watermark)
+                logger.info(f"Дат с изменившимися фактами с {watermark}: {len(dirty_dates)}")
+                dates_to_process = sorted(set(dates_to_process) | set(dirty_dates))
+            else:
+                logger.info("Watermark агрегации не найден, обрабатываем только новые даты")
         
         if not dates_to_process:
             logger.info("Нет дат для обработки")
+            if run_started_at:
+                save_aggregation_watermark(connection, run_started_at - WATERMARK_OVERLAP)
             return
         
         logger.info(f"Найдено дат для обработки: {len(dates_to_process)}")
         logger.info(f"Даты: {', '.join(dates_to_process)}")
         
-        # Обрабатываем каждую дату
-        success_count = 0
-        for date_str in dates_to_process:
-            logger.info(f"--- Запускаем агрегацию для {date_str} ---")
-            if aggregate_daily_metrics(connection, date_str):
-                success_count += 1
-            else:
-                logger.error(f"Не удалось обработать дату: {date_str}")
+        if args.sequential:
+            # Обрабатываем каждую дату
+            failed_dates = []
+            for date_str in dates_to_process:
+                logger.info(f"--- Запускаем агрегацию для {date_str} ---")
+                if not aggregate_daily_metrics(connection, date_str):
+                    failed_dates.append(date_str)
+                    logger.error(f"Не удалось обработать дату: {date_str}")
+        else:
+            _, failed_dates = aggregate_dates_parallel(
+                dates_to_process, workers=args.workers, chunk_days=args.chunk_days
+            )
         
+        success_count = len(dates_to_process) - len(failed_dates)
         logger.info(f"Обработка завершена. Успешно: {success_count}/{len(dates_to_process)}")
         
+        # Сдвигаем watermark только если все даты пересчитаны,
+        # иначе изменения будут найдены повторно при следующем запуске
+        if run_started_at and not failed_dates:
+            save_aggregation_watermark(connection, run_started_at - WATERMARK_OVERLAP)
+        elif failed_dates:
+            logger.error(f"Даты с ошибкой: {', '.join(failed_dates)}")
+        
     except Exception as e:
         logger.error(f"Критическая ошибка в main(): {e}")
         
@@ -2,6 +2,11 @@
 """
 Утилита для синхронизации данных из мастер таблицы dim_products
 в локальную таблицу product_names для улучшения производительности
+
+Названия собираются векторно (pandas), записи загружаются во временную
+таблицу и сливаются в product_names одним INSERT ... SELECT. В режиме
+--incremental читаются только строки dim_products, измененные после
+последней синхронизации (high-water mark по updated_at в system_settings).
 """
 
 import mysql.connector
@@ -9,7 +14,9 @@ import os
 import sys
 import time
 import logging
-from typing import Dict, List, Tuple
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
@@ -26,6 +33,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Строк в одном INSERT при загрузке staging-таблицы
+STAGING_BATCH_SIZE = 5000
+
+# Ключ system_settings с последним dim_products.updated_at, перенесенным в product_names
+WATERMARK_SETTING_KEY = 'master_table_sync_watermark'
+
+# Длина product_names.sku
+MAX_SKU_LENGTH = 255
+
 class MasterTableSyncService:
     """Сервис синхронизации данных из мастер таблицы dim_products"""
     
@@ -71,8 +87,63 @@ class MasterTableSyncService:
             logger.error(f"Ошибка подключения к БД: {e}")
             sys.exit(1)
     
-    def get_master_table_data(self) -> List[Dict]:
-        """Получает данные из мастер таблицы dim_products"""
+    def get_high_water_mark(self) -> Optional[datetime]:
+        """
+        Момент последнего изменения мастер таблицы, уже перенесенного в product_names.
+        
+        Хранится в system_settings, а не берется как MAX(product_names.updated_at):
+        записи без dim_products.updated_at пишутся с текущим временем и сдвинули
+        бы такую границу дальше реальных изменений мастер таблицы.
+        """
+        try:
+            cursor = self.core_connection.cursor()
+            cursor.execute(
+                "SELECT setting_value FROM system_settings WHERE setting_key = %s",
+                (WATERMARK_SETTING_KEY,)
+            )
+            result = cursor.fetchone()
+            cursor.close()
+            
+            if result and result[0]:
+                return datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
+            return None
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения high-water mark: {e}")
+            return None
+    
+    def save_high_water_mark(self, watermark: datetime) -> None:
+        """Сохраняет high-water mark синхронизации в system_settings"""
+        cursor = self.core_connection.cursor()
+        
+        try:
+            cursor.execute("""
+                INSERT INTO system_settings (setting_key, setting_value, description)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE setting_value = VALUES(setting_value)
+            """, (
+                WATERMARK_SETTING_KEY,
+                watermark.strftime('%Y-%m-%d %H:%M:%S'),
+                'Последнее изменение dim_products, перенесенное в product_names'
+            ))
+            self.core_connection.commit()
+            logger.info(f"High-water mark сохранен: {watermark}")
+            
+        except Exception as e:
+            logger.error(f"Ошибка сохранения high-water mark: {e}")
+            self.core_connection.rollback()
+            
+        finally:
+            cursor.close()
+    
+    def get_master_table_data(self, updated_since: Optional[datetime] = None) -> List[Dict]:
+        """
+        Получает данные из мастер таблицы dim_products
+        
+        Args:
+            updated_since: Только записи с updated_at не раньше этого момента
+                (граница включается - повторная запись идемпотентна)
+        """
         try:
             cursor = self.master_connection.cursor(dictionary=True)
             
@@ -91,10 +162,16 @@ class MasterTableSyncService:
                 FROM dim_products 
                 WHERE sku_ozon IS NOT NULL 
                 AND sku_ozon != ''
-                ORDER BY updated_at DESC
             """
+            params = []
+            
+            if updated_since:
+                query += " AND updated_at >= %s"
+                params.append(updated_since)
             
-            cursor.execute(query)
+            query += " ORDER BY updated_at DESC"
+            
+            cursor.execute(query, params)
             results = cursor.fetchall()
             cursor.close()
             
@@ -107,94 +184,190 @@ class MasterTableSyncService:
             logger.error(f"Ошибка получения данных из мастер таблицы: {e}")
             return []
     
+    @staticmethod
+    def build_full_product_names(master_data: List[Dict]) -> List[str]:
+        """
+        Формирует полные названия товаров: "Название (Бренд) [Категория]".
+        
+        Название - product_name, а если он пуст, name; пустые части
+        пропускаются, без всех частей - "Товар <sku_ozon>".
+        """
+        frame = pd.DataFrame(master_data, dtype=object)
+        
+        def non_empty(column: str) -> pd.Series:
+            if column not in frame.columns:
+                return pd.Series(None, index=frame.index, dtype=object)
+            values = frame[column]
+            values = values.where(values.isna(), values.astype(str))
+            return values.where(values != '')
+        
+        base = non_empty('product_name').fillna(non_empty('name'))
+        
+        # Каждая непустая часть начинается с пробела, первый пробел затем отрезается
+        full_names = (
+            (' ' + base).fillna('') +
+            (' (' + non_empty('brand') + ')').fillna('') +
+            (' [' + non_empty('category') + ']').fillna('')
+        ).str.slice(1)
+        
+        fallback = 'Товар ' + frame['sku_ozon'].astype(str)
+        return full_names.where(full_names != '', fallback).tolist()
+    
+    @staticmethod
+    def validate_master_data(master_data: List[Dict]) -> Tuple[pd.DataFrame, int]:
+        """
+        Приводит записи мастер таблицы к типам staging-таблицы и отбраковывает негодные.
+        
+        Отбраковываются записи с нецелым или неположительным id, с пустым или
+        слишком длинным sku_ozon и с нераспознанными датами. Даты остаются
+        None, если их нет в мастер таблице.
+        
+        Returns:
+            Tuple[pd.DataFrame, int]: Годные записи (product_id, sku, created_at,
+                updated_at и позиция в master_data) и число отбракованных
+        """
+        frame = pd.DataFrame(master_data, dtype=object)
+        
+        def column(name: str) -> pd.Series:
+            if name not in frame.columns:
+                return pd.Series(None, index=frame.index, dtype=object)
+            return frame[name]
+        
+        product_id = pd.to_numeric(column('id'), errors='coerce')
+        sku = column('sku_ozon').where(column('sku_ozon').isna(), column('sku_ozon').astype(str).str.strip())
+        
+        checks = {
+            'с некорректным id': product_id.isna() | (product_id % 1 != 0) | (product_id <= 0),
+            'с пустым или слишком длинным sku_ozon': sku.isna() | (sku == '') | (sku.str.len() > MAX_SKU_LENGTH),
+        }
+        dates = {}
+        for field in ['created_at', 'updated_at']:
+            dates[field] = pd.to_datetime(column(field), errors='coerce', format='mixed')
+            checks[f'с некорректным {field}'] = column(field).notna() & dates[field].isna()
+        
+        rejected = pd.Series(False, index=frame.index)
+        for reason, mask in checks.items():
+            mask = mask.fillna(True).astype(bool)
+            count = int(mask.sum())
+            if count:
+                examples = column('sku_ozon')[mask].head(5).tolist()
+                logger.warning(f"⚠️ Пропущено записей {reason}: {count} (например: {examples})")
+            rejected |= mask
+        
+        valid = pd.DataFrame({
+            'position': range(len(frame)),
+            'product_id': product_id,
+            'sku': sku,
+            'created_at': dates['created_at'],
+            'updated_at': dates['updated_at'],
+        }, index=frame.index)[~rejected]
+        
+        return valid, int(rejected.sum())
+    
     def sync_to_product_names(self, master_data: List[Dict]) -> Dict[str, int]:
-        """Синхронизирует данные в таблицу product_names"""
+        """
+        Синхронизирует данные в таблицу product_names (staging-таблица и одно слияние)
+        
+        Негодные записи отбрасываются до staging и считаются ошибками. После
+        слияния high-water mark сдвигается на максимальный dim_products.updated_at
+        перенесенных записей; записи без updated_at в нем не участвуют.
+        """
         if not master_data:
             return {'inserted': 0, 'updated': 0, 'failed': 0}
         
+        valid, failed = self.validate_master_data(master_data)
+        self.stats['failed_records'] += failed
+        if valid.empty:
+            return {'inserted': 0, 'updated': 0, 'failed': failed}
+        
         cursor = self.core_connection.cursor()
-        inserted = updated = failed = 0
         
         try:
-            # Подготавливаем запрос для UPSERT
-            upsert_query = """
+            now = time.strftime('%Y-%m-%d %H:%M:%S')
+            full_names = self.build_full_product_names([master_data[position] for position in valid['position']])
+            
+            def as_db_datetime(value) -> str:
+                return now if pd.isna(value) else value.strftime('%Y-%m-%d %H:%M:%S')
+            
+            rows = [
+                (
+                    seq,
+                    int(product_id),  # Используем ID из мастер таблицы как product_id
+                    sku,
+                    full_name,
+                    as_db_datetime(created_at),
+                    as_db_datetime(updated_at)
+                )
+                for seq, (product_id, sku, created_at, updated_at, full_name) in enumerate(zip(
+                    valid['product_id'], valid['sku'], valid['created_at'], valid['updated_at'], full_names
+                ))
+            ]
+            
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_product_names_sync")
+            cursor.execute("""
+                CREATE TEMPORARY TABLE tmp_product_names_sync (
+                    seq INT NOT NULL,
+                    product_id BIGINT NOT NULL,
+                    sku VARCHAR(255) NOT NULL,
+                    product_name TEXT NOT NULL,
+                    created_at DATETIME,
+                    updated_at DATETIME,
+                    INDEX idx_sku (sku)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            
+            for start in range(0, len(rows), STAGING_BATCH_SIZE):
+                cursor.executemany("""
+                    INSERT INTO tmp_product_names_sync (seq, product_id, sku, product_name, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, rows[start:start + STAGING_BATCH_SIZE])
+                logger.info(f"Загружено в staging: {min(start + STAGING_BATCH_SIZE, len(rows))}/{len(rows)}")
+            
+            # Новые SKU - одним anti-join вместо проверки каждой записи
+            cursor.execute("""
+                SELECT COUNT(DISTINCT t.sku)
+                FROM tmp_product_names_sync t
+                LEFT JOIN product_names p ON p.sku = t.sku AND p.source = 'MasterTable'
+                WHERE p.id IS NULL
+            """)
+            inserted = cursor.fetchone()[0]
+            updated = len(rows) - inserted
+            
+            cursor.execute("""
                 INSERT INTO product_names (
                     product_id, sku, product_name, source, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, %s, %s)
+                )
+                SELECT product_id, sku, product_name, 'MasterTable', created_at, updated_at
+                FROM tmp_product_names_sync
+                ORDER BY seq
                 ON DUPLICATE KEY UPDATE
                 product_name = VALUES(product_name),
                 updated_at = VALUES(updated_at)
-            """
-            
-            for record in master_data:
-                try:
-                    # Формируем полное название товара
-                    product_name_parts = []
-                    
-                    if record.get('product_name'):
-                        product_name_parts.append(record['product_name'])
-                    elif record.get('name'):
-                        product_name_parts.append(record['name'])
-                    
-                    if record.get('brand'):
-                        product_name_parts.append(f"({record['brand']})")
-                    
-                    if record.get('category'):
-                        product_name_parts.append(f"[{record['category']}]")
-                    
-                    full_product_name = ' '.join(product_name_parts) if product_name_parts else f"Товар {record['sku_ozon']}"
-                    
-                    # Проверяем, существует ли запись
-                    check_cursor = self.core_connection.cursor()
-                    check_cursor.execute(
-                        "SELECT id FROM product_names WHERE sku = %s AND source = 'MasterTable'",
-                        (record['sku_ozon'],)
-                    )
-                    exists = check_cursor.fetchone()
-                    check_cursor.close()
-                    
-                    # Выполняем UPSERT
-                    cursor.execute(upsert_query, (
-                        record['id'],  # Используем ID из мастер таблицы как product_id
-                        record['sku_ozon'],
-                        full_product_name,
-                        'MasterTable',
-                        record.get('created_at') or time.strftime('%Y-%m-%d %H:%M:%S'),
-                        record.get('updated_at') or time.strftime('%Y-%m-%d %H:%M:%S')
-                    ))
-                    
-                    if exists:
-                        updated += 1
-                    else:
-                        inserted += 1
-                    
-                    self.stats['processed_records'] += 1
-                    
-                    # Показываем прогресс каждые 100 записей
-                    if self.stats['processed_records'] % 100 == 0:
-                        progress = (self.stats['processed_records'] / self.stats['total_master_records']) * 100
-                        logger.info(f"Прогресс: {progress:.1f}% ({self.stats['processed_records']}/{self.stats['total_master_records']})")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка обработки записи {record.get('sku_ozon', 'unknown')}: {e}")
-                    failed += 1
-                    self.stats['failed_records'] += 1
+            """)
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_product_names_sync")
             
             self.core_connection.commit()
             
+            self.stats['processed_records'] += len(rows)
             self.stats['inserted_records'] = inserted
             self.stats['updated_records'] = updated
             
             logger.info(f"Синхронизация завершена: вставлено {inserted}, обновлено {updated}, ошибок {failed}")
             
-            return {'inserted': inserted, 'updated': updated, 'failed': failed}
-            
         except Exception as e:
             logger.error(f"Ошибка синхронизации: {e}")
             self.core_connection.rollback()
-            return {'inserted': 0, 'updated': 0, 'failed': len(master_data)}
+            self.stats['failed_records'] += len(valid)
+            return {'inserted': 0, 'updated': 0, 'failed': failed + len(valid)}
         finally:
             cursor.close()
+        
+        # Только реальные моменты изменения мастер таблицы: подставленное now сдвинуло бы границу вперед
+        watermark = valid['updated_at'].max()
+        if pd.notna(watermark):
+            self.save_high_water_mark(watermark.to_pydatetime())
+        
+        return {'inserted': inserted, 'updated': updated, 'failed': failed}
     
     def update_inventory_product_ids(self):
         """Обновляет product_id в inventory_data на основе синхронизированных данных"""
@@ -303,8 +476,17 @@ class MasterTableSyncService:
         logger.info("Начинаем синхронизацию данных из мастер таблицы")
         
         try:
+            # В инкрементальном режиме читаем только измененные записи
+            updated_since = None
+            if incremental:
+                updated_since = self.get_high_water_mark()
+                if updated_since:
+                    logger.info(f"Инкрементальная синхронизация: изменения с {updated_since}")
+                else:
+                    logger.info("High-water mark не найден, выполняем полную синхронизацию")
+            
             # Получаем данные из мастер таблицы
-            master_data = self.get_master_table_data()
+            master_data = self.get_master_table_data(updated_since)
             
             if not master_data:
                 logger.info("Нет данных для синхронизации")
@@ -76,10 +76,13 @@ class EnhancedRecommender(ReplenishmentRecommender):
             enhanced_recommendations = []
             processed = 0
             
+            # Остатки загружаются один раз на весь цикл
+            inventory = self.inventory_analyzer.get_current_stock(lazy=True)
+            
             for base_rec in base_recommendations:
                 try:
                     # Получаем товар для анализа маржинальности
-                    item = self._get_inventory_item(base_rec.product_id)
+                    item = self._get_inventory_item(base_rec.product_id, inventory)
                     if not item:
                         continue
                     
@@ -114,14 +117,12 @@ class EnhancedRecommender(ReplenishmentRecommender):
             logger.error(f"Ошибка генерации улучшенных рекомендаций: {e}")
             return []
     
-    def _get_inventory_item(self, product_id: int):
+    def _get_inventory_item(self, product_id: int, inventory=None):
         """Получение товара по ID для анализа маржинальности."""
         try:
-            items = self.inventory_analyzer.get_current_stock()
-            for item in items:
-                if item.product_id == product_id:
-                    return item
-            return None
+            if inventory is None:
+                inventory = self.inventory_analyzer.get_current_stock(lazy=True)
+            return inventory.find(product_id)
         except Exception as e:
             logger.error(f"Ошибка получения товара {product_id}: {e}")
             return None
@@ -8,7 +8,7 @@ import sys
 import os
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterator, Union, Iterable
 from dataclasses import dataclass
 
 # Добавляем путь к модулю importers
@@ -54,6 +54,59 @@ class ProductSettings:
     is_active: bool = True
 
 
+class InventoryColumns:
+    """
+    Колоночный результат get_current_stock(lazy=True).
+    
+    Остатки хранятся списками по колонкам; объекты InventoryItem создаются
+    только при итерации или обращении по индексу.
+    """
+    
+    COLUMNS = (
+        'product_id', 'sku', 'product_name', 'source', 'current_stock',
+        'reserved_stock', 'available_stock', 'last_updated', 'cost_price'
+    )
+    
+    def __init__(self, columns: Dict[str, list]):
+        self.columns = columns
+        self._index: Optional[Dict[int, int]] = None
+    
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> 'InventoryColumns':
+        """Построение из строк запроса в порядке COLUMNS."""
+        rows = list(rows)
+        values = list(zip(*rows)) if rows else [()] * len(cls.COLUMNS)
+        columns = {name: list(column) for name, column in zip(cls.COLUMNS, values)}
+        # Доступный остаток не может быть отрицательным
+        columns['available_stock'] = [max(0, value) for value in columns['available_stock']]
+        return cls(columns)
+    
+    def __len__(self) -> int:
+        return len(self.columns['product_id'])
+    
+    def _item(self, position: int) -> InventoryItem:
+        return InventoryItem(**{name: self.columns[name][position] for name in self.COLUMNS})
+    
+    def __iter__(self) -> Iterator[InventoryItem]:
+        for position in range(len(self)):
+            yield self._item(position)
+    
+    def __getitem__(self, key: Union[int, slice]) -> Union[InventoryItem, 'InventoryColumns']:
+        if isinstance(key, slice):
+            return InventoryColumns({name: column[key] for name, column in self.columns.items()})
+        return self._item(range(len(self))[key])
+    
+    def find(self, product_id: int) -> Optional[InventoryItem]:
+        """Первая запись товара (индекс строится при первом обращении)."""
+        if self._index is None:
+            self._index = {}
+            for position, item_product_id in enumerate(self.columns['product_id']):
+                self._index.setdefault(item_product_id, position)
+        
+        position = self._index.get(product_id)
+        return self._item(position) if position is not None else None
+
+
 class InventoryAnalyzer:
     """Класс для анализа текущих запасов товаров."""
     
@@ -67,6 +120,11 @@ class InventoryAnalyzer:
         self.connection = connection or connect_to_db()
         self.settings = self._load_system_settings()
         
+        # Кэш настроек товаров: source (None - все товары) -> {product_id: ProductSettings}
+        self._product_settings_cache: Dict[Optional[str], Dict[int, ProductSettings]] = {}
+        # Версия dim_products (MAX(updated_at), COUNT(*)), для которой заполнен кэш
+        self._product_settings_version = None
+        
     def _load_system_settings(self) -> Dict[str, any]:
         """Загружает системные настройки из базы данных."""
         try:
@@ -118,19 +176,21 @@ class InventoryAnalyzer:
         }
     
     def get_current_stock(self, product_id: Optional[int] = None, 
-                         source: Optional[str] = None) -> List[InventoryItem]:
+                         source: Optional[str] = None,
+                         lazy: bool = False) -> Union[List[InventoryItem], InventoryColumns]:
         """
         Получить текущие остатки товаров.
         
         Args:
             product_id: ID конкретного товара (опционально)
             source: Источник данных (опционально)
+            lazy: Вернуть колоночный InventoryColumns вместо списка объектов
             
         Returns:
-            Список объектов InventoryItem
+            Список объектов InventoryItem (или InventoryColumns при lazy=True)
         """
         try:
-            cursor = self.connection.cursor(dictionary=True)
+            cursor = self.connection.cursor()
             
             sql = """
                 SELECT 
@@ -161,41 +221,136 @@ class InventoryAnalyzer:
             sql += " ORDER BY i.source, dp.product_name"
             
             cursor.execute(sql, params)
-            results = cursor.fetchall()
+            inventory = InventoryColumns.from_rows(cursor.fetchall())
             cursor.close()
             
-            inventory_items = []
-            for row in results:
-                item = InventoryItem(
-                    product_id=row['product_id'],
-                    sku=row['sku'],
-                    product_name=row['product_name'],
-                    source=row['source'],
-                    current_stock=row['current_stock'],
-                    reserved_stock=row['reserved_stock'],
-                    available_stock=max(0, row['available_stock']),  # Не может быть отрицательным
-                    last_updated=row['last_updated'],
-                    cost_price=row['cost_price']
+            logger.info(f"Получено {len(inventory)} товаров в запасах")
+            return inventory if lazy else list(inventory)
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения остатков: {e}")
+            return InventoryColumns.from_rows([]) if lazy else []
+    
+    def get_product_settings_map(self, source: Optional[str] = None) -> Dict[int, ProductSettings]:
+        """
+        Получить настройки пополнения всех товаров одним запросом.
+        
+        Результат кэшируется, пока не изменится версия dim_products
+        (MAX(updated_at) и число строк) или не будет вызван
+        invalidate_product_settings(): повторный вызов проверяет версию одним
+        легким запросом и не перечитывает настройки всех товаров.
+        
+        Args:
+            source: Источник данных (только товары с остатками в этом источнике)
+            
+        Returns:
+            Словарь product_id -> ProductSettings (товаров без записи в dim_products в нем нет)
+        """
+        self._check_product_settings_version()
+        
+        if source in self._product_settings_cache:
+            return self._product_settings_cache[source]
+        
+        try:
+            cursor = self.connection.cursor(dictionary=True)
+            
+            sql = """
+                SELECT 
+                    product_id,
+                    COALESCE(min_stock_level, 0) as min_stock_level,
+                    COALESCE(max_stock_level, 0) as max_stock_level,
+                    COALESCE(reorder_point, 0) as reorder_point,
+                    COALESCE(lead_time_days, %s) as lead_time_days,
+                    COALESCE(safety_stock_days, %s) as safety_stock_days,
+                    COALESCE(is_active, TRUE) as is_active
+                FROM dim_products
+            """
+            params = [
+                self.settings.get('default_lead_time_days', 14),
+                self.settings.get('default_safety_stock_days', 7)
+            ]
+            
+            if source:
+                sql += " WHERE product_id IN (SELECT product_id FROM inventory WHERE source = %s)"
+                params.append(source)
+            
+            cursor.execute(sql, params)
+            settings_map = {
+                row['product_id']: ProductSettings(
+                    min_stock_level=row['min_stock_level'],
+                    max_stock_level=row['max_stock_level'],
+                    reorder_point=row['reorder_point'],
+                    lead_time_days=row['lead_time_days'],
+                    safety_stock_days=row['safety_stock_days'],
+                    is_active=row['is_active']
                 )
-                inventory_items.append(item)
+                for row in cursor.fetchall()
+            }
+            cursor.close()
             
-            logger.info(f"Получено {len(inventory_items)} товаров в запасах")
-            return inventory_items
+        except Exception as e:
+            logger.error(f"Ошибка получения настроек товаров: {e}")
+            return {}
+        
+        self._product_settings_cache[source] = settings_map
+        logger.info(f"Загружены настройки {len(settings_map)} товаров{' (' + source + ')' if source else ''}")
+        return settings_map
+    
+    def invalidate_product_settings(self) -> None:
+        """Сбросить кэш настроек товаров (после изменения dim_products или перед новым анализом)."""
+        self._product_settings_cache.clear()
+        self._product_settings_version = None
+    
+    def _check_product_settings_version(self) -> None:
+        """Сбросить кэш настроек товаров, если версия dim_products изменилась."""
+        version = self._get_dim_products_version()
+        if version is None or version != self._product_settings_version:
+            self._product_settings_cache.clear()
+            self._product_settings_version = version
+    
+    def _get_dim_products_version(self) -> Optional[tuple]:
+        """
+        Версия dim_products для проверки актуальности кэша настроек.
+        
+        Returns:
+            (MAX(updated_at), COUNT(*)) или None, если версию получить не удалось
+            (тогда кэш не используется между вызовами)
+        """
+        try:
+            cursor = self.connection.cursor(dictionary=True)
+            cursor.execute("SELECT MAX(updated_at) as max_updated_at, COUNT(*) as total FROM dim_products")
+            row = cursor.fetchone()
+            cursor.close()
+            return (row['max_updated_at'], row['total']) if row else None
             
         except Exception as e:
-            logger.error(f"Ошибка получения остатков: {e}")
-            return []
+            logger.warning(f"Не удалось получить версию dim_products: {e}")
+            return None
     
     def get_product_settings(self, product_id: int) -> ProductSettings:
         """
         Получить настройки товара для пополнения.
         
+        Если настройки уже загружены get_product_settings_map() и версия
+        dim_products не изменилась, настройки берутся из кэша.
+        
         Args:
             product_id: ID товара
             
         Returns:
             Объект ProductSettings с настройками товара
         """
+        if self._product_settings_cache:
+            self._check_product_settings_version()
+        
+        all_products = self._product_settings_cache.get(None)
+        if all_products is not None:
+            return all_products.get(product_id, ProductSettings())
+        
+        for settings_map in self._product_settings_cache.values():
+            if product_id in settings_map:
+                return settings_map[product_id]
+        
         try:
             cursor = self.connection.cursor(dictionary=True)
             cursor.execute("""
@@ -249,14 +404,15 @@ class InventoryAnalyzer:
             
         try:
             # Получаем все товары
-            all_items = self.get_current_stock()
+            all_items = self.get_current_stock(lazy=True)
+            settings_map = self.get_product_settings_map()
             
             # Фильтруем товары с низкими остатками
             # Для упрощения считаем, что товар критичен, если остаток меньше порога
             critical_items = []
             
             for item in all_items:
-                settings = self.get_product_settings(item.product_id)
+                settings = settings_map.get(item.product_id, ProductSettings())
                 
                 # Если установлена точка перезаказа, используем её
                 if settings.reorder_point > 0:
@@ -293,12 +449,13 @@ class InventoryAnalyzer:
             
         try:
             # Получаем все товары
-            all_items = self.get_current_stock()
+            all_items = self.get_current_stock(lazy=True)
+            settings_map = self.get_product_settings_map()
             
             overstocked_items = []
             
             for item in all_items:
-                settings = self.get_product_settings(item.product_id)
+                settings = settings_map.get(item.product_id, ProductSettings())
                 
                 # Если установлен максимальный уровень запасов
                 if settings.max_stock_level > 0:
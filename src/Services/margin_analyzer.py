@@ -9,9 +9,12 @@ import os
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from enum import Enum
 
+import numpy as np
+import pandas as pd
+
 # Добавляем путь к модулю importers
 sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
 
@@ -36,6 +39,19 @@ class MarginCategory(Enum):
     NEGATIVE_MARGIN = "NEGATIVE_MARGIN"  # < 5%
 
 
+# Пороги маржинальности (%) по убыванию и соответствующие им категории,
+# корректировки приоритета и множители инвестиций
+MARGIN_THRESHOLDS = [30, 15, 5]
+MARGIN_CATEGORIES = [
+    MarginCategory.HIGH_MARGIN,
+    MarginCategory.MEDIUM_MARGIN,
+    MarginCategory.LOW_MARGIN,
+    MarginCategory.NEGATIVE_MARGIN
+]
+PRIORITY_ADJUSTMENTS = [1.5, 1.2, 1.0, 0.5]
+INVESTMENT_MULTIPLIERS = [1.5, 1.0, 0.7, 0.3]
+
+
 @dataclass
 class MarginAnalysis:
     """Анализ маржинальности товара."""
@@ -93,7 +109,7 @@ class MarginAnalyzer:
                 selling_price = self._get_selling_price(item.product_id)
             
             # Рассчитываем маржу
-            cost_price = item.cost_price or 0
+            cost_price = float(item.cost_price or 0)
             margin_amount = selling_price - cost_price
             margin_percentage = (margin_amount / selling_price * 100) if selling_price > 0 else 0
             
@@ -194,24 +210,16 @@ class MarginAnalyzer:
     
     def _categorize_margin(self, margin_percentage: float) -> MarginCategory:
         """Категоризация маржинальности."""
-        if margin_percentage >= 30:
-            return MarginCategory.HIGH_MARGIN
-        elif margin_percentage >= 15:
-            return MarginCategory.MEDIUM_MARGIN
-        elif margin_percentage >= 5:
-            return MarginCategory.LOW_MARGIN
-        else:
-            return MarginCategory.NEGATIVE_MARGIN
+        for threshold, category in zip(MARGIN_THRESHOLDS, MARGIN_CATEGORIES):
+            if margin_percentage >= threshold:
+                return category
+        return MarginCategory.NEGATIVE_MARGIN
     
     def _calculate_priority_adjustment(self, margin_category: MarginCategory, 
                                      margin_percentage: float) -> float:
         """Расчет корректировки приоритета на основе маржинальности."""
-        adjustments = {
-            MarginCategory.HIGH_MARGIN: 1.5,      # Повышаем приоритет на 50%
-            MarginCategory.MEDIUM_MARGIN: 1.2,    # Повышаем на 20%
-            MarginCategory.LOW_MARGIN: 1.0,       # Без изменений
-            MarginCategory.NEGATIVE_MARGIN: 0.5   # Понижаем на 50%
-        }
+        # HIGH: +50%, MEDIUM: +20%, LOW: без изменений, NEGATIVE: -50%
+        adjustments = dict(zip(MARGIN_CATEGORIES, PRIORITY_ADJUSTMENTS))
         
         base_adjustment = adjustments.get(margin_category, 1.0)
         
@@ -233,19 +241,13 @@ class MarginAnalyzer:
         # Базовый запас на 30 дней
         base_investment = daily_sales_rate * 30 * cost_price
         
-        # Корректировка на основе маржинальности
-        if margin_percentage >= 30:
-            # Высокомаржинальные товары - увеличиваем инвестиции
-            multiplier = 1.5
-        elif margin_percentage >= 15:
-            # Среднемаржинальные - стандартные инвестиции
-            multiplier = 1.0
-        elif margin_percentage >= 5:
-            # Низкомаржинальные - уменьшаем инвестиции
-            multiplier = 0.7
-        else:
-            # Убыточные - минимальные инвестиции
-            multiplier = 0.3
+        # Корректировка на основе маржинальности: высокомаржинальные товары -
+        # увеличиваем инвестиции, низкомаржинальные и убыточные - уменьшаем
+        multiplier = INVESTMENT_MULTIPLIERS[-1]
+        for threshold, threshold_multiplier in zip(MARGIN_THRESHOLDS, INVESTMENT_MULTIPLIERS):
+            if margin_percentage >= threshold:
+                multiplier = threshold_multiplier
+                break
         
         return base_investment * multiplier
     
@@ -262,6 +264,133 @@ class MarginAnalyzer:
         
         return roi
     
+    def _load_selling_prices(self, product_ids: List[int]) -> Dict[int, float]:
+        """
+        Цены продажи товаров портфеля одним запросом.
+        
+        Логика совпадает с _get_selling_price: первая положительная из
+        selling_price, current_price, price, иначе cost_price * 1.3.
+        """
+        if not product_ids:
+            return {}
+        
+        prices = {}
+        try:
+            cursor = self.connection.cursor()
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            cursor.execute(f"""
+                SELECT product_id, selling_price, current_price, price, cost_price 
+                FROM dim_products 
+                WHERE product_id IN ({placeholders})
+            """, product_ids)
+            
+            for product_id, *candidates, cost_price in cursor.fetchall():
+                price = next((float(p) for p in candidates if p and p > 0), None)
+                if price is None and cost_price:
+                    price = float(cost_price) * 1.3  # Предполагаем 30% наценку
+                prices[product_id] = price or 0.0
+            cursor.close()
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения цен товаров портфеля: {e}")
+        
+        return prices
+    
+    def analyze_portfolio_frame(self, source: Optional[str] = None, 
+                                limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Колоночный анализ маржинальности всего портфеля.
+        
+        Остатки, цены и скорость продаж загружаются несколькими запросами
+        на весь портфель, показатели рассчитываются операциями над массивами.
+        
+        Args:
+            source: Источник данных (опционально)
+            limit: Ограничение количества товаров (опционально)
+            
+        Returns:
+            DataFrame с колонками полей MarginAnalysis (margin_category - строковое
+            значение категории), отсортированный по ROI (убывание)
+        """
+        columns = [field.name for field in fields(MarginAnalysis)]
+        
+        inventory = self.inventory_analyzer.get_current_stock(source=source, lazy=True)
+        if limit:
+            inventory = inventory[:limit]
+        
+        if not len(inventory):
+            return pd.DataFrame(columns=columns)
+        
+        frame = pd.DataFrame({
+            'product_id': inventory.columns['product_id'],
+            'sku': inventory.columns['sku'],
+            'product_name': inventory.columns['product_name'],
+            'cost_price': [float(cost or 0) for cost in inventory.columns['cost_price']]
+        })
+        
+        # Цены продажи
+        prices = self._load_selling_prices(frame['product_id'].unique().tolist())
+        frame['selling_price'] = frame['product_id'].map(prices).fillna(0.0).astype(float)
+        
+        # Скорость продаж за 30 дней (один пакетный расчет для всех товаров)
+        self.sales_calculator.refresh_metrics()
+        sales_metrics = self.sales_calculator.metrics_engine.metrics
+        if 'daily_sales_rate_30d' in sales_metrics:
+            frame['daily_sales_rate'] = frame['product_id'].map(
+                sales_metrics['daily_sales_rate_30d']).fillna(0.0).astype(float)
+        else:
+            frame['daily_sales_rate'] = 0.0
+        
+        price = frame['selling_price'].to_numpy()
+        cost = frame['cost_price'].to_numpy()
+        rate = frame['daily_sales_rate'].to_numpy()
+        
+        # Маржа
+        margin_amount = price - cost
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin_percentage = np.where(price > 0, margin_amount / np.where(price > 0, price, 1) * 100, 0.0)
+        
+        # Категория маржинальности: индекс первого пройденного порога
+        conditions = [margin_percentage >= threshold for threshold in MARGIN_THRESHOLDS]
+        category_index = np.select(conditions, range(len(MARGIN_THRESHOLDS)), default=len(MARGIN_THRESHOLDS))
+        
+        # Корректировка приоритета
+        priority_adjustment = np.asarray(PRIORITY_ADJUSTMENTS)[category_index] * np.select(
+            [margin_percentage > 50, margin_percentage < 0], [1.2, 0.3], default=1.0
+        )
+        
+        # Финансовые показатели
+        monthly_revenue = rate * 30 * price
+        monthly_profit = rate * 30 * margin_amount
+        
+        # Рекомендуемые инвестиции в запас
+        recommended_investment = np.where(
+            (rate > 0) & (cost > 0),
+            rate * 30 * cost * np.asarray(INVESTMENT_MULTIPLIERS)[category_index],
+            0.0
+        )
+        
+        # Прогнозируемая ROI за 3 месяца
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roi_forecast = np.where(
+                (recommended_investment > 0) & (rate > 0),
+                monthly_profit * 3 / np.where(recommended_investment > 0, recommended_investment, 1) * 100,
+                0.0
+            )
+        
+        frame['margin_amount'] = margin_amount
+        frame['margin_percentage'] = margin_percentage
+        frame['margin_category'] = np.asarray([c.value for c in MARGIN_CATEGORIES])[category_index]
+        frame['monthly_revenue'] = monthly_revenue
+        frame['monthly_profit'] = monthly_profit
+        frame['priority_adjustment'] = priority_adjustment
+        frame['recommended_investment'] = recommended_investment
+        frame['roi_forecast'] = roi_forecast
+        
+        # Сортируем по ROI (убывание), порядок равных сохраняется
+        frame = frame.sort_values('roi_forecast', ascending=False, kind='mergesort')
+        return frame[columns].reset_index(drop=True)
+    
     def analyze_portfolio_margins(self, source: Optional[str] = None, 
                                 limit: Optional[int] = None) -> List[MarginAnalysis]:
         """
@@ -277,30 +406,12 @@ class MarginAnalyzer:
         logger.info("🔍 Анализ маржинальности портфеля товаров")
         
         try:
-            # Получаем товары для анализа
-            inventory_items = self.inventory_analyzer.get_current_stock(source=source)
-            
-            if limit:
-                inventory_items = inventory_items[:limit]
-            
-            margin_analyses = []
-            processed = 0
-            
-            for item in inventory_items:
-                try:
-                    analysis = self.analyze_product_margin(item)
-                    margin_analyses.append(analysis)
-                    processed += 1
-                    
-                    if processed % 100 == 0:
-                        logger.info(f"Обработано {processed} товаров...")
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка анализа товара {item.sku}: {e}")
-                    continue
-            
-            # Сортируем по ROI (убывание)
-            margin_analyses.sort(key=lambda x: x.roi_forecast, reverse=True)
+            frame = self.analyze_portfolio_frame(source=source, limit=limit)
+            
+            margin_analyses = [
+                MarginAnalysis(**dict(record, margin_category=MarginCategory(record['margin_category'])))
+                for record in frame.to_dict('records')
+            ]
             
             logger.info(f"✅ Анализ завершен: {len(margin_analyses)} товаров")
             return margin_analyses
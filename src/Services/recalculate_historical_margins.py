@@ -2,18 +2,29 @@
 """
 Скрипт для пересчета маржинальности для исторических данных.
 Используется после обновления системы расчета маржинальности.
+
+Даты пересчитываются диапазонами параллельно (aggregate_dates_parallel),
+прогресс сохраняется в файл чекпоинта - прерванный запуск продолжается
+с необработанных дат. Режим --cost-changed пересчитывает только даты
+заказов товаров, у которых изменилась запись в dim_products.
 """
 
 import sys
 import os
+import json
+import hashlib
 import logging
 from datetime import datetime, timedelta
+from typing import List, Optional
 
 # Добавляем путь к модулю importers
 sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
 
 from ozon_importer import connect_to_db
-from run_aggregation import aggregate_daily_metrics
+from run_aggregation import (
+    aggregate_dates_parallel, get_aggregation_watermark, save_aggregation_watermark,
+    WATERMARK_OVERLAP
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,11 +34,81 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Ключ watermark режима --cost-changed в system_settings
+COST_WATERMARK_SETTING_KEY = 'margin_recalc_cost_watermark'
+
+DEFAULT_CHECKPOINT_FILE = 'recalculate_margins_checkpoint.json'
+
+
+class RecalculationCheckpoint:
+    """Чекпоинт пересчета: набор дат запуска и уже пересчитанные даты."""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.run_key = None
+        self.completed = set()
+    
+    @staticmethod
+    def make_run_key(dates: List[str]) -> str:
+        """Ключ запуска по списку дат (чекпоинт другого набора дат не используется)."""
+        return hashlib.sha1(','.join(sorted(dates)).encode('utf-8')).hexdigest()
+    
+    def start(self, dates: List[str]) -> List[str]:
+        """
+        Начать или продолжить запуск.
+        
+        Returns:
+            Даты, которые еще не пересчитаны
+        """
+        run_key = self.make_run_key(dates)
+        self.run_key = run_key
+        self.completed = set()
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get('run_key') == run_key:
+                    self.completed = set(state.get('completed', []))
+                    logger.info(f"♻️  Продолжаем прерванный пересчет: уже готово {len(self.completed)} дат")
+                else:
+                    logger.info("ℹ️  Чекпоинт относится к другому набору дат, начинаем заново")
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️  Не удалось прочитать чекпоинт {self.path}: {e}")
+        
+        return [date for date in dates if date not in self.completed]
+    
+    def mark_done(self, dates: List[str]):
+        """Отметить даты как пересчитанные и сохранить чекпоинт."""
+        self.completed.update(dates)
+        
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'run_key': self.run_key,
+                'completed': sorted(self.completed),
+                'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }, f)
+        os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        """Удалить чекпоинт после успешного завершения."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class HistoricalMarginRecalculator:
     """Класс для пересчета исторических данных маржинальности."""
     
-    def __init__(self):
+    def __init__(self, workers: int = 4, checkpoint_file: str = DEFAULT_CHECKPOINT_FILE):
+        """
+        Args:
+            workers: Количество параллельных соединений для пересчета
+            checkpoint_file: Файл чекпоинта (None - без чекпоинтов)
+        """
         self.connection = None
+        self.workers = workers
+        self.checkpoint = RecalculationCheckpoint(checkpoint_file) if checkpoint_file else None
         
     def setup_connection(self):
         """Устанавливает соединение с базой данных."""
@@ -72,6 +153,37 @@ class HistoricalMarginRecalculator:
             logger.error(f"❌ Ошибка получения дат для пересчета: {e}")
             return []
     
+    def get_dates_affected_by_cost_changes(self, since: datetime) -> List[str]:
+        """
+        Даты заказов товаров, измененных в dim_products после since.
+        
+        Изменение cost_price обновляет dim_products.updated_at, поэтому
+        пересчитываются все даты, в которые эти товары продавались
+        (индекс fact_orders(product_id, order_date)). Другие изменения
+        товара тоже попадают в выборку - лишний пересчет безопасен.
+        """
+        if not self.connection:
+            return []
+        
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("""
+                SELECT DISTINCT fo.order_date
+                FROM dim_products dp
+                JOIN fact_orders fo ON fo.product_id = dp.id
+                WHERE dp.updated_at > %s
+                ORDER BY fo.order_date
+            """, (since,))
+            
+            dates = [row[0].strftime('%Y-%m-%d') for row in cursor.fetchall() if row[0]]
+            cursor.close()
+            
+            return dates
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения дат с измененной себестоимостью: {e}")
+            return []
+    
     def backup_existing_data(self, backup_table_name: str = "metrics_daily_backup"):
         """Создает резервную копию существующих данных."""
         if not self.connection:
@@ -163,8 +275,14 @@ class HistoricalMarginRecalculator:
             logger.error(f"❌ Ошибка проверки схемы: {e}")
             return False
     
-    def recalculate_date_range(self, dates: list, batch_size: int = 10):
-        """Пересчитывает маржинальность для списка дат."""
+    def recalculate_date_range(self, dates: list, batch_size: int = 31):
+        """
+        Пересчитывает маржинальность для списка дат.
+        
+        Даты объединяются в непрерывные диапазоны до batch_size дней,
+        диапазоны обрабатываются параллельно в self.workers соединениях.
+        После каждого диапазона обновляется чекпоинт.
+        """
         if not dates:
             logger.warning("⚠️  Нет дат для пересчета")
             return True
@@ -172,46 +290,36 @@ class HistoricalMarginRecalculator:
         logger.info(f"🔄 Начинаем пересчет для {len(dates)} дат")
         logger.info(f"   Период: {dates[0]} - {dates[-1]}")
         
-        successful_recalculations = 0
-        failed_recalculations = 0
+        pending_dates = self.checkpoint.start(dates) if self.checkpoint else list(dates)
+        if not pending_dates:
+            logger.info("✅ Все даты уже пересчитаны в предыдущем запуске")
+            self.checkpoint.clear()
+            return True
+        
+        def on_chunk_done(chunk_dates, success):
+            if success and self.checkpoint:
+                self.checkpoint.mark_done(chunk_dates)
         
-        # Обрабатываем даты батчами
-        for i in range(0, len(dates), batch_size):
-            batch = dates[i:i + batch_size]
-            
-            logger.info(f"📦 Обработка батча {i//batch_size + 1}: {len(batch)} дат")
-            
-            for date in batch:
-                try:
-                    logger.info(f"   Пересчет {date}...")
-                    
-                    start_time = datetime.now()
-                    success = aggregate_daily_metrics(self.connection, date)
-                    end_time = datetime.now()
-                    
-                    execution_time = (end_time - start_time).total_seconds()
-                    
-                    if success:
-                        successful_recalculations += 1
-                        logger.info(f"     ✅ Завершено за {execution_time:.2f}s")
-                    else:
-                        failed_recalculations += 1
-                        logger.error(f"     ❌ Ошибка пересчета")
-                        
-                except Exception as e:
-                    failed_recalculations += 1
-                    logger.error(f"     ❌ Исключение при пересчете {date}: {e}")
-            
-            # Небольшая пауза между батчами
-            if i + batch_size < len(dates):
-                logger.info("   ⏸️  Пауза 2 секунды...")
-                import time
-                time.sleep(2)
+        start_time = datetime.now()
+        succeeded, failed = aggregate_dates_parallel(
+            pending_dates, workers=self.workers, chunk_days=batch_size,
+            on_chunk_done=on_chunk_done
+        )
+        execution_time = (datetime.now() - start_time).total_seconds()
         
-        logger.info(f"📊 Результаты пересчета:")
+        successful_recalculations = len(dates) - len(pending_dates) + len(succeeded)
+        failed_recalculations = len(failed)
+        
+        logger.info(f"📊 Результаты пересчета ({execution_time:.1f}s):")
         logger.info(f"   - Успешно: {successful_recalculations}")
         logger.info(f"   - С ошибками: {failed_recalculations}")
-        logger.info(f"   - Общий процент успеха: {(successful_recalculations/(successful_recalculations+failed_recalculations))*100:.1f}%")
+        logger.info(f"   - Общий процент успеха: {(successful_recalculations/len(dates))*100:.1f}%")
+        
+        if failed:
+            logger.error(f"   - Даты с ошибкой: {', '.join(failed)}")
+            logger.info("   Повторный запуск продолжит с необработанных дат")
+        elif self.checkpoint:
+            self.checkpoint.clear()
         
         return failed_recalculations == 0
     
@@ -286,8 +394,17 @@ class HistoricalMarginRecalculator:
             return False
     
     def run_full_recalculation(self, start_date: str = None, end_date: str = None, 
-                              create_backup: bool = True, batch_size: int = 10):
-        """Выполняет полный пересчет исторических данных."""
+                              create_backup: bool = True, batch_size: int = 31,
+                              cost_changed_only: bool = False, changed_since: Optional[str] = None):
+        """
+        Выполняет пересчет исторических данных.
+        
+        При cost_changed_only пересчитываются только даты, затронутые
+        изменениями dim_products после changed_since (или после watermark
+        предыдущего запуска в этом режиме). Watermark сдвигается только
+        запуском без --start-date/--end-date и --changed-since: иначе
+        отброшенные даты не пересчитал бы ни один следующий запуск.
+        """
         logger.info("🚀 Запуск пересчета исторических данных маржинальности")
         logger.info("=" * 60)
         
@@ -306,10 +423,36 @@ class HistoricalMarginRecalculator:
                     return False
             
             # 3. Получение списка дат для пересчета
-            dates = self.get_dates_for_recalculation(start_date, end_date)
+            run_started_at = None
+            if cost_changed_only:
+                cursor = self.connection.cursor()
+                cursor.execute("SELECT NOW()")
+                run_started_at = cursor.fetchone()[0]
+                
+                if start_date or end_date or changed_since:
+                    logger.warning("⚠️  Задан период или --changed-since: watermark себестоимости "
+                                   "не будет сдвинут, даты вне выборки останутся для следующих запусков")
+                    run_started_at = None
+                
+                since = (datetime.strptime(changed_since, '%Y-%m-%d') if changed_since
+                         else get_aggregation_watermark(cursor, COST_WATERMARK_SETTING_KEY))
+                cursor.close()
+                
+                if since:
+                    dates = self.get_dates_affected_by_cost_changes(since)
+                    dates = [date for date in dates
+                             if (not start_date or date >= start_date) and (not end_date or date <= end_date)]
+                    logger.info(f"💰 Дат, затронутых изменением товаров с {since}: {len(dates)}")
+                else:
+                    logger.warning("⚠️  Watermark себестоимости не найден, пересчитываем все даты")
+                    dates = self.get_dates_for_recalculation(start_date, end_date)
+            else:
+                dates = self.get_dates_for_recalculation(start_date, end_date)
             
             if not dates:
                 logger.warning("⚠️  Нет данных для пересчета")
+                if run_started_at:
+                    self._save_cost_watermark(run_started_at)
                 return True
             
             # 4. Пересчет данных
@@ -319,6 +462,9 @@ class HistoricalMarginRecalculator:
                 logger.error("❌ Пересчет завершился с ошибками")
                 return False
             
+            if run_started_at:
+                self._save_cost_watermark(run_started_at)
+            
             # 5. Валидация результатов
             validation_success = self.validate_recalculation_results()
             
@@ -336,6 +482,14 @@ class HistoricalMarginRecalculator:
         finally:
             if self.connection:
                 self.connection.close()
+    
+    def _save_cost_watermark(self, run_started_at: datetime):
+        """Сохраняет watermark режима --cost-changed."""
+        save_aggregation_watermark(
+            self.connection, run_started_at - WATERMARK_OVERLAP,
+            setting_key=COST_WATERMARK_SETTING_KEY,
+            description='Последнее изменение dim_products, учтенное пересчетом маржинальности'
+        )
 
 
 def main():
@@ -346,16 +500,28 @@ def main():
     parser.add_argument('--start-date', help='Начальная дата (YYYY-MM-DD)')
     parser.add_argument('--end-date', help='Конечная дата (YYYY-MM-DD)')
     parser.add_argument('--no-backup', action='store_true', help='Не создавать резервную копию')
-    parser.add_argument('--batch-size', type=int, default=10, help='Размер батча для обработки')
+    parser.add_argument('--batch-size', type=int, default=31,
+                        help='Максимальная длина диапазона дат для одного запроса')
+    parser.add_argument('--workers', type=int, default=4, help='Количество параллельных соединений')
+    parser.add_argument('--checkpoint-file', default=DEFAULT_CHECKPOINT_FILE,
+                        help='Файл чекпоинта для продолжения прерванного пересчета')
+    parser.add_argument('--cost-changed', action='store_true',
+                        help='Пересчитать только даты, затронутые изменением себестоимости')
+    parser.add_argument('--changed-since', help='Для --cost-changed: учитывать изменения после даты (YYYY-MM-DD)')
     
     args = parser.parse_args()
     
-    recalculator = HistoricalMarginRecalculator()
+    recalculator = HistoricalMarginRecalculator(
+        workers=args.workers,
+        checkpoint_file=args.checkpoint_file
+    )
     success = recalculator.run_full_recalculation(
         start_date=args.start_date,
         end_date=args.end_date,
         create_backup=not args.no_backup,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        cost_changed_only=args.cost_changed,
+        changed_since=args.changed_since
     )
     
     if success:
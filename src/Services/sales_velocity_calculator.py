@@ -2,16 +2,24 @@
 """
 Модуль расчета скорости продаж для системы пополнения склада.
 Анализирует историю продаж и рассчитывает различные метрики скорости продаж.
+
+Метрики считаются пакетно (SalesMetricsEngine): fact_orders за окно анализа
+загружается одним запросом с группировкой по товару и дню, после чего все
+поля SalesMetrics вычисляются для всех товаров сразу средствами pandas.
 """
 
 import sys
 import os
+import time
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timedelta, date
+from typing import List, Dict, Optional, Tuple, Iterable
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+import pandas as pd
+
 # Добавляем путь к модулю importers
 sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
 
@@ -75,6 +83,242 @@ class StockoutPrediction:
     confidence_level: float  # Уровень уверенности в прогнозе (0-1)
 
 
+class SalesMetricsEngine:
+    """
+    Пакетный расчет метрик продаж для всех товаров.
+    
+    Загружает дневные продажи за окно анализа одним запросом и строит
+    таблицу метрик (по строке на товар). Поиск метрик конкретного товара
+    после загрузки не обращается к базе данных.
+    """
+    
+    ANALYSIS_DAYS = 90  # Окно для общей статистики (последняя/первая продажа, пик)
+    TREND_DAYS = 28  # Последние 4 недели для тренда
+    CONSISTENCY_DAYS = 30
+    
+    def __init__(self, connection, refresh_interval: int = 300):
+        """
+        Инициализация движка метрик.
+        
+        Args:
+            connection: Подключение к базе данных
+            refresh_interval: Через сколько секунд считать рассчитанные метрики устаревшими
+        """
+        self.connection = connection
+        self.refresh_interval = refresh_interval
+        self.metrics: Optional[pd.DataFrame] = None
+        self.skus: Dict[int, str] = {}
+        self.available_stock: Dict[int, int] = {}
+        self.loaded_at: Optional[float] = None
+        self.as_of: Optional[date] = None
+    
+    def ensure_loaded(self) -> None:
+        """Загрузка или обновление метрик, если они отсутствуют или устарели."""
+        if (self.metrics is None or self.as_of != datetime.now().date()
+                or time.time() - self.loaded_at > self.refresh_interval):
+            self.load()
+    
+    def load(self) -> None:
+        """Загрузка продаж, SKU и доступных остатков и расчет метрик для всех товаров."""
+        today = datetime.now().date()
+        cursor = self.connection.cursor(dictionary=True)
+        
+        try:
+            cursor.execute("""
+                SELECT 
+                    product_id,
+                    DATE(order_date) as sale_date,
+                    SUM(qty) as qty,
+                    MAX(qty) as peak_qty
+                FROM fact_orders 
+                WHERE transaction_type = 'продажа'
+                    AND order_date >= %s
+                GROUP BY product_id, DATE(order_date)
+            """, (today - timedelta(days=self.ANALYSIS_DAYS),))
+            daily_rows = cursor.fetchall()
+            
+            cursor.execute("""
+                SELECT product_id, COALESCE(sku, 'UNKNOWN') as sku 
+                FROM dim_products
+            """)
+            self.skus = {row['product_id']: row['sku'] for row in cursor.fetchall()}
+            
+            cursor.execute("""
+                SELECT 
+                    product_id,
+                    SUM(quantity_present - COALESCE(quantity_reserved, 0)) as available_stock
+                FROM inventory 
+                GROUP BY product_id
+            """)
+            self.available_stock = {
+                row['product_id']: max(0, int(row['available_stock'] or 0))
+                for row in cursor.fetchall()
+            }
+        finally:
+            cursor.close()
+        
+        self.metrics = self.compute_metrics(daily_rows, today)
+        self.as_of = today
+        self.loaded_at = time.time()
+        
+        logger.info(f"Рассчитаны метрики продаж для {len(self.metrics)} товаров "
+                    f"({len(daily_rows)} товаро-дней)")
+    
+    @classmethod
+    def compute_metrics(cls, daily_rows: Iterable[Dict], today: date) -> pd.DataFrame:
+        """
+        Расчет метрик по дневным продажам.
+        
+        Args:
+            daily_rows: Строки с полями product_id, sale_date, qty, peak_qty
+            today: Дата расчета
+            
+        Returns:
+            DataFrame с индексом product_id и колонками полей SalesMetrics
+        """
+        daily = pd.DataFrame(list(daily_rows), columns=['product_id', 'sale_date', 'qty', 'peak_qty'])
+        if daily.empty:
+            return pd.DataFrame(index=pd.Index([], name='product_id'))
+        
+        daily['sale_date'] = pd.to_datetime(daily['sale_date'])
+        daily['qty'] = pd.to_numeric(daily['qty']).astype(float)
+        daily['peak_qty'] = pd.to_numeric(daily['peak_qty']).astype(float)
+        
+        today_ts = pd.Timestamp(today)
+        age_days = (today_ts - daily['sale_date']).dt.days
+        grouped = daily.groupby('product_id')
+        
+        metrics = pd.DataFrame({
+            'last_sale_date': grouped['sale_date'].max(),
+            'first_sale_date': grouped['sale_date'].min(),
+            'peak_daily_sales': grouped['peak_qty'].max()
+        })
+        
+        # Скорость и объем продаж за 7/14/30 дней
+        for days in (7, 14, 30):
+            in_window = age_days <= days
+            totals = daily['qty'].where(in_window, 0.0).groupby(daily['product_id']).sum()
+            rate_totals = daily['qty'].where(in_window & (age_days >= 0), 0.0).groupby(daily['product_id']).sum()
+            metrics[f'total_sales_{days}d'] = totals
+            metrics[f'daily_sales_rate_{days}d'] = (rate_totals / days).round(2)
+        
+        metrics['days_since_last_sale'] = (today_ts - metrics['last_sale_date']).dt.days
+        
+        metrics['sales_consistency'] = cls._compute_consistency(daily, age_days)
+        trend, coefficient = cls._compute_trend(daily, age_days)
+        metrics['sales_trend'] = trend
+        metrics['trend_coefficient'] = coefficient
+        
+        metrics['sales_consistency'] = metrics['sales_consistency'].fillna(0.0)
+        metrics['sales_trend'] = metrics['sales_trend'].fillna(SalesTrend.NO_DATA.value)
+        metrics['trend_coefficient'] = metrics['trend_coefficient'].fillna(0.0)
+        return metrics
+    
+    @classmethod
+    def _compute_consistency(cls, daily: pd.DataFrame, age_days: pd.Series) -> pd.Series:
+        """Консистентность продаж: 1 - коэффициент вариации дневных продаж (не менее 3 дней)."""
+        window = daily[(age_days >= 0) & (age_days <= cls.CONSISTENCY_DAYS)]
+        stats = window.groupby('product_id')['qty'].agg(['count', 'mean'])
+        stats['std'] = window.groupby('product_id')['qty'].std(ddof=0)
+        
+        cv = (stats['std'] / stats['mean'].where(stats['mean'] > 0)).clip(upper=1.0)
+        consistency = (1.0 - cv).clip(lower=0.0).round(3)
+        return consistency.where((stats['count'] >= 3) & (stats['mean'] > 0), 0.0)
+    
+    @classmethod
+    def _compute_trend(cls, daily: pd.DataFrame, age_days: pd.Series) -> Tuple[pd.Series, pd.Series]:
+        """Тренд: сравнение первой и последней недели (WEEK() MySQL) за последние 4 недели."""
+        window = daily[age_days <= cls.TREND_DAYS].copy()
+        if window.empty:
+            empty = pd.Series(dtype=object)
+            return empty, pd.Series(dtype=float)
+        
+        # %U совпадает с WEEK(date) MySQL в режиме 0 (неделя с воскресенья)
+        window['week_num'] = window['sale_date'].dt.strftime('%U').astype(int)
+        weekly = window.groupby(['product_id', 'week_num'])['qty'].sum().reset_index()
+        weekly = weekly.sort_values(['product_id', 'week_num'])
+        
+        by_product = weekly.groupby('product_id')['qty']
+        weeks = by_product.count()
+        first = by_product.first()
+        last = by_product.last()
+        
+        change = (last - first) / first.where(first != 0)
+        
+        trend = pd.Series(np.select(
+            [weeks < 2, first == 0, change > 0.2, change < -0.2],
+            [SalesTrend.NO_DATA.value,
+             np.where(last > 0, SalesTrend.GROWING.value, SalesTrend.NO_DATA.value),
+             SalesTrend.GROWING.value,
+             SalesTrend.DECLINING.value],
+            default=SalesTrend.STABLE.value
+        ), index=weeks.index)
+        
+        coefficient = pd.Series(np.select(
+            [weeks < 2, first == 0],
+            [0.0, np.where(last > 0, 1.0, 0.0)],
+            default=change.clip(lower=-1.0, upper=1.0).fillna(0.0)
+        ), index=weeks.index)
+        
+        return trend, coefficient
+    
+    def get_metrics(self, product_id: int) -> SalesMetrics:
+        """
+        Метрики продаж товара из рассчитанной таблицы.
+        
+        Args:
+            product_id: ID товара
+            
+        Returns:
+            Объект SalesMetrics (пустые метрики, если продаж за окно не было)
+        """
+        self.ensure_loaded()
+        sku = self.skus.get(product_id, 'UNKNOWN')
+        
+        if product_id not in self.metrics.index:
+            return SalesMetrics(
+                product_id=product_id,
+                sku=sku,
+                daily_sales_rate_7d=0.0,
+                daily_sales_rate_14d=0.0,
+                daily_sales_rate_30d=0.0,
+                total_sales_7d=0,
+                total_sales_14d=0,
+                total_sales_30d=0,
+                last_sale_date=None,
+                first_sale_date=None,
+                sales_trend=SalesTrend.NO_DATA,
+                trend_coefficient=0.0,
+                days_since_last_sale=0,
+                sales_consistency=0.0,
+                peak_daily_sales=0
+            )
+        
+        row = self.metrics.loc[product_id]
+        return SalesMetrics(
+            product_id=product_id,
+            sku=sku,
+            daily_sales_rate_7d=float(row['daily_sales_rate_7d']),
+            daily_sales_rate_14d=float(row['daily_sales_rate_14d']),
+            daily_sales_rate_30d=float(row['daily_sales_rate_30d']),
+            total_sales_7d=int(row['total_sales_7d']),
+            total_sales_14d=int(row['total_sales_14d']),
+            total_sales_30d=int(row['total_sales_30d']),
+            last_sale_date=row['last_sale_date'].to_pydatetime(),
+            first_sale_date=row['first_sale_date'].to_pydatetime(),
+            sales_trend=SalesTrend(row['sales_trend']),
+            trend_coefficient=float(row['trend_coefficient']),
+            days_since_last_sale=int(row['days_since_last_sale']),
+            sales_consistency=float(row['sales_consistency']),
+            peak_daily_sales=int(row['peak_daily_sales'])
+        )
+    
+    def get_available_stock(self, product_id: int) -> Optional[int]:
+        """Доступный остаток товара по таблице inventory (None, если товара нет)."""
+        self.ensure_loaded()
+        return self.available_stock.get(product_id)
+
+
 class SalesVelocityCalculator:
     """Класс для расчета скорости продаж товаров."""
     
@@ -86,6 +330,11 @@ class SalesVelocityCalculator:
             connection: Подключение к базе данных (опционально)
         """
         self.connection = connection or connect_to_db()
+        self.metrics_engine = SalesMetricsEngine(self.connection)
+    
+    def refresh_metrics(self) -> None:
+        """Пересчитать метрики продаж для всех товаров (один набор запросов)."""
+        self.metrics_engine.load()
         
     def calculate_daily_sales_rate(self, product_id: int, days: int = 7) -> float:
         """
@@ -135,6 +384,9 @@ class SalesVelocityCalculator:
         """
         Получить полные метрики продаж для товара.
         
+        Метрики берутся из пакетного расчета SalesMetricsEngine; при первом
+        обращении (или устаревании) метрики пересчитываются для всех товаров.
+        
         Args:
             product_id: ID товара
             
@@ -142,83 +394,7 @@ class SalesVelocityCalculator:
             Объект SalesMetrics с метриками продаж
         """
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            
-            # Получаем SKU товара
-            cursor.execute("""
-                SELECT COALESCE(sku, 'UNKNOWN') as sku 
-                FROM dim_products 
-                WHERE product_id = %s
-            """, (product_id,))
-            
-            sku_result = cursor.fetchone()
-            sku = sku_result['sku'] if sku_result else 'UNKNOWN'
-            
-            # Рассчитываем скорость продаж за разные периоды
-            daily_rate_7d = self.calculate_daily_sales_rate(product_id, 7)
-            daily_rate_14d = self.calculate_daily_sales_rate(product_id, 14)
-            daily_rate_30d = self.calculate_daily_sales_rate(product_id, 30)
-            
-            # Получаем общую статистику продаж
-            end_date = datetime.now().date()
-            
-            cursor.execute("""
-                SELECT 
-                    SUM(CASE WHEN order_date >= %s THEN qty ELSE 0 END) as sales_7d,
-                    SUM(CASE WHEN order_date >= %s THEN qty ELSE 0 END) as sales_14d,
-                    SUM(CASE WHEN order_date >= %s THEN qty ELSE 0 END) as sales_30d,
-                    MAX(order_date) as last_sale_date,
-                    MIN(order_date) as first_sale_date,
-                    MAX(qty) as peak_daily_sales
-                FROM fact_orders 
-                WHERE product_id = %s 
-                    AND transaction_type = 'продажа'
-                    AND order_date >= %s
-            """, (
-                end_date - timedelta(days=7),
-                end_date - timedelta(days=14),
-                end_date - timedelta(days=30),
-                product_id,
-                end_date - timedelta(days=90)  # Берем данные за 90 дней для общей статистики
-            ))
-            
-            stats_result = cursor.fetchone()
-            
-            # Рассчитываем тренд продаж
-            trend, trend_coefficient = self._calculate_sales_trend(product_id)
-            
-            # Рассчитываем консистентность продаж
-            consistency = self._calculate_sales_consistency(product_id, 30)
-            
-            # Рассчитываем дни с последней продажи
-            last_sale_date = stats_result['last_sale_date'] if stats_result else None
-            days_since_last_sale = 0
-            
-            if last_sale_date:
-                days_since_last_sale = (datetime.now().date() - last_sale_date).days
-            
-            cursor.close()
-            
-            # Создаем объект метрик
-            metrics = SalesMetrics(
-                product_id=product_id,
-                sku=sku,
-                daily_sales_rate_7d=daily_rate_7d,
-                daily_sales_rate_14d=daily_rate_14d,
-                daily_sales_rate_30d=daily_rate_30d,
-                total_sales_7d=stats_result['sales_7d'] or 0 if stats_result else 0,
-                total_sales_14d=stats_result['sales_14d'] or 0 if stats_result else 0,
-                total_sales_30d=stats_result['sales_30d'] or 0 if stats_result else 0,
-                last_sale_date=last_sale_date,
-                first_sale_date=stats_result['first_sale_date'] if stats_result else None,
-                sales_trend=trend,
-                trend_coefficient=trend_coefficient,
-                days_since_last_sale=days_since_last_sale,
-                sales_consistency=consistency,
-                peak_daily_sales=stats_result['peak_daily_sales'] or 0 if stats_result else 0
-            )
-            
-            return metrics
+            return self.metrics_engine.get_metrics(product_id)
             
         except Exception as e:
             logger.error(f"Ошибка получения метрик продаж для товара {product_id}: {e}")
@@ -241,122 +417,6 @@ class SalesVelocityCalculator:
                 peak_daily_sales=0
             )
     
-    def _calculate_sales_trend(self, product_id: int) -> Tuple[SalesTrend, float]:
-        """
-        Рассчитать тренд продаж товара.
-        
-        Args:
-            product_id: ID товара
-            
-        Returns:
-            Кортеж (тренд, коэффициент тренда)
-        """
-        try:
-            cursor = self.connection.cursor(dictionary=True)
-            
-            # Получаем продажи по неделям за последний месяц
-            cursor.execute("""
-                SELECT 
-                    WEEK(order_date) as week_num,
-                    SUM(qty) as weekly_sales
-                FROM fact_orders 
-                WHERE product_id = %s 
-                    AND order_date >= DATE_SUB(CURDATE(), INTERVAL 4 WEEK)
-                    AND transaction_type = 'продажа'
-                GROUP BY WEEK(order_date)
-                ORDER BY week_num
-            """, (product_id,))
-            
-            weekly_sales = cursor.fetchall()
-            cursor.close()
-            
-            if len(weekly_sales) < 2:
-                return SalesTrend.NO_DATA, 0.0
-            
-            # Простой расчет тренда: сравниваем первую и последнюю неделю
-            first_week_sales = weekly_sales[0]['weekly_sales']
-            last_week_sales = weekly_sales[-1]['weekly_sales']
-            
-            if first_week_sales == 0:
-                if last_week_sales > 0:
-                    return SalesTrend.GROWING, 1.0
-                else:
-                    return SalesTrend.NO_DATA, 0.0
-            
-            # Рассчитываем изменение в процентах
-            change_percent = (last_week_sales - first_week_sales) / first_week_sales
-            
-            # Определяем тренд
-            if change_percent > 0.2:  # Рост более 20%
-                return SalesTrend.GROWING, min(change_percent, 1.0)
-            elif change_percent < -0.2:  # Падение более 20%
-                return SalesTrend.DECLINING, max(change_percent, -1.0)
-            else:
-                return SalesTrend.STABLE, change_percent
-                
-        except Exception as e:
-            logger.error(f"Ошибка расчета тренда для товара {product_id}: {e}")
-            return SalesTrend.NO_DATA, 0.0
-    
-    def _calculate_sales_consistency(self, product_id: int, days: int = 30) -> float:
-        """
-        Рассчитать консистентность продаж (насколько равномерно продается товар).
-        
-        Args:
-            product_id: ID товара
-            days: Период для анализа
-            
-        Returns:
-            Коэффициент консистентности (0-1, где 1 - очень консистентные продажи)
-        """
-        try:
-            cursor = self.connection.cursor(dictionary=True)
-            
-            # Получаем ежедневные продажи
-            end_date = datetime.now().date()
-            start_date = end_date - timedelta(days=days)
-            
-            cursor.execute("""
-                SELECT 
-                    DATE(order_date) as sale_date,
-                    SUM(qty) as daily_sales
-                FROM fact_orders 
-                WHERE product_id = %s 
-                    AND order_date >= %s 
-                    AND order_date <= %s
-                    AND transaction_type = 'продажа'
-                GROUP BY DATE(order_date)
-                ORDER BY sale_date
-            """, (product_id, start_date, end_date))
-            
-            daily_sales = cursor.fetchall()
-            cursor.close()
-            
-            if len(daily_sales) < 3:
-                return 0.0
-            
-            # Рассчитываем стандартное отклонение
-            sales_values = [row['daily_sales'] for row in daily_sales]
-            mean_sales = sum(sales_values) / len(sales_values)
-            
-            if mean_sales == 0:
-                return 0.0
-            
-            variance = sum((x - mean_sales) ** 2 for x in sales_values) / len(sales_values)
-            std_dev = variance ** 0.5
-            
-            # Коэффициент вариации (обратный к консистентности)
-            cv = std_dev / mean_sales if mean_sales > 0 else 1.0
-            
-            # Преобразуем в консистентность (0-1)
-            consistency = max(0.0, 1.0 - min(cv, 1.0))
-            
-            return round(consistency, 3)
-            
-        except Exception as e:
-            logger.error(f"Ошибка расчета консистентности для товара {product_id}: {e}")
-            return 0.0
-    
     def calculate_days_until_stockout(self, product_id: int, current_stock: int) -> StockoutPrediction:
         """
         Рассчитать дни до исчерпания запасов.
@@ -383,18 +443,10 @@ class SalesVelocityCalculator:
             if daily_rate == 0:
                 daily_rate = metrics.daily_sales_rate_30d
             
-            # Рассчитываем доступный остаток (исключаем резерв)
-            cursor = self.connection.cursor(dictionary=True)
-            cursor.execute("""
-                SELECT 
-                    SUM(quantity_present - COALESCE(quantity_reserved, 0)) as available_stock
-                FROM inventory 
-                WHERE product_id = %s
-            """, (product_id,))
-            
-            result = cursor.fetchone()
-            available_stock = max(0, result['available_stock'] or 0) if result else current_stock
-            cursor.close()
+            # Доступный остаток (без резерва) из пакетного расчета
+            available_stock = self.metrics_engine.get_available_stock(product_id)
+            if available_stock is None:
+                available_stock = current_stock
             
             # Рассчитываем дни до исчерпания
             days_until_stockout = None
@@ -447,7 +499,8 @@ class SalesVelocityCalculator:
         Returns:
             Кортеж (тренд, коэффициент изменения)
         """
-        return self._calculate_sales_trend(product_id)
+        metrics = self.get_sales_metrics(product_id)
+        return metrics.sales_trend, metrics.trend_coefficient
     
     def get_top_selling_products(self, days: int = 7, limit: int = 10) -> List[Dict]:
         """
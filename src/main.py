@@ -10,6 +10,11 @@
     python main.py --products-only    # Только товары (только для Ozon)
     python main.py --orders-only --start-date 2024-01-01  # Только заказы
     python main.py --transactions-only --start-date 2024-01-01  # Только транзакции
+    python main.py --start-date 2024-01-01 --end-date 2024-03-31 --shard-days 1  # Загрузка по дням
+
+Потоки (заказы, транзакции, финансы WB) выполняются параллельно по шардам
+дат через ImportOrchestrator. Прерванный запуск продолжается с
+незавершенных шардов (чекпоинт --checkpoint-file).
 """
 
 import sys
@@ -17,11 +22,15 @@ import os
 import argparse
 from datetime import datetime, timedelta
 
-# Добавляем путь к модулю importers
-sys.path.append(os.path.join(os.path.dirname(__file__), 'importers'))
+# Добавляем пути к модулям importers, utils (rate_limiter) и ETL (import_orchestrator)
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(SRC_DIR), 'importers'))
+sys.path.append(os.path.join(SRC_DIR, 'utils'))
+sys.path.append(os.path.join(SRC_DIR, 'ETL'))
 
-from ozon_importer import import_products, import_orders, import_transactions, logger
+from ozon_importer import import_products, import_orders, import_transactions, prefetch_reports, logger
 from wb_importer import import_sales, import_financial_details, import_wb_products
+from import_orchestrator import ImportOrchestrator, ImportStream, DEFAULT_CHECKPOINT_FILE, DEFAULT_CONCURRENCY
 
 
 def parse_arguments():
@@ -71,6 +80,39 @@ def parse_arguments():
         help='Укажите источник для импорта: ozon или wb. Можно указать несколько через пробел'
     )
     
+    parser.add_argument(
+        '--shard-days',
+        type=int,
+        default=7,
+        help='Размер шарда периода в днях (1 - по дням, по умолчанию: 7)'
+    )
+    
+    parser.add_argument(
+        '--ozon-workers',
+        type=int,
+        default=DEFAULT_CONCURRENCY['ozon'],
+        help=f"Параллельных задач Ozon (по умолчанию: {DEFAULT_CONCURRENCY['ozon']})"
+    )
+    
+    parser.add_argument(
+        '--wb-workers',
+        type=int,
+        default=DEFAULT_CONCURRENCY['wb'],
+        help=f"Параллельных задач WB (по умолчанию: {DEFAULT_CONCURRENCY['wb']})"
+    )
+    
+    parser.add_argument(
+        '--checkpoint-file',
+        default=DEFAULT_CHECKPOINT_FILE,
+        help=f'Файл чекпоинта шардов (по умолчанию: {DEFAULT_CHECKPOINT_FILE})'
+    )
+    
+    parser.add_argument(
+        '--no-checkpoint',
+        action='store_true',
+        help='Не сохранять и не использовать чекпоинт'
+    )
+    
     return parser.parse_args()
 
 
@@ -97,6 +139,71 @@ def validate_date(date_string):
         return False
 
 
+def build_streams(sources, args):
+    """
+    Потоки импорта для выбранных источников и флагов.
+    
+    Продажи WB не делятся на шарды: API отдает все продажи начиная с dateFrom.
+    """
+    # Определяем, что импортировать
+    if args.products_only:
+        import_products_flag, import_orders_flag, import_transactions_flag = True, False, False
+    elif args.orders_only:
+        import_products_flag, import_orders_flag, import_transactions_flag = False, True, False
+    elif args.transactions_only:
+        import_products_flag, import_orders_flag, import_transactions_flag = False, False, True
+    else:
+        import_products_flag = import_orders_flag = import_transactions_flag = True
+    
+    streams = []
+    if 'ozon' in sources:
+        if import_products_flag:
+            streams.append(ImportStream('ozon_products', 'ozon', import_products, dated=False,
+                                        title='📦 Импорт товаров Ozon'))
+        if import_orders_flag:
+            streams.append(ImportStream('ozon_orders', 'ozon', import_orders,
+                                        title='🛒 Импорт заказов Ozon'))
+        if import_transactions_flag:
+            streams.append(ImportStream('ozon_transactions', 'ozon', import_transactions,
+                                        title='💰 Импорт транзакций Ozon'))
+    
+    if 'wb' in sources:
+        if import_products_flag:
+            streams.append(ImportStream('wb_products', 'wb', import_wb_products, dated=False,
+                                        title='📦 Импорт товаров WB'))
+        if import_orders_flag:
+            streams.append(ImportStream('wb_sales', 'wb', import_sales, shardable=False,
+                                        title='🛒 Импорт продаж WB'))
+        if import_transactions_flag:
+            streams.append(ImportStream('wb_finance', 'wb', import_financial_details,
+                                        title='💰 Импорт финансовых деталей WB'))
+    
+    return streams
+
+
+# Отчеты Ozon, которые читают потоки импорта: имя потока -> тип отчета
+OZON_REPORT_STREAMS = {
+    'ozon_products': 'products',
+    'ozon_orders': 'postings',
+}
+
+
+def prefetch_ozon_reports(tasks):
+    """
+    Параллельно заказать отчеты Ozon для невыполненных задач запуска.
+    
+    Товары и заказы по всем шардам запрашиваются одновременно через
+    fetch_reports_sync и попадают в кэш отчетов; задачи импорта затем
+    берут их из кэша, а не ждут готовности каждого отчета по очереди.
+    """
+    reports = [
+        (OZON_REPORT_STREAMS[stream.name], *(shard or (None, None)))
+        for stream, shard in tasks if stream.name in OZON_REPORT_STREAMS
+    ]
+    if reports:
+        prefetch_reports(reports)
+
+
 def main():
     """Главная функция."""
     # Парсим аргументы
@@ -112,15 +219,15 @@ def main():
         start_date, end_date = get_last_7_days_dates()
         logger.info("📅 Режим: последние 7 дней для cron job")
     elif args.start_date or args.end_date:
-        start_date = args.start_date
+        start_date = args.start_date or args.end_date
         end_date = args.end_date or args.start_date
         
         # Проверяем корректность дат
-        if start_date and not validate_date(start_date):
+        if not validate_date(start_date):
             logger.error(f"Некорректный формат начальной даты: {start_date}. Используйте YYYY-MM-DD")
             return 1
             
-        if end_date and not validate_date(end_date):
+        if not validate_date(end_date):
             logger.error(f"Некорректный формат конечной даты: {end_date}. Используйте YYYY-MM-DD")
             return 1
     else:
@@ -129,87 +236,17 @@ def main():
     logger.info(f"📅 Период импорта: с {start_date} по {end_date}")
     
     try:
-        # Обрабатываем каждый источник
-        for source in sources:
-            if source == "wb":
-                logger.info("--- Запускаем импорт данных Wildberries ---")
-                
-                # Определяем, что импортировать
-                import_products_flag = not (args.orders_only or args.transactions_only)
-                import_orders_flag = not (args.products_only or args.transactions_only)
-                import_transactions_flag = not (args.products_only or args.orders_only)
-                
-                # Если указаны специальные флаги, переопределяем
-                if args.products_only:
-                    import_products_flag = True
-                    import_orders_flag = False
-                    import_transactions_flag = False
-                elif args.orders_only:
-                    import_products_flag = False
-                    import_orders_flag = True
-                    import_transactions_flag = False
-                elif args.transactions_only:
-                    import_products_flag = False
-                    import_orders_flag = False
-                    import_transactions_flag = True
-                
-                # Импорт товаров WB
-                if import_products_flag:
-                    logger.info("📦 Начинаем импорт товаров WB...")
-                    import_wb_products()
-                    logger.info("✅ Импорт товаров WB завершен")
-                
-                # Импорт продаж (заказов)
-                if import_orders_flag:
-                    logger.info("🛒 Начинаем импорт продаж WB...")
-                    import_sales(start_date, end_date)
-                    logger.info("✅ Импорт продаж WB завершен")
-                
-                # Импорт финансовых деталей (транзакций)
-                if import_transactions_flag:
-                    logger.info("💰 Начинаем импорт финансовых деталей WB...")
-                    import_financial_details(start_date, end_date)
-                    logger.info("✅ Импорт финансовых деталей WB завершен")
-            
-            elif source == "ozon":
-                logger.info("--- Запускаем импорт данных Ozon ---")
-                
-                # Определяем, что импортировать
-                import_products_flag = not (args.orders_only or args.transactions_only)
-                import_orders_flag = not (args.products_only or args.transactions_only)
-                import_transactions_flag = not (args.products_only or args.orders_only)
-                
-                # Если указаны специальные флаги, переопределяем
-                if args.products_only:
-                    import_products_flag = True
-                    import_orders_flag = False
-                    import_transactions_flag = False
-                elif args.orders_only:
-                    import_products_flag = False
-                    import_orders_flag = True
-                    import_transactions_flag = False
-                elif args.transactions_only:
-                    import_products_flag = False
-                    import_orders_flag = False
-                    import_transactions_flag = True
-                
-                # Импорт товаров
-                if import_products_flag:
-                    logger.info("📦 Начинаем импорт товаров...")
-                    import_products()
-                    logger.info("✅ Импорт товаров завершен")
-                
-                # Импорт заказов
-                if import_orders_flag:
-                    logger.info("🛒 Начинаем импорт заказов...")
-                    import_orders(start_date, end_date)
-                    logger.info("✅ Импорт заказов завершен")
-                
-                # Импорт транзакций
-                if import_transactions_flag:
-                    logger.info("💰 Начинаем импорт транзакций...")
-                    import_transactions(start_date, end_date)
-                    logger.info("✅ Импорт транзакций завершен")
+        orchestrator = ImportOrchestrator(
+            build_streams(sources, args),
+            concurrency={'ozon': args.ozon_workers, 'wb': args.wb_workers},
+            checkpoint_file=None if args.no_checkpoint else args.checkpoint_file,
+            prefetch=prefetch_ozon_reports
+        )
+        errors = orchestrator.run(start_date, end_date, shard_days=args.shard_days)
+        
+        if errors:
+            logger.error(f"❌ Не выполнено задач: {len(errors)}. Повторный запуск продолжит с них")
+            return 1
         
         logger.info("🎉 Все операции импорта завершены успешно!")
         return 0
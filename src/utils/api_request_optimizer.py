@@ -4,7 +4,7 @@
 
 Улучшения:
 - Параллельная обработка данных с разных маркетплейсов
-- Кэширование неизменяемых данных
+- Кэширование неизменяемых данных (LRU в памяти + SQLite на диске)
 - Оптимизация размера батчей для API запросов
 - Адаптивное управление rate limits
 
@@ -24,10 +24,13 @@ from enum import Enum
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
-from collections import defaultdict, deque
+from collections import defaultdict, OrderedDict
 import pickle
+import sqlite3
 import os
 
+from rate_limiter import get_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 
@@ -59,15 +62,227 @@ class CacheEntry:
         return self.data
 
 
-@dataclass
-class RateLimitInfo:
-    """Информация о лимитах API."""
-    requests_per_second: float
-    requests_per_minute: int
-    requests_per_hour: int
-    current_requests: int = 0
-    reset_time: Optional[datetime] = None
-    last_request_time: Optional[datetime] = None
+class MemoryLRUCache:
+    """
+    Кэш в памяти с вытеснением LRU и TTL.
+    
+    Все операции O(1): порядок доступа хранится в OrderedDict,
+    при переполнении вытесняется самая давно использованная запись.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Получение неистекшей записи с обновлением порядка LRU."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        if entry.is_expired():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        return entry
+    
+    def set(self, key: str, entry: CacheEntry) -> None:
+        """Сохранение записи с вытеснением LRU при переполнении."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self._entries[key] = entry
+        
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteDiskCache:
+    """
+    Дисковый уровень кэша на SQLite.
+    
+    Каждая запись хранится отдельной строкой со своим сроком жизни, поэтому
+    запись одного ключа не переписывает весь кэш. Режим WAL и таймаут
+    блокировки позволяют нескольким cron-процессам безопасно работать
+    с одним файлом. При превышении max_bytes вытесняются записи
+    с самым давним доступом.
+    
+    Время доступа при чтении не пишется сразу: оно копится в памяти и
+    сохраняется одним пакетом при записи, вытеснении, закрытии или когда
+    накопится ACCESS_FLUSH_SIZE ключей, поэтому попадание в кэш не
+    требует транзакции записи.
+    """
+    
+    # Как часто (в операциях записи) проверять размер кэша
+    EVICTION_CHECK_INTERVAL = 100
+    
+    # Сколько накопленных времен доступа сохранять одним пакетом
+    ACCESS_FLUSH_SIZE = 500
+    
+    def __init__(self, db_path: str, max_bytes: int):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        self._pending_access: Dict[str, float] = {}
+        
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'bytes_read': 0,
+            'bytes_written': 0
+        }
+        
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries (expires_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (last_accessed)")
+        self._conn.commit()
+        
+        self.purge_expired()
+    
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Чтение записи; истекшая запись удаляется."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, expires_at FROM cache_entries WHERE key = ?",
+                (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            
+            value, created_at, expires_at = row
+            now = time.time()
+            
+            if expires_at <= now:
+                self._pending_access.pop(key, None)
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            
+            self._pending_access[key] = now
+            if len(self._pending_access) >= self.ACCESS_FLUSH_SIZE:
+                self._flush_access_times()
+                self._conn.commit()
+            
+            self.stats['hits'] += 1
+            self.stats['bytes_read'] += len(value)
+            
+        return CacheEntry(
+            data=pickle.loads(value),
+            created_at=datetime.fromtimestamp(created_at),
+            expires_at=datetime.fromtimestamp(expires_at)
+        )
+    
+    def set(self, key: str, entry: CacheEntry) -> None:
+        """Запись одной строки (INSERT OR REPLACE)."""
+        value = pickle.dumps(entry.data, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        
+        with self._lock:
+            self._pending_access.pop(key, None)
+            self._flush_access_times()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries "
+                "(key, value, size, created_at, expires_at, last_accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, len(value), entry.created_at.timestamp(), entry.expires_at.timestamp(), now)
+            )
+            self._conn.commit()
+            self.stats['bytes_written'] += len(value)
+            
+            self._writes_since_check += 1
+            if self._writes_since_check >= self.EVICTION_CHECK_INTERVAL:
+                self._writes_since_check = 0
+                self._evict_to_limit()
+    
+    def purge_expired(self) -> int:
+        """Удаление всех истекших записей."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+            self.stats['expirations'] += cursor.rowcount
+            return cursor.rowcount
+    
+    def _flush_access_times(self) -> None:
+        """Запись накопленных времен доступа одним пакетом (под self._lock, без commit)."""
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE cache_entries SET last_accessed = MAX(last_accessed, ?) WHERE key = ?",
+            [(accessed, key) for key, accessed in self._pending_access.items()]
+        )
+        self._pending_access.clear()
+    
+    def _evict_to_limit(self) -> None:
+        """Вытеснение давно неиспользуемых записей сверх max_bytes (под self._lock)."""
+        # Вытеснение опирается на last_accessed - сначала сохраняем накопленное
+        self._flush_access_times()
+        self._conn.commit()
+        total = self._total_bytes()
+        while total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache_entries ORDER BY last_accessed LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                total -= size
+                self.stats['evictions'] += 1
+            self._conn.commit()
+    
+    def _total_bytes(self) -> int:
+        """Суммарный размер значений в кэше."""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика дискового уровня."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+        
+        stats = dict(self.stats)
+        stats['entries'] = entries
+        stats['bytes'] = size
+        stats['max_bytes'] = self.max_bytes
+        return stats
+    
+    def close(self) -> None:
+        """Сохранение накопленных времен доступа и закрытие соединения с файлом кэша."""
+        with self._lock:
+            try:
+                self._flush_access_times()
+                self._conn.commit()
+            finally:
+                self._conn.close()
 
 
 @dataclass
@@ -84,23 +299,27 @@ class BatchConfig:
 class APIRequestOptimizer:
     """Оптимизатор API запросов с кэшированием и параллельной обработкой."""
     
-    def __init__(self, cache_dir: str = "cache", max_cache_size: int = 1000):
+    def __init__(self, cache_dir: str = "cache", max_cache_size: int = 1000,
+                 max_disk_cache_mb: int = 256):
         """
         Инициализация оптимизатора.
         
         Args:
             cache_dir: Директория для хранения кэша
-            max_cache_size: Максимальный размер кэша в записях
+            max_cache_size: Максимальный размер кэша в памяти (в записях)
+            max_disk_cache_mb: Максимальный размер дискового кэша в мегабайтах
         """
         self.cache_dir = cache_dir
         self.max_cache_size = max_cache_size
-        self._cache: Dict[str, CacheEntry] = {}
+        self._cache = MemoryLRUCache(max_cache_size)
         self._cache_lock = threading.Lock()
         
         # Статистика производительности
         self._stats = {
             'cache_hits': 0,
             'cache_misses': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
             'api_requests': 0,
             'parallel_requests': 0,
             'batch_optimizations': 0
@@ -114,70 +333,29 @@ class APIRequestOptimizer:
             'wb_products': BatchConfig(500, 50, 1000)
         }
         
-        # Информация о rate limits
-        self._rate_limits = {
-            'ozon': RateLimitInfo(10.0, 600, 7200),  # 10 RPS, 600 RPM, 7200 RPH
-            'wb': RateLimitInfo(5.0, 300, 3600)      # 5 RPS, 300 RPM, 3600 RPH
-        }
-        
-        # Очереди запросов для rate limiting
-        self._request_queues = {
-            'ozon': deque(),
-            'wb': deque()
-        }
+        # Общий для всех процессов rate limiter (token bucket на маркетплейс)
+        self._rate_limiter = get_rate_limiter()
         
-        # Создаем директорию кэша
+        # Создаем директорию кэша и подключаем дисковый уровень
         os.makedirs(cache_dir, exist_ok=True)
+        self._disk_cache: Optional[SQLiteDiskCache] = None
         
-        # Загружаем кэш из файла
-        self._load_cache_from_disk()
+        try:
+            self._disk_cache = SQLiteDiskCache(
+                os.path.join(cache_dir, "api_cache.sqlite3"),
+                max_bytes=max_disk_cache_mb * 1024 * 1024
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Дисковый кэш недоступен, используется только кэш в памяти: {e}")
     
     def _generate_cache_key(self, cache_type: CacheType, **kwargs) -> str:
         """Генерация ключа кэша."""
         key_data = f"{cache_type.value}:{json.dumps(kwargs, sort_keys=True)}"
         return hashlib.md5(key_data.encode()).hexdigest()
     
-    def _load_cache_from_disk(self) -> None:
-        """Загрузка кэша с диска."""
-        cache_file = os.path.join(self.cache_dir, "api_cache.pkl")
-        
-        try:
-            if os.path.exists(cache_file):
-                with open(cache_file, 'rb') as f:
-                    disk_cache = pickle.load(f)
-                
-                # Фильтруем неистекшие записи
-                current_time = datetime.now()
-                for key, entry in disk_cache.items():
-                    if not entry.is_expired():
-                        self._cache[key] = entry
-                
-                logger.info(f"✅ Загружено {len(self._cache)} записей из кэша")
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка загрузки кэша: {e}")
-    
-    def _save_cache_to_disk(self) -> None:
-        """Сохранение кэша на диск."""
-        cache_file = os.path.join(self.cache_dir, "api_cache.pkl")
-        
-        try:
-            with self._cache_lock:
-                # Сохраняем только неистекшие записи
-                valid_cache = {
-                    key: entry for key, entry in self._cache.items()
-                    if not entry.is_expired()
-                }
-                
-                with open(cache_file, 'wb') as f:
-                    pickle.dump(valid_cache, f)
-                
-                logger.debug(f"💾 Сохранено {len(valid_cache)} записей в кэш")
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка сохранения кэша: {e}")
-    
     def get_cached_data(self, cache_type: CacheType, **kwargs) -> Optional[Any]:
         """
-        Получение данных из кэша.
+        Получение данных из кэша: сначала память, затем диск.
         
         Args:
             cache_type: Тип кэшируемых данных
@@ -189,22 +367,34 @@ class APIRequestOptimizer:
         cache_key = self._generate_cache_key(cache_type, **kwargs)
         
         with self._cache_lock:
-            if cache_key in self._cache:
-                entry = self._cache[cache_key]
-                
-                if not entry.is_expired():
-                    self._stats['cache_hits'] += 1
-                    return entry.access()
-                else:
-                    # Удаляем истекшую запись
-                    del self._cache[cache_key]
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                self._stats['cache_hits'] += 1
+                self._stats['memory_hits'] += 1
+                return entry.access()
+        
+        if self._disk_cache is not None:
+            try:
+                entry = self._disk_cache.get(cache_key)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка чтения дискового кэша: {e}")
+                entry = None
             
+            if entry is not None:
+                with self._cache_lock:
+                    # Поднимаем запись в память для следующих обращений
+                    self._cache.set(cache_key, entry)
+                    self._stats['cache_hits'] += 1
+                    self._stats['disk_hits'] += 1
+                return entry.access()
+        
+        with self._cache_lock:
             self._stats['cache_misses'] += 1
-            return None
+        return None
     
-    def set_cached_data(self, cache_type: CacheType, data: Any, ttl_hours: int = 24, **kwargs) -> None:
+    def set_cached_data(self, cache_type: CacheType, data: Any, ttl_hours: float = 24, **kwargs) -> None:
         """
-        Сохранение данных в кэш.
+        Сохранение данных в кэш (память и диск).
         
         Args:
             cache_type: Тип кэшируемых данных
@@ -214,92 +404,24 @@ class APIRequestOptimizer:
         """
         cache_key = self._generate_cache_key(cache_type, **kwargs)
         
-        with self._cache_lock:
-            # Проверяем размер кэша и очищаем при необходимости
-            if len(self._cache) >= self.max_cache_size:
-                self._cleanup_cache()
-            
-            # Создаем новую запись
-            entry = CacheEntry(
-                data=data,
-                created_at=datetime.now(),
-                expires_at=datetime.now() + timedelta(hours=ttl_hours)
-            )
-            
-            self._cache[cache_key] = entry
-    
-    def _cleanup_cache(self) -> None:
-        """Очистка кэша от старых записей."""
-        current_time = datetime.now()
-        
-        # Удаляем истекшие записи
-        expired_keys = [
-            key for key, entry in self._cache.items()
-            if entry.is_expired()
-        ]
-        
-        for key in expired_keys:
-            del self._cache[key]
-        
-        # Если все еще превышен лимит, удаляем наименее используемые
-        if len(self._cache) >= self.max_cache_size:
-            # Сортируем по частоте использования и времени последнего доступа
-            sorted_entries = sorted(
-                self._cache.items(),
-                key=lambda x: (x[1].access_count, x[1].last_accessed or x[1].created_at)
-            )
-            
-            # Удаляем 20% наименее используемых записей
-            to_remove = int(len(sorted_entries) * 0.2)
-            for key, _ in sorted_entries[:to_remove]:
-                del self._cache[key]
-        
-        logger.debug(f"🧹 Очистка кэша: осталось {len(self._cache)} записей")
-    
-    def _check_rate_limit(self, marketplace: str) -> float:
-        """
-        Проверка rate limit и возврат времени ожидания.
-        
-        Args:
-            marketplace: Маркетплейс ('ozon' или 'wb')
-            
-        Returns:
-            Время ожидания в секундах
-        """
-        if marketplace not in self._rate_limits:
-            return 0.0
-        
-        rate_info = self._rate_limits[marketplace]
-        current_time = datetime.now()
-        
-        # Очищаем старые запросы из очереди
-        queue = self._request_queues[marketplace]
-        while queue and (current_time - queue[0]).total_seconds() > 60:
-            queue.popleft()
-        
-        # Проверяем лимит запросов в минуту
-        if len(queue) >= rate_info.requests_per_minute:
-            # Вычисляем время ожидания до освобождения слота
-            oldest_request = queue[0]
-            wait_time = 60 - (current_time - oldest_request).total_seconds()
-            return max(0, wait_time)
-        
-        # Проверяем лимит запросов в секунду
-        recent_requests = [
-            req_time for req_time in queue
-            if (current_time - req_time).total_seconds() <= 1
-        ]
+        entry = CacheEntry(
+            data=data,
+            created_at=datetime.now(),
+            expires_at=datetime.now() + timedelta(hours=ttl_hours)
+        )
         
-        if len(recent_requests) >= rate_info.requests_per_second:
-            return 1.0 / rate_info.requests_per_second
+        with self._cache_lock:
+            self._cache.set(cache_key, entry)
         
-        return 0.0
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.set(cache_key, entry)
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка записи в дисковый кэш: {e}")
     
     def _record_request(self, marketplace: str) -> None:
-        """Запись времени выполнения запроса."""
-        if marketplace in self._request_queues:
-            self._request_queues[marketplace].append(datetime.now())
-            self._stats['api_requests'] += 1
+        """Учет выполненного запроса в статистике."""
+        self._stats['api_requests'] += 1
     
     async def make_api_request(
         self,
@@ -332,16 +454,14 @@ class APIRequestOptimizer:
             if cached_data:
                 return cached_data
         
-        # Проверяем rate limit
-        wait_time = self._check_rate_limit(marketplace)
-        if wait_time > 0:
-            logger.debug(f"⏳ Ожидание rate limit для {marketplace}: {wait_time:.2f} сек")
-            await asyncio.sleep(wait_time)
+        # Ожидаем токен общего rate limiter (резервирование - в пуле потоков)
+        await self._rate_limiter.acquire_async(marketplace)
         
         try:
             # Выполняем запрос
             async with session.request(method, url, **kwargs) as response:
                 self._record_request(marketplace)
+                self._rate_limiter.update_from_response(marketplace, response.status, response.headers)
                 
                 if response.status == 200:
                     data = await response.json()
@@ -353,10 +473,9 @@ class APIRequestOptimizer:
                     return data
                 
                 elif response.status == 429:  # Too Many Requests
-                    # Обновляем информацию о rate limits
-                    retry_after = int(response.headers.get('Retry-After', 60))
-                    logger.warning(f"⚠️ Rate limit для {marketplace}, ожидание {retry_after} сек")
-                    await asyncio.sleep(retry_after)
+                    # Пауза уже назначена в rate limiter и будет выдержана
+                    # следующими запросами всех процессов
+                    logger.warning(f"⚠️ Rate limit для {marketplace}")
                     return None
                 
                 else:
@@ -627,12 +746,24 @@ class APIRequestOptimizer:
         if total_cache_requests > 0:
             cache_hit_rate = self._stats['cache_hits'] / total_cache_requests
         
+        disk_stats = {}
+        if self._disk_cache is not None:
+            try:
+                disk_stats = self._disk_cache.get_stats()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка получения статистики дискового кэша: {e}")
+        
         return {
             'cache_stats': {
                 'hit_rate': cache_hit_rate,
                 'total_entries': len(self._cache),
                 'hits': self._stats['cache_hits'],
-                'misses': self._stats['cache_misses']
+                'misses': self._stats['cache_misses'],
+                'memory_hits': self._stats['memory_hits'],
+                'disk_hits': self._stats['disk_hits'],
+                'memory_evictions': self._cache.evictions,
+                'memory_expirations': self._cache.expirations,
+                'disk': disk_stats
             },
             'api_stats': {
                 'total_requests': self._stats['api_requests'],
@@ -645,8 +776,14 @@ class APIRequestOptimizer:
         }
     
     def cleanup(self) -> None:
-        """Очистка ресурсов и сохранение кэша."""
-        self._save_cache_to_disk()
+        """Очистка ресурсов и закрытие дискового кэша."""
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.purge_expired()
+                self._disk_cache.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка закрытия дискового кэша: {e}")
+            self._disk_cache = None
         logger.info("🧹 Очистка оптимизатора API завершена")
 
 
@@ -20,6 +20,8 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from rate_limiter import get_rate_limiter, resolve_bucket_name
+
 logger = logging.getLogger(__name__)
 
 
@@ -93,6 +95,9 @@ class APIErrorHandler:
         self.error_history: Dict[str, List[ErrorContext]] = {}
         self.rate_limit_info: Dict[str, Dict[str, Any]] = {}
         
+        # Общий для всех процессов rate limiter
+        self.rate_limiter = get_rate_limiter()
+        
         # Настройка HTTP сессии с retry
         self.session = requests.Session()
         try:
@@ -264,6 +269,9 @@ class APIErrorHandler:
         if response.status_code == 429 and 'Retry-After' in headers:
             self.rate_limit_info[source]['retry_after'] = int(headers['Retry-After'])
             self.rate_limit_info[source]['retry_after_timestamp'] = datetime.now()
+        
+        # Пауза действует для всех процессов, работающих с этим API
+        self.rate_limiter.update_from_response(resolve_bucket_name(source), response.status_code, headers)
     
     def check_rate_limit(self, source: str) -> Optional[float]:
         """
@@ -275,25 +283,8 @@ class APIErrorHandler:
         Returns:
             Optional[float]: Время ожидания в секундах или None
         """
-        if source not in self.rate_limit_info:
-            return None
-        
-        rate_info = self.rate_limit_info[source]
-        
-        # Проверяем Retry-After
-        if 'retry_after' in rate_info and 'retry_after_timestamp' in rate_info:
-            elapsed = (datetime.now() - rate_info['retry_after_timestamp']).total_seconds()
-            if elapsed < rate_info['retry_after']:
-                return rate_info['retry_after'] - elapsed
-        
-        # Проверяем оставшиеся запросы
-        if 'remaining' in rate_info and rate_info['remaining'] <= 1:
-            if 'reset' in rate_info:
-                reset_time = datetime.fromtimestamp(rate_info['reset'])
-                if reset_time > datetime.now():
-                    return (reset_time - datetime.now()).total_seconds()
-        
-        return None
+        wait_time = self.rate_limiter.get_wait_time(resolve_bucket_name(source))
+        return wait_time if wait_time > 0 else None
     
     def execute_with_retry(
         self, 
@@ -319,11 +310,10 @@ class APIErrorHandler:
         
         while attempt <= self.retry_config.max_attempts:
             try:
-                # Проверяем rate limits перед запросом
-                wait_time = self.check_rate_limit(source)
-                if wait_time and wait_time > 0:
+                # Резервируем запрос в общем rate limiter
+                wait_time = self.rate_limiter.acquire(resolve_bucket_name(source))
+                if wait_time > 0:
                     logger.info(f"Ожидание {wait_time:.1f}с из-за rate limit для {source}")
-                    time.sleep(wait_time)
                 
                 # Выполняем функцию
                 result = func(*args, **kwargs)
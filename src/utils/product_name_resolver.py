@@ -11,6 +11,7 @@ import logging
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from config import OZON_CLIENT_ID, OZON_API_KEY
+from rate_limiter import get_rate_limiter
 import mysql.connector
 from mysql.connector import Error
 
@@ -44,9 +45,9 @@ class ProductNameResolver:
         # Кэш для избежания повторных запросов в рамках сессии
         self.name_cache: Dict[str, str] = {}
         
-        # Настройки для rate limiting
-        self.request_delay = 0.1  # 100ms между запросами
-        self.last_request_time = 0
+        # Общий rate limiter Ozon; ответы API корректируют его по заголовкам
+        self.rate_limiter = get_rate_limiter()
+        self.session.hooks['response'].append(self._on_response)
         
         # Подключение к БД
         self.db_connection = None
@@ -70,11 +71,11 @@ class ProductNameResolver:
     
     def _rate_limit(self):
         """Контроль частоты запросов"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.request_delay:
-            time.sleep(self.request_delay - time_since_last)
-        self.last_request_time = time.time()
+        self.rate_limiter.acquire('ozon')
+    
+    def _on_response(self, response, *args, **kwargs):
+        """Передача заголовков лимитов из ответа в rate limiter"""
+        self.rate_limiter.update_from_response('ozon', response.status_code, response.headers)
     
     def get_product_name_by_sku(self, sku: str) -> Optional[str]:
         """
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Индекс разрешения SKU → product_id для сервисов синхронизации и импортеров.
+
+Развитие ProductCache из inventory_sync_service_optimized.py:
+- Ключи: sku_ozon, sku_wb, sku_internal, barcode
+- Полная загрузка dim_products одним запросом
+- Инкрементальное обновление по dim_products.updated_at
+- Опциональный LISTEN/NOTIFY (PostgreSQL) для мгновенной инвалидации
+- Счетчики попаданий/промахов и запросов к БД при промахах
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple, Set
+
+logger = logging.getLogger(__name__)
+
+
+# Поддерживаемые ключи разрешения (колонки dim_products)
+KEY_COLUMNS = ('sku_ozon', 'sku_wb', 'sku_internal', 'barcode')
+
+# Канал уведомлений об изменениях dim_products
+DEFAULT_NOTIFY_CHANNEL = 'dim_products_changed'
+
+# Значений в одном запросе WHERE ... IN (...) при пакетной проверке промахов
+LOOKUP_BATCH_SIZE = 1000
+
+
+def _row_value(row, index: int, name: str):
+    """Значение колонки из строки dict- или tuple-курсора."""
+    if isinstance(row, dict):
+        return row.get(name)
+    return row[index]
+
+
+class ProductResolutionIndex:
+    """
+    Потокобезопасный индекс товаров в памяти.
+
+    Использование:
+        index = get_product_index()
+        product_id = index.get_product_id_by_ozon_sku(offer_id, cursor=self.cursor)
+
+    Если передан cursor, индекс при необходимости загружается или
+    инкрементально обновляется, а промах проверяется запросом к БД
+    (результат кэшируется, в т.ч. отрицательный до следующего обновления).
+    """
+
+    def __init__(self, refresh_interval: int = 300):
+        """
+        Инициализация индекса.
+
+        Args:
+            refresh_interval: Интервал инкрементального обновления (секунды)
+        """
+        self.refresh_interval = refresh_interval
+        self._maps: Dict[str, Dict[str, int]] = {key: {} for key in KEY_COLUMNS}
+        self._product_keys: Dict[int, Tuple[Optional[str], ...]] = {}
+        self._negative: Set[Tuple[str, str]] = set()
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._supports_updated_at: Optional[bool] = None
+        self._high_water_mark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._dirty = False
+        self._listen_connection = None
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'db_lookups': 0,
+            'db_hits': 0,
+            'full_loads': 0,
+            'incremental_refreshes': 0,
+            'rows_refreshed': 0,
+            'notifications': 0
+        }
+
+    # ------------------------------------------------------------------
+    # Загрузка и обновление
+    # ------------------------------------------------------------------
+
+    def load(self, cursor) -> None:
+        """Полная загрузка индекса одним сканированием dim_products."""
+        with self._lock:
+            logger.info("🔄 Загружаем индекс товаров...")
+            rows = self._fetch_products(cursor)
+
+            for key in KEY_COLUMNS:
+                self._maps[key].clear()
+            self._product_keys.clear()
+            self._negative.clear()
+            self._high_water_mark = None
+
+            self._apply_rows(rows)
+
+            self._loaded = True
+            self._dirty = False
+            self._last_refresh = time.time()
+            self.stats['full_loads'] += 1
+
+            sizes = ', '.join(f"{key}={len(self._maps[key])}" for key in KEY_COLUMNS)
+            logger.info(f"✅ Индекс товаров загружен: {sizes}")
+
+    def refresh(self, cursor) -> int:
+        """
+        Инкрементальное обновление по dim_products.updated_at.
+
+        Returns:
+            int: Количество обновленных товаров
+        """
+        with self._lock:
+            if not self._loaded or not self._supports_updated_at or self._high_water_mark is None:
+                self.load(cursor)
+                return len(self._product_keys)
+
+            rows = self._fetch_products(cursor, since=self._high_water_mark)
+            self._apply_rows(rows)
+            # Изменения могли закрыть прежние промахи
+            self._negative.clear()
+
+            self._dirty = False
+            self._last_refresh = time.time()
+            self.stats['incremental_refreshes'] += 1
+            self.stats['rows_refreshed'] += len(rows)
+
+            if rows:
+                logger.info(f"🔄 Индекс товаров обновлен: {len(rows)} изменений")
+            return len(rows)
+
+    def ensure_fresh(self, cursor) -> None:
+        """Загрузка индекса при первом обращении и обновление по интервалу/уведомлению."""
+        if cursor is None:
+            return
+
+        self.poll_notifications()
+
+        if not self._loaded:
+            self.load(cursor)
+        elif self._dirty or time.time() - self._last_refresh >= self.refresh_interval:
+            try:
+                self.refresh(cursor)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить индекс товаров: {e}")
+                self._last_refresh = time.time()
+
+    def _fetch_products(self, cursor, since: Optional[datetime] = None) -> list:
+        """Чтение товаров из dim_products (все или измененные после since)."""
+        columns = ', '.join(('id',) + KEY_COLUMNS)
+
+        if self._supports_updated_at is None:
+            self._supports_updated_at = self._has_updated_at_column(cursor)
+            if not self._supports_updated_at:
+                logger.warning("⚠️ dim_products.updated_at недоступен, "
+                               "инкрементальное обновление отключено")
+
+        if self._supports_updated_at:
+            query = f"SELECT {columns}, updated_at FROM dim_products"
+            params: tuple = ()
+            if since is not None:
+                query += " WHERE updated_at >= %s"
+                params = (since,)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        cursor.execute(f"SELECT {columns} FROM dim_products")
+        return cursor.fetchall()
+
+    @staticmethod
+    def _has_updated_at_column(cursor) -> bool:
+        """
+        Проверка колонки dim_products.updated_at через information_schema.
+
+        Пробный SELECT с откатом при ошибке отменил бы незавершенную
+        транзакцию вызывающего кода на том же соединении.
+        """
+        # Соединение psycopg2 (есть notifies) - текущая схема, иначе текущая БД MySQL
+        is_postgres = hasattr(getattr(cursor, 'connection', None), 'notifies')
+        schema = 'current_schema()' if is_postgres else 'DATABASE()'
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns "
+            f"WHERE table_schema = {schema} AND table_name = %s AND column_name = %s",
+            ('dim_products', 'updated_at')
+        )
+        return bool(cursor.fetchall())
+
+    def _apply_rows(self, rows) -> None:
+        """Применение строк dim_products к индексу."""
+        for row in rows:
+            product_id = _row_value(row, 0, 'id')
+            if product_id is None:
+                continue
+
+            # Убираем старые ключи товара, если они изменились
+            for key, old_value in zip(KEY_COLUMNS, self._product_keys.get(product_id, ())):
+                if old_value is not None and self._maps[key].get(old_value) == product_id:
+                    del self._maps[key][old_value]
+
+            values = []
+            for offset, key in enumerate(KEY_COLUMNS, start=1):
+                value = _row_value(row, offset, key)
+                value = str(value).strip() if value is not None and str(value).strip() else None
+                values.append(value)
+                if value is not None:
+                    self._maps[key][value] = product_id
+            self._product_keys[product_id] = tuple(values)
+
+            if self._supports_updated_at:
+                updated_at = _row_value(row, len(KEY_COLUMNS) + 1, 'updated_at')
+                if updated_at is not None and (self._high_water_mark is None
+                                               or updated_at > self._high_water_mark):
+                    self._high_water_mark = updated_at
+
+    # ------------------------------------------------------------------
+    # LISTEN/NOTIFY
+    # ------------------------------------------------------------------
+
+    def listen(self, connection, channel: str = DEFAULT_NOTIFY_CHANNEL) -> bool:
+        """
+        Подписка на уведомления об изменениях dim_products (только PostgreSQL).
+
+        Триггер на dim_products должен выполнять pg_notify(channel, id::text).
+        Соединение должно быть в режиме autocommit.
+
+        Returns:
+            bool: True если подписка оформлена
+        """
+        if not hasattr(connection, 'notifies'):
+            logger.info("LISTEN/NOTIFY не поддерживается соединением, используем обновление по интервалу")
+            return False
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"LISTEN {channel}")
+            cursor.close()
+            self._listen_connection = connection
+            logger.info(f"✅ Подписка на канал {channel} оформлена")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подписаться на канал {channel}: {e}")
+            return False
+
+    def poll_notifications(self) -> int:
+        """Проверка поступивших уведомлений; при наличии индекс помечается устаревшим."""
+        connection = self._listen_connection
+        if connection is None:
+            return 0
+
+        try:
+            connection.poll()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка получения уведомлений: {e}")
+            self._listen_connection = None
+            return 0
+
+        received = len(connection.notifies)
+        if received:
+            connection.notifies.clear()
+            self._dirty = True
+            self.stats['notifications'] += received
+        return received
+
+    # ------------------------------------------------------------------
+    # Разрешение
+    # ------------------------------------------------------------------
+
+    def resolve(self, key: str, value: Any, cursor=None) -> Optional[int]:
+        """
+        Разрешение product_id по одному ключу.
+
+        Args:
+            key: Одна из колонок KEY_COLUMNS
+            value: Значение ключа
+            cursor: Курсор БД для загрузки индекса и проверки промахов (опционально)
+
+        Returns:
+            product_id или None
+        """
+        return self.resolve_any((key,), value, cursor=cursor)
+
+    def resolve_any(self, keys: Tuple[str, ...], value: Any, cursor=None) -> Optional[int]:
+        """Разрешение product_id по первому совпавшему ключу из списка."""
+        if value is None or str(value).strip() == '':
+            return None
+        value = str(value).strip()
+
+        self.ensure_fresh(cursor)
+
+        with self._lock:
+            for key in keys:
+                product_id = self._maps[key].get(value)
+                if product_id is not None:
+                    self.stats['hits'] += 1
+                    return product_id
+
+            self.stats['misses'] += 1
+            negative_key = (','.join(keys), value)
+            if cursor is None or negative_key in self._negative:
+                return None
+
+        return self._lookup_in_db(keys, value, cursor, negative_key)
+
+    def _lookup_in_db(self, keys: Tuple[str, ...], value: str, cursor,
+                      negative_key: Tuple[str, str]) -> Optional[int]:
+        """Проверка промаха запросом к БД (товар мог появиться после обновления)."""
+        where = ' OR '.join(f"{key} = %s" for key in keys)
+        self.stats['db_lookups'] += 1
+
+        try:
+            cursor.execute(f"SELECT id, {', '.join(keys)} FROM dim_products WHERE {where} LIMIT 1",
+                           tuple(value for _ in keys))
+            row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при поиске товара по {'/'.join(keys)} {value}: {e}")
+            return None
+
+        with self._lock:
+            if not row:
+                self._negative.add(negative_key)
+                return None
+
+            product_id = _row_value(row, 0, 'id')
+            # Кэшируем под колонкой, по которой совпала строка, а не под первым ключом
+            for offset, key in enumerate(keys, start=1):
+                matched = _row_value(row, offset, key)
+                if matched is not None and str(matched).strip() == value:
+                    self._maps[key][value] = product_id
+                    break
+            self.stats['db_hits'] += 1
+            return product_id
+
+    def resolve_many(self, key: str, values, cursor=None) -> Dict[str, int]:
+        """
+        Разрешение набора значений одного ключа (например, всех SKU страницы API).
+
+        Промахи проверяются одним запросом WHERE key IN (...) на каждые
+        LOOKUP_BATCH_SIZE значений вместо запроса на каждое значение.
+
+        Args:
+            key: Одна из колонок KEY_COLUMNS
+            values: Значения ключа (пустые и повторы пропускаются)
+            cursor: Курсор БД для загрузки индекса и проверки промахов (опционально)
+
+        Returns:
+            Словарь значение -> product_id для найденных значений
+
+        Raises:
+            Exception: Ошибка запроса к БД при проверке промахов
+        """
+        wanted = {str(value).strip() for value in values if value is not None and str(value).strip() != ''}
+        if not wanted:
+            return {}
+
+        self.ensure_fresh(cursor)
+
+        resolved: Dict[str, int] = {}
+        missing = []
+        with self._lock:
+            key_map = self._maps[key]
+            for value in wanted:
+                product_id = key_map.get(value)
+                if product_id is not None:
+                    resolved[value] = product_id
+                elif (key, value) not in self._negative:
+                    missing.append(value)
+            self.stats['hits'] += len(resolved)
+            self.stats['misses'] += len(wanted) - len(resolved)
+
+        if cursor is None or not missing:
+            return resolved
+
+        for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            batch = missing[start:start + LOOKUP_BATCH_SIZE]
+            self.stats['db_lookups'] += 1
+            try:
+                cursor.execute(
+                    f"SELECT id, {key} FROM dim_products WHERE {key} IN ({', '.join(['%s'] * len(batch))})",
+                    tuple(batch)
+                )
+                rows = cursor.fetchall()
+            except Exception as e:
+                # Не превращаем ошибку БД в "товар не найден": вызывающий код
+                # иначе молча отбросит строки страницы
+                logger.error(f"❌ Ошибка при поиске {len(batch)} товаров по {key}: {e}")
+                raise
+
+            with self._lock:
+                for row in rows:
+                    value = str(_row_value(row, 1, key)).strip()
+                    if value in resolved:
+                        continue
+                    resolved[value] = _row_value(row, 0, 'id')
+                    self._maps[key][value] = resolved[value]
+                    self.stats['db_hits'] += 1
+                self._negative.update((key, value) for value in batch if value not in resolved)
+
+        return resolved
+
+    def get_product_id_by_ozon_sku(self, sku: Any, cursor=None) -> Optional[int]:
+        """Получение product_id по SKU Ozon."""
+        return self.resolve('sku_ozon', sku, cursor=cursor)
+
+    def get_product_id_by_wb_sku(self, sku: Any, cursor=None) -> Optional[int]:
+        """Получение product_id по SKU Wildberries."""
+        return self.resolve('sku_wb', sku, cursor=cursor)
+
+    def get_product_id_by_internal_sku(self, sku: Any, cursor=None) -> Optional[int]:
+        """Получение product_id по внутреннему артикулу."""
+        return self.resolve('sku_internal', sku, cursor=cursor)
+
+    def get_product_id_by_barcode(self, barcode: Any, cursor=None) -> Optional[int]:
+        """Получение product_id по штрихкоду."""
+        return self.resolve('barcode', barcode, cursor=cursor)
+
+    def get_product_id_by_offer_id(self, offer_id: Any, cursor=None) -> Optional[int]:
+        """Получение product_id по offer_id Ozon (sku_ozon, затем sku_internal)."""
+        return self.resolve_any(('sku_ozon', 'sku_internal'), offer_id, cursor=cursor)
+
+    # ------------------------------------------------------------------
+    # Совместимость с ProductCache и статистика
+    # ------------------------------------------------------------------
+
+    def load_cache(self, cursor) -> None:
+        """Загрузка индекса, если он еще не загружен (API ProductCache)."""
+        if not self._loaded:
+            self.load(cursor)
+
+    def clear_cache(self) -> None:
+        """Очистка индекса."""
+        with self._lock:
+            for key in KEY_COLUMNS:
+                self._maps[key].clear()
+            self._product_keys.clear()
+            self._negative.clear()
+            self._high_water_mark = None
+            self._loaded = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика индекса: размеры, попадания, промахи, запросы к БД."""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            stats = dict(self.stats)
+            stats['lookups'] = lookups
+            stats['hit_rate_percent'] = round(self.stats['hits'] / lookups * 100, 2) if lookups else 0.0
+            stats['sizes'] = {key: len(self._maps[key]) for key in KEY_COLUMNS}
+            stats['products'] = len(self._product_keys)
+            stats['high_water_mark'] = self._high_water_mark.isoformat() if self._high_water_mark else None
+            return stats
+
+
+_shared_index: Optional[ProductResolutionIndex] = None
+_shared_lock = threading.Lock()
+
+
+def get_product_index() -> ProductResolutionIndex:
+    """Общий для процесса экземпляр индекса."""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = ProductResolutionIndex()
+        return _shared_index
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Общий rate limiter (token bucket) для API маркетплейсов.
+
+Один bucket на класс эндпоинтов (ozon, wb, wb_statistics). Состояние
+хранится в локальном SQLite-файле, поэтому одновременно запущенные
+cron-задачи (остатки, движения, еженедельные отчеты) делят один лимит
+и не получают 429 друг из-за друга.
+
+Возможности:
+- Синхронное (acquire) и асинхронное (acquire_async) ожидание токена
+- Учет заголовков Retry-After и X-RateLimit-* из ответов API
+- Резервирование токена: ожидающие процессы обслуживаются по очереди
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Mapping
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Параметры token bucket."""
+    rate: float  # Токенов в секунду
+    capacity: float  # Максимальный всплеск запросов
+
+
+# Лимиты по классам эндпоинтов
+DEFAULT_RATE_LIMITS: Dict[str, RateLimitRule] = {
+    'ozon': RateLimitRule(rate=10.0, capacity=10.0),
+    'wb': RateLimitRule(rate=2.0, capacity=2.0),
+    # Statistics API Wildberries: 1 запрос в минуту (с запасом)
+    'wb_statistics': RateLimitRule(rate=1.0 / 61, capacity=1.0),
+}
+
+DEFAULT_DB_PATH = os.path.join(tempfile.gettempdir(), 'mi_core_rate_limits.sqlite3')
+
+
+def resolve_bucket_name(source: str) -> str:
+    """Имя bucket по названию источника ('Ozon', 'Wildberries', 'wb', ...)."""
+    normalized = (source or '').strip().lower()
+    if normalized.startswith('ozon'):
+        return 'ozon'
+    if normalized in ('wb', 'wildberries') or normalized.startswith('wb_'):
+        return normalized if normalized in DEFAULT_RATE_LIMITS else 'wb'
+    return normalized
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """Разбор Retry-After: число секунд или HTTP-дата."""
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """Разбор X-RateLimit-Reset: секунды до сброса или unix-время."""
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+class RateLimiter:
+    """
+    Token bucket, разделяемый между процессами через SQLite.
+
+    Каждое обращение резервирует токен в транзакции BEGIN IMMEDIATE:
+    баланс может уйти в минус, и тогда вызывающий ждет, пока bucket
+    пополнится. Ответ 429 или исчерпанный лимит в заголовках блокируют
+    bucket для всех процессов до указанного момента.
+    """
+
+    def __init__(self, db_path: Optional[str] = None,
+                 rules: Optional[Mapping[str, RateLimitRule]] = None):
+        """
+        Инициализация limiter.
+
+        Args:
+            db_path: Путь к файлу состояния (по умолчанию RATE_LIMITER_DB или временная директория)
+            rules: Лимиты по классам эндпоинтов (по умолчанию DEFAULT_RATE_LIMITS)
+        """
+        self.db_path = db_path or os.getenv('RATE_LIMITER_DB', DEFAULT_DB_PATH)
+        self.rules: Dict[str, RateLimitRule] = dict(rules or DEFAULT_RATE_LIMITS)
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'acquired': 0,
+            'waited': 0,
+            'total_wait_seconds': 0.0,
+            'blocks': 0
+        }
+
+        try:
+            self._conn = self._connect(self.db_path)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Файл rate limiter {self.db_path} недоступен, "
+                           f"лимиты действуют только в текущем процессе: {e}")
+            self.db_path = ':memory:'
+            self._conn = self._connect(self.db_path)
+
+    @staticmethod
+    def _connect(db_path: str) -> sqlite3.Connection:
+        """Открытие файла состояния (autocommit, транзакции вручную)."""
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+        """)
+        return conn
+
+    def reserve(self, name: str, tokens: float = 1.0) -> float:
+        """
+        Резервирование токена без ожидания.
+
+        Args:
+            name: Класс эндпоинтов ('ozon', 'wb', 'wb_statistics')
+            tokens: Стоимость запроса в токенах
+
+        Returns:
+            float: Сколько секунд нужно подождать перед запросом
+        """
+        rule = self.rules.get(name)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE name = ?",
+                    (name,)
+                ).fetchone()
+
+                if row is None:
+                    balance, updated_at, blocked_until = (rule.capacity if rule else 0.0), now, 0.0
+                else:
+                    balance, updated_at, blocked_until = row
+
+                # Во время блокировки bucket "замораживается": баланс считаем
+                # на момент ее окончания (или на текущий момент)
+                start = max(now, blocked_until, updated_at)
+                wait_time = start - now
+                if rule:
+                    balance = min(rule.capacity, balance + (start - updated_at) * rule.rate)
+                    balance -= tokens
+                    if balance < 0:
+                        wait_time += -balance / rule.rate
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated_at, blocked_until) "
+                    "VALUES (?, ?, ?, ?)",
+                    (name, balance, start, blocked_until)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            self.stats['acquired'] += 1
+            if wait_time > 0:
+                self.stats['waited'] += 1
+                self.stats['total_wait_seconds'] += wait_time
+
+        return wait_time
+
+    def acquire(self, name: str, tokens: float = 1.0) -> float:
+        """
+        Ожидание токена (синхронно).
+
+        Returns:
+            float: Фактическое время ожидания в секундах
+        """
+        wait_time = self.reserve(name, tokens)
+        if wait_time > 0:
+            logger.debug(f"⏳ Rate limit {name}: ожидание {wait_time:.2f} сек")
+            time.sleep(wait_time)
+        return wait_time
+
+    async def acquire_async(self, name: str, tokens: float = 1.0) -> float:
+        """
+        Ожидание токена (асинхронно).
+
+        Резервирование (транзакция sqlite, которая может ждать блокировку до
+        30 сек) выполняется в пуле потоков, чтобы не останавливать event loop.
+
+        Returns:
+            float: Фактическое время ожидания в секундах
+        """
+        loop = asyncio.get_running_loop()
+        wait_time = await loop.run_in_executor(None, self.reserve, name, tokens)
+        if wait_time > 0:
+            logger.debug(f"⏳ Rate limit {name}: ожидание {wait_time:.2f} сек")
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+    def block(self, name: str, seconds: float) -> None:
+        """Блокировка bucket для всех процессов на указанное время."""
+        if seconds <= 0:
+            return
+
+        until = time.time() + seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO rate_buckets (name, tokens, updated_at, blocked_until) "
+                    "VALUES (?, 0, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET tokens = MIN(tokens, 0), "
+                    "updated_at = MAX(updated_at, excluded.updated_at), "
+                    "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                    (name, until, until)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.stats['blocks'] += 1
+
+        logger.warning(f"⚠️ Rate limit {name}: запросы приостановлены на {seconds:.1f} сек")
+
+    def update_from_response(self, name: str, status_code: int,
+                             headers: Optional[Mapping[str, str]]) -> float:
+        """
+        Адаптация к ответу API по статусу и заголовкам.
+
+        Учитываются Retry-After, X-RateLimit-Remaining/X-RateLimit-Reset
+        и X-Ratelimit-Retry (Wildberries).
+
+        Args:
+            name: Класс эндпоинтов
+            status_code: HTTP статус ответа
+            headers: Заголовки ответа (requests или aiohttp)
+
+        Returns:
+            float: Назначенная пауза в секундах (0, если лимит не исчерпан)
+        """
+        lowered = {str(key).lower(): str(value) for key, value in (headers or {}).items()}
+        pause = None
+
+        if 'retry-after' in lowered:
+            pause = _parse_retry_after(lowered['retry-after'])
+        if pause is None and 'x-ratelimit-retry' in lowered:
+            pause = _parse_reset(lowered['x-ratelimit-retry'])
+
+        remaining = lowered.get('x-ratelimit-remaining')
+        if pause is None and remaining is not None and 'x-ratelimit-reset' in lowered:
+            try:
+                if float(remaining) <= 0:
+                    pause = _parse_reset(lowered['x-ratelimit-reset'])
+            except ValueError:
+                pass
+
+        if pause is None and status_code == 429:
+            # Сервер не сообщил время ожидания - ждем период пополнения bucket
+            rule = self.rules.get(name)
+            pause = rule.capacity / rule.rate if rule else 60.0
+
+        if pause:
+            self.block(name, pause)
+        return pause or 0.0
+
+    def get_wait_time(self, name: str) -> float:
+        """Время ожидания до следующего токена без его резервирования."""
+        rule = self.rules.get(name)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE name = ?",
+                (name,)
+            ).fetchone()
+
+        if row is None:
+            return 0.0
+
+        balance, updated_at, blocked_until = row
+        start = max(now, blocked_until, updated_at)
+        wait_time = start - now
+        if rule:
+            balance = min(rule.capacity, balance + (start - updated_at) * rule.rate)
+            if balance < 1:
+                wait_time += (1 - balance) / rule.rate
+        return wait_time
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика ожиданий текущего процесса."""
+        stats = dict(self.stats)
+        stats['db_path'] = self.db_path
+        return stats
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Общий для процесса экземпляр RateLimiter."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -2,14 +2,23 @@
 """
 Простой HTTP API сервер для системы пополнения склада.
 Использует встроенный http.server без внешних зависимостей.
+
+Запросы обрабатываются пулом потоков, обработчики берут подключения
+из общего пула БД. Долгие операции (анализ, комплексный отчет)
+выполняются в фоновой очереди задач: API возвращает ID задачи,
+статус доступен по /api/jobs/<job_id>.
 """
 
 import sys
 import os
 import json
+import uuid
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Optional
 from urllib.parse import urlparse, parse_qs
 import threading
 
@@ -20,12 +29,212 @@ from replenishment_recommender import ReplenishmentRecommender
 from alert_manager import AlertManager
 from reporting_engine import ReportingEngine
 from replenishment_orchestrator import ReplenishmentOrchestrator
+from recommendations_read_model import RecommendationsReadModel, parse_priorities, build_http_response
+from replenishment_db_connector import get_replenishment_pool
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class AnalysisJobQueue:
+    """Фоновая очередь долгих задач с хранением статусов."""
+    
+    def __init__(self, max_workers: int = 2, max_history: int = 100):
+        """
+        Инициализация очереди.
+        
+        Args:
+            max_workers: Количество одновременно выполняемых задач
+            max_history: Сколько завершенных задач хранить для запросов статуса
+        """
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='api-job')
+        self._jobs: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def submit(self, kind: str, func: Callable, *args, dedupe_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Поставить задачу в очередь.
+        
+        Если задача с тем же dedupe_key еще в очереди или выполняется,
+        новая не создается - возвращается существующая.
+        
+        Returns:
+            Статус задачи
+        """
+        with self._lock:
+            if dedupe_key:
+                for job in self._jobs.values():
+                    if job['dedupe_key'] == dedupe_key and job['status'] in ('queued', 'running'):
+                        return self._public(job)
+            
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'kind': kind,
+                'status': 'queued',
+                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'dedupe_key': dedupe_key
+            }
+            self._jobs[job['job_id']] = job
+            self._trim()
+        
+        self._executor.submit(self._run, job, func, args)
+        logger.info(f"📥 Задача {kind} поставлена в очередь: {job['job_id']}")
+        return self._public(job)
+    
+    def _run(self, job: Dict[str, Any], func: Callable, args: tuple):
+        """Выполнение задачи в потоке очереди."""
+        with self._lock:
+            job['status'] = 'running'
+            job['started_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        try:
+            result = func(*args)
+            with self._lock:
+                job['result'] = result
+                job['status'] = 'completed'
+        except Exception as e:
+            logger.error(f"❌ Задача {job['kind']} ({job['job_id']}) завершилась ошибкой: {e}")
+            with self._lock:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+        finally:
+            with self._lock:
+                job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    def _trim(self):
+        """Удаление самых старых завершенных задач сверх max_history."""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('completed', 'failed')]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+    
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        status = {key: value for key, value in job.items() if key != 'dedupe_key'}
+        status['status_url'] = f"/api/jobs/{job['job_id']}"
+        return status
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи (None, если задача неизвестна)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+    
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние задачи (без результатов)."""
+        with self._lock:
+            jobs = list(self._jobs.values())[-limit:]
+            return [{key: value for key, value in self._public(job).items() if key != 'result'}
+                    for job in reversed(jobs)]
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Количество задач по статусам."""
+        with self._lock:
+            stats = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0}
+            for job in self._jobs.values():
+                stats[job['status']] += 1
+            return stats
+    
+    def shutdown(self):
+        """Остановка очереди (выполняемые задачи не прерываются)."""
+        self._executor.shutdown(wait=False)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTP сервер, обрабатывающий запросы в пуле потоков."""
+    
+    def __init__(self, server_address, handler_class, max_workers: int = 16):
+        super().__init__(server_address, handler_class)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='api-request')
+    
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_in_thread, request, client_address)
+    
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+
+def _demo_analysis_result() -> Dict[str, Any]:
+    """Результат анализа в демо-режиме (без подключения к БД)."""
+    return {
+        'execution_time': 0.5,
+        'critical_recommendations': 5,
+        'critical_alerts': 3,
+        'status': 'SUCCESS'
+    }
+
+
+def _demo_comprehensive_report() -> Dict[str, Any]:
+    """Комплексный отчет в демо-режиме (без подключения к БД)."""
+    return {
+        'report_metadata': {
+            'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'source_filter': 'Все источники',
+            'report_type': 'Демо отчет'
+        },
+        'inventory_metrics': {
+            'total_products': 100,
+            'total_inventory_value': 500000.0,
+            'low_stock_products': 15,
+            'zero_stock_products': 5,
+            'overstocked_products': 10,
+            'avg_inventory_turnover_days': 45.5,
+            'total_recommended_orders': 25,
+            'total_recommended_value': 150000.0
+        },
+        'sales_metrics': {
+            'total_sales_volume_30d': 1500,
+            'total_sales_value_30d': 750000.0,
+            'avg_daily_sales': 50.0,
+            'fast_moving_products': 20,
+            'slow_moving_products': 30,
+            'no_sales_products': 10
+        }
+    }
+
+
+def run_analysis_job(mode: str = 'quick', source: Optional[str] = None) -> Dict[str, Any]:
+    """Анализ пополнения на подключении из пула (выполняется в очереди задач)."""
+    pool = ReplenishmentAPIHandler.db_pool
+    if pool is None:
+        return _demo_analysis_result()
+    
+    # Подключение возвращается в пул и при ошибке конструктора оркестратора
+    # (повторный close() после orchestrator.close() игнорируется)
+    with pool.connection() as connection:
+        orchestrator = ReplenishmentOrchestrator(connection)
+        try:
+            if mode == 'full':
+                return orchestrator.run_full_analysis(source=source)
+            return orchestrator.run_quick_check()
+        finally:
+            orchestrator.close()
+
+
+def build_comprehensive_report(source: Optional[str] = None) -> Dict[str, Any]:
+    """Комплексный отчет на подключении из пула."""
+    pool = ReplenishmentAPIHandler.db_pool
+    if pool is None:
+        return _demo_comprehensive_report()
+    
+    with pool.connection() as connection:
+        return ReportingEngine(connection).create_comprehensive_report(source)
+
+
 class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
     """HTTP обработчик для API системы пополнения."""
     
@@ -34,6 +243,9 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
     alert_manager = None
     reporting_engine = None
     orchestrator = None
+    recommendations_model = None
+    db_pool = None
+    job_queue = None
     
     def do_GET(self):
         """Обработка GET запросов."""
@@ -52,6 +264,10 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
                 self._handle_get_alerts(query_params)
             elif path == '/api/reports/comprehensive':
                 self._handle_get_comprehensive_report(query_params)
+            elif path == '/api/jobs':
+                self._handle_list_jobs(query_params)
+            elif path.startswith('/api/jobs/'):
+                self._handle_get_job(path.split('/')[-1])
             elif path.startswith('/api/recommendations/'):
                 product_id = path.split('/')[-1]
                 self._handle_get_product_recommendation(product_id)
@@ -239,7 +455,14 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
                             headers: { 'Content-Type': 'application/json' },
                             body: JSON.stringify({})
                         });
-                        const data = await response.json();
+                        let job = await response.json();
+                        
+                        // Анализ выполняется в фоне: опрашиваем статус задачи
+                        while (job.status_url && (job.status === 'queued' || job.status === 'running')) {
+                            await new Promise(resolve => setTimeout(resolve, 1000));
+                            job = await (await fetch(job.status_url)).json();
+                        }
+                        const data = job.result || { error: job.error || 'Анализ не выполнен' };
                         
                         let html = '<div class="card"><h2>⚡ Результаты быстрого анализа</h2>';
                         
@@ -288,15 +511,23 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
                 }
             }
             
-            # Проверяем подключение к БД (упрощенно)
+            # Проверяем подключение к БД через пул (не зависит от выполняемого анализа)
             try:
-                if self.recommender and hasattr(self.recommender, 'connection'):
+                if self.db_pool:
+                    with self.db_pool.connection(timeout=2) as connection:
+                        cursor = connection.cursor()
+                        cursor.execute("SELECT 1")
+                        cursor.fetchall()
+                        cursor.close()
                     status['components']['database'] = True
                 else:
                     status['components']['database'] = False
-            except:
+            except Exception:
                 status['components']['database'] = False
             
+            if self.job_queue:
+                status['jobs'] = self.job_queue.get_stats()
+            
             # Определяем общий статус
             all_healthy = all(status['components'].values())
             status['status'] = 'healthy' if all_healthy else 'degraded'
@@ -311,57 +542,32 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
             })
     
     def _handle_get_recommendations(self, query_params):
-        """Обработка получения рекомендаций."""
+        """Обработка получения рекомендаций (кэш, пагинация, ETag, gzip)."""
         try:
             limit = int(query_params.get('limit', [50])[0])
+            source = query_params.get('source', [None])[0]
+            cursor = query_params.get('cursor', [None])[0]
             
-            if not self.recommender:
+            if not self.recommendations_model:
                 self._send_json_response(500, {'error': 'Система не инициализирована'})
                 return
             
-            # Имитируем получение рекомендаций
-            recommendations_data = [
-                {
-                    'product_id': 1,
-                    'sku': 'DEMO-001',
-                    'product_name': 'Демо товар 1',
-                    'source': 'demo',
-                    'current_stock': 5,
-                    'available_stock': 3,
-                    'recommended_order_quantity': 50,
-                    'recommended_order_value': 25000.0,
-                    'priority_level': 'CRITICAL',
-                    'urgency_score': 95.0,
-                    'days_until_stockout': 2,
-                    'daily_sales_rate_7d': 2.5,
-                    'sales_trend': 'STABLE',
-                    'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                },
-                {
-                    'product_id': 2,
-                    'sku': 'DEMO-002',
-                    'product_name': 'Демо товар 2',
-                    'source': 'demo',
-                    'current_stock': 15,
-                    'available_stock': 12,
-                    'recommended_order_quantity': 30,
-                    'recommended_order_value': 15000.0,
-                    'priority_level': 'HIGH',
-                    'urgency_score': 75.0,
-                    'days_until_stockout': 5,
-                    'daily_sales_rate_7d': 2.0,
-                    'sales_trend': 'GROWING',
-                    'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-            ]
+            try:
+                priorities = parse_priorities(query_params.get('priority', [None])[0])
+                page = self.recommendations_model.get_page(priorities, source=source, limit=limit, cursor=cursor)
+            except ValueError as e:
+                self._send_json_response(400, {'error': str(e)})
+                return
             
             response = {
-                'recommendations': recommendations_data[:limit],
-                'total_count': len(recommendations_data),
-                'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                'recommendations': page['recommendations'],
+                'total_count': page['count'],
+                'next_cursor': page['next_cursor'],
+                'analysis_date': page['analysis_date']
             }
             
-            self._send_json_response(200, response)
+            status, headers, body = build_http_response(response, page['etag'], self.headers)
+            self._send_raw_response(status, headers, body)
             
         except Exception as e:
             self._send_json_response(500, {'error': str(e)})
@@ -400,36 +606,23 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
             self._send_json_response(500, {'error': str(e)})
     
     def _handle_get_comprehensive_report(self, query_params):
-        """Обработка получения комплексного отчета."""
+        """
+        Обработка получения комплексного отчета.
+        
+        С параметром async=1 отчет строится в очереди задач, ответ 202 с ID задачи.
+        """
         try:
-            # Имитируем создание отчета
-            report = {
-                'report_metadata': {
-                    'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'source_filter': 'Все источники',
-                    'report_type': 'Демо отчет'
-                },
-                'inventory_metrics': {
-                    'total_products': 100,
-                    'total_inventory_value': 500000.0,
-                    'low_stock_products': 15,
-                    'zero_stock_products': 5,
-                    'overstocked_products': 10,
-                    'avg_inventory_turnover_days': 45.5,
-                    'total_recommended_orders': 25,
-                    'total_recommended_value': 150000.0
-                },
-                'sales_metrics': {
-                    'total_sales_volume_30d': 1500,
-                    'total_sales_value_30d': 750000.0,
-                    'avg_daily_sales': 50.0,
-                    'fast_moving_products': 20,
-                    'slow_moving_products': 30,
-                    'no_sales_products': 10
-                }
-            }
+            source = query_params.get('source', [None])[0]
+            
+            if query_params.get('async', ['0'])[0] in ('1', 'true') and self.job_queue:
+                job = self.job_queue.submit(
+                    'comprehensive_report', build_comprehensive_report, source,
+                    dedupe_key=f"comprehensive_report:{source}"
+                )
+                self._send_json_response(202, job)
+                return
             
-            self._send_json_response(200, report)
+            self._send_json_response(200, build_comprehensive_report(source))
             
         except Exception as e:
             self._send_json_response(500, {'error': str(e)})
@@ -459,17 +652,46 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
             self._send_json_response(500, {'error': str(e)})
     
     def _handle_run_analysis(self, request_data):
-        """Обработка запуска анализа."""
+        """
+        Обработка запуска анализа: задача ставится в очередь, ответ 202 с ID задачи.
+        
+        Параметры тела: mode ('quick' или 'full'), source.
+        """
         try:
-            # Имитируем запуск быстрого анализа
-            result = {
-                'execution_time': 0.5,
-                'critical_recommendations': 5,
-                'critical_alerts': 3,
-                'status': 'SUCCESS'
-            }
+            mode = request_data.get('mode', 'quick')
+            source = request_data.get('source')
+            
+            if mode not in ('quick', 'full'):
+                self._send_json_response(400, {'error': f'Неизвестный режим анализа: {mode}'})
+                return
+            
+            if not self.job_queue:
+                self._send_json_response(500, {'error': 'Очередь задач не инициализирована'})
+                return
+            
+            job = self.job_queue.submit(
+                f'analysis_{mode}', run_analysis_job, mode, source,
+                dedupe_key=f"analysis:{mode}:{source}"
+            )
+            self._send_json_response(202, job)
             
-            self._send_json_response(200, result)
+        except Exception as e:
+            self._send_json_response(500, {'error': str(e)})
+    
+    def _handle_get_job(self, job_id):
+        """Обработка получения статуса фоновой задачи."""
+        job = self.job_queue.get(job_id) if self.job_queue else None
+        if job:
+            self._send_json_response(200, job)
+        else:
+            self._send_json_response(404, {'error': 'Задача не найдена'})
+    
+    def _handle_list_jobs(self, query_params):
+        """Обработка получения списка последних задач."""
+        try:
+            limit = int(query_params.get('limit', [20])[0])
+            jobs = self.job_queue.list_jobs(limit) if self.job_queue else []
+            self._send_json_response(200, {'jobs': jobs, 'total_count': len(jobs)})
             
         except Exception as e:
             self._send_json_response(500, {'error': str(e)})
@@ -501,9 +723,21 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(content.encode('utf-8'))
     
+    def _send_raw_response(self, status_code, headers, body):
+        """Отправка готового HTTP ответа (заголовки и тело в байтах)."""
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+    
     def _send_json_response(self, status_code, data):
         """Отправка JSON ответа."""
-        json_content = json.dumps(data, ensure_ascii=False, indent=2)
+        json_content = json.dumps(data, ensure_ascii=False, indent=2, default=str)
         self._send_response(status_code, json_content, 'application/json')
     
     def _send_error(self, status_code, message):
@@ -524,10 +758,16 @@ class ReplenishmentAPIHandler(BaseHTTPRequestHandler):
         logger.info(f"{self.address_string()} - {format % args}")
 
 
-def init_components():
+def init_components(db_pool_size: int = 8, job_workers: int = 2):
     """Инициализация компонентов системы."""
+    ReplenishmentAPIHandler.job_queue = AnalysisJobQueue(max_workers=job_workers)
+    
     try:
+        ReplenishmentAPIHandler.db_pool = get_replenishment_pool(db_pool_size)
         ReplenishmentAPIHandler.recommender = ReplenishmentRecommender()
+        ReplenishmentAPIHandler.recommendations_model = RecommendationsReadModel(
+            ReplenishmentAPIHandler.recommender.connection
+        )
         ReplenishmentAPIHandler.alert_manager = AlertManager()
         ReplenishmentAPIHandler.reporting_engine = ReportingEngine()
         ReplenishmentAPIHandler.orchestrator = ReplenishmentOrchestrator()
@@ -546,7 +786,10 @@ def main():
     
     # Инициализируем компоненты
     print("🔧 Инициализация компонентов...")
-    components_ok = init_components()
+    components_ok = init_components(
+        db_pool_size=int(os.getenv('API_DB_POOL_SIZE', '8')),
+        job_workers=int(os.getenv('API_JOB_WORKERS', '2'))
+    )
     
     if not components_ok:
         print("⚠️  Компоненты не инициализированы - работаем в демо-режиме")
@@ -554,12 +797,13 @@ def main():
     # Настройки сервера
     host = '0.0.0.0'
     port = 8000
+    workers = int(os.getenv('API_WORKERS', '16'))
     
     # Создаем и запускаем сервер
     try:
-        server = HTTPServer((host, port), ReplenishmentAPIHandler)
+        server = ThreadPoolHTTPServer((host, port), ReplenishmentAPIHandler, max_workers=workers)
         
-        print(f"🌐 Сервер запущен на http://{host}:{port}")
+        print(f"🌐 Сервер запущен на http://{host}:{port} (потоков: {workers})")
         print(f"   Веб-интерфейс: http://localhost:{port}")
         print(f"   API здоровья: http://localhost:{port}/api/health")
         print(f"   Рекомендации: http://localhost:{port}/api/recommendations")
@@ -577,6 +821,8 @@ def main():
             server.server_close()
         except:
             pass
+        if ReplenishmentAPIHandler.job_queue:
+            ReplenishmentAPIHandler.job_queue.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Тесты сопоставления и создания товаров в cost_importer.
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import os
+import sys
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+try:
+    import pandas as pd
+except ImportError:  # pragma: no cover - pandas есть в requirements, но не везде установлен
+    pd = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'ETL'))
+
+# Соединение с БД в тестах не нужно: ozon_importer требует mysql/requests
+if 'ozon_importer' not in sys.modules:
+    sys.modules['ozon_importer'] = types.SimpleNamespace(connect_to_db=MagicMock())
+
+PRICE_COL = 'СС без НДС'
+
+
+def cost_file(rows):
+    """DataFrame в формате read_cost_file: (артикул, баркод, цена)."""
+    return pd.DataFrame(rows, columns=['артикул', 'баркод', PRICE_COL])
+
+
+@unittest.skipIf(pd is None, "pandas не установлен")
+class TestNewProductsWithSharedArticle(unittest.TestCase):
+    """Новые штрихкоды с общим артикулом создают один товар."""
+
+    def setUp(self):
+        import cost_importer
+        self.cost_importer = cost_importer
+        self.products = pd.DataFrame(columns=['id', 'barcode', 'sku_ozon', 'sku_wb', 'cost_price'])
+
+    def test_collapse_keeps_first_article_and_latest_barcode(self):
+        df = cost_file([
+            ('ART-1', '4600000000011', 100.0),
+            ('art-1', '4600000000028', 120.0),
+            ('ART-2', '4600000000035', 50.0),
+            ('', '4600000000042', 70.0),
+        ])
+        matched = self.cost_importer.match_cost_rows(df, self.products)
+        collapsed = self.cost_importer.collapse_new_products(matched[matched['product_id'].isna()])
+
+        rows = sorted(
+            (str(item.barcode), None if pd.isna(item.article) else str(item.article), float(item.cost_price))
+            for item in collapsed.itertuples(index=False)
+        )
+        self.assertEqual(rows, [
+            ('4600000000028', 'ART-1', 120.0),
+            ('4600000000035', 'ART-2', 50.0),
+            ('4600000000042', None, 70.0),
+        ])
+
+    def test_update_product_costs_inserts_shared_article_once(self):
+        df = cost_file([
+            ('ART-1', '4600000000011', 100.0),
+            ('ART-1', '4600000000028', 120.0),
+        ])
+        connection = MagicMock()
+        cursor = connection.cursor.return_value
+        cursor.fetchall.return_value = []
+
+        with patch.object(self.cost_importer, 'connect_to_db', return_value=connection):
+            updated, created, errors = self.cost_importer.update_product_costs(df)
+
+        self.assertEqual((updated, created, errors), (1, 1, 0))
+        inserted = [row for call in cursor.executemany.call_args_list
+                    if 'INSERT INTO dim_products' in call.args[0] for row in call.args[1]]
+        self.assertEqual(inserted, [('4600000000028', 'ART-1', 120.0)])
+        connection.commit.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Тесты шардирования, чекпоинта и планирования в import_orchestrator.
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'ETL'))
+
+from import_orchestrator import (  # noqa: E402
+    SKIPPED_ERROR, ImportCheckpoint, ImportOrchestrator, ImportStream, split_into_shards
+)
+
+
+def stream(name: str, marketplace: str = 'ozon', **kwargs) -> ImportStream:
+    """Поток с фиктивной функцией импорта."""
+    return ImportStream(name=name, marketplace=marketplace, func=kwargs.pop('func', MagicMock()), **kwargs)
+
+
+class TestSplitIntoShards(unittest.TestCase):
+    """Деление периода на шарды."""
+
+    def test_weekly_with_partial_last_shard(self):
+        self.assertEqual(split_into_shards('2026-10-01', '2026-10-16', 7), [
+            ('2026-10-01', '2026-10-07'),
+            ('2026-10-08', '2026-10-14'),
+            ('2026-10-15', '2026-10-16'),
+        ])
+
+    def test_daily(self):
+        self.assertEqual(split_into_shards('2026-09-30', '2026-10-02', 1), [
+            ('2026-09-30', '2026-09-30'),
+            ('2026-10-01', '2026-10-01'),
+            ('2026-10-02', '2026-10-02'),
+        ])
+
+    def test_single_day_and_non_positive_size(self):
+        self.assertEqual(split_into_shards('2026-10-16', '2026-10-16', 7), [('2026-10-16', '2026-10-16')])
+        self.assertEqual(split_into_shards('2026-10-15', '2026-10-16', 0),
+                         [('2026-10-15', '2026-10-15'), ('2026-10-16', '2026-10-16')])
+
+    def test_end_before_start_is_rejected(self):
+        with self.assertRaises(ValueError):
+            split_into_shards('2026-10-16', '2026-10-01', 7)
+
+
+class TestImportCheckpoint(unittest.TestCase):
+    """Продолжение прерванного запуска по чекпоинту."""
+
+    KEYS = ['ozon_orders:2026-10-01..2026-10-07', 'ozon_orders:2026-10-08..2026-10-14', 'ozon_products']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'import_checkpoint.json')
+
+    def test_resume_with_same_tasks(self):
+        first = ImportCheckpoint(self.path)
+        self.assertEqual(first.start(self.KEYS), set())
+        first.mark_done(self.KEYS[0])
+        first.mark_done(self.KEYS[2])
+
+        # Порядок задач не влияет на ключ запуска
+        resumed = ImportCheckpoint(self.path)
+        self.assertEqual(resumed.start(list(reversed(self.KEYS))), {self.KEYS[0], self.KEYS[2]})
+
+    def test_other_tasks_start_fresh(self):
+        first = ImportCheckpoint(self.path)
+        first.start(self.KEYS)
+        first.mark_done(self.KEYS[0])
+
+        other = ImportCheckpoint(self.path)
+        self.assertEqual(other.start(self.KEYS[:2]), set())
+
+    def test_unreadable_file_starts_fresh(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"run_key": ')
+        self.assertEqual(ImportCheckpoint(self.path).start(self.KEYS), set())
+
+    def test_clear_removes_file(self):
+        checkpoint = ImportCheckpoint(self.path)
+        checkpoint.start(self.KEYS)
+        checkpoint.mark_done(self.KEYS[1])
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['completed'], [self.KEYS[1]])
+
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        checkpoint.clear()
+
+
+class TestPlan(unittest.TestCase):
+    """Состав и порядок задач запуска."""
+
+    def test_streams_are_interleaved(self):
+        orchestrator = ImportOrchestrator([
+            stream('ozon_products', dated=False),
+            stream('ozon_orders'),
+            stream('wb_finance', marketplace='wb'),
+            stream('wb_stocks', marketplace='wb', shardable=False),
+        ], checkpoint_file=None)
+
+        plan = [(item.name, shard) for item, shard in orchestrator._plan('2026-10-01', '2026-10-16', 7)]
+        self.assertEqual(plan, [
+            ('ozon_products', None),
+            ('ozon_orders', ('2026-10-01', '2026-10-07')),
+            ('wb_finance', ('2026-10-01', '2026-10-07')),
+            ('wb_stocks', ('2026-10-01', '2026-10-16')),
+            ('ozon_orders', ('2026-10-08', '2026-10-14')),
+            ('wb_finance', ('2026-10-08', '2026-10-14')),
+            ('ozon_orders', ('2026-10-15', '2026-10-16')),
+            ('wb_finance', ('2026-10-15', '2026-10-16')),
+        ])
+
+
+class TestRun(unittest.TestCase):
+    """Порядок фаз, пропуск завершенных шардов и ошибок товаров."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'import_checkpoint.json')
+
+    def test_resume_skips_completed_shards(self):
+        orders = MagicMock(side_effect=[None, RuntimeError('API недоступен'), None])
+        streams = [stream('ozon_products', dated=False), stream('ozon_orders', func=orders)]
+
+        # Первый запуск: второй шард падает, чекпоинт остается
+        errors = ImportOrchestrator(streams, concurrency={'ozon': 1}, checkpoint_file=self.path).run(
+            '2026-10-01', '2026-10-14', 7)
+        self.assertEqual(list(errors), ['ozon_orders:2026-10-08..2026-10-14'])
+        self.assertTrue(os.path.exists(self.path))
+
+        # Повторный запуск выполняет только упавший шард
+        streams[0].func.reset_mock()
+        orders.reset_mock()
+        errors = ImportOrchestrator(streams, checkpoint_file=self.path).run('2026-10-01', '2026-10-14', 7)
+        self.assertEqual(errors, {})
+        streams[0].func.assert_not_called()
+        orders.assert_called_once_with('2026-10-08', '2026-10-14')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_failed_products_skip_dated_tasks(self):
+        products = stream('ozon_products', dated=False, func=MagicMock(side_effect=RuntimeError('timeout')))
+        orders = stream('ozon_orders')
+
+        errors = ImportOrchestrator([products, orders], checkpoint_file=self.path).run(
+            '2026-10-01', '2026-10-14', 7)
+
+        orders.func.assert_not_called()
+        self.assertEqual(errors, {
+            'ozon_products': 'timeout',
+            'ozon_orders:2026-10-01..2026-10-07': SKIPPED_ERROR,
+            'ozon_orders:2026-10-08..2026-10-14': SKIPPED_ERROR,
+        })
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_prefetch_receives_pending_tasks_and_errors_are_ignored(self):
+        prefetch = MagicMock(side_effect=RuntimeError('отчет не готов'))
+        orders = stream('ozon_orders')
+
+        errors = ImportOrchestrator([orders], checkpoint_file=None, prefetch=prefetch).run(
+            '2026-10-01', '2026-10-03', 7)
+
+        self.assertEqual(errors, {})
+        prefetch.assert_called_once_with([(orders, ('2026-10-01', '2026-10-03'))])
+        orders.func.assert_called_once_with('2026-10-01', '2026-10-03')
+
+
+if __name__ == '__main__':
+    unittest.main()
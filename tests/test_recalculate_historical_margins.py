@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тесты watermark режима --cost-changed в HistoricalMarginRecalculator.
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import os
+import sys
+import types
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'ETL'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'Services'))
+
+# Соединение с БД в тестах не нужно: ozon_importer требует mysql/requests
+if 'ozon_importer' not in sys.modules:
+    sys.modules['ozon_importer'] = types.SimpleNamespace(connect_to_db=MagicMock())
+
+import recalculate_historical_margins as recalc  # noqa: E402
+
+
+RUN_STARTED_AT = datetime(2026, 10, 16, 12, 0, 0)
+WATERMARK = datetime(2026, 10, 1, 0, 0, 0)
+AFFECTED_DATES = ['2026-09-15', '2026-10-02', '2026-10-10']
+
+
+class TestCostWatermark(unittest.TestCase):
+    """Сдвиг watermark себестоимости при пересчете по измененным товарам."""
+
+    def setUp(self):
+        self.recalculator = recalc.HistoricalMarginRecalculator(workers=1, checkpoint_file=None)
+        connection = MagicMock()
+        connection.cursor.return_value.fetchone.return_value = (RUN_STARTED_AT,)
+        self.recalculator.connection = connection
+
+        patches = [
+            patch.object(self.recalculator, 'setup_connection', return_value=True),
+            patch.object(self.recalculator, 'check_schema_readiness', return_value=True),
+            patch.object(self.recalculator, 'get_dates_affected_by_cost_changes',
+                         return_value=list(AFFECTED_DATES)),
+            patch.object(self.recalculator, 'validate_recalculation_results', return_value=True),
+            patch.object(recalc, 'get_aggregation_watermark', return_value=WATERMARK),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+        self.recalculate = patch.object(self.recalculator, 'recalculate_date_range',
+                                        return_value=True).start()
+        self.save_watermark = patch.object(self.recalculator, '_save_cost_watermark').start()
+        self.addCleanup(patch.stopall)
+
+    def test_unfiltered_run_advances_watermark(self):
+        """Запуск без фильтров пересчитывает все даты и сдвигает watermark."""
+        self.assertTrue(self.recalculator.run_full_recalculation(
+            create_backup=False, cost_changed_only=True))
+
+        self.recalculate.assert_called_once_with(AFFECTED_DATES, 31)
+        self.save_watermark.assert_called_once_with(RUN_STARTED_AT)
+
+    def test_date_filter_keeps_watermark(self):
+        """Период отбрасывает часть дат, поэтому watermark не сдвигается."""
+        self.assertTrue(self.recalculator.run_full_recalculation(
+            start_date='2026-10-01', end_date='2026-10-31',
+            create_backup=False, cost_changed_only=True))
+
+        self.recalculate.assert_called_once_with(['2026-10-02', '2026-10-10'], 31)
+        self.save_watermark.assert_not_called()
+
+    def test_date_filter_without_matching_dates_keeps_watermark(self):
+        """Пустая выборка после фильтра тоже не сдвигает watermark."""
+        self.assertTrue(self.recalculator.run_full_recalculation(
+            start_date='2026-11-01', end_date='2026-11-30',
+            create_backup=False, cost_changed_only=True))
+
+        self.recalculate.assert_not_called()
+        self.save_watermark.assert_not_called()
+
+    def test_start_date_only_filters_and_keeps_watermark(self):
+        """Одна граница периода тоже считается фильтром."""
+        self.assertTrue(self.recalculator.run_full_recalculation(
+            start_date='2026-10-05', create_backup=False, cost_changed_only=True))
+
+        self.recalculate.assert_called_once_with(['2026-10-10'], 31)
+        self.save_watermark.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тесты потокового разбора ответов API Wildberries и чекпоинта загрузки в wb_importer.
+
+Автор: ETL System
+Дата: 16 октября 2026
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'importers'))
+
+import wb_importer  # noqa: E402
+from wb_importer import WbStreamCheckpoint, iter_json_array  # noqa: E402
+
+
+def split_bytes(data: bytes, size: int):
+    """Фрагменты тела ответа фиксированного размера."""
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class TestIterJsonArray(unittest.TestCase):
+    """Инкрементальный разбор JSON-массива."""
+
+    BODY = ('[{"rrd_id": 1005, "name": "Футболка"}, 1005, "a,b]", '
+            '{"rrd_id": 1006, "nested": [1, 2]}, null, 12.5]').encode('utf-8')
+    ITEMS = [{"rrd_id": 1005, "name": "Футболка"}, 1005, "a,b]",
+             {"rrd_id": 1006, "nested": [1, 2]}, None, 12.5]
+
+    def test_whole_body(self):
+        self.assertEqual(list(iter_json_array([self.BODY])), self.ITEMS)
+
+    def test_every_chunk_boundary(self):
+        """Разбиение по любой границе, в т.ч. внутри числа и многобайтного символа."""
+        for size in range(1, len(self.BODY) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_array(split_bytes(self.BODY, size))), self.ITEMS)
+
+    def test_utf8_bom_and_whitespace(self):
+        body = b'\xef\xbb\xbf \n[ {"a": 1} ,\n {"b": 2} ]\n'
+        self.assertEqual(list(iter_json_array(split_bytes(body, 3))), [{"a": 1}, {"b": 2}])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b'[', b']'])), [])
+
+    def test_empty_body(self):
+        self.assertEqual(list(iter_json_array([])), [])
+        self.assertEqual(list(iter_json_array([b''])), [])
+        self.assertEqual(list(iter_json_array([b' \r\n'])), [])
+
+    def test_null_body(self):
+        self.assertEqual(list(iter_json_array([b'null'])), [])
+        self.assertEqual(list(iter_json_array([b'nu', b'll', b'\n'])), [])
+
+    def test_object_body_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"errors": ["bad token"]}']))
+
+    def test_text_starting_like_null_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'nul', b'x']))
+
+    def test_truncated_body_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'[{"a": 1}, {"b": ']))
+
+
+class TestStreamWbRequest(unittest.TestCase):
+    """Конец постраничной выгрузки в stream_wb_request."""
+
+    def _response(self, status_code: int, chunks):
+        response = MagicMock()
+        response.status_code = status_code
+        response.headers = {}
+        response.iter_content.return_value = iter(chunks)
+        response.__enter__.return_value = response
+        return response
+
+    def _stream(self, response):
+        with patch.object(wb_importer, '_prepare_wb_request', return_value=('url', {}, 'wb_statistics')), \
+                patch.object(wb_importer, 'get_rate_limiter'), \
+                patch.object(wb_importer.requests, 'get', return_value=response):
+            return list(wb_importer.stream_wb_request('/api/v5/supplier/reportDetailByPeriod'))
+
+    def test_no_content_yields_nothing(self):
+        response = self._response(204, [])
+        self.assertEqual(self._stream(response), [])
+        response.iter_content.assert_not_called()
+
+    def test_null_body_yields_nothing(self):
+        self.assertEqual(self._stream(self._response(200, [b'null'])), [])
+
+    def test_array_body(self):
+        self.assertEqual(self._stream(self._response(200, [b'[{"rrd_id": 1}', b']'])), [{"rrd_id": 1}])
+
+
+class TestWbStreamCheckpoint(unittest.TestCase):
+    """Чекпоинт, общий для параллельных импортов продаж и финансов."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'wb_import_checkpoint.json')
+
+    def test_instances_share_lock_per_path(self):
+        first = WbStreamCheckpoint(self.path)
+        second = WbStreamCheckpoint(os.path.join(self.tmp_dir.name, '.', 'wb_import_checkpoint.json'))
+        other = WbStreamCheckpoint(os.path.join(self.tmp_dir.name, 'other.json'))
+        self.assertIs(first._lock, second._lock)
+        self.assertIsNot(first._lock, other._lock)
+
+    def test_concurrent_saves_keep_every_key(self):
+        def worker(stream: str):
+            checkpoint = WbStreamCheckpoint(self.path)
+            for page in range(20):
+                checkpoint.save(f"{stream}:{page % 5}", {'rrd_id': page})
+
+        threads = [threading.Thread(target=worker, args=(stream,)) for stream in ('wb_sales', 'wb_finance')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        checkpoint = WbStreamCheckpoint(self.path)
+        for stream in ('wb_sales', 'wb_finance'):
+            for key in range(5):
+                self.assertIsNotNone(checkpoint.load(f"{stream}:{key}"))
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['wb_import_checkpoint.json'])
+
+    def test_clear_removes_file_with_last_key(self):
+        checkpoint = WbStreamCheckpoint(self.path)
+        checkpoint.save('wb_sales:a', {'date_from': '2026-10-01'})
+        checkpoint.save('wb_finance:a', {'rrd_id': 5})
+        checkpoint.clear('wb_sales:a')
+        self.assertEqual(checkpoint.load('wb_finance:a')['rrd_id'], 5)
+        checkpoint.clear('wb_finance:a')
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()